@@ -1,5 +1,7 @@
-from typing import Annotated
-from fastapi import Depends
+import hmac
+import os
+from typing import Annotated, Optional
+from fastapi import Depends, Header, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 
 from app.dependencies import get_repository_session
@@ -30,3 +32,20 @@ def get_current_user_id(
     auth_service = auth_service_factory(repository_session)
     user_id = auth_service.decode_user_id(token)
     return user_id
+
+
+def is_admin_token_valid(token: Optional[str]) -> bool:
+    """
+    The admin endpoints are disabled unless the ADMIN_TOKEN environment variable is set.
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), admin_token.encode())
+
+
+def verify_admin_token(
+    x_admin_token: Annotated[Optional[str], Header()] = None,
+):
+    if not is_admin_token_valid(x_admin_token):
+        raise HTTPException(status_code=403, detail="invalid admin token")
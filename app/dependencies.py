@@ -1,6 +1,117 @@
+from functools import cache
+
+from app.lock_waits import LockWaitMonitor, LockWaitMonitorConfig
+from app.metrics import AppMetrics
+from app.repositories.config import RepositoryBackend
+from app.repositories.memory.session import MemorySession, MemoryStore
 from app.repositories.postgres.session import PostgresSession
 from app.repositories.postgres.config import PostgresConfig
+from app.repositories.sharded.config import ShardingConfig
+from app.repositories.sharded.session import ShardedSession
+from app.repositories.sqlite.config import SqliteConfig
+from app.repositories.sqlite.session import SqliteDatabase, SqliteSession
+from app.services.order import (
+    InventorySnapshot,
+    InventorySnapshotConfig,
+    OrderBatchConfig,
+)
+from app.services.product import ProductCatalogCache, ProductCatalogCacheConfig
+from app.tracing import (
+    JsonlExporter,
+    RingBufferExporter,
+    SpanExporter,
+    Tracer,
+    TracingConfig,
+    record_statement_span,
+)
 
 
 def get_repository_session():
-    return PostgresSession(PostgresConfig.from_env())
+    statement_observers = [get_app_metrics().record_statement, record_statement_span]
+    match RepositoryBackend.from_env():
+        case RepositoryBackend.POSTGRES:
+            return PostgresSession(
+                PostgresConfig.from_env(), statement_observers=statement_observers
+            )
+        case RepositoryBackend.MEMORY:
+            return MemorySession(get_memory_store())
+        case RepositoryBackend.SQLITE:
+            return SqliteSession(
+                get_sqlite_database(), statement_observers=statement_observers
+            )
+        case RepositoryBackend.SHARDED_POSTGRES:
+            return ShardedSession(
+                ShardingConfig.from_env(), statement_observers=statement_observers
+            )
+
+
+@cache
+def get_memory_store():
+    """
+    The data of the memory backend, shared by all requests handled by this process.
+    """
+    return MemoryStore()
+
+
+@cache
+def get_sqlite_database():
+    """
+    The database of the sqlite backend, shared by all requests handled by this process.
+    """
+    return SqliteDatabase(SqliteConfig.from_env())
+
+
+@cache
+def get_app_metrics():
+    return AppMetrics()
+
+
+@cache
+def get_product_catalog_cache():
+    """
+    The cache is shared by all requests handled by this process.
+    """
+    return ProductCatalogCache(ProductCatalogCacheConfig.from_env())
+
+
+@cache
+def get_inventory_snapshot():
+    """
+    The snapshot is shared by all requests handled by this process.
+    """
+    return InventorySnapshot(InventorySnapshotConfig.from_env())
+
+
+@cache
+def get_order_batch_config():
+    return OrderBatchConfig.from_env()
+
+
+@cache
+def get_lock_wait_monitor():
+    """
+    The monitor is shared by all requests handled by this process.
+    """
+    return LockWaitMonitor(LockWaitMonitorConfig.from_env())
+
+
+@cache
+def get_tracing_config():
+    return TracingConfig.from_env()
+
+
+@cache
+def get_trace_buffer():
+    """
+    The latest spans of the requests handled by this process.
+    """
+    return RingBufferExporter(get_tracing_config().buffer_size)
+
+
+@cache
+def get_tracer():
+    config = get_tracing_config()
+    exporters: list[SpanExporter] = [get_trace_buffer()]
+    if config.jsonl_path:
+        exporters.append(JsonlExporter(config.jsonl_path))
+    return Tracer(exporters, config.sample_rate)
@@ -0,0 +1,144 @@
+"""
+Import products from a local CSV file with the header `id,name,price,quantity,category`.
+
+Rows are validated against the Product model and streamed into the database in chunks. Each chunk is committed
+separately, so a rejected row is reported instead of failing the whole import.
+
+Usage:
+    python -m app.import_products path/to/products.csv [--chunk-size 10000] [--rejected-output rejected.csv]
+"""
+
+import argparse
+import csv
+from dataclasses import dataclass, field
+import sys
+from typing import Callable, Iterator, TextIO
+
+from pydantic import ValidationError
+
+from app.dependencies import get_repository_session
+from app.err import MyValueError
+from app.models.product import Product
+from app.repositories.base import RepositorySession
+from app.repositories.migration import migrate_up
+from app.repositories.product import product_repository_factory
+
+CSV_COLUMNS = ("id", "name", "price", "quantity", "category")
+DEFAULT_CHUNK_SIZE = 10000
+
+
+@dataclass(frozen=True)
+class RejectedRow:
+    line_number: int
+    reason: str
+
+
+@dataclass
+class ProductImportReport:
+    imported_count: int = 0
+    rejected_rows: list[RejectedRow] = field(default_factory=list)
+
+
+def import_products(
+    session: RepositorySession,
+    csv_file: TextIO,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    on_progress: Callable[[ProductImportReport], None] = lambda report: None,
+) -> ProductImportReport:
+    """
+    Raises:
+        MyValueError: If the CSV header doesn't contain all of CSV_COLUMNS
+    """
+    report = ProductImportReport()
+    product_repository = product_repository_factory(session.new_operator)
+
+    reader = csv.DictReader(csv_file)
+    missing_columns = set(CSV_COLUMNS) - set(reader.fieldnames or [])
+    if missing_columns:
+        raise MyValueError(f"missing columns: {', '.join(sorted(missing_columns))}")
+
+    with session:
+        chunk: list[Product] = []
+        for line_number, product_or_err in _read_products(reader):
+            if isinstance(product_or_err, str):
+                report.rejected_rows.append(RejectedRow(line_number, product_or_err))
+                continue
+
+            chunk.append(product_or_err)
+            if len(chunk) >= chunk_size:
+                _save_chunk(session, product_repository, chunk, report)
+                on_progress(report)
+                chunk = []
+
+        if chunk:
+            _save_chunk(session, product_repository, chunk, report)
+            on_progress(report)
+
+    return report
+
+
+def _read_products(reader: csv.DictReader) -> Iterator[tuple[int, Product | str]]:
+    """
+    Yield (line number, product) for valid rows and (line number, reason of rejection) for invalid rows.
+    """
+    for row in reader:
+        line_number = reader.line_num
+        try:
+            yield line_number, Product.model_validate(
+                {column: row[column] for column in CSV_COLUMNS}
+            )
+        except ValidationError as e:
+            yield line_number, _format_validation_error(e)
+
+
+def _format_validation_error(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()
+    )
+
+
+def _save_chunk(session, product_repository, chunk: list[Product], report):
+    product_repository.save_many(chunk)
+    session.commit()
+    report.imported_count += len(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import products from a CSV file")
+    parser.add_argument("csv_file_path")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument(
+        "--rejected-output",
+        help="Write rejected rows to this CSV file instead of stderr",
+    )
+    args = parser.parse_args()
+
+    def print_progress(report: ProductImportReport):
+        print(
+            f"imported: {report.imported_count}, rejected: {len(report.rejected_rows)}",
+            file=sys.stderr,
+        )
+
+    session = get_repository_session()
+    migrate_up(session)
+    with open(args.csv_file_path, newline="") as csv_file:
+        report = import_products(session, csv_file, args.chunk_size, print_progress)
+
+    if args.rejected_output:
+        with open(args.rejected_output, "w", newline="") as rejected_file:
+            writer = csv.writer(rejected_file)
+            writer.writerow(["line_number", "reason"])
+            for rejected_row in report.rejected_rows:
+                writer.writerow([rejected_row.line_number, rejected_row.reason])
+    else:
+        for rejected_row in report.rejected_rows:
+            print(
+                f"rejected line {rejected_row.line_number}: {rejected_row.reason}",
+                file=sys.stderr,
+            )
+
+    print_progress(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Diagnostics of the time spent acquiring row locks, to find out which rows (e.g. hot products) are contended.
+
+Note: Each worker process has its own monitor, so each of them should be queried separately.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+import os
+from threading import Lock
+import time
+from typing import Callable, Iterator, Optional
+
+USER_LOCK = "user"
+PRODUCT_LOCK = "product"
+
+
+@dataclass(frozen=True)
+class LockWaitMonitorConfig:
+    # Shorter waits are not recorded, so the uncontended rows don't take memory
+    min_wait_seconds: float = 0.001
+
+    # The top rows are computed from the waits in the last `bucket_seconds * buckets` seconds
+    bucket_seconds: float = 60
+    buckets: int = 15
+
+    max_samples: int = 100
+
+    # The blocked database sessions are sampled every `sample_interval_seconds` while a lock acquisition has been
+    # pending for more than `sample_after_seconds`
+    sample_after_seconds: float = 0.1
+    sample_interval_seconds: float = 0.5
+
+    @staticmethod
+    def from_env():
+        min_wait_seconds = float(os.getenv("LOCK_WAIT_MIN_WAIT_SECONDS", 0.001))
+        bucket_seconds = float(os.getenv("LOCK_WAIT_BUCKET_SECONDS", 60))
+        buckets = int(os.getenv("LOCK_WAIT_BUCKETS", 15))
+        max_samples = int(os.getenv("LOCK_WAIT_MAX_SAMPLES", 100))
+        sample_after_seconds = float(os.getenv("LOCK_WAIT_SAMPLE_AFTER_SECONDS", 0.1))
+        sample_interval_seconds = float(
+            os.getenv("LOCK_WAIT_SAMPLE_INTERVAL_SECONDS", 0.5)
+        )
+
+        return LockWaitMonitorConfig(
+            min_wait_seconds=min_wait_seconds,
+            bucket_seconds=bucket_seconds,
+            buckets=buckets,
+            max_samples=max_samples,
+            sample_after_seconds=sample_after_seconds,
+            sample_interval_seconds=sample_interval_seconds,
+        )
+
+
+@dataclass
+class LockWaitStats:
+    kind: str  # USER_LOCK or PRODUCT_LOCK
+    key: str  # Id of the locked entity
+    waits: int = 0
+    total_wait_seconds: float = 0
+    max_wait_seconds: float = 0
+
+    def add(self, wait_seconds: float):
+        self.waits += 1
+        self.total_wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+
+@dataclass(frozen=True)
+class PendingLockWait:
+    kind: str
+    key: str
+    waiting_seconds: float
+
+
+@dataclass(frozen=True)
+class BlockedSession:
+    """
+    A database session waiting for a lock held by another session.
+    """
+
+    pid: int
+
+    # Since the waiting statement started. Postgres doesn't record when the wait started, so it includes the time the
+    # statement ran before waiting.
+    waiting_seconds: float
+
+    wait_event: str
+    locked_relation: Optional[str]
+    query: str
+    blocking_pid: int
+    blocking_state: str
+    blocking_transaction_seconds: float
+    blocking_query: str
+
+
+@dataclass(frozen=True)
+class BlockingSample:
+    taken_at: float  # Unix time
+
+    # The lock acquisitions of this process pending when the sample was taken
+    pending_waits: list[PendingLockWait]
+    blocked_sessions: list[BlockedSession]
+
+
+class LockWaitMonitor:
+    """
+    Keeps the lock waits of the recent time buckets aggregated by the locked row, and the samples of the blocked
+    database sessions taken while the lock acquisitions of this process were pending.
+    """
+
+    def __init__(
+        self,
+        config: LockWaitMonitorConfig,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.config = config
+        self._clock = clock
+        self._buckets: dict[int, dict[tuple[str, str], LockWaitStats]] = {}
+        self._pending: dict[int, tuple[str, str, float]] = {}
+        self._next_pending_id = 0
+        self._samples: deque[BlockingSample] = deque(maxlen=config.max_samples)
+        self._lock = Lock()
+
+    @contextmanager
+    def track(self, kind: str, key: str) -> Iterator[None]:
+        """
+        Measure the time spent in the block as the wait for the lock of the row.
+        """
+        start = self._clock()
+        with self._lock:
+            pending_id = self._next_pending_id
+            self._next_pending_id += 1
+            self._pending[pending_id] = (kind, key, start)
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._pending[pending_id]
+            self.record(kind, key, self._clock() - start)
+
+    def record(self, kind: str, key: str, wait_seconds: float):
+        if wait_seconds < self.config.min_wait_seconds:
+            return
+
+        bucket_index = self._bucket_index()
+        with self._lock:
+            self._drop_expired_buckets(bucket_index)
+            stats_by_row = self._buckets.setdefault(bucket_index, {})
+            stats = stats_by_row.setdefault((kind, key), LockWaitStats(kind, key))
+            stats.add(wait_seconds)
+
+    def _bucket_index(self):
+        return int(self._clock() // self.config.bucket_seconds)
+
+    def _drop_expired_buckets(self, current_bucket_index: int):
+        for bucket_index in list(self._buckets):
+            if bucket_index <= current_bucket_index - self.config.buckets:
+                del self._buckets[bucket_index]
+
+    def top(self, limit: int, kind: Optional[str] = None) -> list[LockWaitStats]:
+        """
+        Return the rows with the longest total wait in the window, optionally only the rows of the given kind.
+        """
+        with self._lock:
+            self._drop_expired_buckets(self._bucket_index())
+            merged: dict[tuple[str, str], LockWaitStats] = {}
+            for stats_by_row in self._buckets.values():
+                for row, stats in stats_by_row.items():
+                    if kind is not None and row[0] != kind:
+                        continue
+                    total = merged.setdefault(row, LockWaitStats(*row))
+                    total.waits += stats.waits
+                    total.total_wait_seconds += stats.total_wait_seconds
+                    total.max_wait_seconds = max(
+                        total.max_wait_seconds, stats.max_wait_seconds
+                    )
+
+        return sorted(
+            merged.values(), key=lambda stats: stats.total_wait_seconds, reverse=True
+        )[:limit]
+
+    @property
+    def window_seconds(self) -> float:
+        return self.config.bucket_seconds * self.config.buckets
+
+    def pending_waits(self, min_waiting_seconds: float = 0) -> list[PendingLockWait]:
+        now = self._clock()
+        with self._lock:
+            pending = list(self._pending.values())
+        return [
+            PendingLockWait(kind, key, now - start)
+            for kind, key, start in pending
+            if now - start >= min_waiting_seconds
+        ]
+
+    def add_sample(self, sample: BlockingSample):
+        with self._lock:
+            self._samples.append(sample)
+
+    def samples(self) -> list[BlockingSample]:
+        """
+        Return the samples from the newest.
+        """
+        with self._lock:
+            return list(reversed(self._samples))
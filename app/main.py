@@ -1,12 +1,99 @@
+from contextlib import asynccontextmanager
+from typing import Protocol
 from fastapi import FastAPI
-from app.dependencies import get_repository_session
+from app.dependencies import (
+    get_app_metrics,
+    get_inventory_snapshot,
+    get_lock_wait_monitor,
+    get_memory_store,
+    get_product_catalog_cache,
+    get_repository_session,
+    get_sqlite_database,
+    get_tracer,
+)
+from app.metrics import MetricsMiddleware
+from app.profiling import ProfilingConfig, ProfilingMiddleware
+from app.tracing import TracingMiddleware
+from app.repositories.config import RepositoryBackend
 from app.repositories.migration import migrate_up
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.invalidation import PostgresInvalidationListener
+from app.repositories.postgres.lock_waits import PostgresBlockingSampler
+from app.repositories.sharded.config import RecoveryConfig, ShardingConfig
+from app.repositories.sharded.session import PreparedTransactionRecoverer
 from app.routers.orders import router as order_router
 from app.routers.auth import router as auth_router
+from app.routers.products import router as product_router
+from app.routers.metrics import router as metrics_router
+from app.routers.admin import router as admin_router
+from app.routers.reports import router as reports_router
 
-app = FastAPI()
+
+class BackgroundWorker(Protocol):
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    workers: list[BackgroundWorker] = []
+    match RepositoryBackend.from_env():
+        case RepositoryBackend.POSTGRES:
+            config = PostgresConfig.from_env()
+            workers.append(new_invalidation_listener(config))
+            workers.append(PostgresBlockingSampler(config, get_lock_wait_monitor()))
+        case RepositoryBackend.SHARDED_POSTGRES:
+            # The products are stored in the catalog, so the changes to them are published there. The locks are
+            # waited for on every node.
+            sharding_config = ShardingConfig.from_env()
+            workers.append(new_invalidation_listener(sharding_config.catalog))
+            for node in dict.fromkeys(
+                (sharding_config.catalog, *sharding_config.shards)
+            ):
+                workers.append(PostgresBlockingSampler(node, get_lock_wait_monitor()))
+            workers.append(
+                PreparedTransactionRecoverer(sharding_config, RecoveryConfig.from_env())
+            )
+        case RepositoryBackend.MEMORY | RepositoryBackend.SQLITE as backend:
+            # The backend invalidates the caches directly when the changes are committed in this process. The caches
+            # of other worker processes sharing a sqlite file only expire after their TTL.
+            publisher = (
+                get_memory_store()
+                if backend == RepositoryBackend.MEMORY
+                else get_sqlite_database()
+            )
+            publisher.subscribe("products", get_product_catalog_cache())
+            publisher.subscribe("products", get_inventory_snapshot())
+
+    for worker in workers:
+        worker.start()
+    yield
+    for worker in reversed(workers):
+        worker.stop()
+
+
+def new_invalidation_listener(config: PostgresConfig) -> PostgresInvalidationListener:
+    # Each worker process has its own in-process caches, so each of them listens to the changes committed by the others
+    invalidation_listener = PostgresInvalidationListener(config)
+    invalidation_listener.subscribe("products", get_product_catalog_cache())
+    invalidation_listener.subscribe("products", get_inventory_snapshot())
+    return invalidation_listener
+
+
+app = FastAPI(lifespan=lifespan)
+# The middleware added last is the outermost. Profiling is inside metrics so that it can read the SQL stats.
+app.add_middleware(ProfilingMiddleware, config=ProfilingConfig.from_env())
+app.add_middleware(MetricsMiddleware, metrics=get_app_metrics())
+app.add_middleware(TracingMiddleware, tracer=get_tracer())
 
 migrate_up(get_repository_session())
 
 app.include_router(order_router, prefix="/orders", tags=["orders"])
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
+app.include_router(product_router, prefix="/products", tags=["products"])
+app.include_router(metrics_router, tags=["metrics"])
+app.include_router(admin_router, prefix="/admin", tags=["admin"])
+app.include_router(reports_router, prefix="/reports", tags=["reports"])
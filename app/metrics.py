@@ -0,0 +1,277 @@
+"""
+Process-wide metrics exposed in the Prometheus text format.
+
+Note: Each worker process has its own metrics, so each of them should be scraped separately.
+"""
+
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+from threading import Lock
+from time import perf_counter
+from typing import Iterator, Optional
+
+from app.repositories.postgres.instrumentation import StatementRecord
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...]):
+    if not label_names:
+        return ""
+    pairs = (
+        f'{name}="{_escape_label_value(value)}"'
+        for name, value in zip(label_names, label_values)
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape_label_value(value: str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...]):
+        self.name = name
+        self._documentation = documentation
+        self._label_names = label_names
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def inc(self, label_values: tuple[str, ...], amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, label_values: tuple[str, ...]) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self._documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_format_labels(self._label_names, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...],
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self._documentation = documentation
+        self._label_names = label_names
+        self._buckets = buckets
+
+        # label values -> (count of each bucket and +Inf bucket (not cumulative), sum)
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+        self._lock = Lock()
+
+    def observe(self, label_values: tuple[str, ...], value: float):
+        bucket_index = bisect_left(self._buckets, value)
+        with self._lock:
+            bucket_counts, total = self._values.get(
+                label_values, ([0] * (len(self._buckets) + 1), 0.0)
+            )
+            bucket_counts[bucket_index] += 1
+            self._values[label_values] = (bucket_counts, total + value)
+
+    def get_count(self, label_values: tuple[str, ...]) -> int:
+        with self._lock:
+            if label_values not in self._values:
+                return 0
+            return sum(self._values[label_values][0])
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self._documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            values = [
+                (label_values, list(bucket_counts), total)
+                for label_values, (bucket_counts, total) in self._values.items()
+            ]
+        label_names = self._label_names + ("le",)
+        for label_values, bucket_counts, total in values:
+            cumulative_count = 0
+            for upper_bound, count in zip(
+                [str(bucket) for bucket in self._buckets] + ["+Inf"], bucket_counts
+            ):
+                cumulative_count += count
+                labels = _format_labels(label_names, label_values + (upper_bound,))
+                yield f"{self.name}_bucket{labels} {cumulative_count}"
+            labels = _format_labels(self._label_names, label_values)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative_count}"
+
+
+@dataclass
+class RequestSqlStats:
+    statement_count: int = 0
+    duration_seconds: float = 0
+    rows: int = 0
+    locking_seconds: float = 0
+
+    def add(self, record: StatementRecord):
+        self.statement_count += 1
+        self.duration_seconds += record.duration_seconds
+        self.rows += record.rows
+        self.locking_seconds += record.locking_seconds
+
+
+# Set by MetricsMiddleware for each request. The threads running the sync endpoints and dependencies get a copy of
+# the context, so the statements executed by them are added to the same object.
+current_request_sql_stats: ContextVar[Optional[RequestSqlStats]] = ContextVar(
+    "current_request_sql_stats", default=None
+)
+
+
+class AppMetrics:
+    def __init__(self):
+        self.http_request_duration = Histogram(
+            "http_request_duration_seconds",
+            "Latency of HTTP requests",
+            ("method", "route", "status"),
+        )
+        self.http_request_db_statements = Histogram(
+            "http_request_db_statements",
+            "Number of SQL statements executed per HTTP request",
+            ("method", "route"),
+            buckets=COUNT_BUCKETS,
+        )
+        self.http_request_db_duration = Histogram(
+            "http_request_db_duration_seconds",
+            "Time spent executing SQL statements per HTTP request",
+            ("method", "route"),
+        )
+        self.http_request_db_locking = Counter(
+            "http_request_db_locking_seconds_total",
+            "Time spent executing SQL statements acquiring row locks, including waiting for them",
+            ("method", "route"),
+        )
+        self.db_statement_duration = Histogram(
+            "db_statement_duration_seconds",
+            "Latency of SQL statements by the repository method executing them",
+            ("operation",),
+        )
+        self.db_rows = Counter(
+            "db_rows_total",
+            "Rows returned or affected by SQL statements",
+            ("operation",),
+        )
+        self.db_locking = Counter(
+            "db_locking_seconds_total",
+            "Time spent executing SQL statements acquiring row locks, including waiting for them",
+            ("operation",),
+        )
+
+    def record_statement(self, record: StatementRecord):
+        label_values = (record.operation,)
+        self.db_statement_duration.observe(label_values, record.duration_seconds)
+        self.db_rows.inc(label_values, record.rows)
+        if record.locking_seconds:
+            self.db_locking.inc(label_values, record.locking_seconds)
+
+        request_sql_stats = current_request_sql_stats.get()
+        if request_sql_stats is not None:
+            request_sql_stats.add(record)
+
+    def record_request(
+        self,
+        method: str,
+        route: str,
+        status: int,
+        duration_seconds: float,
+        sql_stats: RequestSqlStats,
+    ):
+        self.http_request_duration.observe(
+            (method, route, str(status)), duration_seconds
+        )
+        label_values = (method, route)
+        self.http_request_db_statements.observe(label_values, sql_stats.statement_count)
+        self.http_request_db_duration.observe(label_values, sql_stats.duration_seconds)
+        if sql_stats.locking_seconds:
+            self.http_request_db_locking.inc(label_values, sql_stats.locking_seconds)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in (
+            self.http_request_duration,
+            self.http_request_db_statements,
+            self.http_request_db_duration,
+            self.http_request_db_locking,
+            self.db_statement_duration,
+            self.db_rows,
+            self.db_locking,
+        ):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+def get_route_path(scope) -> str:
+    """
+    Return the path template of the matched route (e.g. /products/{product_id}) so that the number of label values is bounded.
+    """
+    route = scope.get("route")
+    return getattr(route, "path", UNMATCHED_ROUTE)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency and the SQL statements of each HTTP request.
+    """
+
+    def __init__(self, app, metrics: AppMetrics):
+        self._app = app
+        self._metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        sql_stats = RequestSqlStats()
+        token = current_request_sql_stats.set(sql_stats)
+        start = perf_counter()
+        try:
+            await self._app(scope, receive, send_wrapper)
+        finally:
+            duration_seconds = perf_counter() - start
+            current_request_sql_stats.reset(token)
+            self._metrics.record_request(
+                scope["method"],
+                get_route_path(scope),
+                status,
+                duration_seconds,
+                sql_stats,
+            )
@@ -1,13 +1,42 @@
+from datetime import datetime
+from typing import Optional
 from uuid import UUID, uuid4
 from pydantic.dataclasses import dataclass
 from pydantic import Field, field_validator
 
 
-@dataclass(frozen=True)
+# Slotted as many of them are built when reading the orders
+@dataclass(frozen=True, slots=True)
 class OrderItem:
     product_id: str
     quantity: int = Field(gt=0)
 
+    @classmethod
+    def construct(cls, product_id: str, quantity: int) -> "OrderItem":
+        """
+        Create without validation. Only for trusted data, e.g. rows read from our own database.
+        """
+        item = object.__new__(cls)
+        # The dataclass is frozen
+        object.__setattr__(item, "product_id", product_id)
+        object.__setattr__(item, "quantity", quantity)
+        return item
+
+
+def validate_order_items(order_items: tuple[OrderItem, ...]):
+    """
+    Raises:
+        ValueError: If there are no items or more than one item of the same product.
+    """
+    if len(order_items) == 0:
+        raise ValueError("order_items must not be empty")
+
+    seen_product_ids = set()
+    for item in order_items:
+        if item.product_id in seen_product_ids:
+            raise ValueError("order_items must not contain duplicate product_id")
+        seen_product_ids.add(item.product_id)
+
 
 @dataclass(frozen=True)
 class PurchaseInfo:
@@ -21,20 +50,63 @@ class PurchaseInfo:
     @field_validator("order_items")
     @classmethod
     def validate_order_items(cls, v: tuple[OrderItem, ...]):
-        if len(v) == 0:
-            raise ValueError("order_items must not be empty")
-
-        seen_product_ids = set()
-        for item in v:
-            if item.product_id in seen_product_ids:
-                raise ValueError("order_items must not contain duplicate product_id")
-            seen_product_ids.add(item.product_id)
-
+        validate_order_items(v)
         return v
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Order:
     id: str
     user_id: str
     order_items: tuple[OrderItem, ...]
+
+    @classmethod
+    def construct(
+        cls, id: str, user_id: str, order_items: tuple[OrderItem, ...]
+    ) -> "Order":
+        """
+        Create without validation. Only for trusted data, e.g. rows read from our own database.
+        """
+        order = object.__new__(cls)
+        object.__setattr__(order, "id", id)
+        object.__setattr__(order, "user_id", user_id)
+        object.__setattr__(order, "order_items", order_items)
+        return order
+
+
+@dataclass(frozen=True)
+class UserOrderStats:
+    order_count: int = 0
+
+    # Units of the products in the orders
+    item_count: int = 0
+
+    # The orders placed before the prices were recorded with them count as nothing spent
+    total_spent: float = 0
+
+    # None if the user has no orders
+    last_order_at: Optional[datetime] = None
+
+
+@dataclass(frozen=True)
+class QuoteLine:
+    product_id: str
+    quantity: int
+    unit_price: float
+    line_price: float
+
+    # The stock of the product is enough for the quantity
+    in_stock: bool
+
+
+@dataclass(frozen=True)
+class OrderQuote:
+    lines: tuple[QuoteLine, ...]
+    total_price: float
+    balance: float
+
+    # The balance is enough for the total price
+    balance_sufficient: bool
+
+    # Placing the order would succeed if nothing changes before: all products are in stock and the balance is enough
+    placeable: bool
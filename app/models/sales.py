@@ -0,0 +1,40 @@
+from datetime import datetime
+from enum import Enum
+
+from pydantic.dataclasses import dataclass
+
+
+class SalesDimension(Enum):
+    PRODUCT = "product"
+    CATEGORY = "category"
+
+
+class SalesPeriod(Enum):
+    HOUR = "hour"
+    DAY = "day"
+
+
+class SalesMetric(Enum):
+    UNITS = "units"
+    REVENUE = "revenue"
+
+
+@dataclass(frozen=True)
+class SalesRollup:
+    # The product id or the category, by the dimension
+    key: str
+
+    # The start of the hour or the day
+    period_start: datetime
+
+    units: int
+
+    # The items of the orders placed before the prices were recorded with them count as no revenue
+    revenue: float
+
+
+@dataclass(frozen=True)
+class TopSeller:
+    product_id: str
+    units: int
+    revenue: float
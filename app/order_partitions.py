@@ -0,0 +1,164 @@
+"""
+Maintenance of the monthly partitions of the orders and their items (REPOSITORY_BACKEND=postgres or sharded_postgres,
+where each shard is maintained in turn). See app/repositories/postgres/partitions.py.
+
+`create` creates the partitions up to ORDER_PARTITION_MONTHS_AHEAD months ahead, as the migrations do when the servers
+start, and moves the rows of the default partitions to the partitions of their months. Run it monthly if the servers
+run for longer than that.
+
+`archive` exports the partitions of the months before --before to gzip-compressed CSV files with a header, named
+`<directory>/<host>_<port>_<database>/<table>_YYYY_MM.csv.gz`, and then detaches and drops them with the keys of their
+orders. The orders of these months are no longer returned. The writes to the partitions of a month are blocked from its
+export to its drop, so the files have all of their rows. Rerunning after a failure exports the remaining months again.
+
+Usage:
+    python -m app.order_partitions create
+    python -m app.order_partitions archive --before 2024-01 [--directory archive]
+"""
+
+import argparse
+from datetime import date
+import gzip
+from pathlib import Path
+
+from psycopg import Cursor, sql
+
+from app.err import MyValueError
+from app.repositories.config import RepositoryBackend
+from app.repositories.postgres.config import OrderPartitionConfig, PostgresConfig
+from app.repositories.postgres.partitions import (
+    PARTITIONED_TABLES,
+    create_partitions,
+    drop_partitions,
+    partition_months,
+    partition_name,
+)
+from app.repositories.postgres.session import new_postgres_conn
+from app.repositories.sharded.config import ShardingConfig, node_name
+
+DEFAULT_DIRECTORY = "archive"
+
+
+def order_nodes() -> list[PostgresConfig]:
+    """
+    The postgres nodes storing the orders of REPOSITORY_BACKEND.
+
+    Raises:
+        MyValueError: If the backend is not backed by postgres.
+    """
+    match RepositoryBackend.from_env():
+        case RepositoryBackend.POSTGRES:
+            return [PostgresConfig.from_env()]
+        case RepositoryBackend.SHARDED_POSTGRES:
+            return list(dict.fromkeys(ShardingConfig.from_env().shards))
+        case backend:
+            raise MyValueError(
+                f"the orders of the {backend.value} backend are not partitioned"
+            )
+
+
+def create_order_partitions(config: PostgresConfig, months_ahead: int) -> list[str]:
+    """
+    Returns:
+        The names of the created partitions.
+    """
+    with new_postgres_conn(config) as conn:
+        with conn.cursor() as cur:
+            return create_partitions(cur, months_ahead)
+
+
+def archive_order_partitions(
+    config: PostgresConfig, before: date, directory: Path, months_ahead: int
+) -> list[Path]:
+    """
+    Export the partitions of the months before the month of `before` to files in the directory, and then detach and
+    drop them. The missing partitions are created first, so the old rows left in the default partitions are archived
+    too.
+
+    Returns:
+        The paths of the exported files.
+
+    Raises:
+        MyValueError: If `before` is after the current month.
+    """
+    before = before.replace(day=1)
+    if before > date.today().replace(day=1):
+        raise MyValueError("can't archive the orders of the current month or later")
+
+    node_directory = directory / f"{config.host}_{config.port}_{config.database}"
+    node_directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    with new_postgres_conn(config) as conn:
+        with conn.cursor() as cur:
+            create_partitions(cur, months_ahead)
+            months = [
+                month for month in partition_months(cur, "orders") if month < before
+            ]
+        conn.commit()
+
+        for month in months:
+            with conn.cursor() as cur:
+                names = [partition_name(table, month) for table in PARTITIONED_TABLES]
+                cur.execute(
+                    sql.SQL("LOCK TABLE {} IN SHARE MODE;").format(
+                        sql.SQL(", ").join(map(sql.Identifier, names))
+                    )
+                )
+                for name in names:
+                    paths.append(_export(cur, name, node_directory / f"{name}.csv.gz"))
+                drop_partitions(cur, month)
+            conn.commit()
+    return paths
+
+
+def _export(cur: Cursor, table: str, path: Path) -> Path:
+    # Written to a temporary file first, so a file with the final name is always complete
+    temporary_path = path.with_name(f"{path.name}.tmp")
+    with gzip.open(temporary_path, "wb") as file:
+        with cur.copy(
+            sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER);").format(
+                sql.Identifier(table)
+            )
+        ) as copy:
+            for data in copy:
+                file.write(data)
+    temporary_path.replace(path)
+    return path
+
+
+def _month(value: str) -> date:
+    return date.fromisoformat(f"{value}-01")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Maintenance of the monthly partitions of the orders"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("create")
+    archive_parser = subparsers.add_parser("archive")
+    archive_parser.add_argument(
+        "--before",
+        type=_month,
+        required=True,
+        help="The months before this month (YYYY-MM) are archived",
+    )
+    archive_parser.add_argument("--directory", type=Path, default=DEFAULT_DIRECTORY)
+    args = parser.parse_args()
+
+    months_ahead = OrderPartitionConfig.from_env().months_ahead
+    for node in order_nodes():
+        if args.command == "create":
+            names = create_order_partitions(node, months_ahead)
+        else:
+            names = [
+                str(path)
+                for path in archive_order_partitions(
+                    node, args.before, args.directory, months_ahead
+                )
+            ]
+        print(f"{node_name(node)}: {', '.join(names) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Repair of the order stats of the users, which are maintained while placing the orders. Recomputes them from the orders,
+e.g. after upgrading from a version without them, or after changing the orders in the database by hand. The orders
+being placed wait for the repair to commit.
+
+The items of the orders placed before their prices were recorded count as nothing spent.
+
+Usage:
+    python -m app.order_stats
+"""
+
+import argparse
+
+from app.dependencies import get_repository_session
+from app.repositories.base import RepositorySession
+from app.repositories.migration import migrate_up
+from app.repositories.order import order_repository_factory
+
+
+def repair_order_stats(session: RepositorySession):
+    order_repository = order_repository_factory(session.new_operator)
+    with session:
+        order_repository.rebuild_stats()
+        session.commit()
+
+
+def main():
+    argparse.ArgumentParser(
+        description="Recompute the order stats of the users from their orders"
+    ).parse_args()
+
+    session = get_repository_session()
+    migrate_up(session)
+    repair_order_stats(session)
+
+
+if __name__ == "__main__":
+    main()
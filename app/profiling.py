@@ -0,0 +1,271 @@
+"""
+Opt-in profiling of single HTTP requests.
+
+A profiled request is sampled by a background thread reading the stacks of the threads that run requests: the event
+loop thread, which runs the async code such as the validation of request bodies, and the worker threads of the
+threadpool, which run the sync dependencies and endpoints. Idle threads are skipped. The samples are written as
+collapsed stacks (e.g. for flamegraph.pl or speedscope) with a JSON file describing the request.
+
+Note: The stacks of the requests handled concurrently by the same process are included as well. The number of
+requests in progress is recorded with each profile, so a profile mixing other requests can be recognized.
+"""
+
+from collections import Counter
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import random
+import re
+import sys
+import threading
+from types import FrameType
+from time import perf_counter
+from typing import Callable, Optional
+
+import anyio
+
+from app.auth import is_admin_token_valid
+from app.metrics import current_request_sql_stats, get_route_path
+
+PROFILE_HEADER = b"x-profile"
+ADMIN_TOKEN_HEADER = b"x-admin-token"
+
+# Threads sitting in these functions are waiting for work
+_IDLE_FUNCTIONS = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+
+
+@dataclass(frozen=True)
+class ProfilingConfig:
+    # Fraction of requests profiled without the profile header
+    sample_rate: float = 0
+
+    directory: str = "profiles"
+    max_profiles: int = 100  # The oldest are deleted
+    interval_seconds: float = 0.001
+
+    @staticmethod
+    def from_env():
+        sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+        directory = os.getenv("PROFILE_DIRECTORY", "profiles")
+        max_profiles = int(os.getenv("PROFILE_MAX_PROFILES", 100))
+        interval_seconds = float(os.getenv("PROFILE_INTERVAL_SECONDS", 0.001))
+
+        return ProfilingConfig(
+            sample_rate=sample_rate,
+            directory=directory,
+            max_profiles=max_profiles,
+            interval_seconds=interval_seconds,
+        )
+
+
+def _format_frame(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_FUNCTIONS
+
+
+def _is_request_thread(thread: threading.Thread, event_loop_thread_id: int) -> bool:
+    # The worker threads of anyio, which is used by starlette to run sync functions in the threadpool
+    return (
+        thread.ident == event_loop_thread_id or type(thread).__name__ == "WorkerThread"
+    )
+
+
+class SamplingProfiler:
+    """
+    Count the stacks of the threads running requests until stopped.
+    """
+
+    def __init__(self, event_loop_thread_id: int, interval_seconds: float):
+        self._event_loop_thread_id = event_loop_thread_id
+        self._interval_seconds = interval_seconds
+        self._stacks: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter[str]:
+        self._stopped.set()
+        self._thread.join()
+        return self._stacks
+
+    def _run(self):
+        while not self._stopped.wait(self._interval_seconds):
+            self.sample()
+
+    def sample(self):
+        threads = {thread.ident: thread for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            thread = threads.get(thread_id)
+            if thread is None or not _is_request_thread(
+                thread, self._event_loop_thread_id
+            ):
+                continue
+            if _is_idle(frame):
+                continue
+
+            frames: list[str] = []
+            current: Optional[FrameType] = frame
+            while current is not None:
+                frames.append(_format_frame(current))
+                current = current.f_back
+            frames.append(thread.name)
+            self._stacks[";".join(reversed(frames))] += 1
+
+
+@dataclass(frozen=True)
+class RequestProfile:
+    method: str
+    route: str
+    status: int
+    latency_seconds: float
+    started_at: str  # ISO 8601 in UTC
+    samples: int
+
+    # Max number of requests in progress in this process while profiling
+    concurrent_requests: int
+
+    sql_statement_count: int
+    sql_duration_seconds: float
+    sql_locking_seconds: float
+
+
+class ProfileStore:
+    """
+    Directory of profiles where each profile is a `.collapsed` file of the stacks and a `.json` file of the request.
+    """
+
+    def __init__(self, directory: str, max_profiles: int):
+        self._directory = Path(directory)
+        self._max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def save(self, profile: RequestProfile, stacks: Counter[str]) -> str:
+        """
+        Return the name of the profile
+        """
+        route = re.sub(r"[^A-Za-z0-9]+", "_", profile.route).strip("_") or "root"
+        name = "-".join(
+            [
+                datetime.fromisoformat(profile.started_at).strftime("%Y%m%d%H%M%S%f"),
+                profile.method,
+                route,
+                f"{round(profile.latency_seconds * 1000)}ms",
+            ]
+        )
+
+        with self._lock:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            (self._directory / f"{name}.collapsed").write_text(
+                "".join(f"{stack} {count}\n" for stack, count in stacks.items())
+            )
+            (self._directory / f"{name}.json").write_text(
+                json.dumps(asdict(profile), indent=2)
+            )
+            self._delete_oldest()
+        return name
+
+    def _delete_oldest(self):
+        # Names start with the time, so they are sorted from the oldest
+        names = sorted(path.stem for path in self._directory.glob("*.json"))
+        for name in names[: max(len(names) - self._max_profiles, 0)]:
+            for suffix in (".json", ".collapsed"):
+                (self._directory / f"{name}{suffix}").unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling a sampled fraction of the requests, and the requests with the `X-Profile: 1` header and
+    a valid admin token.
+
+    Should be added before (i.e. inside) MetricsMiddleware so that the SQL statements of the request are recorded.
+    """
+
+    def __init__(
+        self,
+        app,
+        config: ProfilingConfig,
+        store: Optional[ProfileStore] = None,
+        random_value: Callable[[], float] = random.random,
+    ):
+        self._app = app
+        self._config = config
+        self._store = store or ProfileStore(config.directory, config.max_profiles)
+        self._random_value = random_value
+        self._requests_in_progress = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+
+        self._requests_in_progress += 1
+        try:
+            if self._should_profile(scope):
+                await self._profile(scope, receive, send)
+            else:
+                await self._app(scope, receive, send)
+        finally:
+            self._requests_in_progress -= 1
+
+    def _should_profile(self, scope) -> bool:
+        headers = dict(scope["headers"])
+        if headers.get(PROFILE_HEADER) == b"1" and is_admin_token_valid(
+            headers.get(ADMIN_TOKEN_HEADER, b"").decode("latin-1")
+        ):
+            return True
+        return self._random_value() < self._config.sample_rate
+
+    async def _profile(self, scope, receive, send):
+        status = 500
+        max_requests_in_progress = self._requests_in_progress
+
+        async def send_wrapper(message):
+            nonlocal status, max_requests_in_progress
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            max_requests_in_progress = max(
+                max_requests_in_progress, self._requests_in_progress
+            )
+            await send(message)
+
+        profiler = SamplingProfiler(
+            threading.get_ident(), self._config.interval_seconds
+        )
+        started_at = datetime.now(timezone.utc)
+        start = perf_counter()
+        profiler.start()
+        try:
+            await self._app(scope, receive, send_wrapper)
+        finally:
+            latency_seconds = perf_counter() - start
+            sql_stats = current_request_sql_stats.get()
+            # Waiting for the sampling thread and writing the files would block the event loop, which runs the other
+            # requests
+            stacks = await anyio.to_thread.run_sync(profiler.stop)
+            profile = RequestProfile(
+                method=scope["method"],
+                route=get_route_path(scope),
+                status=status,
+                latency_seconds=latency_seconds,
+                started_at=started_at.isoformat(),
+                samples=sum(stacks.values()),
+                concurrent_requests=max_requests_in_progress,
+                sql_statement_count=sql_stats.statement_count if sql_stats else 0,
+                sql_duration_seconds=(sql_stats.duration_seconds if sql_stats else 0),
+                sql_locking_seconds=(sql_stats.locking_seconds if sql_stats else 0),
+            )
+            await anyio.to_thread.run_sync(self._store.save, profile, stacks)
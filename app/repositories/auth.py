@@ -1,12 +1,22 @@
 from abc import abstractmethod
 from typing import Callable, TypeAlias, TypeVar
 
+import sqlite3
+
 from psycopg import Cursor
 import psycopg
 
 from app.models.auth import AuthRecord
+from app.models.user import User
 from app.repositories.err import EntityAlreadyExistsError, EntityNotFoundError
 from app.repositories.base import AbstractRepository
+from app.repositories.config import RepositoryBackend
+from app.repositories.memory.session import MemoryTransaction
+from app.repositories.postgres.rows import AUTH_RECORD_COLUMNS, auth_record_row
+from app.repositories.sharded.session import ShardedOperator
+from app.repositories.sqlite import rows as sqlite_rows
+from app.repositories.sqlite.session import SqliteCursor
+from app.repositories.user import MemoryUserRepository
 
 
 Operator = TypeVar("Operator")
@@ -21,6 +31,16 @@ class AuthRecordRepository(AbstractRepository[Operator]):
         """
         pass
 
+    @abstractmethod
+    def add_with_user(self, auth_record: AuthRecord, user: User):
+        """
+        Add the auth record together with the new user it belongs to.
+
+        Raises:
+            EntityAlreadyExistsError: If a record with the provided username already exists. Neither the auth record nor the user is written in this case.
+        """
+        pass
+
     @abstractmethod
     def get_by_username(self, username: str) -> AuthRecord:
         """
@@ -31,12 +51,20 @@ class AuthRecordRepository(AbstractRepository[Operator]):
 
 
 AuthRecordRepositoryFactory: TypeAlias = Callable[
-    [Callable[[], Operator]], AuthRecordRepository[Operator]
+    [Callable[[str], Operator]], AuthRecordRepository[Operator]
 ]
 
 
 def auth_record_repository_factory(new_operator):
-    return PostgresAuthRecordRepository(new_operator)
+    match RepositoryBackend.from_env():
+        case RepositoryBackend.POSTGRES:
+            return PostgresAuthRecordRepository(new_operator)
+        case RepositoryBackend.MEMORY:
+            return MemoryAuthRecordRepository(new_operator)
+        case RepositoryBackend.SQLITE:
+            return SqliteAuthRecordRepository(new_operator)
+        case RepositoryBackend.SHARDED_POSTGRES:
+            return ShardedAuthRecordRepository(new_operator)
 
 
 class PostgresAuthRecordRepository(AuthRecordRepository[Cursor]):
@@ -53,7 +81,7 @@ class PostgresAuthRecordRepository(AuthRecordRepository[Cursor]):
     """
 
     def add(self, auth_record: AuthRecord):
-        with self.new_operator() as cursor:
+        with self.new_operator("add") as cursor:
             try:
                 cursor.execute(
                     "INSERT INTO auth_records (user_id, username, hashed_password) VALUES (%s, %s, %s);",
@@ -66,15 +94,193 @@ class PostgresAuthRecordRepository(AuthRecordRepository[Cursor]):
             except psycopg.errors.UniqueViolation:
                 raise EntityAlreadyExistsError.create("username", auth_record.username)
 
+    def add_with_user(self, auth_record: AuthRecord, user: User):
+        with self.new_operator("add_with_user") as cursor:
+            # Single round trip. ON CONFLICT checks the username against the unique index before inserting, so the user row is only inserted if the auth record is.
+            # If other concurrent transaction inserted the same username first without committing, this will wait until the other transaction is committed or rolled back.
+            cursor.execute(
+                """
+                WITH new_auth_record AS (
+                    INSERT INTO auth_records (user_id, username, hashed_password)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (username) DO NOTHING
+                    RETURNING user_id
+                )
+                INSERT INTO users (id, balance)
+                SELECT %s, %s FROM new_auth_record
+                RETURNING id;
+            """,
+                (
+                    auth_record.user_id,
+                    auth_record.username,
+                    auth_record.hashed_password,
+                    user.id,
+                    user.balance,
+                ),
+            )
+            if cursor.fetchone() is None:
+                raise EntityAlreadyExistsError.create("username", auth_record.username)
+
+    def get_by_username(self, username: str) -> AuthRecord:
+        with self.new_operator("get_by_username") as cursor:
+            cursor.row_factory = auth_record_row
+            cursor.execute(
+                f"SELECT {AUTH_RECORD_COLUMNS} FROM auth_records WHERE username = %s;",
+                (username,),
+                binary=True,
+            )
+            auth_record = cursor.fetchone()
+            if auth_record is None:
+                raise EntityNotFoundError.create("username", username)
+            return auth_record
+
+
+class MemoryAuthRecordRepository(AuthRecordRepository[MemoryTransaction]):
+    # Keyed by username, which is unique
+    TABLE = "auth_records"
+
+    def add(self, auth_record: AuthRecord):
+        if not self.new_operator("add").insert(
+            self.TABLE, auth_record.username, auth_record
+        ):
+            raise EntityAlreadyExistsError.create("username", auth_record.username)
+
+    def add_with_user(self, auth_record: AuthRecord, user: User):
+        self.add(auth_record)
+        self.new_operator("add_with_user").put(
+            MemoryUserRepository.TABLE, user.id, user.model_copy()
+        )
+
+    def get_by_username(self, username: str) -> AuthRecord:
+        auth_record = self.new_operator("get_by_username").get(self.TABLE, username)
+        if auth_record is None:
+            raise EntityNotFoundError.create("username", username)
+        return auth_record
+
+
+class SqliteAuthRecordRepository(AuthRecordRepository[SqliteCursor]):
+    CREATE_TABLE_IF_NOT_EXISTS = """
+        CREATE TABLE IF NOT EXISTS auth_records (
+            user_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL UNIQUE,
+            hashed_password TEXT NOT NULL
+        );
+    """
+
+    DROP_TABLE = """
+        DROP TABLE auth_records;
+    """
+
+    def add(self, auth_record: AuthRecord):
+        with self.new_operator("add") as cursor:
+            cursor.begin_write()
+            try:
+                cursor.execute(
+                    "INSERT INTO auth_records (user_id, username, hashed_password) VALUES (?, ?, ?);",
+                    (
+                        auth_record.user_id,
+                        auth_record.username,
+                        auth_record.hashed_password,
+                    ),
+                )
+            except sqlite3.IntegrityError:
+                raise EntityAlreadyExistsError.create("username", auth_record.username)
+
+    def add_with_user(self, auth_record: AuthRecord, user: User):
+        with self.new_operator("add_with_user") as cursor:
+            # No other transaction can insert the same username once the write transaction has begun
+            cursor.begin_write()
+            cursor.execute(
+                """
+                INSERT INTO auth_records (user_id, username, hashed_password)
+                VALUES (?, ?, ?)
+                ON CONFLICT (username) DO NOTHING;
+            """,
+                (
+                    auth_record.user_id,
+                    auth_record.username,
+                    auth_record.hashed_password,
+                ),
+            )
+            if cursor.rowcount == 0:
+                raise EntityAlreadyExistsError.create("username", auth_record.username)
+
+            cursor.execute(
+                "INSERT INTO users (id, balance) VALUES (?, ?);",
+                (user.id, user.balance),
+            )
+
     def get_by_username(self, username: str) -> AuthRecord:
-        with self.new_operator() as cursor:
+        with self.new_operator("get_by_username") as cursor:
+            cursor.row_factory = sqlite_rows.auth_record_row
             cursor.execute(
-                "SELECT user_id, username, hashed_password FROM auth_records WHERE username = %s;",
+                f"SELECT {sqlite_rows.AUTH_RECORD_COLUMNS} FROM auth_records WHERE username = ?;",
                 (username,),
             )
-            result = cursor.fetchone()
-            if result is None:
+            auth_record = cursor.fetchone()
+            if auth_record is None:
                 raise EntityNotFoundError.create("username", username)
-            return AuthRecord(
-                user_id=result[0], username=result[1], hashed_password=result[2]
+            return auth_record
+
+
+class ShardedAuthRecordRepository(AuthRecordRepository[ShardedOperator]):
+    """
+    Each auth record is stored in the shard of its user. The directory in the catalog node maps the usernames to the
+    user ids, whose shards are known, and checks the uniqueness of the usernames across the shards.
+    """
+
+    CREATE_DIRECTORY_TABLE_IF_NOT_EXISTS = """
+        CREATE TABLE IF NOT EXISTS user_directory (
+            username VARCHAR PRIMARY KEY,
+            user_id VARCHAR NOT NULL
+        );
+    """
+
+    DROP_DIRECTORY_TABLE = """
+        DROP TABLE user_directory;
+    """
+
+    def add(self, auth_record: AuthRecord):
+        operator = self.new_operator("add")
+        self._add_to_directory(operator, auth_record)
+        PostgresAuthRecordRepository(
+            lambda _: operator.user_shard(auth_record.user_id)
+        ).add(auth_record)
+
+    def add_with_user(self, auth_record: AuthRecord, user: User):
+        operator = self.new_operator("add_with_user")
+        self._add_to_directory(operator, auth_record)
+        PostgresAuthRecordRepository(
+            lambda _: operator.user_shard(user.id)
+        ).add_with_user(auth_record, user)
+
+    @staticmethod
+    def _add_to_directory(operator: ShardedOperator, auth_record: AuthRecord):
+        with operator.catalog() as cursor:
+            # Waits for the concurrent transaction inserting the same username, as in PostgresAuthRecordRepository
+            cursor.execute(
+                """
+                INSERT INTO user_directory (username, user_id)
+                VALUES (%s, %s)
+                ON CONFLICT (username) DO NOTHING
+                RETURNING user_id;
+            """,
+                (auth_record.username, auth_record.user_id),
             )
+            if cursor.fetchone() is None:
+                raise EntityAlreadyExistsError.create("username", auth_record.username)
+
+    def get_by_username(self, username: str) -> AuthRecord:
+        operator = self.new_operator("get_by_username")
+        with operator.catalog() as cursor:
+            cursor.execute(
+                "SELECT user_id FROM user_directory WHERE username = %s;", (username,)
+            )
+            row = cursor.fetchone()
+        if row is None:
+            raise EntityNotFoundError.create("username", username)
+
+        user_id = row[0]
+        return PostgresAuthRecordRepository(
+            lambda _: operator.user_shard(user_id)
+        ).get_by_username(username)
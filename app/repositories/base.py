@@ -35,18 +35,31 @@ class RepositorySession(ABC, Generic[Operator]):
         self.rollback()
 
     @abstractmethod
-    def new_operator(self) -> Operator:
+    def new_operator(self, operation: str = "") -> Operator:
         """
         Return a new instance of Operator that is used for database interactions within the repository.
 
         This method can be passed to the constructor of a class implementing AbstractRepository.
 
+        Args:
+            operation: The name the statements executed with the operator are attributed to, e.g. in the metrics and
+                the traces. AbstractRepository.new_operator passes the name of the repository method.
+
         This setup allows AbstractRepository to utilize the specific Operator for executing database operations,
         while separating the concerns of transaction management (committing and rolling back) which are handled
         by the RepositorySession class.
         """
         pass
 
+    @abstractmethod
+    def begin_snapshot(self):
+        """
+        Make the current transaction read-only, reading a snapshot of the data committed before its first read without
+        taking any lock, so that the reads are consistent with each other without blocking or waiting for the writers.
+        Must be called before the first statement of the transaction. The following transactions are not affected.
+        """
+        pass
+
     @abstractmethod
     def commit(self):
         pass
@@ -57,14 +70,21 @@ class RepositorySession(ABC, Generic[Operator]):
 
 
 class AbstractRepository(ABC, Generic[Operator]):
-    def __init__(self, new_operator: Callable[[], Operator]):
+    def __init__(self, new_operator: Callable[[str], Operator]):
         """
         Args:
-           new_operator (Callable[[], Operator]): A factory method that returns an instance of Operator.
-                This callable is expected to be provided by an implementation of the RepositorySession class.
-                Also see the comment of new_operator in the RepositorySession class.
+           new_operator (Callable[[str], Operator]): A factory method that returns an instance of Operator for the name
+                of an operation. This callable is expected to be provided by an implementation of the RepositorySession
+                class. Also see the comment of new_operator in the RepositorySession class.
+        """
+        self._new_operator = new_operator
+
+    def new_operator(self, method: str) -> Operator:
+        """
+        Return a new instance of Operator for `method` of this repository, whose statements are attributed to
+        `<repository class>.<method>`, e.g. PostgresUserRepository.get_by_id.
         """
-        self.new_operator = new_operator
+        return self._new_operator(f"{type(self).__qualname__}.{method}")
 
 
 class LockLevel(Enum):
@@ -0,0 +1,19 @@
+from enum import Enum
+import os
+
+
+class RepositoryBackend(Enum):
+    POSTGRES = "postgres"
+
+    # Data is lost when the process exits. Each process has its own data, so only for a single worker.
+    MEMORY = "memory"
+
+    # Embedded database file, for a single node. The writes of all worker processes are serialized.
+    SQLITE = "sqlite"
+
+    # The users are spread across the postgres shards of POSTGRES_SHARDS, and the products are in the catalog node
+    SHARDED_POSTGRES = "sharded_postgres"
+
+    @staticmethod
+    def from_env():
+        return RepositoryBackend(os.getenv("REPOSITORY_BACKEND", "postgres"))
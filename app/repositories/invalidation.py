@@ -0,0 +1,24 @@
+from collections import defaultdict
+
+from app.repositories.postgres.invalidation import InvalidationHandler
+
+
+class InvalidationPublisher:
+    """
+    Calls the subscribed handlers with the changes committed in this process, for the backends without a way to
+    notify other processes.
+    """
+
+    def __init__(self):
+        self._handlers: dict[str, list[InvalidationHandler]] = defaultdict(list)
+
+    def subscribe(self, table: str, handler: InvalidationHandler):
+        """
+        The handler is called with the keys of the rows of the table changed by each commit.
+        """
+        self._handlers[table].append(handler)
+
+    def publish(self, changed_keys: dict[str, list[str]]):
+        for table, keys in changed_keys.items():
+            for handler in self._handlers.get(table, []):
+                handler.invalidate(keys)
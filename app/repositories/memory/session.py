@@ -0,0 +1,204 @@
+"""
+In-memory storage engine for running the services and the whole application without a database, e.g. in fast tests
+and in load tests of the service layer.
+
+It behaves like postgres with the read committed isolation level:
+- Reads see the changes committed before them and the changes of their own transaction.
+- Writing a row and reading it with LockLevel.MODIFY_LOCK lock the row until the transaction is committed or rolled
+  back. Another transaction locking the same row waits, and reads the latest committed value once it gets the lock.
+- Inserting a row whose key is locked by another transaction waits for it, so the unique keys are checked against the
+  committed rows.
+- A transaction that would wait for a lock held by a transaction waiting for it raises DeadlockDetectedError.
+
+The changes are kept in the transaction and applied to the store atomically on commit.
+"""
+
+from collections import defaultdict
+from itertools import count
+from threading import Condition
+from typing import Any, Optional
+
+from app.repositories.base import RepositorySession
+from app.repositories.invalidation import InvalidationPublisher
+
+Row = tuple[str, str]  # (table, key)
+
+
+class DeadlockDetectedError(Exception):
+    pass
+
+
+class MemoryStore(InvalidationPublisher):
+    """
+    Committed rows of the tables, and the row locks of the transactions in progress. Shared by all sessions of the
+    process.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._tables: dict[str, dict[str, Any]] = defaultdict(dict)
+        self._lock_owners: dict[Row, MemoryTransaction] = {}
+        self._waiting_for: dict[MemoryTransaction, Row] = {}
+
+        # Guards all the states above, and is notified when locks are released
+        self._condition = Condition()
+
+        self._sequence = count()
+
+    def next_sequence(self) -> int:
+        return next(self._sequence)
+
+    def clear(self):
+        """
+        Drop all rows. Should not be called while a transaction is in progress.
+        """
+        with self._condition:
+            self._tables.clear()
+
+    def get_committed(self, table: str, key: str) -> Any:
+        with self._condition:
+            return self._tables[table].get(key)
+
+    def scan_committed(self, table: str) -> dict[str, Any]:
+        with self._condition:
+            return dict(self._tables[table])
+
+    def lock(self, transaction: "MemoryTransaction", row: Row):
+        """
+        Wait until the row is not locked by other transactions and lock it for the transaction.
+
+        Raises:
+            DeadlockDetectedError: If the owner of the lock is waiting for the transaction, directly or not.
+        """
+        with self._condition:
+            while True:
+                owner = self._lock_owners.get(row)
+                if owner is transaction:
+                    return
+                if owner is None:
+                    self._lock_owners[row] = transaction
+                    transaction.locked_rows.append(row)
+                    return
+                if self._is_waiting_for(owner, transaction):
+                    raise DeadlockDetectedError(
+                        f"Deadlock detected while locking {row[0]}: {row[1]}"
+                    )
+
+                self._waiting_for[transaction] = row
+                try:
+                    self._condition.wait()
+                finally:
+                    del self._waiting_for[transaction]
+
+    def _is_waiting_for(
+        self, transaction: "MemoryTransaction", target: "MemoryTransaction"
+    ) -> bool:
+        # Each transaction waits for at most one lock, so the waits form chains
+        current: Optional[MemoryTransaction] = transaction
+        while current is not None:
+            if current is target:
+                return True
+            row = self._waiting_for.get(current)
+            current = self._lock_owners.get(row) if row else None
+        return False
+
+    def end(self, transaction: "MemoryTransaction", writes: dict[Row, Any]):
+        """
+        Apply the writes of the transaction, which are empty on rollback, and release its locks.
+        """
+        changed_keys: dict[str, list[str]] = defaultdict(list)
+        with self._condition:
+            for (table, key), value in writes.items():
+                self._tables[table][key] = value
+                changed_keys[table].append(key)
+
+            for row in transaction.locked_rows:
+                del self._lock_owners[row]
+            transaction.locked_rows.clear()
+            self._condition.notify_all()
+
+        self.publish(changed_keys)
+
+
+class MemoryTransaction:
+    """
+    The operator of MemorySession used by the memory repositories. The values are stored as they are, so the
+    repositories should store and return copies of mutable objects.
+    """
+
+    def __init__(self, store: MemoryStore):
+        self.store = store
+        self.locked_rows: list[Row] = []
+        self._writes: dict[Row, Any] = {}
+
+    def get(self, table: str, key: str, lock: bool = False) -> Any:
+        """
+        Return None if the row doesn't exist.
+        """
+        row = (table, key)
+        if lock:
+            self.store.lock(self, row)
+        if row in self._writes:
+            return self._writes[row]
+        return self.store.get_committed(table, key)
+
+    def put(self, table: str, key: str, value: Any):
+        """
+        Insert or update the row.
+        """
+        row = (table, key)
+        self.store.lock(self, row)
+        self._writes[row] = value
+
+    def insert(self, table: str, key: str, value: Any) -> bool:
+        """
+        Return False without writing if the row already exists.
+        """
+        if self.get(table, key, lock=True) is not None:
+            return False
+        self._writes[(table, key)] = value
+        return True
+
+    def scan(self, table: str) -> list[Any]:
+        """
+        Return the values of all rows of the table in no particular order.
+        """
+        rows = self.store.scan_committed(table)
+        for (written_table, key), value in self._writes.items():
+            if written_table == table:
+                rows[key] = value
+        return list(rows.values())
+
+    def commit(self):
+        writes, self._writes = self._writes, {}
+        self.store.end(self, writes)
+
+    def rollback(self):
+        self._writes = {}
+        self.store.end(self, {})
+
+
+class MemorySession(RepositorySession[MemoryTransaction]):
+    """
+    A transaction begins when entering the session and after each commit or rollback, as a postgres connection does.
+    """
+
+    def __init__(self, store: MemoryStore):
+        self.store = store
+
+    def __enter__(self):
+        self._transaction = MemoryTransaction(self.store)
+        return super().__enter__()
+
+    def new_operator(self, operation: str = ""):
+        return self._transaction
+
+    def begin_snapshot(self):
+        # Unlike the other backends, the reads see the latest committed data, so they may be inconsistent with each other
+        pass
+
+    def commit(self):
+        self._transaction.commit()
+
+    def rollback(self):
+        self._transaction.rollback()
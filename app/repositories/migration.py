@@ -1,35 +1,159 @@
-from app.repositories.auth import PostgresAuthRecordRepository
-from app.repositories.order import PostgresOrderRepository
-from app.repositories.postgres.session import PostgresSession
-from app.repositories.product import PostgresProductRepository
-from app.repositories.user import PostgresUserRepository
+from typing import Optional
 
+from app.repositories.auth import (
+    PostgresAuthRecordRepository,
+    ShardedAuthRecordRepository,
+    SqliteAuthRecordRepository,
+)
+from app.repositories.base import RepositorySession
+from app.repositories.memory.session import MemorySession
+from app.repositories.order import PostgresOrderRepository, SqliteOrderRepository
+from app.repositories.postgres.config import OrderPartitionConfig
+from app.repositories.postgres.helper import lock_schema
+from app.repositories.postgres.partitions import (
+    copy_unpartitioned_tables,
+    create_partitions,
+    rename_unpartitioned_tables,
+)
+from app.repositories.product import PostgresProductRepository, SqliteProductRepository
+from app.repositories.sales import PostgresSalesRepository, SqliteSalesRepository
+from app.repositories.sharded.session import (
+    CREATE_COMMITS_TABLE_IF_NOT_EXISTS,
+    DROP_COMMITS_TABLE,
+    ShardedSession,
+)
+from app.repositories.sqlite.session import SqliteSession
+from app.repositories.user import PostgresUserRepository, SqliteUserRepository
 
-def migrate_up(session: PostgresSession):
-    stmts = [
-        PostgresProductRepository.CREATE_TABLE_IF_NOT_EXISTS,
-        PostgresUserRepository.CREATE_TABLE_IF_NOT_EXISTS,
-        PostgresOrderRepository.CREATE_TABLES_IF_NOT_EXISTS,
-        PostgresAuthRecordRepository.CREATE_TABLE_IF_NOT_EXISTS,
-    ]
 
+def migrate_up(session: RepositorySession):
+    if isinstance(session, MemorySession):
+        return  # The tables are created when the first row is written
+    if isinstance(session, SqliteSession):
+        _migrate_sqlite(
+            session,
+            [
+                SqliteProductRepository.CREATE_TABLE_IF_NOT_EXISTS,
+                SqliteUserRepository.CREATE_TABLE_IF_NOT_EXISTS,
+                SqliteOrderRepository.CREATE_TABLES_IF_NOT_EXISTS,
+                SqliteAuthRecordRepository.CREATE_TABLE_IF_NOT_EXISTS,
+                SqliteSalesRepository.CREATE_TABLES_IF_NOT_EXISTS,
+            ],
+        )
+        return
+    if isinstance(session, ShardedSession):
+        _migrate_postgres(
+            session.catalog_session(),
+            [
+                PostgresProductRepository.CREATE_TABLE_IF_NOT_EXISTS,
+                ShardedAuthRecordRepository.CREATE_DIRECTORY_TABLE_IF_NOT_EXISTS,
+                CREATE_COMMITS_TABLE_IF_NOT_EXISTS,
+                PostgresSalesRepository.CREATE_TABLES_IF_NOT_EXISTS,
+            ],
+        )
+        for shard_session in session.shard_sessions():
+            _migrate_postgres(
+                shard_session,
+                [
+                    PostgresUserRepository.CREATE_TABLE_IF_NOT_EXISTS,
+                    PostgresOrderRepository.CREATE_TABLES_IF_NOT_EXISTS,
+                    PostgresAuthRecordRepository.CREATE_TABLE_IF_NOT_EXISTS,
+                ],
+                order_partitions=OrderPartitionConfig.from_env(),
+            )
+        return
+    _migrate_postgres(
+        session,
+        [
+            PostgresProductRepository.CREATE_TABLE_IF_NOT_EXISTS,
+            PostgresUserRepository.CREATE_TABLE_IF_NOT_EXISTS,
+            PostgresOrderRepository.CREATE_TABLES_IF_NOT_EXISTS,
+            PostgresAuthRecordRepository.CREATE_TABLE_IF_NOT_EXISTS,
+            PostgresSalesRepository.CREATE_TABLES_IF_NOT_EXISTS,
+        ],
+        order_partitions=OrderPartitionConfig.from_env(),
+    )
+
+
+def migrate_down(session: RepositorySession):
+    if isinstance(session, MemorySession):
+        session.store.clear()
+        return
+    if isinstance(session, SqliteSession):
+        _migrate_sqlite(
+            session,
+            [
+                SqliteProductRepository.DROP_TABLE,
+                SqliteUserRepository.DROP_TABLE,
+                SqliteOrderRepository.DROP_TABLES,
+                SqliteAuthRecordRepository.DROP_TABLE,
+                SqliteSalesRepository.DROP_TABLES,
+            ],
+        )
+        return
+    if isinstance(session, ShardedSession):
+        _migrate_postgres(
+            session.catalog_session(),
+            [
+                PostgresProductRepository.DROP_TABLE,
+                ShardedAuthRecordRepository.DROP_DIRECTORY_TABLE,
+                DROP_COMMITS_TABLE,
+                PostgresSalesRepository.DROP_TABLES,
+            ],
+        )
+        for shard_session in session.shard_sessions():
+            _migrate_postgres(
+                shard_session,
+                [
+                    PostgresUserRepository.DROP_TABLE,
+                    PostgresOrderRepository.DROP_TABLES,
+                    PostgresAuthRecordRepository.DROP_TABLE,
+                ],
+            )
+        return
+    _migrate_postgres(
+        session,
+        [
+            PostgresProductRepository.DROP_TABLE,
+            PostgresUserRepository.DROP_TABLE,
+            PostgresOrderRepository.DROP_TABLES,
+            PostgresAuthRecordRepository.DROP_TABLE,
+            PostgresSalesRepository.DROP_TABLES,
+        ],
+    )
+
+
+def _migrate_postgres(
+    session: RepositorySession,
+    stmts: list[str],
+    order_partitions: Optional[OrderPartitionConfig] = None,
+):
+    """
+    Args:
+        order_partitions: Given if the statements create the tables of the orders, to create their partitions. The
+            unpartitioned tables of the previous versions are converted first.
+    """
     with session:
-        with session.new_operator() as cur:
+        with session.new_operator("_migrate_postgres") as cur:
+            lock_schema(cur)
+            converting = order_partitions is not None and rename_unpartitioned_tables(
+                cur
+            )
             for stmt in stmts:
                 cur.execute(stmt)
+            if order_partitions is not None:
+                if converting:
+                    copy_unpartitioned_tables(cur)
+                create_partitions(cur, order_partitions.months_ahead)
         session.commit()
 
 
-def migrate_down(session: PostgresSession):
-    stmts = [
-        PostgresProductRepository.DROP_TABLE,
-        PostgresUserRepository.DROP_TABLE,
-        PostgresOrderRepository.DROP_TABLES,
-        PostgresAuthRecordRepository.DROP_TABLE,
-    ]
-
+def _migrate_sqlite(session: SqliteSession, scripts: list[str]):
     with session:
-        with session.new_operator() as cur:
-            for stmt in stmts:
-                cur.execute(stmt)
+        with session.new_operator("_migrate_sqlite") as cur:
+            # Persisted in the database file. Can't be changed within a transaction.
+            cur.execute("PRAGMA journal_mode = WAL;")
+            cur.begin_write()
+            for script in scripts:
+                cur.executescript(script)
         session.commit()
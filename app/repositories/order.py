@@ -1,20 +1,95 @@
 from abc import abstractmethod
-from typing import Callable, TypeAlias, TypeVar
+import sqlite3
+from datetime import datetime
+from typing import Callable, Mapping, NamedTuple, Optional, TypeAlias, TypeVar
 
 from psycopg import Cursor
-import psycopg
+from psycopg.rows import args_row
 
-from app.models.order import Order, OrderItem
+from app.models.order import Order, OrderItem, UserOrderStats
 from app.repositories.base import AbstractRepository
+from app.repositories.config import RepositoryBackend
+from app.repositories.memory.session import MemoryTransaction
+from app.repositories.postgres import rows as postgres_rows
 from app.repositories.err import EntityAlreadyExistsError
+from app.repositories.sharded.session import ShardedOperator
+from app.repositories.sqlite import rows as sqlite_rows
+from app.repositories.sqlite.session import SqliteCursor
 
 Operator = TypeVar("Operator")
 
 
+class OrderItemRow(NamedTuple):
+    """
+    A row of an order joined with one of its items. The rows of the same order are adjacent.
+    """
+
+    order_id: str
+
+    # None if the order has no items
+    product_id: Optional[str]
+    quantity: Optional[int]
+
+
+def build_orders(user_id: str, rows: list[OrderItemRow]) -> list[Order]:
+    """
+    Build the orders from the rows read from the database without validation.
+    """
+    order_items_by_id: dict[str, list[OrderItem]] = {}
+    for order_id, product_id, quantity in rows:
+        order_items = order_items_by_id.setdefault(order_id, [])
+        if product_id is not None and quantity is not None:
+            order_items.append(OrderItem.construct(product_id, quantity))
+
+    return [
+        Order.construct(order_id, user_id, tuple(order_items))
+        for order_id, order_items in order_items_by_id.items()
+    ]
+
+
+def count_order(
+    stats: UserOrderStats,
+    order: Order,
+    unit_prices: Mapping[str, float],
+    created_at: datetime,
+) -> UserOrderStats:
+    """
+    The stats after the order of the user is added.
+    """
+    return UserOrderStats(
+        order_count=stats.order_count + 1,
+        item_count=stats.item_count + _item_count(order),
+        total_spent=stats.total_spent + _spent(order, unit_prices),
+        last_order_at=(
+            created_at
+            if stats.last_order_at is None
+            else max(stats.last_order_at, created_at)
+        ),
+    )
+
+
+def _item_count(order: Order) -> int:
+    return sum(item.quantity for item in order.order_items)
+
+
+def _spent(order: Order, unit_prices: Mapping[str, float]) -> float:
+    return sum(
+        item.quantity * unit_prices[item.product_id]
+        for item in order.order_items
+        if item.product_id in unit_prices
+    )
+
+
 class OrderRepository(AbstractRepository[Operator]):
     @abstractmethod
-    def add(self, order: Order):
+    def add(self, order: Order, unit_prices: Optional[Mapping[str, float]] = None):
         """
+        Also counts the order in the stats of its user, in the same transaction.
+
+        Args:
+            unit_prices: The price paid for a unit of each product of the order, by product id. The items without a
+                price count as nothing spent.
+
         Raises:
             EntityAlreadyExistsError: If order already exists
         """
@@ -30,72 +105,451 @@ class OrderRepository(AbstractRepository[Operator]):
         """
         pass
 
+    def get_item_rows_by_user_id(
+        self, user_id: str, limit: Optional[int] = None, offset: int = 0
+    ) -> list[OrderItemRow]:
+        """
+        Same as get_by_user_id but returns the rows of the orders joined with their items, in the same order, so that
+        they can be encoded without building the Order objects.
+
+        Args:
+            limit: The maximum number of orders, after skipping `offset` orders. All orders if None.
+        """
+        orders = self.get_by_user_id(user_id)[offset:]
+        rows: list[OrderItemRow] = []
+        for order in orders if limit is None else orders[:limit]:
+            if not order.order_items:
+                rows.append(OrderItemRow(order.id, None, None))
+            rows.extend(
+                OrderItemRow(order.id, item.product_id, item.quantity)
+                for item in order.order_items
+            )
+        return rows
+
+    @abstractmethod
+    def get_stats_by_user_id(self, user_id: str) -> UserOrderStats:
+        """
+        The stats maintained by `add`, read without reading the orders. Zeros if the user has no orders. The orders
+        archived with their partitions are not counted.
+        """
+        pass
+
+    @abstractmethod
+    def rebuild_stats(self):
+        """
+        Recompute the stats of all users from their orders, e.g. to repair them after the orders are changed without
+        this repository.
+        """
+        pass
+
 
 OrderRepositoryFactory: TypeAlias = Callable[
-    [Callable[[], Operator]], OrderRepository[Operator]
+    [Callable[[str], Operator]], OrderRepository[Operator]
 ]
 
 
 def order_repository_factory(new_operator):
-    return PostgresOrderRepository(new_operator)
+    match RepositoryBackend.from_env():
+        case RepositoryBackend.POSTGRES:
+            return PostgresOrderRepository(new_operator)
+        case RepositoryBackend.MEMORY:
+            return MemoryOrderRepository(new_operator)
+        case RepositoryBackend.SQLITE:
+            return SqliteOrderRepository(new_operator)
+        case RepositoryBackend.SHARDED_POSTGRES:
+            return ShardedOrderRepository(new_operator)
 
 
 class PostgresOrderRepository(OrderRepository[Cursor]):
+    # The orders and their items are partitioned by the month of creation, and each item stores the created_at of its
+    # order. See app/repositories/postgres/partitions.py. The partitions are created by the migrations.
+    # The orders take the created_at of their keys, which is the time of the insertion rather than of the start of the
+    # transaction, so the orders placed in the same transaction are sorted too.
     CREATE_TABLES_IF_NOT_EXISTS = """
-        CREATE TABLE IF NOT EXISTS orders (
+        CREATE TABLE IF NOT EXISTS order_keys (
             id VARCHAR(36) PRIMARY KEY,
-            user_id VARCHAR(36) NOT NULL,
-            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP NOT NULL DEFAULT clock_timestamp()
         );
+        ALTER TABLE order_keys ALTER COLUMN created_at SET DEFAULT clock_timestamp();
+        CREATE INDEX IF NOT EXISTS order_keys_created_at_idx ON order_keys (created_at);
+        CREATE TABLE IF NOT EXISTS orders (
+            id VARCHAR(36) NOT NULL,
+            user_id VARCHAR(36) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        CREATE TABLE IF NOT EXISTS orders_default PARTITION OF orders DEFAULT;
+        CREATE INDEX IF NOT EXISTS orders_user_id_created_at_idx ON orders (user_id, created_at);
         CREATE TABLE IF NOT EXISTS order_items (
             order_id VARCHAR(36) NOT NULL,
             product_id VARCHAR(36) NOT NULL,
             quantity INT NOT NULL,
+            unit_price NUMERIC,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (order_id, product_id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        CREATE TABLE IF NOT EXISTS order_items_default PARTITION OF order_items DEFAULT;
+        ALTER TABLE order_items ADD COLUMN IF NOT EXISTS unit_price NUMERIC;
+        CREATE TABLE IF NOT EXISTS user_order_stats (
+            user_id VARCHAR(36) PRIMARY KEY,
+            order_count INT NOT NULL,
+            item_count BIGINT NOT NULL,
+            total_spent NUMERIC NOT NULL,
+            last_order_at TIMESTAMP NOT NULL
+        );
+    """
+    DROP_TABLES = """
+        DROP TABLE order_items, orders, order_keys, user_order_stats;
+    """
+
+    # The lock waits for the transactions adding orders to commit and blocks the new ones until the rebuild commits, so
+    # every order is counted once, either by the rebuild or by adding it after the rebuild.
+    REBUILD_STATS = """
+        LOCK TABLE user_order_stats IN EXCLUSIVE MODE;
+        DELETE FROM user_order_stats;
+        INSERT INTO user_order_stats (user_id, order_count, item_count, total_spent, last_order_at)
+        SELECT
+            orders.user_id,
+            count(*),
+            coalesce(sum(items.item_count), 0),
+            coalesce(sum(items.spent), 0),
+            max(orders.created_at)
+        FROM orders
+        LEFT JOIN (
+            SELECT order_id, created_at, sum(quantity) AS item_count, sum(quantity * unit_price) AS spent
+            FROM order_items
+            GROUP BY order_id, created_at
+        ) items ON items.order_id = orders.id AND items.created_at = orders.created_at
+        GROUP BY orders.user_id;
+    """
+
+    def add(self, order: Order, unit_prices: Optional[Mapping[str, float]] = None):
+        # One statement for the key, the order, its items and the stats of the user. The key is inserted first, so the
+        # order is not added if its id is taken, including by an order of another month.
+        unit_prices = unit_prices or {}
+        with self.new_operator("add") as cursor:
+            cursor.execute(
+                """
+                WITH order_key AS (
+                    INSERT INTO order_keys (id) VALUES (%(id)s)
+                    ON CONFLICT (id) DO NOTHING
+                    RETURNING id, created_at
+                ), new_order AS (
+                    INSERT INTO orders (id, user_id, created_at)
+                    SELECT id, %(user_id)s, created_at FROM order_key
+                    RETURNING id, created_at
+                ), new_items AS (
+                    INSERT INTO order_items (order_id, product_id, quantity, unit_price, created_at)
+                    SELECT new_order.id, item.product_id, item.quantity, item.unit_price, new_order.created_at
+                    FROM new_order, unnest(%(product_ids)s::varchar[], %(quantities)s::int[], %(unit_prices)s::numeric[])
+                        AS item (product_id, quantity, unit_price)
+                ), stats AS (
+                    INSERT INTO user_order_stats (user_id, order_count, item_count, total_spent, last_order_at)
+                    SELECT %(user_id)s, 1, %(item_count)s, %(spent)s, created_at FROM new_order
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        order_count = user_order_stats.order_count + 1,
+                        item_count = user_order_stats.item_count + EXCLUDED.item_count,
+                        total_spent = user_order_stats.total_spent + EXCLUDED.total_spent,
+                        last_order_at = GREATEST(user_order_stats.last_order_at, EXCLUDED.last_order_at)
+                )
+                SELECT id FROM new_order;
+                """,
+                {
+                    "id": order.id,
+                    "user_id": order.user_id,
+                    "product_ids": [item.product_id for item in order.order_items],
+                    "quantities": [item.quantity for item in order.order_items],
+                    # psycopg can't dump a list mixing int and float prices
+                    "unit_prices": [
+                        (
+                            float(unit_prices[item.product_id])
+                            if item.product_id in unit_prices
+                            else None
+                        )
+                        for item in order.order_items
+                    ],
+                    "item_count": _item_count(order),
+                    "spent": _spent(order, unit_prices),
+                },
+            )
+            if cursor.fetchone() is None:
+                raise EntityAlreadyExistsError.create("id", order.id)
+
+    def get_by_user_id(self, user_id: str) -> list[Order]:
+        return build_orders(user_id, self.get_item_rows_by_user_id(user_id))
+
+    def get_item_rows_by_user_id(
+        self, user_id: str, limit: Optional[int] = None, offset: int = 0
+    ) -> list[OrderItemRow]:
+        # Fetch the orders with their items in one query instead of querying the items of each order separately
+        with self.new_operator("get_item_rows_by_user_id") as cursor:
+            cursor.row_factory = args_row(OrderItemRow)
+            cursor.execute(
+                """
+                SELECT orders.id, order_items.product_id, order_items.quantity
+                FROM (
+                    SELECT id, created_at FROM orders
+                    WHERE user_id = %(user_id)s
+                    ORDER BY created_at DESC, id
+                    LIMIT %(limit)s OFFSET %(offset)s
+                ) orders
+                LEFT JOIN order_items
+                    ON order_items.order_id = orders.id AND order_items.created_at = orders.created_at
+                ORDER BY orders.created_at DESC, orders.id, order_items.product_id;
+                """,
+                {"user_id": user_id, "limit": limit, "offset": offset},
+                binary=True,
+            )
+            return cursor.fetchall()
+
+    def get_stats_by_user_id(self, user_id: str) -> UserOrderStats:
+        with self.new_operator("get_stats_by_user_id") as cursor:
+            cursor.row_factory = postgres_rows.user_order_stats_row
+            cursor.execute(
+                f"SELECT {postgres_rows.USER_ORDER_STATS_COLUMNS} FROM user_order_stats WHERE user_id = %s;",
+                (user_id,),
+                binary=True,
+            )
+            return cursor.fetchone() or UserOrderStats()
+
+    def rebuild_stats(self):
+        with self.new_operator("rebuild_stats") as cursor:
+            cursor.execute(self.REBUILD_STATS)
+
+
+class MemoryOrderRepository(OrderRepository[MemoryTransaction]):
+    # Values are (sequence of creation, time of creation, order, unit prices by product id). Orders are immutable, so
+    # they are not copied.
+    TABLE = "orders"
+
+    # Index of the ids of the orders of each user
+    USER_ORDERS_TABLE = "user_orders"
+
+    # Values are UserOrderStats, which are immutable
+    STATS_TABLE = "user_order_stats"
+
+    def add(self, order: Order, unit_prices: Optional[Mapping[str, float]] = None):
+        transaction = self.new_operator("add")
+        created_at = datetime.now()
+        unit_prices = dict(unit_prices or {})
+        if not transaction.insert(
+            self.TABLE,
+            order.id,
+            (transaction.store.next_sequence(), created_at, order, unit_prices),
+        ):
+            raise EntityAlreadyExistsError.create("id", order.id)
+
+        order_ids = transaction.get(self.USER_ORDERS_TABLE, order.user_id, lock=True)
+        transaction.put(
+            self.USER_ORDERS_TABLE, order.user_id, (order_ids or ()) + (order.id,)
+        )
+
+        stats = transaction.get(self.STATS_TABLE, order.user_id, lock=True)
+        transaction.put(
+            self.STATS_TABLE,
+            order.user_id,
+            count_order(stats or UserOrderStats(), order, unit_prices, created_at),
+        )
+
+    def get_by_user_id(self, user_id: str) -> list[Order]:
+        transaction = self.new_operator("get_by_user_id")
+        order_ids = transaction.get(self.USER_ORDERS_TABLE, user_id) or ()
+        order_rows = sorted(
+            (transaction.get(self.TABLE, order_id) for order_id in order_ids),
+            key=lambda order_row: order_row[0],
+            reverse=True,
+        )
+        # Same order of items as the postgres implementation
+        return [
+            Order.construct(
+                order.id,
+                order.user_id,
+                tuple(sorted(order.order_items, key=lambda item: item.product_id)),
+            )
+            for _, _, order, _ in order_rows
+        ]
+
+    def get_stats_by_user_id(self, user_id: str) -> UserOrderStats:
+        return (
+            self.new_operator("get_stats_by_user_id").get(self.STATS_TABLE, user_id)
+            or UserOrderStats()
+        )
+
+    def rebuild_stats(self):
+        # Unlike the other backends, the orders added concurrently may be counted twice or not at all
+        transaction = self.new_operator("rebuild_stats")
+        stats_by_user_id: dict[str, UserOrderStats] = {}
+        for _, created_at, order, unit_prices in transaction.scan(self.TABLE):
+            stats_by_user_id[order.user_id] = count_order(
+                stats_by_user_id.get(order.user_id, UserOrderStats()),
+                order,
+                unit_prices,
+                created_at,
+            )
+        for user_id, stats in stats_by_user_id.items():
+            transaction.put(self.STATS_TABLE, user_id, stats)
+
+
+def _sqlite_order_item_row(cursor: sqlite3.Cursor, row: tuple) -> OrderItemRow:
+    return OrderItemRow(*row)
+
+
+class SqliteOrderRepository(OrderRepository[SqliteCursor]):
+    # created_at has millisecond precision. The orders created in the same millisecond are sorted by rowid, i.e. the
+    # order of insertion.
+    CREATE_TABLES_IF_NOT_EXISTS = """
+        CREATE TABLE IF NOT EXISTS orders (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        );
+        CREATE INDEX IF NOT EXISTS orders_user_id_created_at_idx ON orders (user_id, created_at);
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_id TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            unit_price REAL,
             PRIMARY KEY (order_id, product_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS user_order_stats (
+            user_id TEXT PRIMARY KEY,
+            order_count INTEGER NOT NULL,
+            item_count INTEGER NOT NULL,
+            total_spent REAL NOT NULL,
+            last_order_at TEXT NOT NULL
         );
     """
     DROP_TABLES = """
-        DROP TABLE order_items, orders;
+        DROP TABLE order_items;
+        DROP TABLE orders;
+        DROP TABLE user_order_stats;
     """
 
-    def add(self, order: Order):
-        with self.new_operator() as cursor:
+    def add(self, order: Order, unit_prices: Optional[Mapping[str, float]] = None):
+        unit_prices = unit_prices or {}
+        with self.new_operator("add") as cursor:
+            cursor.begin_write()
             try:
                 cursor.execute(
-                    "INSERT INTO orders (id, user_id) VALUES (%s, %s)",
+                    "INSERT INTO orders (id, user_id) VALUES (?, ?);",
                     (order.id, order.user_id),
                 )
-            except psycopg.errors.UniqueViolation:
+            except sqlite3.IntegrityError:
                 raise EntityAlreadyExistsError.create("id", order.id)
 
-            for item in order.order_items:
-                cursor.execute(
-                    "INSERT INTO order_items (order_id, product_id, quantity) VALUES (%s, %s, %s)",
-                    (order.id, item.product_id, item.quantity),
-                )
+            cursor.executemany(
+                "INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?);",
+                [
+                    (
+                        order.id,
+                        item.product_id,
+                        item.quantity,
+                        unit_prices.get(item.product_id),
+                    )
+                    for item in order.order_items
+                ],
+            )
+            cursor.execute(
+                """
+                INSERT INTO user_order_stats (user_id, order_count, item_count, total_spent, last_order_at)
+                SELECT user_id, 1, ?, ?, created_at FROM orders WHERE id = ?
+                ON CONFLICT (user_id) DO UPDATE SET
+                    order_count = order_count + 1,
+                    item_count = item_count + excluded.item_count,
+                    total_spent = total_spent + excluded.total_spent,
+                    last_order_at = max(last_order_at, excluded.last_order_at);
+                """,
+                (_item_count(order), _spent(order, unit_prices), order.id),
+            )
 
     def get_by_user_id(self, user_id: str) -> list[Order]:
-        orders = []
-        with self.new_operator() as cursor:
+        return build_orders(user_id, self.get_item_rows_by_user_id(user_id))
+
+    def get_item_rows_by_user_id(
+        self, user_id: str, limit: Optional[int] = None, offset: int = 0
+    ) -> list[OrderItemRow]:
+        with self.new_operator("get_item_rows_by_user_id") as cursor:
+            cursor.row_factory = _sqlite_order_item_row
+            # A negative limit is no limit
             cursor.execute(
-                "SELECT id, created_at FROM orders WHERE user_id = %s ORDER BY created_at DESC;",
-                (user_id,),
+                """
+                SELECT orders.id, order_items.product_id, order_items.quantity
+                FROM (
+                    SELECT id, created_at, rowid AS sequence FROM orders
+                    WHERE user_id = ?
+                    ORDER BY created_at DESC, rowid DESC
+                    LIMIT ? OFFSET ?
+                ) orders
+                LEFT JOIN order_items ON order_items.order_id = orders.id
+                ORDER BY orders.created_at DESC, orders.sequence DESC, order_items.product_id;
+                """,
+                (user_id, -1 if limit is None else limit, offset),
             )
-            order_rows = cursor.fetchall()
-            for order_id, _ in order_rows:
-                order_items = self._get_order_items(order_id)
-                orders.append(
-                    Order(id=order_id, user_id=user_id, order_items=order_items)
-                )
-            return orders
+            return cursor.fetchall()
 
-    def _get_order_items(self, order_id) -> tuple[OrderItem, ...]:
-        with self.new_operator() as cursor:
+    def get_stats_by_user_id(self, user_id: str) -> UserOrderStats:
+        with self.new_operator("get_stats_by_user_id") as cursor:
+            cursor.row_factory = sqlite_rows.user_order_stats_row
             cursor.execute(
-                "SELECT product_id, quantity FROM order_items WHERE order_id = %s",
-                (order_id,),
+                f"SELECT {sqlite_rows.USER_ORDER_STATS_COLUMNS} FROM user_order_stats WHERE user_id = ?;",
+                (user_id,),
             )
-            return tuple(
-                OrderItem(product_id, quantity)
-                for product_id, quantity in cursor.fetchall()
+            return cursor.fetchone() or UserOrderStats()
+
+    def rebuild_stats(self):
+        with self.new_operator("rebuild_stats") as cursor:
+            # The write transaction blocks the orders being added until the rebuild commits
+            cursor.begin_write()
+            cursor.execute("DELETE FROM user_order_stats;")
+            cursor.execute(
+                """
+                INSERT INTO user_order_stats (user_id, order_count, item_count, total_spent, last_order_at)
+                SELECT
+                    orders.user_id,
+                    count(*),
+                    coalesce(sum(items.item_count), 0),
+                    coalesce(sum(items.spent), 0),
+                    max(orders.created_at)
+                FROM orders
+                LEFT JOIN (
+                    SELECT order_id, sum(quantity) AS item_count, sum(quantity * unit_price) AS spent
+                    FROM order_items
+                    GROUP BY order_id
+                ) items ON items.order_id = orders.id
+                GROUP BY orders.user_id;
+                """
             )
+
+
+class ShardedOrderRepository(OrderRepository[ShardedOperator]):
+    """
+    The orders and their items are stored in the shard of their user with the stats of the user, so the orders of a
+    user are read from one node.
+    """
+
+    def add(self, order: Order, unit_prices: Optional[Mapping[str, float]] = None):
+        operator = self.new_operator("add")
+        PostgresOrderRepository(lambda _: operator.user_shard(order.user_id)).add(
+            order, unit_prices
+        )
+
+    def get_by_user_id(self, user_id: str) -> list[Order]:
+        return build_orders(user_id, self.get_item_rows_by_user_id(user_id))
+
+    def get_item_rows_by_user_id(
+        self, user_id: str, limit: Optional[int] = None, offset: int = 0
+    ) -> list[OrderItemRow]:
+        operator = self.new_operator("get_item_rows_by_user_id")
+        return PostgresOrderRepository(
+            lambda _: operator.user_shard(user_id)
+        ).get_item_rows_by_user_id(user_id, limit, offset)
+
+    def get_stats_by_user_id(self, user_id: str) -> UserOrderStats:
+        operator = self.new_operator("get_stats_by_user_id")
+        return PostgresOrderRepository(
+            lambda _: operator.user_shard(user_id)
+        ).get_stats_by_user_id(user_id)
+
+    def rebuild_stats(self):
+        for cursor in self.new_operator("rebuild_stats").shards():
+            PostgresOrderRepository(lambda _: cursor).rebuild_stats()
@@ -20,3 +20,15 @@ class PostgresConfig:
         return PostgresConfig(
             host=host, port=port, user=user, password=password, database=database
         )
+
+
+@dataclass(frozen=True)
+class OrderPartitionConfig:
+    # The migrations create the monthly partitions of the orders up to this number of months after the current one
+    months_ahead: int
+
+    @staticmethod
+    def from_env():
+        return OrderPartitionConfig(
+            months_ahead=int(os.getenv("ORDER_PARTITION_MONTHS_AHEAD", "3"))
+        )
@@ -1,5 +1,10 @@
+from psycopg import Cursor
+
 from app.repositories.base import LockLevel
 
+# Key of the advisory lock of the transactions changing the schema
+SCHEMA_LOCK_KEY = 0x5343
+
 
 def select_query_helper(query: str, lock_level: LockLevel):
     query = query.strip(";")
@@ -12,3 +17,11 @@ def select_query_helper(query: str, lock_level: LockLevel):
 
     query += ";"
     return query
+
+
+def lock_schema(cur: Cursor):
+    """
+    Wait until the other transactions changing the schema end, e.g. of the servers migrating as they start together, and
+    keep them waiting until the end of the current transaction.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(%s);", (SCHEMA_LOCK_KEY,))
@@ -0,0 +1,75 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Callable, Iterator
+
+import psycopg
+
+from app.repositories.postgres.notification import ChangedKeys, NotifyingCursor
+
+
+@dataclass(frozen=True)
+class StatementRecord:
+    operation: str  # Given to the new_operator of the session, e.g. PostgresUserRepository.get_by_id
+    duration_seconds: float
+    rows: int
+
+    # The whole duration of the statements acquiring row locks (FOR UPDATE), including the time to execute them and
+    # transfer their rows besides waiting for the locks, as the wait alone is not reported by postgres. An upper bound
+    # of the lock wait, which is most of it when there is contention. See LockWaitMonitor for the wait itself.
+    locking_seconds: float
+
+
+StatementObserver = Callable[[StatementRecord], None]
+
+
+class InstrumentedCursor(NotifyingCursor):
+    """
+    Cursor reporting every statement it executes to the observers.
+    """
+
+    def __init__(
+        self,
+        connection: psycopg.Connection,
+        changed_keys: ChangedKeys,
+        operation: str,
+        observers: list[StatementObserver],
+    ):
+        super().__init__(connection, changed_keys)
+        self._operation = operation
+        self._observers = observers
+
+    def execute(self, query, params=None, *, prepare=None, binary=None):
+        start = perf_counter()
+        try:
+            return super().execute(query, params, prepare=prepare, binary=binary)
+        finally:
+            self._record(query, start)
+
+    def executemany(self, query, params_seq, *, returning=False):
+        start = perf_counter()
+        try:
+            return super().executemany(query, params_seq, returning=returning)
+        finally:
+            self._record(query, start)
+
+    @contextmanager
+    def copy(self, statement, params=None, *, writer=None) -> Iterator[psycopg.Copy]:
+        start = perf_counter()
+        try:
+            with super().copy(statement, params, writer=writer) as copy:
+                yield copy
+        finally:
+            self._record(statement, start)
+
+    def _record(self, query, start: float):
+        duration_seconds = perf_counter() - start
+        is_locking = isinstance(query, str) and "FOR UPDATE" in query
+        record = StatementRecord(
+            operation=self._operation,
+            duration_seconds=duration_seconds,
+            rows=max(self.rowcount, 0),
+            locking_seconds=duration_seconds if is_locking else 0,
+        )
+        for observer in self._observers:
+            observer(record)
@@ -0,0 +1,110 @@
+from collections import defaultdict
+import logging
+import select
+from threading import Event, Thread
+from typing import Iterable, Protocol
+
+import psycopg
+
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.notification import (
+    ALL_ENTITIES,
+    INVALIDATION_CHANNEL,
+    parse_invalidation_payload,
+)
+from app.repositories.postgres.session import new_postgres_conn
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidationHandler(Protocol):
+    def invalidate(self, entity_ids: Iterable[str]):
+        pass
+
+    def clear(self):
+        pass
+
+
+class PostgresInvalidationListener:
+    """
+    Listens to the notifications published by the postgres sessions when the changes of their repositories are
+    committed, and evicts the changed entities from the subscribed handlers (e.g. in-process caches).
+
+    Notifications sent while the listener is disconnected are lost, so every handler is cleared on each (re)connect.
+    """
+
+    def __init__(
+        self,
+        config: PostgresConfig,
+        poll_interval_seconds: float = 1,
+        reconnect_delay_seconds: float = 1,
+    ):
+        self._config = config
+        self._poll_interval_seconds = poll_interval_seconds
+        self._reconnect_delay_seconds = reconnect_delay_seconds
+        self._handlers: dict[str, list[InvalidationHandler]] = defaultdict(list)
+        self._listening = Event()
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def subscribe(self, table: str, handler: InvalidationHandler):
+        """
+        Should be called before `start`.
+        """
+        self._handlers[table].append(handler)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def wait_until_listening(self, timeout: float) -> bool:
+        return self._listening.wait(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except psycopg.OperationalError:
+                logger.exception("Lost connection for cache invalidation, reconnecting")
+            finally:
+                self._listening.clear()
+            self._stopped.wait(self._reconnect_delay_seconds)
+
+    def _listen(self):
+        payloads: list[str] = []
+        with new_postgres_conn(self._config, autocommit=True) as conn:
+            conn.add_notify_handler(lambda notify: payloads.append(notify.payload))
+            conn.execute(f"LISTEN {INVALIDATION_CHANNEL};")
+
+            self._clear_all()
+            self._listening.set()
+
+            while not self._stopped.is_set():
+                readable, _, _ = select.select(
+                    [conn.fileno()], [], [], self._poll_interval_seconds
+                )
+                if readable:
+                    conn.execute("SELECT 1;")  # Let psycopg consume the notifications
+                    self._dispatch(payloads)
+                    payloads.clear()
+
+    def _clear_all(self):
+        for handlers in self._handlers.values():
+            for handler in handlers:
+                handler.clear()
+
+    def _dispatch(self, payloads: list[str]):
+        entity_ids_by_table: dict[str, set[str]] = defaultdict(set)
+        for payload in payloads:
+            for table, entity_id in parse_invalidation_payload(payload):
+                entity_ids_by_table[table].add(entity_id)
+
+        for table, entity_ids in entity_ids_by_table.items():
+            for handler in self._handlers.get(table, []):
+                if ALL_ENTITIES in entity_ids:
+                    handler.clear()
+                else:
+                    handler.invalidate(entity_ids)
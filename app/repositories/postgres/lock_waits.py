@@ -0,0 +1,84 @@
+import logging
+from threading import Event, Thread
+import time
+
+import psycopg
+
+from app.lock_waits import BlockedSession, BlockingSample, LockWaitMonitor
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.session import new_postgres_conn
+
+logger = logging.getLogger(__name__)
+
+SELECT_BLOCKED_SESSIONS = """
+    SELECT
+        blocked.pid,
+        EXTRACT(EPOCH FROM now() - blocked.query_start)::float8,
+        blocked.wait_event,
+        waiting_lock.relation::regclass::text,
+        blocked.query,
+        blocking.pid,
+        blocking.state,
+        EXTRACT(EPOCH FROM now() - blocking.xact_start)::float8,
+        blocking.query
+    FROM pg_stat_activity AS blocked
+    CROSS JOIN LATERAL unnest(pg_blocking_pids(blocked.pid)) AS blocking_pid
+    JOIN pg_stat_activity AS blocking ON blocking.pid = blocking_pid
+    LEFT JOIN pg_locks AS waiting_lock
+        ON waiting_lock.pid = blocked.pid AND NOT waiting_lock.granted
+    WHERE blocked.datname = current_database() AND blocked.wait_event_type = 'Lock'
+    ORDER BY blocked.query_start;
+"""
+
+
+class PostgresBlockingSampler:
+    """
+    Samples the sessions waiting for locks from pg_stat_activity and pg_locks, together with the sessions blocking
+    them, while a lock acquisition tracked by the monitor has been pending for longer than the threshold.
+    """
+
+    def __init__(
+        self,
+        config: PostgresConfig,
+        monitor: LockWaitMonitor,
+        reconnect_delay_seconds: float = 1,
+    ):
+        self._config = config
+        self._monitor = monitor
+        self._reconnect_delay_seconds = reconnect_delay_seconds
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._sample_until_stopped()
+            except psycopg.OperationalError:
+                logger.exception("Lost connection for sampling locks, reconnecting")
+            self._stopped.wait(self._reconnect_delay_seconds)
+
+    def _sample_until_stopped(self):
+        monitor_config = self._monitor.config
+        with new_postgres_conn(self._config, autocommit=True) as conn:
+            while not self._stopped.wait(monitor_config.sample_interval_seconds):
+                pending_waits = self._monitor.pending_waits(
+                    monitor_config.sample_after_seconds
+                )
+                if not pending_waits:
+                    continue
+
+                rows = conn.execute(SELECT_BLOCKED_SESSIONS).fetchall()
+                self._monitor.add_sample(
+                    BlockingSample(
+                        taken_at=time.time(),
+                        pending_waits=pending_waits,
+                        blocked_sessions=[BlockedSession(*row) for row in rows],
+                    )
+                )
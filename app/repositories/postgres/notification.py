@@ -0,0 +1,85 @@
+from collections import defaultdict
+from typing import Iterable
+
+import psycopg
+
+INVALIDATION_CHANNEL = "entity_invalidation"
+ALL_ENTITIES = "*"
+
+# Postgres rejects payloads of 8000 bytes or longer
+MAX_PAYLOAD_BYTES = 7999
+
+ChangedKeys = dict[str, set[str]]
+
+
+def new_changed_keys() -> ChangedKeys:
+    return defaultdict(set)
+
+
+def invalidation_payload_prefix(table: str):
+    """
+    Each line of a payload is `<table>:<entity id>`. `<table>:*` means all entities of that table should be invalidated.
+    """
+    return f"{table}:"
+
+
+def invalidation_payload(changed_keys: ChangedKeys) -> str:
+    """
+    One payload for all the entities changed by a transaction. If it would be too long, all entities of the changed
+    tables are invalidated instead.
+    """
+    payload = "\n".join(
+        invalidation_payload_prefix(table) + key
+        for table, keys in sorted(changed_keys.items())
+        for key in sorted(keys)
+    )
+    if len(payload.encode()) <= MAX_PAYLOAD_BYTES:
+        return payload
+    return "\n".join(
+        invalidation_payload_prefix(table) + ALL_ENTITIES
+        for table in sorted(changed_keys)
+    )
+
+
+def parse_invalidation_payload(payload: str) -> list[tuple[str, str]]:
+    """
+    Return the (table, entity id) of each line
+    """
+    pairs = []
+    for line in payload.split("\n"):
+        table, _, entity_id = line.partition(":")
+        pairs.append((table, entity_id))
+    return pairs
+
+
+class NotifyingCursor(psycopg.Cursor):
+    """
+    Cursor collecting the entities changed in the transaction, which its session publishes with one notification when
+    committing.
+    """
+
+    def __init__(self, connection: psycopg.Connection, changed_keys: ChangedKeys):
+        super().__init__(connection)
+        self._changed_keys = changed_keys
+
+    def notify_changed(self, table: str, keys: Iterable[str]):
+        """
+        The listeners are notified of the keys after the transaction is committed.
+        """
+        self._changed_keys[table].update(keys)
+
+
+def notify_changed_keys(conn: psycopg.Connection, changed_keys: ChangedKeys):
+    """
+    Should be called in the transaction right before committing it, so that the listeners get the notification only
+    if it is committed. Postgres serializes the commits of the transactions which sent a notification, so the changes
+    are sent once however many statements made them.
+    """
+    if not changed_keys:
+        return
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT pg_notify(%s, %s);",
+            (INVALIDATION_CHANNEL, invalidation_payload(changed_keys)),
+        )
+    changed_keys.clear()
@@ -0,0 +1,227 @@
+"""
+Monthly partitions of the orders and their items, by `created_at`.
+
+Each item stores the `created_at` of its order, so an order and its items are in the partitions of the same month, and
+the partitions of a month can be archived and dropped together instead of deleting millions of rows. The partitions are
+named `<table>_YYYY_MM`. The rows of the months without partitions are stored in the default partitions
+`<table>_default`, and are moved out when the partitions of their months are created.
+
+The primary key of a partitioned table must include the partition key, so it can't keep the ids of the orders unique
+across the months. `order_keys` keeps the id of every order for that purpose.
+"""
+
+from datetime import date
+import re
+from typing import Optional
+
+from psycopg import Cursor, sql
+
+from app.repositories.postgres.helper import lock_schema
+
+PARTITIONED_TABLES = ("orders", "order_items")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+def partition_months(cur: Cursor, table: str) -> list[date]:
+    """
+    The first days of the months of the partitions of the table, in ascending order. The default partition is excluded.
+    """
+    cur.execute(
+        """
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = %s::regclass;
+        """,
+        (table,),
+    )
+    pattern = re.compile(rf"{table}_(\d{{4}})_(\d{{2}})")
+    months = []
+    for (name,) in cur.fetchall():
+        match = pattern.fullmatch(name)
+        if match:
+            months.append(date(int(match[1]), int(match[2]), 1))
+    return sorted(months)
+
+
+def create_partitions(
+    cur: Cursor, months_ahead: int, since: Optional[date] = None
+) -> list[str]:
+    """
+    Create the missing partitions of the months from the month of `since` (the current month by default) to
+    `months_ahead` months after the current month, and of the months of the rows in the default partitions, which are
+    moved to them.
+
+    Returns:
+        The names of the created partitions.
+    """
+    # The existing partitions are read after the lock, so the partitions created by a concurrent transaction are seen
+    lock_schema(cur)
+    [(today,)] = cur.execute("SELECT CURRENT_DATE;").fetchall()
+    current_month = today.replace(day=1)
+    first_month = min(since.replace(day=1), current_month) if since else current_month
+
+    months = {
+        add_months(first_month, offset)
+        for offset in range(
+            _months_between(first_month, current_month) + months_ahead + 1
+        )
+    }
+    for table in PARTITIONED_TABLES:
+        cur.execute(
+            sql.SQL(
+                "SELECT DISTINCT date_trunc('month', created_at)::date FROM {};"
+            ).format(sql.Identifier(f"{table}_default"))
+        )
+        months.update(month for (month,) in cur.fetchall())
+
+    created = []
+    for table in PARTITIONED_TABLES:
+        existing_months = set(partition_months(cur, table))
+        for month in sorted(months - existing_months):
+            _create_partition(cur, table, month)
+            created.append(partition_name(table, month))
+    return created
+
+
+def _create_partition(cur: Cursor, table: str, month: date):
+    name = sql.Identifier(partition_name(table, month))
+    start, end = month, add_months(month, 1)
+
+    # Attaching a table is the only way to create a partition overlapping rows of the default partition, after moving
+    # them. The indexes of the partitioned table are created on the table when it's attached.
+    cur.execute(
+        sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS);").format(
+            name, sql.Identifier(table)
+        )
+    )
+    cur.execute(
+        sql.SQL(
+            """
+            WITH moved AS (
+                DELETE FROM {} WHERE created_at >= %s AND created_at < %s RETURNING *
+            )
+            INSERT INTO {} SELECT * FROM moved;
+            """
+        ).format(sql.Identifier(f"{table}_default"), name),
+        (start, end),
+    )
+    cur.execute(
+        sql.SQL(
+            "ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM ({}) TO ({});"
+        ).format(
+            sql.Identifier(table),
+            name,
+            sql.Literal(start.isoformat()),
+            sql.Literal(end.isoformat()),
+        )
+    )
+
+
+def rename_unpartitioned_tables(cur: Cursor) -> bool:
+    """
+    Rename the unpartitioned tables of the orders and their items of the previous versions, with their indexes, so
+    that the partitioned tables can be created. They are copied to them and dropped by copy_unpartitioned_tables.
+
+    Returns:
+        Whether the unpartitioned tables exist.
+    """
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('orders');")
+    row = cur.fetchone()
+    if row is None or row[0] == "p":
+        return False
+    cur.execute(
+        """
+        ALTER TABLE orders RENAME TO unpartitioned_orders;
+        ALTER INDEX orders_pkey RENAME TO unpartitioned_orders_pkey;
+        ALTER INDEX IF EXISTS orders_user_id_created_at_idx RENAME TO unpartitioned_orders_user_id_created_at_idx;
+        ALTER TABLE order_items RENAME TO unpartitioned_order_items;
+        ALTER INDEX order_items_pkey RENAME TO unpartitioned_order_items_pkey;
+        """
+    )
+    return True
+
+
+def copy_unpartitioned_tables(cur: Cursor):
+    """
+    Copy the rows of the tables renamed by rename_unpartitioned_tables to the partitioned tables and drop them. The
+    partitions of their months are created first, so the rows are written once.
+    """
+    [(oldest,)] = cur.execute(
+        "SELECT min(created_at)::date FROM unpartitioned_orders;"
+    ).fetchall()
+    if oldest is not None:
+        create_partitions(cur, months_ahead=0, since=oldest)
+    cur.execute(
+        """
+        INSERT INTO order_keys (id, created_at)
+        SELECT id, created_at FROM unpartitioned_orders;
+        INSERT INTO orders (id, user_id, created_at)
+        SELECT id, user_id, created_at FROM unpartitioned_orders;
+        INSERT INTO order_items (order_id, product_id, quantity, created_at)
+        SELECT order_items.order_id, order_items.product_id, order_items.quantity, orders.created_at
+        FROM unpartitioned_order_items order_items
+        JOIN unpartitioned_orders orders ON orders.id = order_items.order_id;
+        DROP TABLE unpartitioned_order_items, unpartitioned_orders;
+        """
+    )
+
+
+def drop_partitions(cur: Cursor, month: date):
+    """
+    Detach and drop the partitions of the month, and delete the keys of their orders. Their orders are subtracted from
+    the stats of their users, so the stats only count the orders kept in the database, as rebuilding them does. The
+    stats of the users without orders left are deleted.
+    """
+    lock_schema(cur)
+    orders, order_items = (
+        sql.Identifier(partition_name(table, month)) for table in PARTITIONED_TABLES
+    )
+    # The last order of a user with orders left is in a later month, as the months are archived from the oldest
+    cur.execute(
+        sql.SQL(
+            """
+            UPDATE user_order_stats stats SET
+                order_count = stats.order_count - archived.order_count,
+                item_count = stats.item_count - archived.item_count,
+                total_spent = stats.total_spent - archived.spent
+            FROM (
+                SELECT orders.user_id, count(*) AS order_count, coalesce(sum(items.item_count), 0) AS item_count,
+                    coalesce(sum(items.spent), 0) AS spent
+                FROM {} orders
+                LEFT JOIN (
+                    SELECT order_id, sum(quantity) AS item_count, coalesce(sum(quantity * unit_price), 0) AS spent
+                    FROM {}
+                    GROUP BY order_id
+                ) items ON items.order_id = orders.id
+                GROUP BY orders.user_id
+            ) archived
+            WHERE stats.user_id = archived.user_id;
+            """
+        ).format(orders, order_items)
+    )
+    cur.execute("DELETE FROM user_order_stats WHERE order_count <= 0;")
+    for table in PARTITIONED_TABLES:
+        name = sql.Identifier(partition_name(table, month))
+        cur.execute(
+            sql.SQL("ALTER TABLE {} DETACH PARTITION {};").format(
+                sql.Identifier(table), name
+            )
+        )
+        cur.execute(sql.SQL("DROP TABLE {};").format(name))
+    cur.execute(
+        "DELETE FROM order_keys WHERE created_at >= %s AND created_at < %s;",
+        (month, add_months(month, 1)),
+    )
+
+
+def _months_between(start: date, end: date) -> int:
+    return (end.year - start.year) * 12 + end.month - start.month
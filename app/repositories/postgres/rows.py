@@ -0,0 +1,30 @@
+"""
+Row factories building the domain objects directly from the result sets, together with the columns each of them
+expects. They are set as the `row_factory` of the cursors and the results are fetched in binary format, so the values
+are decoded by psycopg in C and the repositories don't index the rows.
+
+The NUMERIC columns are selected as float8 because the models use float, so they are not decoded as Decimal first.
+
+The rows of the orders are mapped in PostgresOrderRepository, as OrderItemRow is defined with it.
+"""
+
+from psycopg.rows import RowFactory, kwargs_row
+
+from app.models.auth import AuthRecord
+from app.models.order import UserOrderStats
+from app.models.product import Product
+from app.models.user import User
+
+PRODUCT_COLUMNS = "id, name, category, price::float8 AS price, quantity"
+product_row: RowFactory[Product] = kwargs_row(Product)
+
+USER_COLUMNS = "id, balance::float8 AS balance"
+user_row: RowFactory[User] = kwargs_row(User)
+
+AUTH_RECORD_COLUMNS = "user_id, username, hashed_password"
+auth_record_row: RowFactory[AuthRecord] = kwargs_row(AuthRecord)
+
+USER_ORDER_STATS_COLUMNS = (
+    "order_count, item_count, total_spent::float8 AS total_spent, last_order_at"
+)
+user_order_stats_row: RowFactory[UserOrderStats] = kwargs_row(UserOrderStats)
@@ -1,14 +1,37 @@
+from typing import Sequence
 import psycopg
 from app.repositories.base import RepositorySession
 from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.instrumentation import (
+    InstrumentedCursor,
+    StatementObserver,
+)
+from app.repositories.postgres.notification import (
+    NotifyingCursor,
+    new_changed_keys,
+    notify_changed_keys,
+)
+
+# The snapshot of a repeatable read transaction is taken at its first query
+SET_SNAPSHOT_TRANSACTION = "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"
 
 
 class PostgresSession(RepositorySession):
-    def __init__(self, config: PostgresConfig):
+    def __init__(
+        self,
+        config: PostgresConfig,
+        statement_observers: Sequence[StatementObserver] = (),
+    ):
+        """
+        Args:
+            statement_observers: Called with the record of each statement executed by the operators of this session.
+        """
         self._config = config
+        self._statement_observers = list(statement_observers)
 
     def __enter__(self):
         self._conn = self._new_postgres_conn()
+        self._changed_keys = new_changed_keys()
         return super().__enter__()
 
     def __exit__(self, *args):
@@ -16,19 +39,36 @@ class PostgresSession(RepositorySession):
         self._conn.close()
 
     def _new_postgres_conn(self):
-        return psycopg.connect(
-            host=self._config.host,
-            user=self._config.user,
-            password=self._config.password,
-            dbname=self._config.database,
-            port=self._config.port,
+        return new_postgres_conn(self._config)
+
+    def add_statement_observer(self, observer: StatementObserver):
+        self._statement_observers.append(observer)
+
+    def new_operator(self, operation: str = ""):
+        if not self._statement_observers:
+            return NotifyingCursor(self._conn, self._changed_keys)
+        return InstrumentedCursor(
+            self._conn, self._changed_keys, operation, self._statement_observers
         )
 
-    def new_operator(self):
-        return self._conn.cursor()
+    def begin_snapshot(self):
+        self._conn.execute(SET_SNAPSHOT_TRANSACTION)
 
     def commit(self):
+        notify_changed_keys(self._conn, self._changed_keys)
         self._conn.commit()
 
     def rollback(self):
+        self._changed_keys.clear()
         self._conn.rollback()
+
+
+def new_postgres_conn(config: PostgresConfig, autocommit: bool = False):
+    return psycopg.connect(
+        host=config.host,
+        user=config.user,
+        password=config.password,
+        dbname=config.database,
+        port=config.port,
+        autocommit=autocommit,
+    )
@@ -1,19 +1,51 @@
 from abc import abstractmethod
-from typing import Callable, TypeAlias, TypeVar
-
-from psycopg import Cursor
+from dataclasses import dataclass
+import re
+from typing import Callable, Iterable, Optional, TypeAlias, TypeVar
 
 from app.models.product import Product
 from app.repositories.err import EntityNotFoundError
 from app.repositories.base import AbstractRepository, LockLevel
+from app.repositories.config import RepositoryBackend
+from app.repositories.memory.session import MemoryTransaction
 from app.repositories.postgres.helper import select_query_helper
+from app.repositories.postgres.rows import PRODUCT_COLUMNS, product_row
+from app.repositories.postgres.notification import NotifyingCursor
+from app.repositories.sharded.session import ShardedOperator
+from app.repositories.sqlite import rows as sqlite_rows
+from app.repositories.sqlite.session import SqliteCursor
 
 Operator = TypeVar("Operator")
 
 
+@dataclass(frozen=True)
+class ProductSearchQuery:
+    text: Optional[str] = None  # Match the words in product name
+    category: Optional[str] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    in_stock: bool = False
+    limit: int = 20
+
+    # The id of the last product of the previous page, to get the next page (keyset pagination)
+    after_id: Optional[str] = None
+
+
 class ProductRepository(AbstractRepository[Operator]):
     @abstractmethod
     def save(self, product: Product):
+        """
+        Save a product, e.g. with the stock left after an order. The change is published to the caches of all
+        processes when committed, together with the other products changed by the transaction.
+        """
+        pass
+
+    @abstractmethod
+    def save_many(self, products: Iterable[Product]):
+        """
+        Save products in bulk, e.g. to change the catalog or restock. If the same product id appears more than once,
+        the last one wins. The change is published to the caches of all processes when committed.
+        """
         pass
 
     @abstractmethod
@@ -26,17 +58,50 @@ class ProductRepository(AbstractRepository[Operator]):
         """
         pass
 
+    @abstractmethod
+    def get_page(
+        self,
+        limit: int,
+        after_id: Optional[str] = None,
+        category: Optional[str] = None,
+    ) -> list[Product]:
+        """
+        Retrieves at most `limit` products sorted by id, starting after the product with `after_id` if provided.
+
+        Passing the id of the last product of a page as `after_id` retrieves the next page (keyset pagination).
+        """
+        pass
+
+    @abstractmethod
+    def search(self, query: ProductSearchQuery) -> list[Product]:
+        """
+        Retrieves at most `query.limit` products matching all the criteria of the query, starting after the product
+        with `query.after_id` if provided.
+
+        If `query.text` is provided, the results are sorted by relevance to it. Otherwise, they are sorted by price ascending.
+        The ties are sorted by id.
+        """
+        pass
+
 
 ProductRepositoryFactory: TypeAlias = Callable[
-    [Callable[[], Operator]], ProductRepository[Operator]
+    [Callable[[str], Operator]], ProductRepository[Operator]
 ]
 
 
 def product_repository_factory(new_operator):
-    return PostgresProductRepository(new_operator)
+    match RepositoryBackend.from_env():
+        case RepositoryBackend.POSTGRES:
+            return PostgresProductRepository(new_operator)
+        case RepositoryBackend.MEMORY:
+            return MemoryProductRepository(new_operator)
+        case RepositoryBackend.SQLITE:
+            return SqliteProductRepository(new_operator)
+        case RepositoryBackend.SHARDED_POSTGRES:
+            return ShardedProductRepository(new_operator)
 
 
-class PostgresProductRepository(ProductRepository[Cursor]):
+class PostgresProductRepository(ProductRepository[NotifyingCursor]):
     CREATE_TABLE_IF_NOT_EXISTS = """
         CREATE TABLE IF NOT EXISTS products (
             id VARCHAR PRIMARY KEY,
@@ -44,20 +109,32 @@ class PostgresProductRepository(ProductRepository[Cursor]):
             category VARCHAR NOT NULL,
             price NUMERIC,
             quantity INTEGER
-        );  
+        );
+        CREATE INDEX IF NOT EXISTS products_category_id_idx ON products (category, id);
+        CREATE INDEX IF NOT EXISTS products_category_price_idx ON products (category, price);
+        CREATE INDEX IF NOT EXISTS products_name_search_idx ON products USING GIN (to_tsvector('simple', name));
+        CREATE INDEX IF NOT EXISTS products_price_id_idx ON products (price, id);
+        CREATE INDEX IF NOT EXISTS products_in_stock_price_id_idx ON products (price, id) WHERE quantity > 0;
     """
     DROP_TABLE = """
         DROP TABLE products;
     """
 
+    # Temporary table only visible to the current connection and dropped at the end of the transaction
+    CREATE_STAGING_TABLE_IF_NOT_EXISTS = """
+        CREATE TEMP TABLE IF NOT EXISTS products_staging
+        (LIKE products INCLUDING DEFAULTS)
+        ON COMMIT DROP;
+    """
+
     def save(self, product: Product):
-        with self.new_operator() as cur:
+        with self.new_operator("save") as cur:
             cur.execute(
                 """
                     INSERT INTO products (id, name, category, price, quantity)
                     VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (id) 
-                    DO UPDATE SET 
+                    ON CONFLICT (id)
+                    DO UPDATE SET
                         name = EXCLUDED.name,
                         category = EXCLUDED.category,
                         price = EXCLUDED.price,
@@ -71,26 +148,424 @@ class PostgresProductRepository(ProductRepository[Cursor]):
                     product.quantity,
                 ),
             )
+            cur.notify_changed("products", [product.id])
+
+    def save_many(self, products: Iterable[Product]):
+        # ON CONFLICT DO UPDATE cannot affect the same row twice in one statement
+        products_by_id = {product.id: product for product in products}
+
+        with self.new_operator("save_many") as cur:
+            cur.execute(self.CREATE_STAGING_TABLE_IF_NOT_EXISTS)
+            with cur.copy(
+                "COPY products_staging (id, name, category, price, quantity) FROM STDIN"
+            ) as copy:
+                for product in products_by_id.values():
+                    copy.write_row(
+                        (
+                            product.id,
+                            product.name,
+                            product.category,
+                            product.price,
+                            product.quantity,
+                        )
+                    )
+            cur.execute(
+                """
+                    INSERT INTO products (id, name, category, price, quantity)
+                    SELECT id, name, category, price, quantity FROM products_staging
+                    ON CONFLICT (id)
+                    DO UPDATE SET
+                        name = EXCLUDED.name,
+                        category = EXCLUDED.category,
+                        price = EXCLUDED.price,
+                        quantity = EXCLUDED.quantity;
+                """
+            )
+            cur.execute("TRUNCATE products_staging;")
+
+            cur.notify_changed("products", products_by_id)
 
     def get_by_id(
         self, product_id: str, lock_level: LockLevel = LockLevel.NONE
     ) -> Product:
-        with self.new_operator() as cur:
+        with self.new_operator("get_by_id") as cur:
             query = select_query_helper(
-                "SELECT id, name, category, price, quantity FROM products WHERE id = %s;",
+                f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id = %s;",
                 lock_level,
             )
+            cur.row_factory = product_row
+            cur.execute(query, (product_id,), binary=True)
+            product = cur.fetchone()
+            if product:
+                return product
+            raise EntityNotFoundError.create("product_id", product_id)
+
+    def get_page(
+        self,
+        limit: int,
+        after_id: Optional[str] = None,
+        category: Optional[str] = None,
+    ) -> list[Product]:
+        conditions = []
+        params: list = []
+        if category is not None:
+            conditions.append("category = %s")
+            params.append(category)
+        if after_id is not None:
+            conditions.append("id > %s")
+            params.append(after_id)
+
+        query = f"SELECT {PRODUCT_COLUMNS} FROM products"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id LIMIT %s;"
+        params.append(limit)
+
+        with self.new_operator("get_page") as cur:
+            cur.row_factory = product_row
+            cur.execute(query, params, binary=True)
+            return cur.fetchall()
+
+    def search(self, query: ProductSearchQuery) -> list[Product]:
+        # The expression must be the same as the one of products_name_search_idx for the index to be used
+        name_tsvector = "to_tsvector('simple', name)"
+        rank = f"ts_rank({name_tsvector}, plainto_tsquery('simple', %(text)s))"
+
+        conditions = []
+        if query.text is not None:
+            conditions.append(f"{name_tsvector} @@ plainto_tsquery('simple', %(text)s)")
+        if query.category is not None:
+            conditions.append("category = %(category)s")
+        if query.min_price is not None:
+            conditions.append("price >= %(min_price)s")
+        if query.max_price is not None:
+            conditions.append("price <= %(max_price)s")
+        if query.in_stock:
+            # Same as the condition of products_in_stock_price_id_idx
+            conditions.append("quantity > 0")
+        if query.after_id is not None:
+            # Seek past the last product of the previous page in the index instead of skipping the rows before it
+            if query.text is not None:
+                after_rank = f"(SELECT {rank} FROM products WHERE id = %(after_id)s)"
+                conditions.append(
+                    f"({rank} < {after_rank} OR ({rank} = {after_rank} AND id > %(after_id)s))"
+                )
+            else:
+                conditions.append(
+                    "(price, id) > (SELECT price, id FROM products WHERE id = %(after_id)s)"
+                )
+
+        sql = f"SELECT {PRODUCT_COLUMNS} FROM products"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if query.text is not None:
+            sql += f" ORDER BY {rank} DESC, id"
+        else:
+            sql += " ORDER BY price, id"
+        sql += " LIMIT %(limit)s;"
+
+        with self.new_operator("search") as cur:
+            cur.row_factory = product_row
+            cur.execute(
+                sql,
+                {
+                    "text": query.text,
+                    "category": query.category,
+                    "min_price": query.min_price,
+                    "max_price": query.max_price,
+                    "after_id": query.after_id,
+                    "limit": query.limit,
+                },
+                binary=True,
+            )
+            return cur.fetchall()
+
+
+def _words(text: str) -> list[str]:
+    # Similar to the parser of the simple text search configuration of postgres
+    return re.findall(r"\w+", text.lower())
+
+
+class MemoryProductRepository(ProductRepository[MemoryTransaction]):
+    """
+    The pages and searches scan all products, so they are slow for large catalogs.
+    """
+
+    TABLE = "products"
+
+    def save(self, product: Product):
+        self.new_operator("save").put(self.TABLE, product.id, product.model_copy())
+
+    def save_many(self, products: Iterable[Product]):
+        for product in products:
+            self.save(product)
+
+    def get_by_id(
+        self, product_id: str, lock_level: LockLevel = LockLevel.NONE
+    ) -> Product:
+        product = self.new_operator("get_by_id").get(
+            self.TABLE, product_id, lock=lock_level == LockLevel.MODIFY_LOCK
+        )
+        if product is None:
+            raise EntityNotFoundError.create("product_id", product_id)
+        return product.model_copy()
+
+    def get_page(
+        self,
+        limit: int,
+        after_id: Optional[str] = None,
+        category: Optional[str] = None,
+    ) -> list[Product]:
+        products = sorted(
+            (
+                product
+                for product in self.new_operator("get_page").scan(self.TABLE)
+                if (category is None or product.category == category)
+                and (after_id is None or product.id > after_id)
+            ),
+            key=lambda product: product.id,
+        )
+        return [product.model_copy() for product in products[:limit]]
+
+    def search(self, query: ProductSearchQuery) -> list[Product]:
+        query_words = _words(query.text) if query.text is not None else []
+
+        def sort_key(product: Product) -> tuple:
+            if query.text is None:
+                return (product.price, product.id)
+            # Approximates ts_rank by the occurrences of the words of the query
+            name_words = _words(product.name)
+            return (-sum(name_words.count(word) for word in query_words), product.id)
+
+        transaction = self.new_operator("search")
+        after = (
+            transaction.get(self.TABLE, query.after_id)
+            if query.after_id is not None
+            else None
+        )
+        if query.after_id is not None and after is None:
+            return []  # As the comparison with the missing row of postgres
+
+        matches: list[tuple[tuple, Product]] = []
+        for product in transaction.scan(self.TABLE):
+            if query.category is not None and product.category != query.category:
+                continue
+            if query.min_price is not None and product.price < query.min_price:
+                continue
+            if query.max_price is not None and product.price > query.max_price:
+                continue
+            if query.in_stock and product.quantity <= 0:
+                continue
+            name_words = _words(product.name)
+            if not all(word in name_words for word in query_words):
+                continue
+            key = sort_key(product)
+            if after is not None and key <= sort_key(after):
+                continue
+            matches.append((key, product))
+
+        matches.sort(key=lambda match: match[0])
+        return [product.model_copy() for _, product in matches[: query.limit]]
+
+
+class SqliteProductRepository(ProductRepository[SqliteCursor]):
+    # products_search is a full-text index of the names kept in sync by the triggers. It doesn't store the names again
+    # (external content table) and refers to the products by rowid.
+    CREATE_TABLE_IF_NOT_EXISTS = """
+        CREATE TABLE IF NOT EXISTS products (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            category TEXT NOT NULL,
+            price REAL,
+            quantity INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS products_category_id_idx ON products (category, id);
+        CREATE INDEX IF NOT EXISTS products_category_price_idx ON products (category, price);
+        CREATE INDEX IF NOT EXISTS products_price_id_idx ON products (price, id);
+        CREATE INDEX IF NOT EXISTS products_in_stock_price_id_idx ON products (price, id) WHERE quantity > 0;
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_search USING fts5 (
+            name, content = 'products', tokenize = 'unicode61'
+        );
+        CREATE TRIGGER IF NOT EXISTS products_search_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_search (rowid, name) VALUES (new.rowid, new.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_search_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_search (products_search, rowid, name) VALUES ('delete', old.rowid, old.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_search_update AFTER UPDATE OF name ON products BEGIN
+            INSERT INTO products_search (products_search, rowid, name) VALUES ('delete', old.rowid, old.name);
+            INSERT INTO products_search (rowid, name) VALUES (new.rowid, new.name);
+        END;
+    """
+    DROP_TABLE = """
+        DROP TABLE products_search;
+        DROP TABLE products;
+    """
+
+    UPSERT = """
+        INSERT INTO products (id, name, category, price, quantity)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (id)
+        DO UPDATE SET
+            name = excluded.name,
+            category = excluded.category,
+            price = excluded.price,
+            quantity = excluded.quantity;
+    """
+
+    def save(self, product: Product):
+        self.save_many([product])
+
+    def save_many(self, products: Iterable[Product]):
+        products_by_id = {product.id: product for product in products}
+
+        with self.new_operator("save_many") as cur:
+            cur.begin_write()
+            cur.executemany(
+                self.UPSERT,
+                [
+                    (
+                        product.id,
+                        product.name,
+                        product.category,
+                        product.price,
+                        product.quantity,
+                    )
+                    for product in products_by_id.values()
+                ],
+            )
+            cur.notify_changed("products", list(products_by_id))
+
+    def get_by_id(
+        self, product_id: str, lock_level: LockLevel = LockLevel.NONE
+    ) -> Product:
+        with self.new_operator("get_by_id") as cur:
+            if lock_level == LockLevel.MODIFY_LOCK:
+                cur.begin_write()
+            cur.row_factory = sqlite_rows.product_row
             cur.execute(
-                query,
+                f"SELECT {sqlite_rows.PRODUCT_COLUMNS} FROM products WHERE id = ?;",
                 (product_id,),
             )
-            row = cur.fetchone()
-            if row:
-                return Product(
-                    id=row[0],
-                    name=row[1],
-                    category=row[2],
-                    price=row[3],
-                    quantity=row[4],
-                )
+            product = cur.fetchone()
+            if product:
+                return product
             raise EntityNotFoundError.create("product_id", product_id)
+
+    def get_page(
+        self,
+        limit: int,
+        after_id: Optional[str] = None,
+        category: Optional[str] = None,
+    ) -> list[Product]:
+        conditions = []
+        params: list = []
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        if after_id is not None:
+            conditions.append("id > ?")
+            params.append(after_id)
+
+        query = f"SELECT {sqlite_rows.PRODUCT_COLUMNS} FROM products"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id LIMIT ?;"
+        params.append(limit)
+
+        with self.new_operator("get_page") as cur:
+            cur.row_factory = sqlite_rows.product_row
+            cur.execute(query, params)
+            return cur.fetchall()
+
+    def search(self, query: ProductSearchQuery) -> list[Product]:
+        sql = f"SELECT {sqlite_rows.PRODUCT_COLUMNS} FROM products"
+        conditions = []
+        params: list = []
+        if query.text is not None:
+            query_words = _words(query.text)
+            if not query_words:
+                return []  # As plainto_tsquery of postgres, which matches nothing
+            sql += " JOIN products_search ON products_search.rowid = products.rowid"
+            conditions.append("products_search MATCH ?")
+            # Quoted so that the words are not parsed as the operators of the query syntax. Implicitly ANDed.
+            match_query = " ".join(f'"{word}"' for word in query_words)
+            params.append(match_query)
+        if query.category is not None:
+            conditions.append("products.category = ?")
+            params.append(query.category)
+        if query.min_price is not None:
+            conditions.append("products.price >= ?")
+            params.append(query.min_price)
+        if query.max_price is not None:
+            conditions.append("products.price <= ?")
+            params.append(query.max_price)
+        if query.in_stock:
+            conditions.append("products.quantity > 0")
+        if query.after_id is not None:
+            if query.text is not None:
+                after_rank = """(
+                    SELECT bm25(products_search) FROM products_search
+                    WHERE products_search MATCH ? AND rowid = (SELECT rowid FROM products WHERE id = ?)
+                )"""
+                conditions.append(
+                    f"(bm25(products_search) > {after_rank} OR (bm25(products_search) = {after_rank} AND products.id > ?))"
+                )
+                params.extend([match_query, query.after_id] * 2 + [query.after_id])
+            else:
+                conditions.append(
+                    "(products.price, products.id) > (SELECT price, id FROM products WHERE id = ?)"
+                )
+                params.append(query.after_id)
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if query.text is not None:
+            # bm25 is lower for the more relevant rows. Similar to ts_rank, but it also takes the length of the names
+            # into account.
+            sql += " ORDER BY bm25(products_search), products.id"
+        else:
+            sql += " ORDER BY products.price, products.id"
+        sql += " LIMIT ?;"
+        params.append(query.limit)
+
+        with self.new_operator("search") as cur:
+            cur.row_factory = sqlite_rows.product_row
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+
+class ShardedProductRepository(ProductRepository[ShardedOperator]):
+    """
+    All products are stored in the catalog node, so the searches don't need to be sent to every shard.
+    """
+
+    def save(self, product: Product):
+        PostgresProductRepository(self.new_operator("save").catalog).save(product)
+
+    def save_many(self, products: Iterable[Product]):
+        PostgresProductRepository(self.new_operator("save_many").catalog).save_many(
+            products
+        )
+
+    def get_by_id(
+        self, product_id: str, lock_level: LockLevel = LockLevel.NONE
+    ) -> Product:
+        return PostgresProductRepository(
+            self.new_operator("get_by_id").catalog
+        ).get_by_id(product_id, lock_level)
+
+    def get_page(
+        self,
+        limit: int,
+        after_id: Optional[str] = None,
+        category: Optional[str] = None,
+    ) -> list[Product]:
+        return PostgresProductRepository(
+            self.new_operator("get_page").catalog
+        ).get_page(limit, after_id, category)
+
+    def search(self, query: ProductSearchQuery) -> list[Product]:
+        return PostgresProductRepository(self.new_operator("search").catalog).search(
+            query
+        )
@@ -0,0 +1,594 @@
+from abc import abstractmethod
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Callable, TypeAlias, TypeVar
+
+from psycopg import Cursor
+from psycopg.rows import kwargs_row
+
+from app.models.sales import (
+    SalesDimension,
+    SalesMetric,
+    SalesPeriod,
+    SalesRollup,
+    TopSeller,
+)
+from app.repositories.base import AbstractRepository
+from app.repositories.config import RepositoryBackend
+from app.repositories.memory.session import MemoryTransaction
+from app.repositories.order import MemoryOrderRepository
+from app.repositories.product import MemoryProductRepository
+from app.repositories.sharded.session import ShardedOperator
+from app.repositories.sqlite.session import SqliteCursor
+
+Operator = TypeVar("Operator")
+
+# The watermark of the orders which are never aggregated
+EPOCH = datetime(1970, 1, 1)
+
+
+class SalesRepository(AbstractRepository[Operator]):
+    """
+    The units and revenue of each product and each category per hour, kept in rollups so that the reports don't read
+    the orders. `aggregate` adds the items of the orders created after a watermark to the rollups and advances the
+    watermark in the same transaction, so each item is counted once.
+
+    An item counts in the category of its product when it is aggregated. The items of the deleted products only count
+    in the product rollups.
+    """
+
+    @abstractmethod
+    def aggregate(self, lag_seconds: float) -> int:
+        """
+        Args:
+            lag_seconds: The orders created in the last `lag_seconds` are left to the next aggregation, so that the
+                orders whose transactions are still committing are not skipped.
+
+        Returns:
+            The number of order items aggregated.
+        """
+        pass
+
+    @abstractmethod
+    def get_sales(
+        self,
+        dimension: SalesDimension,
+        period: SalesPeriod,
+        since: datetime,
+        until: datetime,
+    ) -> list[SalesRollup]:
+        """
+        The sales of each product or category in each hour or day, from the hours starting in [since, until). Sorted by
+        the start of the period and then by the key. The times are in the time zone of the creation times of the orders.
+        """
+        pass
+
+    @abstractmethod
+    def get_top_sellers(
+        self, since: datetime, until: datetime, metric: SalesMetric, limit: int
+    ) -> list[TopSeller]:
+        """
+        The products with the most units or revenue in the hours starting in [since, until), the most first. The ties
+        are sorted by product id.
+        """
+        pass
+
+
+SalesRepositoryFactory: TypeAlias = Callable[
+    [Callable[[str], Operator]], SalesRepository[Operator]
+]
+
+
+def sales_repository_factory(new_operator):
+    match RepositoryBackend.from_env():
+        case RepositoryBackend.POSTGRES:
+            return PostgresSalesRepository(new_operator)
+        case RepositoryBackend.MEMORY:
+            return MemorySalesRepository(new_operator)
+        case RepositoryBackend.SQLITE:
+            return SqliteSalesRepository(new_operator)
+        case RepositoryBackend.SHARDED_POSTGRES:
+            return ShardedSalesRepository(new_operator)
+
+
+def _hour(time: datetime) -> datetime:
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+def _period_start(hour: datetime, period: SalesPeriod) -> datetime:
+    return hour.replace(hour=0) if period == SalesPeriod.DAY else hour
+
+
+# The items of an order are inserted with the start time of the transaction adding it, so the items of the transactions
+# still running are after the start of the oldest of them. A prepared transaction of a sharded session has no start
+# time, so its items are assumed to be created at most the lag before it was prepared.
+POSTGRES_AGGREGATABLE_UNTIL = """
+    SELECT LEAST(
+        LOCALTIMESTAMP - make_interval(secs => %(lag_seconds)s),
+        (
+            SELECT min(xact_start)::timestamp FROM pg_stat_activity
+            WHERE datname = current_database() AND pid <> pg_backend_pid()
+        ),
+        (
+            SELECT min(prepared)::timestamp - make_interval(secs => %(lag_seconds)s) FROM pg_prepared_xacts
+            WHERE database = current_database()
+        )
+    );
+"""
+
+POSTGRES_ADD_SALES = """
+    WITH delta AS (
+        SELECT * FROM unnest(%(product_ids)s::varchar[], %(hours)s::timestamp[], %(units)s::bigint[], %(revenues)s::numeric[])
+            AS delta (product_id, hour, units, revenue)
+    ), product_sales AS (
+        INSERT INTO sales_rollups (dimension, key, hour, units, revenue)
+        SELECT %(product)s, product_id, hour, units, revenue FROM delta
+        ON CONFLICT (dimension, key, hour) DO UPDATE SET
+            units = sales_rollups.units + EXCLUDED.units,
+            revenue = sales_rollups.revenue + EXCLUDED.revenue
+    )
+    INSERT INTO sales_rollups (dimension, key, hour, units, revenue)
+    SELECT %(category)s, products.category, delta.hour, sum(delta.units), sum(delta.revenue)
+    FROM delta
+    JOIN products ON products.id = delta.product_id
+    GROUP BY products.category, delta.hour
+    ON CONFLICT (dimension, key, hour) DO UPDATE SET
+        units = sales_rollups.units + EXCLUDED.units,
+        revenue = sales_rollups.revenue + EXCLUDED.revenue;
+"""
+
+
+def _aggregate_postgres_sales(
+    rollups: Cursor, orders: Cursor, source: str, lag_seconds: float
+) -> int:
+    """
+    Aggregate the items of the orders of the node of `orders` to the rollups of the node of `rollups`, with the
+    watermark of `source`. Both cursors may be the same.
+    """
+    rollups.execute(
+        "INSERT INTO sales_watermarks (source, aggregated_until) VALUES (%s, %s) ON CONFLICT (source) DO NOTHING;",
+        (source, EPOCH),
+    )
+    # Locked, so a concurrent aggregation of the same orders waits for this one and then starts from its watermark
+    [(aggregated_until,)] = rollups.execute(
+        "SELECT aggregated_until FROM sales_watermarks WHERE source = %s FOR UPDATE;",
+        (source,),
+    ).fetchall()
+    [(until,)] = orders.execute(
+        POSTGRES_AGGREGATABLE_UNTIL, {"lag_seconds": lag_seconds}
+    ).fetchall()
+    if until <= aggregated_until:
+        return 0
+
+    # Only the partitions of the months between the watermarks are scanned
+    deltas = orders.execute(
+        """
+        SELECT product_id, date_trunc('hour', created_at), count(*), sum(quantity), coalesce(sum(quantity * unit_price), 0)
+        FROM order_items
+        WHERE created_at >= %s AND created_at < %s
+        GROUP BY 1, 2;
+        """,
+        (aggregated_until, until),
+    ).fetchall()
+    item_count = 0
+    if deltas:
+        product_ids, hours, item_counts, units, revenues = map(list, zip(*deltas))
+        rollups.execute(
+            POSTGRES_ADD_SALES,
+            {
+                "product_ids": product_ids,
+                "hours": hours,
+                "units": units,
+                "revenues": revenues,
+                "product": SalesDimension.PRODUCT.value,
+                "category": SalesDimension.CATEGORY.value,
+            },
+        )
+        item_count = sum(item_counts)
+    rollups.execute(
+        "UPDATE sales_watermarks SET aggregated_until = %s WHERE source = %s;",
+        (until, source),
+    )
+    return item_count
+
+
+class PostgresSalesRepository(SalesRepository[Cursor]):
+    # The watermark is the creation time of the orders aggregated until, exclusive
+    CREATE_TABLES_IF_NOT_EXISTS = """
+        CREATE TABLE IF NOT EXISTS sales_rollups (
+            dimension VARCHAR NOT NULL,
+            key VARCHAR NOT NULL,
+            hour TIMESTAMP NOT NULL,
+            units BIGINT NOT NULL,
+            revenue NUMERIC NOT NULL,
+            PRIMARY KEY (dimension, key, hour)
+        );
+        CREATE INDEX IF NOT EXISTS sales_rollups_dimension_hour_idx ON sales_rollups (dimension, hour);
+        CREATE TABLE IF NOT EXISTS sales_watermarks (
+            source VARCHAR PRIMARY KEY,
+            aggregated_until TIMESTAMP NOT NULL
+        );
+    """
+    DROP_TABLES = """
+        DROP TABLE sales_rollups, sales_watermarks;
+    """
+
+    # The watermark of the orders of the same node
+    SOURCE = "orders"
+
+    def aggregate(self, lag_seconds: float) -> int:
+        with self.new_operator("aggregate") as cursor:
+            return _aggregate_postgres_sales(cursor, cursor, self.SOURCE, lag_seconds)
+
+    def get_sales(
+        self,
+        dimension: SalesDimension,
+        period: SalesPeriod,
+        since: datetime,
+        until: datetime,
+    ) -> list[SalesRollup]:
+        with self.new_operator("get_sales") as cursor:
+            cursor.row_factory = kwargs_row(SalesRollup)
+            cursor.execute(
+                """
+                SELECT
+                    key,
+                    date_trunc(%(period)s, hour) AS period_start,
+                    sum(units)::int8 AS units,
+                    sum(revenue)::float8 AS revenue
+                FROM sales_rollups
+                WHERE dimension = %(dimension)s AND hour >= %(since)s AND hour < %(until)s
+                GROUP BY key, period_start
+                ORDER BY period_start, key;
+                """,
+                {
+                    "period": period.value,
+                    "dimension": dimension.value,
+                    "since": since,
+                    "until": until,
+                },
+                binary=True,
+            )
+            return cursor.fetchall()
+
+    def get_top_sellers(
+        self, since: datetime, until: datetime, metric: SalesMetric, limit: int
+    ) -> list[TopSeller]:
+        with self.new_operator("get_top_sellers") as cursor:
+            cursor.row_factory = kwargs_row(TopSeller)
+            # The metric is one of the names of the selected columns
+            cursor.execute(
+                f"""
+                SELECT key AS product_id, sum(units)::int8 AS units, sum(revenue)::float8 AS revenue
+                FROM sales_rollups
+                WHERE dimension = %(dimension)s AND hour >= %(since)s AND hour < %(until)s
+                GROUP BY key
+                ORDER BY {metric.value} DESC, key
+                LIMIT %(limit)s;
+                """,
+                {
+                    "dimension": SalesDimension.PRODUCT.value,
+                    "since": since,
+                    "until": until,
+                    "limit": limit,
+                },
+                binary=True,
+            )
+            return cursor.fetchall()
+
+
+class MemorySalesRepository(SalesRepository[MemoryTransaction]):
+    # Values are (dimension, SalesRollup of an hour), which are immutable
+    ROLLUPS_TABLE = "sales_rollups"
+
+    # The watermark is the sequence of creation of the last order aggregated. Unlike the other backends, the orders whose
+    # transactions commit after a later order is aggregated are skipped.
+    WATERMARKS_TABLE = "sales_watermarks"
+    SOURCE = "orders"
+
+    def aggregate(self, lag_seconds: float) -> int:
+        transaction = self.new_operator("aggregate")
+        aggregated_until = (
+            transaction.get(self.WATERMARKS_TABLE, self.SOURCE, lock=True) or 0
+        )
+        until = datetime.now() - timedelta(seconds=lag_seconds)
+        order_rows = sorted(
+            (
+                order_row
+                for order_row in transaction.scan(MemoryOrderRepository.TABLE)
+                if order_row[0] > aggregated_until
+            ),
+            key=lambda order_row: order_row[0],
+        )
+
+        deltas: dict[tuple[SalesDimension, str, datetime], tuple[int, float]] = {}
+        item_count = 0
+        for sequence, created_at, order, unit_prices in order_rows:
+            if created_at >= until:
+                break
+            for item in order.order_items:
+                keys = [(SalesDimension.PRODUCT, item.product_id)]
+                product = transaction.get(
+                    MemoryProductRepository.TABLE, item.product_id
+                )
+                if product is not None:
+                    keys.append((SalesDimension.CATEGORY, product.category))
+                revenue = item.quantity * unit_prices.get(item.product_id, 0)
+                for dimension, key in keys:
+                    units, total = deltas.get(
+                        (dimension, key, _hour(created_at)), (0, 0)
+                    )
+                    deltas[(dimension, key, _hour(created_at))] = (
+                        units + item.quantity,
+                        total + revenue,
+                    )
+                item_count += 1
+            aggregated_until = sequence
+
+        for (dimension, key, hour), (units, revenue) in deltas.items():
+            row_key = f"{dimension.value}/{key}/{hour.isoformat()}"
+            row = transaction.get(self.ROLLUPS_TABLE, row_key, lock=True)
+            if row is not None:
+                units += row[1].units
+                revenue += row[1].revenue
+            transaction.put(
+                self.ROLLUPS_TABLE,
+                row_key,
+                (dimension, SalesRollup(key, hour, units, revenue)),
+            )
+        transaction.put(self.WATERMARKS_TABLE, self.SOURCE, aggregated_until)
+        return item_count
+
+    def get_sales(
+        self,
+        dimension: SalesDimension,
+        period: SalesPeriod,
+        since: datetime,
+        until: datetime,
+    ) -> list[SalesRollup]:
+        totals: dict[tuple[datetime, str], tuple[int, float]] = {}
+        for rollup in self._scan(dimension, since, until):
+            period_start = _period_start(rollup.period_start, period)
+            units, revenue = totals.get((period_start, rollup.key), (0, 0))
+            totals[(period_start, rollup.key)] = (
+                units + rollup.units,
+                revenue + rollup.revenue,
+            )
+        return [
+            SalesRollup(key, period_start, units, revenue)
+            for (period_start, key), (units, revenue) in sorted(totals.items())
+        ]
+
+    def get_top_sellers(
+        self, since: datetime, until: datetime, metric: SalesMetric, limit: int
+    ) -> list[TopSeller]:
+        totals: dict[str, TopSeller] = {}
+        for rollup in self._scan(SalesDimension.PRODUCT, since, until):
+            total = totals.get(rollup.key, TopSeller(rollup.key, 0, 0))
+            totals[rollup.key] = TopSeller(
+                rollup.key, total.units + rollup.units, total.revenue + rollup.revenue
+            )
+        return sorted(
+            totals.values(),
+            key=lambda seller: (-getattr(seller, metric.value), seller.product_id),
+        )[:limit]
+
+    def _scan(
+        self, dimension: SalesDimension, since: datetime, until: datetime
+    ) -> list[SalesRollup]:
+        return [
+            rollup
+            for row_dimension, rollup in self.new_operator("_scan").scan(
+                self.ROLLUPS_TABLE
+            )
+            if row_dimension == dimension and since <= rollup.period_start < until
+        ]
+
+
+def _sqlite_sales_rollup(cursor: sqlite3.Cursor, row: tuple) -> SalesRollup:
+    key, period_start, units, revenue = row
+    return SalesRollup(key, datetime.fromisoformat(period_start), units, revenue)
+
+
+def _sqlite_top_seller(cursor: sqlite3.Cursor, row: tuple) -> TopSeller:
+    return TopSeller(*row)
+
+
+def _sqlite_time(time: datetime) -> str:
+    # Same format as the hours of the rollups, so the times compare as text
+    return time.isoformat(sep=" ")
+
+
+class SqliteSalesRepository(SalesRepository[SqliteCursor]):
+    # The watermark is the rowid of the last order aggregated. The write transactions are serialized, so the rowids of
+    # the orders increase in the order of commit and no order is committed below the watermark.
+    CREATE_TABLES_IF_NOT_EXISTS = """
+        CREATE TABLE IF NOT EXISTS sales_rollups (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            hour TEXT NOT NULL,
+            units INTEGER NOT NULL,
+            revenue REAL NOT NULL,
+            PRIMARY KEY (dimension, key, hour)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS sales_rollups_dimension_hour_idx ON sales_rollups (dimension, hour);
+        CREATE TABLE IF NOT EXISTS sales_watermarks (
+            source TEXT PRIMARY KEY,
+            aggregated_until INTEGER NOT NULL
+        );
+    """
+    DROP_TABLES = """
+        DROP TABLE sales_rollups;
+        DROP TABLE sales_watermarks;
+    """
+    SOURCE = "orders"
+
+    def aggregate(self, lag_seconds: float) -> int:
+        with self.new_operator("aggregate") as cursor:
+            cursor.begin_write()
+            cursor.execute(
+                "SELECT aggregated_until FROM sales_watermarks WHERE source = ?;",
+                (self.SOURCE,),
+            )
+            row = cursor.fetchone()
+            aggregated_until = 0 if row is None else row[0]
+            cursor.execute(
+                """
+                SELECT max(rowid) FROM orders
+                WHERE rowid > ? AND created_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?);
+                """,
+                (aggregated_until, f"-{lag_seconds} seconds"),
+            )
+            [(until,)] = cursor.fetchall()
+            if until is None:
+                return 0
+
+            params = {"since": aggregated_until, "until": until}
+            cursor.execute(
+                """
+                INSERT INTO sales_rollups (dimension, key, hour, units, revenue)
+                SELECT
+                    :product,
+                    order_items.product_id,
+                    strftime('%Y-%m-%d %H:00:00', orders.created_at),
+                    sum(order_items.quantity),
+                    coalesce(sum(order_items.quantity * order_items.unit_price), 0)
+                FROM orders
+                JOIN order_items ON order_items.order_id = orders.id
+                WHERE orders.rowid > :since AND orders.rowid <= :until
+                GROUP BY 2, 3
+                ON CONFLICT (dimension, key, hour) DO UPDATE SET
+                    units = units + excluded.units,
+                    revenue = revenue + excluded.revenue;
+                """,
+                {**params, "product": SalesDimension.PRODUCT.value},
+            )
+            cursor.execute(
+                """
+                INSERT INTO sales_rollups (dimension, key, hour, units, revenue)
+                SELECT
+                    :category,
+                    products.category,
+                    strftime('%Y-%m-%d %H:00:00', orders.created_at),
+                    sum(order_items.quantity),
+                    coalesce(sum(order_items.quantity * order_items.unit_price), 0)
+                FROM orders
+                JOIN order_items ON order_items.order_id = orders.id
+                JOIN products ON products.id = order_items.product_id
+                WHERE orders.rowid > :since AND orders.rowid <= :until
+                GROUP BY 2, 3
+                ON CONFLICT (dimension, key, hour) DO UPDATE SET
+                    units = units + excluded.units,
+                    revenue = revenue + excluded.revenue;
+                """,
+                {**params, "category": SalesDimension.CATEGORY.value},
+            )
+            cursor.execute(
+                """
+                INSERT INTO sales_watermarks (source, aggregated_until) VALUES (?, ?)
+                ON CONFLICT (source) DO UPDATE SET aggregated_until = excluded.aggregated_until;
+                """,
+                (self.SOURCE, until),
+            )
+            cursor.execute(
+                """
+                SELECT count(*) FROM orders
+                JOIN order_items ON order_items.order_id = orders.id
+                WHERE orders.rowid > :since AND orders.rowid <= :until;
+                """,
+                params,
+            )
+            [(item_count,)] = cursor.fetchall()
+            return item_count
+
+    def get_sales(
+        self,
+        dimension: SalesDimension,
+        period: SalesPeriod,
+        since: datetime,
+        until: datetime,
+    ) -> list[SalesRollup]:
+        period_start = (
+            "substr(hour, 1, 10) || ' 00:00:00'"
+            if period == SalesPeriod.DAY
+            else "hour"
+        )
+        with self.new_operator("get_sales") as cursor:
+            cursor.row_factory = _sqlite_sales_rollup
+            cursor.execute(
+                f"""
+                SELECT key, {period_start} AS period_start, sum(units), sum(revenue)
+                FROM sales_rollups
+                WHERE dimension = ? AND hour >= ? AND hour < ?
+                GROUP BY key, period_start
+                ORDER BY period_start, key;
+                """,
+                (dimension.value, _sqlite_time(since), _sqlite_time(until)),
+            )
+            return cursor.fetchall()
+
+    def get_top_sellers(
+        self, since: datetime, until: datetime, metric: SalesMetric, limit: int
+    ) -> list[TopSeller]:
+        with self.new_operator("get_top_sellers") as cursor:
+            cursor.row_factory = _sqlite_top_seller
+            # The metric is one of the names of the selected columns
+            cursor.execute(
+                f"""
+                SELECT key, sum(units) AS units, sum(revenue) AS revenue
+                FROM sales_rollups
+                WHERE dimension = ? AND hour >= ? AND hour < ?
+                GROUP BY key
+                ORDER BY {metric.value} DESC, key
+                LIMIT ?;
+                """,
+                (
+                    SalesDimension.PRODUCT.value,
+                    _sqlite_time(since),
+                    _sqlite_time(until),
+                    limit,
+                ),
+            )
+            return cursor.fetchall()
+
+
+class ShardedSalesRepository(SalesRepository[ShardedOperator]):
+    """
+    The rollups are stored in the catalog node with the products, and the orders of each node storing shards are
+    aggregated to them with the watermark of that node. So the reports read the catalog only.
+    """
+
+    def aggregate(self, lag_seconds: float) -> int:
+        operator = self.new_operator("aggregate")
+        item_count = 0
+        with operator.catalog() as rollups:
+            for orders in operator.shards():
+                info = orders.connection.info
+                with orders:
+                    item_count += _aggregate_postgres_sales(
+                        rollups,
+                        orders,
+                        f"{info.host}:{info.port}/{info.dbname}",
+                        lag_seconds,
+                    )
+        return item_count
+
+    def get_sales(
+        self,
+        dimension: SalesDimension,
+        period: SalesPeriod,
+        since: datetime,
+        until: datetime,
+    ) -> list[SalesRollup]:
+        operator = self.new_operator("get_sales")
+        return PostgresSalesRepository(operator.catalog).get_sales(
+            dimension, period, since, until
+        )
+
+    def get_top_sellers(
+        self, since: datetime, until: datetime, metric: SalesMetric, limit: int
+    ) -> list[TopSeller]:
+        operator = self.new_operator("get_top_sellers")
+        return PostgresSalesRepository(operator.catalog).get_top_sellers(
+            since, until, metric, limit
+        )
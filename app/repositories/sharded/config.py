@@ -0,0 +1,64 @@
+from dataclasses import dataclass, replace
+import os
+
+from app.err import MyValueError
+from app.repositories.postgres.config import PostgresConfig
+
+
+@dataclass(frozen=True)
+class ShardingConfig:
+    # Stores the products, and the directory of the usernames
+    catalog: PostgresConfig
+
+    # Store the users, with their auth records and orders. The order matters: the shard of a user is an index of it.
+    shards: tuple[PostgresConfig, ...]
+
+    @staticmethod
+    def from_env():
+        catalog = PostgresConfig.from_env()
+        shards = os.getenv("POSTGRES_SHARDS")
+        return ShardingConfig(
+            catalog=catalog,
+            shards=parse_shards(shards, catalog) if shards else (catalog,),
+        )
+
+
+@dataclass(frozen=True)
+class RecoveryConfig:
+    # The servers resolve the prepared transactions left by the failed sessions at startup and then every this often
+    interval_seconds: float = 60
+
+    # The transactions prepared more recently are skipped, as their sessions may still be committing them
+    min_age_seconds: float = 60
+
+    @staticmethod
+    def from_env():
+        return RecoveryConfig(
+            interval_seconds=float(os.getenv("SHARDED_RECOVERY_INTERVAL_SECONDS", 60)),
+            min_age_seconds=float(os.getenv("SHARDED_RECOVERY_MIN_AGE_SECONDS", 60)),
+        )
+
+
+def parse_shards(value: str, catalog: PostgresConfig) -> tuple[PostgresConfig, ...]:
+    """
+    Parse the comma-separated shards in the format of `host:port/database`, e.g.
+    `shard0:5432/db,shard1:5432/db`. The user and password are the same as the ones of the catalog.
+
+    Raises:
+        MyValueError: If a shard is not in the format.
+    """
+    shards = []
+    for shard in value.split(","):
+        address, _, database = shard.strip().partition("/")
+        host, _, port = address.partition(":")
+        if not host or not port.isdigit() or not database:
+            raise MyValueError(f"invalid shard: {shard}, expected host:port/database")
+        shards.append(replace(catalog, host=host, port=int(port), database=database))
+    return tuple(shards)
+
+
+def node_name(config: PostgresConfig) -> str:
+    """
+    The node in the format of a shard of parse_shards, e.g. to report which node a row is in.
+    """
+    return f"{config.host}:{config.port}/{config.database}"
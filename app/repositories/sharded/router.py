@@ -0,0 +1,28 @@
+from hashlib import blake2b
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash (Lamping and Veach). Maps the 64-bit key to a bucket in [0, buckets). When the number of
+    buckets grows from n to n + 1, only 1 / (n + 1) of the keys move, all of them to the new bucket.
+    """
+    bucket, next_bucket = -1, 0
+    while next_bucket < buckets:
+        bucket = next_bucket
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        next_bucket = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+class ShardRouter:
+    """
+    Maps the user ids to the indexes of the shards. Adding a shard at the end only moves the users to it.
+    """
+
+    def __init__(self, shard_count: int):
+        self.shard_count = shard_count
+
+    def shard_of(self, user_id: str) -> int:
+        # Python's hash of str is randomized per process, so it can't be used
+        key = int.from_bytes(blake2b(user_id.encode(), digest_size=8).digest())
+        return jump_hash(key, self.shard_count)
@@ -0,0 +1,339 @@
+"""
+Sessions spanning the postgres nodes of a sharded deployment: the catalog node and the shards of the users.
+
+The connection to a node is opened when a repository first accesses it, and each node takes part in the transaction
+as a two-phase commit transaction. Committing a transaction which changed a single node is a plain commit. Otherwise:
+1. The transactions of the nodes other than the catalog are prepared (PREPARE TRANSACTION).
+2. The id of the transaction is inserted to `sharded_commits` in the transaction of the catalog, which is committed.
+   This commit is the decision to commit the whole transaction.
+3. The prepared transactions are committed (COMMIT PREPARED).
+
+If the session fails between 1 and 3, the prepared transactions keep their locks until recover_prepared_transactions
+commits them if the decision was committed and rolls them back otherwise. Each server runs it in the background with
+PreparedTransactionRecoverer. The servers need `max_prepared_transactions` to be at least the number of concurrent
+sessions.
+
+Postgres doesn't detect deadlocks across nodes, so the services should lock the rows of different nodes in a fixed
+order, as OrderService locks the user before the products.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import logging
+from threading import Event, Thread
+from typing import Optional, Sequence
+from uuid import uuid4
+
+import psycopg
+
+from app.repositories.base import RepositorySession
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.instrumentation import (
+    InstrumentedCursor,
+    StatementObserver,
+)
+from app.repositories.postgres.notification import (
+    NotifyingCursor,
+    new_changed_keys,
+    notify_changed_keys,
+)
+from app.repositories.postgres.session import (
+    SET_SNAPSHOT_TRANSACTION,
+    PostgresSession,
+    new_postgres_conn,
+)
+from app.repositories.sharded.config import RecoveryConfig, ShardingConfig
+from app.repositories.sharded.router import ShardRouter
+
+CATALOG_NODE = 0
+
+# Identifies the prepared transactions of the sessions among the others of the servers
+XID_FORMAT_ID = 0x5348
+
+# Key of the advisory lock of the catalog held while recovering, so that the servers don't recover at the same time
+RECOVERY_LOCK_KEY = XID_FORMAT_ID
+
+CREATE_COMMITS_TABLE_IF_NOT_EXISTS = """
+    CREATE TABLE IF NOT EXISTS sharded_commits (
+        gtrid VARCHAR PRIMARY KEY,
+        committed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+DROP_COMMITS_TABLE = """
+    DROP TABLE sharded_commits;
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedOperator:
+    """
+    The operator of ShardedSession used by the sharded repositories, to get a cursor of the node storing the rows.
+    """
+
+    def __init__(self, session: "ShardedSession", operation: str):
+        self._session = session
+        self._operation = operation
+
+    def catalog(self, operation: str = "") -> NotifyingCursor:
+        """
+        Can be the new_operator of a postgres repository accessing the catalog, whose statements are still attributed
+        to the operation of the sharded repository, so `operation` is ignored.
+        """
+        return self._session.cursor(CATALOG_NODE, self._operation)
+
+    def user_shard(self, user_id: str) -> NotifyingCursor:
+        return self._session.cursor(
+            self._session.node_of_user(user_id), self._operation
+        )
+
+    def shards(self) -> list[NotifyingCursor]:
+        """
+        A cursor of each node storing shards, e.g. to maintain the rows of all users.
+        """
+        return [
+            self._session.cursor(node, self._operation)
+            for node in sorted(set(self._session.shard_nodes))
+        ]
+
+
+class ShardedSession(RepositorySession[ShardedOperator]):
+    def __init__(
+        self,
+        config: ShardingConfig,
+        statement_observers: Sequence[StatementObserver] = (),
+    ):
+        """
+        Args:
+            statement_observers: Called with the record of each statement executed by the operators of this session.
+        """
+        self.config = config
+        self.router = ShardRouter(len(config.shards))
+        self._statement_observers = list(statement_observers)
+
+        # A shard with the same config as the catalog or another shard shares the node, so a single connection
+        self.nodes: list[PostgresConfig] = [config.catalog]
+        self.shard_nodes: list[int] = []
+        for shard in config.shards:
+            if shard not in self.nodes:
+                self.nodes.append(shard)
+            self.shard_nodes.append(self.nodes.index(shard))
+
+    def __enter__(self):
+        self._conns: dict[int, psycopg.Connection] = {}
+        self._gtrid: Optional[str] = None
+        self._changed_keys = new_changed_keys()
+
+        # The nodes in the current transaction
+        self._participants: list[int] = []
+        self._snapshot = False
+        return super().__enter__()
+
+    def __exit__(self, *args):
+        super().__exit__(*args)
+        for conn in self._conns.values():
+            conn.close()
+
+    def catalog_session(self) -> PostgresSession:
+        """
+        A session of the catalog node only, e.g. for the migrations.
+        """
+        return PostgresSession(self.config.catalog, self._statement_observers)
+
+    def shard_sessions(self) -> list[PostgresSession]:
+        """
+        A session of each node storing shards, e.g. for the migrations.
+        """
+        return [
+            PostgresSession(self.nodes[node], self._statement_observers)
+            for node in sorted(set(self.shard_nodes))
+        ]
+
+    def add_statement_observer(self, observer: StatementObserver):
+        self._statement_observers.append(observer)
+
+    def node_of_user(self, user_id: str) -> int:
+        return self.shard_nodes[self.router.shard_of(user_id)]
+
+    def new_operator(self, operation: str = ""):
+        return ShardedOperator(self, operation)
+
+    def cursor(self, node: int, operation: str) -> NotifyingCursor:
+        conn = self._join(node)
+        if not self._statement_observers:
+            return NotifyingCursor(conn, self._changed_keys)
+        return InstrumentedCursor(
+            conn, self._changed_keys, operation, self._statement_observers
+        )
+
+    def _join(self, node: int) -> psycopg.Connection:
+        conn = self._conns.get(node)
+        if conn is None:
+            conn = self._conns[node] = new_postgres_conn(self.nodes[node])
+        if node not in self._participants:
+            if self._gtrid is None:
+                self._gtrid = uuid4().hex
+            conn.tpc_begin(conn.xid(XID_FORMAT_ID, self._gtrid, str(node)))
+            if self._snapshot:
+                conn.execute(SET_SNAPSHOT_TRANSACTION)
+            self._participants.append(node)
+        return conn
+
+    def begin_snapshot(self):
+        # Each node joining the transaction takes its own snapshot when it is first read, so the reads of different
+        # nodes may see the transactions committed between them
+        self._snapshot = True
+
+    def commit(self):
+        # The listeners only listen to the catalog, whose transaction is never prepared. A prepared transaction can't
+        # have sent a notification.
+        if self._changed_keys:
+            notify_changed_keys(self._join(CATALOG_NODE), self._changed_keys)
+
+        if len(self._participants) <= 1:
+            for node in self._participants:
+                self._conns[node].tpc_commit()
+            self._end_transaction()
+            return
+
+        prepared = [node for node in self._participants if node != CATALOG_NODE]
+        for node in prepared:
+            self._conns[node].tpc_prepare()
+
+        catalog = self._join(CATALOG_NODE)
+        with catalog.cursor() as cur:
+            cur.execute(
+                "INSERT INTO sharded_commits (gtrid) VALUES (%s);", (self._gtrid,)
+            )
+        try:
+            catalog.tpc_commit()
+        except psycopg.Error:
+            # Unknown whether the decision is committed, so the prepared transactions are left to the recovery
+            self._end_transaction()
+            raise
+
+        self._end_transaction()
+        for node in prepared:
+            try:
+                self._conns[node].tpc_commit()
+            except psycopg.Error:
+                logger.exception(
+                    "Failed to commit the prepared transaction of node %s. It is committed by the recovery.",
+                    node,
+                )
+                self._conns.pop(node).close()
+
+    def rollback(self):
+        for node in self._participants:
+            try:
+                # Also rolls back the prepared transaction if it is prepared
+                self._conns[node].tpc_rollback()
+            except psycopg.Error:
+                logger.exception(
+                    "Failed to roll back the transaction of node %s. It is rolled back by the server or the recovery.",
+                    node,
+                )
+                self._conns.pop(node).close()
+        self._end_transaction()
+
+    def _end_transaction(self):
+        self._changed_keys.clear()
+        self._participants = []
+        self._gtrid = None
+        self._snapshot = False
+
+
+@dataclass
+class RecoveryReport:
+    committed: int = 0
+    rolled_back: int = 0
+
+
+def recover_prepared_transactions(
+    config: ShardingConfig, min_age_seconds: float = 60
+) -> RecoveryReport:
+    """
+    Commit or roll back the prepared transactions left by the sessions failing during the commit, according to the
+    decisions recorded in the catalog. Then delete the decisions which are no longer needed.
+
+    Args:
+        min_age_seconds: The transactions prepared more recently are skipped, as their sessions may still be committing
+            them. The decisions are kept for twice this long.
+    """
+    report = RecoveryReport()
+    shards = [
+        shard for shard in dict.fromkeys(config.shards) if shard != config.catalog
+    ]
+    now = datetime.now(timezone.utc)
+
+    with new_postgres_conn(config.catalog, autocommit=True) as catalog:
+        # Released when the connection is closed
+        catalog.execute("SELECT pg_advisory_lock(%s);", (RECOVERY_LOCK_KEY,))
+        for shard in shards:
+            with new_postgres_conn(shard) as conn:
+                for xid in conn.tpc_recover():
+                    # pg_prepared_xacts lists the prepared transactions of all databases of the server
+                    if xid.format_id != XID_FORMAT_ID or xid.database != shard.database:
+                        continue
+                    if (
+                        xid.prepared
+                        and (now - xid.prepared).total_seconds() < min_age_seconds
+                    ):
+                        continue
+
+                    decision = catalog.execute(
+                        "SELECT 1 FROM sharded_commits WHERE gtrid = %s;", (xid.gtrid,)
+                    ).fetchone()
+                    try:
+                        if decision:
+                            conn.tpc_commit(xid)
+                            report.committed += 1
+                        else:
+                            conn.tpc_rollback(xid)
+                            report.rolled_back += 1
+                    except psycopg.errors.UndefinedObject:
+                        # Finished by its session meanwhile
+                        conn.rollback()
+
+        catalog.execute(
+            "DELETE FROM sharded_commits WHERE committed_at < CURRENT_TIMESTAMP - make_interval(secs => %s);",
+            (2 * min_age_seconds,),
+        )
+    return report
+
+
+class PreparedTransactionRecoverer:
+    """
+    Runs recover_prepared_transactions in the background when started and then periodically, so that the prepared
+    transactions of the failed sessions don't keep their locks until someone runs the recovery.
+    """
+
+    def __init__(self, config: ShardingConfig, recovery_config: RecoveryConfig):
+        self._config = config
+        self._recovery_config = recovery_config
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                report = recover_prepared_transactions(
+                    self._config, self._recovery_config.min_age_seconds
+                )
+                if report.committed or report.rolled_back:
+                    logger.warning(
+                        "Recovered prepared transactions, committed: %s, rolled back: %s",
+                        report.committed,
+                        report.rolled_back,
+                    )
+            except psycopg.Error:
+                logger.exception("Failed to recover prepared transactions")
+            if self._stopped.wait(self._recovery_config.interval_seconds):
+                return
@@ -0,0 +1,16 @@
+from dataclasses import dataclass
+import os
+
+
+@dataclass(frozen=True)
+class SqliteConfig:
+    path: str
+
+    # How long a transaction waits for the write lock held by another connection before failing
+    busy_timeout_seconds: float
+
+    @staticmethod
+    def from_env():
+        path = os.getenv("SQLITE_PATH", "app.db")
+        busy_timeout_seconds = float(os.getenv("SQLITE_BUSY_TIMEOUT_SECONDS", 5))
+        return SqliteConfig(path=path, busy_timeout_seconds=busy_timeout_seconds)
@@ -0,0 +1,54 @@
+"""
+Row factories building the domain objects from the rows of the sqlite repositories, together with the columns each of
+them expects. They are set as the `row_factory` of the cursors, as in app/repositories/postgres/rows.py.
+
+The columns of the products are qualified because the searches join the products with their full-text index.
+"""
+
+from datetime import datetime
+import sqlite3
+
+from app.models.auth import AuthRecord
+from app.models.order import UserOrderStats
+from app.models.product import Product
+from app.models.user import User
+
+PRODUCT_COLUMNS = (
+    "products.id, products.name, products.category, products.price, products.quantity"
+)
+
+
+def product_row(cursor: sqlite3.Cursor, row: tuple) -> Product:
+    id, name, category, price, quantity = row
+    return Product(id=id, name=name, category=category, price=price, quantity=quantity)
+
+
+USER_COLUMNS = "id, balance"
+
+
+def user_row(cursor: sqlite3.Cursor, row: tuple) -> User:
+    id, balance = row
+    return User(id=id, balance=balance)
+
+
+AUTH_RECORD_COLUMNS = "user_id, username, hashed_password"
+
+
+def auth_record_row(cursor: sqlite3.Cursor, row: tuple) -> AuthRecord:
+    user_id, username, hashed_password = row
+    return AuthRecord(
+        user_id=user_id, username=username, hashed_password=hashed_password
+    )
+
+
+USER_ORDER_STATS_COLUMNS = "order_count, item_count, total_spent, last_order_at"
+
+
+def user_order_stats_row(cursor: sqlite3.Cursor, row: tuple) -> UserOrderStats:
+    order_count, item_count, total_spent, last_order_at = row
+    return UserOrderStats(
+        order_count=order_count,
+        item_count=item_count,
+        total_spent=total_spent,
+        last_order_at=datetime.fromisoformat(last_order_at),
+    )
@@ -0,0 +1,163 @@
+"""
+Embedded SQLite storage for single-node deployments, where running a postgres server is not worth it.
+
+The database file is in WAL mode, so the reads don't block the write transaction and vice versa. SQLite has no row
+locks, and a database has only one write transaction at a time:
+- The statements run in autocommit mode until the first write or read with LockLevel.MODIFY_LOCK of the transaction,
+  so the reads before it see the changes committed before them, as with the read committed isolation level.
+- The first write or read with LockLevel.MODIFY_LOCK begins the transaction with BEGIN IMMEDIATE, which waits for the
+  write transaction of other connections to end. It stands in for SELECT ... FOR UPDATE, locking the whole database
+  instead of the rows, until the transaction is committed or rolled back. No other transaction can commit in between,
+  so all reads after it see the latest data.
+- After SqliteSession.begin_snapshot, the transaction is begun with BEGIN DEFERRED and its reads see the snapshot taken
+  at its first read, without blocking the write transaction.
+
+As the writes are serialized, deadlocks can't happen, but the transactions writing different rows wait for each other.
+"""
+
+from collections import defaultdict
+import sqlite3
+from time import perf_counter
+from typing import Sequence
+
+from app.repositories.base import RepositorySession
+from app.repositories.invalidation import InvalidationPublisher
+from app.repositories.postgres.instrumentation import StatementObserver, StatementRecord
+from app.repositories.sqlite.config import SqliteConfig
+
+BEGIN_WRITE = "BEGIN IMMEDIATE"
+
+
+class SqliteDatabase(InvalidationPublisher):
+    """
+    The database file, and the handlers of the changes committed to it by this process. Shared by all sessions of the
+    process.
+
+    The changes committed by other processes are not published, so the handlers only rely on their TTL for them.
+    """
+
+    def __init__(self, config: SqliteConfig):
+        super().__init__()
+        self.config = config
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.config.path,
+            timeout=self.config.busy_timeout_seconds,
+            # The transactions are begun explicitly by SqliteCursor.begin_write
+            isolation_level=None,
+            # The session may be entered and used by different threads, though not concurrently
+            check_same_thread=False,
+        )
+        # Safe from corruption in WAL mode. A commit may be lost on power failure, but not on crash of the process.
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+
+class SqliteCursor(sqlite3.Cursor):
+    """
+    The operator of SqliteSession used by the sqlite repositories. Reports every statement it executes to the
+    observers of the session.
+    """
+
+    def __init__(self, session: "SqliteSession", operation: str):
+        super().__init__(session.connection)
+        self._session = session
+        self._operation = operation
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def begin_write(self):
+        """
+        Should be called before writing and before reading with LockLevel.MODIFY_LOCK. Begin the write transaction if
+        it hasn't begun, waiting up to the busy timeout for the write transaction of another connection to end.
+
+        Raises:
+            sqlite3.OperationalError: If the database is still locked after the busy timeout.
+        """
+        if not self.connection.in_transaction:
+            self.execute(BEGIN_WRITE)
+
+    def notify_changed(self, table: str, keys: list[str]):
+        """
+        The handlers subscribed to the database are called with the keys after the transaction is committed.
+        """
+        self._session.changed_keys[table].extend(keys)
+
+    def execute(self, sql, parameters=(), /):
+        start = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(sql, start)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        start = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(sql, start)
+
+    def _record(self, sql: str, start: float):
+        observers = self._session.statement_observers
+        if not observers:
+            return
+        duration_seconds = perf_counter() - start
+        record = StatementRecord(
+            operation=self._operation,
+            duration_seconds=duration_seconds,
+            rows=max(self.rowcount, 0),
+            # Beginning the write transaction is the counterpart of the statements acquiring the row locks of postgres
+            locking_seconds=duration_seconds if sql == BEGIN_WRITE else 0,
+        )
+        for observer in observers:
+            observer(record)
+
+
+class SqliteSession(RepositorySession[SqliteCursor]):
+    def __init__(
+        self,
+        database: SqliteDatabase,
+        statement_observers: Sequence[StatementObserver] = (),
+    ):
+        """
+        Args:
+            statement_observers: Called with the record of each statement executed by the operators of this session.
+        """
+        self.database = database
+        self.statement_observers = list(statement_observers)
+
+    def __enter__(self):
+        self.connection = self.database.connect()
+        self.changed_keys: dict[str, list[str]] = defaultdict(list)
+        return super().__enter__()
+
+    def __exit__(self, *args):
+        super().__exit__(*args)
+        self.connection.close()
+
+    def add_statement_observer(self, observer: StatementObserver):
+        self.statement_observers.append(observer)
+
+    def new_operator(self, operation: str = ""):
+        return SqliteCursor(self, operation)
+
+    def begin_snapshot(self):
+        # In WAL mode, the first read of a deferred transaction starts a snapshot which lasts until the transaction ends
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN DEFERRED")
+
+    def commit(self):
+        if self.connection.in_transaction:
+            self.connection.execute("COMMIT")
+        changed_keys, self.changed_keys = self.changed_keys, defaultdict(list)
+        self.database.publish(changed_keys)
+
+    def rollback(self):
+        if self.connection.in_transaction:
+            self.connection.execute("ROLLBACK")
+        self.changed_keys.clear()
@@ -5,7 +5,13 @@ from psycopg import Cursor
 from app.models.user import User
 from app.repositories.err import EntityNotFoundError
 from app.repositories.base import AbstractRepository, LockLevel
+from app.repositories.config import RepositoryBackend
+from app.repositories.memory.session import MemoryTransaction
 from app.repositories.postgres.helper import select_query_helper
+from app.repositories.postgres.rows import USER_COLUMNS, user_row
+from app.repositories.sharded.session import ShardedOperator
+from app.repositories.sqlite import rows as sqlite_rows
+from app.repositories.sqlite.session import SqliteCursor
 
 
 Operator = TypeVar("Operator")
@@ -30,12 +36,20 @@ class UserRepository(AbstractRepository[Operator]):
 
 
 UserRepositoryFactory: TypeAlias = Callable[
-    [Callable[[], Operator]], UserRepository[Operator]
+    [Callable[[str], Operator]], UserRepository[Operator]
 ]
 
 
 def user_repository_factory(new_operator):
-    return PostgresUserRepository(new_operator)
+    match RepositoryBackend.from_env():
+        case RepositoryBackend.POSTGRES:
+            return PostgresUserRepository(new_operator)
+        case RepositoryBackend.MEMORY:
+            return MemoryUserRepository(new_operator)
+        case RepositoryBackend.SQLITE:
+            return SqliteUserRepository(new_operator)
+        case RepositoryBackend.SHARDED_POSTGRES:
+            return ShardedUserRepository(new_operator)
 
 
 class PostgresUserRepository(UserRepository[Cursor]):
@@ -51,7 +65,7 @@ class PostgresUserRepository(UserRepository[Cursor]):
     """
 
     def save(self, user: User):
-        with self.new_operator() as cur:
+        with self.new_operator("save") as cur:
             cur.execute(
                 """
                 INSERT INTO users (id, balance)
@@ -63,18 +77,92 @@ class PostgresUserRepository(UserRepository[Cursor]):
             )
 
     def get_by_id(self, user_id: str, lock_level: LockLevel = LockLevel.NONE) -> User:
-        with self.new_operator() as cur:
+        with self.new_operator("get_by_id") as cur:
             query = select_query_helper(
-                "SELECT id, balance FROM users WHERE id = %s", lock_level
+                f"SELECT {USER_COLUMNS} FROM users WHERE id = %s", lock_level
             )
+            cur.row_factory = user_row
+            cur.execute(query, (user_id,), binary=True)
+            user = cur.fetchone()
+            if user:
+                return user
+            raise EntityNotFoundError.create("user_id", user_id)
+
+
+class MemoryUserRepository(UserRepository[MemoryTransaction]):
+    TABLE = "users"
+
+    def save(self, user: User):
+        self.new_operator("save").put(self.TABLE, user.id, user.model_copy())
+
+    def get_by_id(self, user_id: str, lock_level: LockLevel = LockLevel.NONE) -> User:
+        user = self.new_operator("get_by_id").get(
+            self.TABLE, user_id, lock=lock_level == LockLevel.MODIFY_LOCK
+        )
+        if user is None:
+            raise EntityNotFoundError.create("user_id", user_id)
+        return user.model_copy()
+
+
+class SqliteUserRepository(UserRepository[SqliteCursor]):
+    CREATE_TABLE_IF_NOT_EXISTS = """
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            balance REAL
+        );
+    """
+
+    DROP_TABLE = """
+        DROP TABLE users;
+    """
+
+    def save(self, user: User):
+        with self.new_operator("save") as cur:
+            cur.begin_write()
+            cur.execute(
+                """
+                INSERT INTO users (id, balance)
+                VALUES (?, ?)
+                ON CONFLICT (id)
+                DO UPDATE SET balance = excluded.balance;
+            """,
+                (user.id, user.balance),
+            )
+
+    def get_by_id(self, user_id: str, lock_level: LockLevel = LockLevel.NONE) -> User:
+        with self.new_operator("get_by_id") as cur:
+            if lock_level == LockLevel.MODIFY_LOCK:
+                cur.begin_write()
+            cur.row_factory = sqlite_rows.user_row
             cur.execute(
-                query,
+                f"SELECT {sqlite_rows.USER_COLUMNS} FROM users WHERE id = ?;",
                 (user_id,),
             )
-            row = cur.fetchone()
-            if row:
-                return User(
-                    id=row[0],
-                    balance=row[1],
-                )
+            user = cur.fetchone()
+            if user:
+                return user
             raise EntityNotFoundError.create("user_id", user_id)
+
+
+class ShardedUserRepository(UserRepository[ShardedOperator]):
+    """
+    Each user is stored in the shard of its id.
+    """
+
+    def save(self, user: User):
+        with self.new_operator("save").user_shard(user.id) as cur:
+            cur.execute(
+                """
+                INSERT INTO users (id, balance)
+                VALUES (%s, %s)
+                ON CONFLICT (id)
+                DO UPDATE SET balance = EXCLUDED.balance;
+            """,
+                (user.id, user.balance),
+            )
+
+    def get_by_id(self, user_id: str, lock_level: LockLevel = LockLevel.NONE) -> User:
+        operator = self.new_operator("get_by_id")
+        return PostgresUserRepository(lambda _: operator.user_shard(user_id)).get_by_id(
+            user_id, lock_level
+        )
@@ -0,0 +1,193 @@
+"""
+Maintenance of the shards of the sharded postgres backend (REPOSITORY_BACKEND=sharded_postgres).
+
+`plan` and `move` compare the shards of the users under the current layout (--from), which the data is stored with,
+against the new layout of POSTGRES_SHARDS. `move` copies the rows of each user whose shard changes (the user, the
+auth record, the orders with their keys and items, and the order stats) to the new shard and then deletes them from
+the old one, in batches. Stop the servers before moving, and restart them with the new POSTGRES_SHARDS after it.
+Moving is idempotent, so it can be rerun after a failure. Appending shards to the layout only moves the users to the new shards.
+
+`recover` resolves the prepared transactions left by the sessions failing during the commit, as the servers do at
+startup and periodically. Run it when no server is running, e.g. before moving.
+
+Usage:
+    POSTGRES_SHARDS=host0:5432/db,host1:5432/db python -m app.reshard plan --from host0:5432/db
+    POSTGRES_SHARDS=host0:5432/db,host1:5432/db python -m app.reshard move --from host0:5432/db [--batch-size 500]
+    POSTGRES_SHARDS=host0:5432/db,host1:5432/db python -m app.reshard recover [--min-age-seconds 60]
+"""
+
+import argparse
+from collections import Counter
+from dataclasses import dataclass, field
+import sys
+from typing import Callable, Iterator
+
+import psycopg
+
+from app.repositories.migration import migrate_up
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.session import new_postgres_conn
+from app.repositories.sharded.config import ShardingConfig, node_name, parse_shards
+from app.repositories.sharded.router import ShardRouter
+from app.repositories.sharded.session import (
+    ShardedSession,
+    recover_prepared_transactions,
+)
+
+DEFAULT_BATCH_SIZE = 500
+
+# The tables stored in the shards, with the condition selecting the rows of a list of user ids. The rows are copied in
+# this order and deleted in the reverse order.
+SHARD_TABLES = (
+    ("users", "id = ANY(%s)"),
+    ("auth_records", "user_id = ANY(%s)"),
+    ("orders", "user_id = ANY(%s)"),
+    ("order_keys", "id IN (SELECT id FROM orders WHERE user_id = ANY(%s))"),
+    ("order_items", "order_id IN (SELECT id FROM orders WHERE user_id = ANY(%s))"),
+    ("user_order_stats", "user_id = ANY(%s)"),
+)
+
+
+@dataclass
+class ReshardReport:
+    # Number of users by (source node, target node), in the format of `host:port/database` of the shards
+    moved_users: Counter[tuple[str, str]] = field(default_factory=Counter)
+
+
+def reshard(
+    source: ShardingConfig,
+    target: ShardingConfig,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    dry_run: bool = False,
+    on_progress: Callable[[ReshardReport], None] = lambda report: None,
+) -> ReshardReport:
+    """
+    Move the users stored with the layout of `source` to their shards in the layout of `target`. Only counts them if
+    `dry_run`.
+    """
+    report = ReshardReport()
+    target_router = ShardRouter(len(target.shards))
+    if not dry_run:
+        migrate_up(ShardedSession(target))
+
+    target_conns: dict[PostgresConfig, psycopg.Connection] = {}
+    try:
+        for source_shard in dict.fromkeys(source.shards):
+            with new_postgres_conn(source_shard) as source_conn:
+                for user_ids in _user_id_batches(source_conn, batch_size):
+                    user_ids_by_target: dict[PostgresConfig, list[str]] = {}
+                    for user_id in user_ids:
+                        target_shard = target.shards[target_router.shard_of(user_id)]
+                        if target_shard != source_shard:
+                            user_ids_by_target.setdefault(target_shard, []).append(
+                                user_id
+                            )
+
+                    for target_shard, moving_user_ids in user_ids_by_target.items():
+                        if not dry_run:
+                            if target_shard not in target_conns:
+                                target_conns[target_shard] = new_postgres_conn(
+                                    target_shard
+                                )
+                            _move_users(
+                                source_conn, target_conns[target_shard], moving_user_ids
+                            )
+                        report.moved_users[
+                            (node_name(source_shard), node_name(target_shard))
+                        ] += len(moving_user_ids)
+                    on_progress(report)
+    finally:
+        for conn in target_conns.values():
+            conn.close()
+    return report
+
+
+def _user_id_batches(conn: psycopg.Connection, batch_size: int) -> Iterator[list[str]]:
+    # Keyset pagination, which is not affected by the deletion of the users already read
+    after_id = ""
+    while True:
+        user_ids = [
+            row[0]
+            for row in conn.execute(
+                "SELECT id FROM users WHERE id > %s ORDER BY id LIMIT %s;",
+                (after_id, batch_size),
+            ).fetchall()
+        ]
+        conn.commit()
+        if not user_ids:
+            return
+        after_id = user_ids[-1]
+        yield user_ids
+
+
+def _move_users(
+    source_conn: psycopg.Connection,
+    target_conn: psycopg.Connection,
+    user_ids: list[str],
+):
+    # Copied rows are skipped by ON CONFLICT, so the users can be moved again if the deletion fails
+    for table, condition in SHARD_TABLES:
+        rows_cursor = source_conn.execute(
+            f"SELECT * FROM {table} WHERE {condition};", (user_ids,)
+        )
+        rows = rows_cursor.fetchall()
+        if not rows:
+            continue
+        columns = [column.name for column in rows_cursor.description or []]
+        target_conn.cursor().executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) ON CONFLICT DO NOTHING;",
+            rows,
+        )
+    target_conn.commit()
+
+    for table, condition in reversed(SHARD_TABLES):
+        source_conn.execute(f"DELETE FROM {table} WHERE {condition};", (user_ids,))
+    source_conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Maintenance of the shards of the sharded postgres backend"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ("plan", "move"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument(
+            "--from",
+            dest="source_shards",
+            required=True,
+            help="The current shards, in the format of POSTGRES_SHARDS",
+        )
+        subparser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    recover_parser = subparsers.add_parser("recover")
+    recover_parser.add_argument("--min-age-seconds", type=float, default=60)
+    args = parser.parse_args()
+
+    target = ShardingConfig.from_env()
+    if args.command == "recover":
+        recovery_report = recover_prepared_transactions(target, args.min_age_seconds)
+        print(
+            f"committed: {recovery_report.committed}, rolled back: {recovery_report.rolled_back}"
+        )
+        return
+
+    def print_progress(report: ReshardReport):
+        print(f"users: {sum(report.moved_users.values())}", file=sys.stderr)
+
+    source = ShardingConfig(
+        catalog=target.catalog,
+        shards=parse_shards(args.source_shards, target.catalog),
+    )
+    report = reshard(
+        source,
+        target,
+        args.batch_size,
+        dry_run=args.command == "plan",
+        on_progress=print_progress,
+    )
+    for (source_node, target_node), count in report.moved_users.items():
+        print(f"{source_node} -> {target_node}: {count} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from typing import Annotated, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
+
+from app.auth import verify_admin_token
+from app.dependencies import get_lock_wait_monitor, get_trace_buffer
+from app.lock_waits import (
+    PRODUCT_LOCK,
+    USER_LOCK,
+    BlockingSample,
+    LockWaitMonitor,
+    LockWaitStats,
+)
+from app.tracing import RingBufferExporter, Span
+
+router = APIRouter(dependencies=[Depends(verify_admin_token)])
+
+
+class LockWaitReport(BaseModel):
+    window_seconds: float
+    top: list[LockWaitStats]  # Rows with the longest total wait first
+    samples: list[BlockingSample]  # Newest first
+
+
+@router.get("/lock-waits")
+def get_lock_waits(
+    lock_wait_monitor: Annotated[LockWaitMonitor, Depends(get_lock_wait_monitor)],
+    limit: Annotated[int, Query(ge=1, le=1000)] = 20,
+    kind: Annotated[
+        Optional[str], Query(pattern=f"^({USER_LOCK}|{PRODUCT_LOCK})$")
+    ] = None,
+) -> LockWaitReport:
+    """
+    Rows contended by the orders placed in this worker process.
+    """
+    return LockWaitReport(
+        window_seconds=lock_wait_monitor.window_seconds,
+        top=lock_wait_monitor.top(limit, kind),
+        samples=lock_wait_monitor.samples(),
+    )
+
+
+class SpanModel(BaseModel):
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    layer: str
+    start_time: float
+    duration_seconds: float
+    attributes: dict
+
+    @staticmethod
+    def from_span(span: Span):
+        return SpanModel(**span.to_dict())
+
+
+@router.get("/traces")
+def get_recent_traces(
+    trace_buffer: Annotated[RingBufferExporter, Depends(get_trace_buffer)],
+    limit: Annotated[int, Query(ge=1, le=1000)] = 20,
+) -> list[SpanModel]:
+    """
+    Root spans of the latest requests handled by this worker process. The trace id is the request id.
+    """
+    return list(map(SpanModel.from_span, trace_buffer.recent_root_spans(limit)))
+
+
+@router.get("/traces/{trace_id}")
+def get_trace(
+    trace_id: str,
+    trace_buffer: Annotated[RingBufferExporter, Depends(get_trace_buffer)],
+) -> list[SpanModel]:
+    spans = trace_buffer.get_trace(trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="trace not found")
+    return list(map(SpanModel.from_span, spans))
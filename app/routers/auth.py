@@ -11,6 +11,7 @@ from app.services.auth import (
     GetAccessTokenError,
     RegisterUserError,
 )
+from app.tracing import ROUTER_LAYER, traced
 
 
 router = APIRouter()
@@ -22,6 +23,7 @@ class Token(BaseModel):
 
 
 @router.post("/signup", status_code=201)
+@traced(ROUTER_LAYER)
 def sign_up(
     auth_input: AuthInput,  # Reuse domain model in the API layer because it can has the validation logic of the domain model and response bad request if the input is invalid.
     # If future wanna refactor the domain model without affecting the API layer, consider using a separate model for the API layer.
@@ -36,6 +38,7 @@ def sign_up(
 
 
 @router.post("/login")
+@traced(ROUTER_LAYER)
 def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     repository_session: Annotated[RepositorySession, Depends(get_repository_session)],
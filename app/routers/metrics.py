@@ -0,0 +1,15 @@
+from typing import Annotated
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from app.dependencies import get_app_metrics
+from app.metrics import AppMetrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(metrics: Annotated[AppMetrics, Depends(get_app_metrics)]):
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
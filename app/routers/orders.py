@@ -1,18 +1,45 @@
-from typing import Annotated
+from typing import Annotated, Optional
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response
+import orjson
+from pydantic import BaseModel, field_validator
 
 from app.auth import get_current_user_id
-from app.dependencies import get_repository_session
+from app.dependencies import (
+    get_inventory_snapshot,
+    get_lock_wait_monitor,
+    get_order_batch_config,
+    get_product_catalog_cache,
+    get_repository_session,
+)
 from app.err import MyValueError
-from app.models.order import Order, OrderItem, PurchaseInfo
-from app.repositories.order import order_repository_factory
+from app.lock_waits import LockWaitMonitor
+from app.models.order import (
+    Order,
+    OrderItem,
+    OrderQuote,
+    PurchaseInfo,
+    UserOrderStats,
+    validate_order_items,
+)
+from app.repositories.order import OrderItemRow, order_repository_factory
 from app.repositories.product import product_repository_factory
 from app.repositories.base import RepositorySession
 from app.repositories.user import user_repository_factory
-from app.services.order import OrderService
+from app.services.order import (
+    InventorySnapshot,
+    OrderBatchConfig,
+    OrderService,
+    PlaceOrderResult,
+)
+from app.services.product import ProductCatalogCache
+from app.tracing import ROUTER_LAYER, traced
 
+MAX_PAGE_SIZE = 100
+MAX_BATCH_SIZE = 100
+
+# The number of all orders of the user, in the responses of the pages of the orders
+TOTAL_COUNT_HEADER = "X-Total-Count"
 
 router = APIRouter()
 
@@ -25,6 +52,16 @@ class PurchaseRequest(BaseModel):
         return PurchaseInfo(order_items=self.order_items, order_id=str(self.order_id))
 
 
+class QuoteRequest(BaseModel):
+    order_items: tuple[OrderItem, ...]
+
+    @field_validator("order_items")
+    @classmethod
+    def validate_order_items(cls, v: tuple[OrderItem, ...]):
+        validate_order_items(v)
+        return v
+
+
 class OrderItemModel(BaseModel):
     id: str
     purchase_quantity: int
@@ -45,17 +82,58 @@ class OrderModel(BaseModel):
         )
 
 
+class PlaceOrderResultModel(BaseModel):
+    order_id: str
+    placed: bool
+
+    # The reason why the order is rejected
+    error: Optional[str] = None
+
+    @staticmethod
+    def from_domain(result: PlaceOrderResult):
+        return PlaceOrderResultModel(
+            order_id=result.order_id, placed=result.error is None, error=result.error
+        )
+
+
+def encode_orders(rows: list[OrderItemRow]) -> bytes:
+    """
+    Encode the rows of the orders as JSON in the schema of list[OrderModel] without building and validating the
+    models, which takes most of the time of the response for users with many orders.
+    """
+    orders: list[dict] = []
+    items: list[dict] = []
+    last_order_id = None
+    for order_id, product_id, quantity in rows:
+        if order_id != last_order_id:
+            items = []
+            orders.append({"id": order_id, "items": items})
+            last_order_id = order_id
+        if product_id is not None:
+            items.append({"id": product_id, "purchase_quantity": quantity})
+    return orjson.dumps(orders)
+
+
 @router.post("/", status_code=201)
+@traced(ROUTER_LAYER)
 def place_order(
     purchase_request: PurchaseRequest,
     current_user_id: Annotated[str, Depends(get_current_user_id)],
     repository_session: Annotated[RepositorySession, Depends(get_repository_session)],
+    product_catalog_cache: Annotated[
+        ProductCatalogCache, Depends(get_product_catalog_cache)
+    ],
+    inventory_snapshot: Annotated[InventorySnapshot, Depends(get_inventory_snapshot)],
+    lock_wait_monitor: Annotated[LockWaitMonitor, Depends(get_lock_wait_monitor)],
 ):
     order_service = OrderService(
         user_repository_factory,
         product_repository_factory,
         order_repository_factory,
         repository_session,
+        product_catalog_cache,
+        inventory_snapshot,
+        lock_wait_monitor,
     )
 
     try:
@@ -69,12 +147,99 @@ def place_order(
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.post("/quote", response_model=OrderQuote)
+@traced(ROUTER_LAYER)
+def quote_order(
+    quote_request: QuoteRequest,
+    current_user_id: Annotated[str, Depends(get_current_user_id)],
+    repository_session: Annotated[RepositorySession, Depends(get_repository_session)],
+):
+    # Reads without locks, so it doesn't wait for the orders being placed and isn't waited for by them
+    order_service = OrderService(
+        user_repository_factory,
+        product_repository_factory,
+        order_repository_factory,
+        repository_session,
+    )
+    try:
+        return order_service.quote_order(current_user_id, quote_request.order_items)
+    except MyValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/batch", response_model=list[PlaceOrderResultModel])
+@traced(ROUTER_LAYER)
+def place_orders(
+    purchase_requests: Annotated[
+        list[PurchaseRequest], Body(min_length=1, max_length=MAX_BATCH_SIZE)
+    ],
+    current_user_id: Annotated[str, Depends(get_current_user_id)],
+    repository_session: Annotated[RepositorySession, Depends(get_repository_session)],
+    product_catalog_cache: Annotated[
+        ProductCatalogCache, Depends(get_product_catalog_cache)
+    ],
+    inventory_snapshot: Annotated[InventorySnapshot, Depends(get_inventory_snapshot)],
+    lock_wait_monitor: Annotated[LockWaitMonitor, Depends(get_lock_wait_monitor)],
+    order_batch_config: Annotated[OrderBatchConfig, Depends(get_order_batch_config)],
+):
+    # All orders are validated before any of them is placed. The orders which can't be placed are reported in the
+    # results instead of failing the request. With chunks, a failed transaction after the first chunk is committed
+    # doesn't fail the request either: the orders of the failed chunk and those after it are reported as not placed,
+    # while the orders of the chunks before it stay placed.
+    order_service = OrderService(
+        user_repository_factory,
+        product_repository_factory,
+        order_repository_factory,
+        repository_session,
+        product_catalog_cache,
+        inventory_snapshot,
+        lock_wait_monitor,
+    )
+
+    purchase_infos = []
+    for index, purchase_request in enumerate(purchase_requests):
+        try:
+            purchase_infos.append(purchase_request.to_purchase_info())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"orders[{index}]: {e}")
+
+    try:
+        results = order_service.place_orders(
+            [(current_user_id, purchase_info) for purchase_info in purchase_infos],
+            order_batch_config.chunk_size,
+        )
+    except MyValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return [PlaceOrderResultModel.from_domain(result) for result in results]
+
+
 @router.get("/", response_model=list[OrderModel])
+@traced(ROUTER_LAYER)
 def get_orders(
     current_user_id: Annotated[str, Depends(get_current_user_id)],
     repository_session: Annotated[RepositorySession, Depends(get_repository_session)],
+    limit: Annotated[Optional[int], Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    offset: Annotated[int, Query(ge=0)] = 0,
+):
+    # All orders without limit. The total count of a page is read from the stats of the user, not by counting the orders.
+    order_repository = order_repository_factory(repository_session.new_operator)
+    headers = {}
+    with repository_session:
+        rows = order_repository.get_item_rows_by_user_id(current_user_id, limit, offset)
+        if limit is not None:
+            stats = order_repository.get_stats_by_user_id(current_user_id)
+            headers[TOTAL_COUNT_HEADER] = str(stats.order_count)
+
+    # The response model is only for the documentation. FastAPI doesn't validate a returned Response.
+    return Response(encode_orders(rows), media_type="application/json", headers=headers)
+
+
+@router.get("/stats", response_model=UserOrderStats)
+@traced(ROUTER_LAYER)
+def get_order_stats(
+    current_user_id: Annotated[str, Depends(get_current_user_id)],
+    repository_session: Annotated[RepositorySession, Depends(get_repository_session)],
 ):
     order_repository = order_repository_factory(repository_session.new_operator)
     with repository_session:
-        orders = order_repository.get_by_user_id(current_user_id)
-    return list(map(OrderModel.from_domain, orders))
+        return order_repository.get_stats_by_user_id(current_user_id)
@@ -0,0 +1,83 @@
+from typing import Annotated, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
+
+from app.dependencies import get_product_catalog_cache, get_repository_session
+from app.models.product import Product
+from app.repositories.base import RepositorySession
+from app.repositories.err import EntityNotFoundError
+from app.repositories.product import ProductSearchQuery, product_repository_factory
+from app.services.product import ProductCatalogCache, ProductService
+from app.tracing import ROUTER_LAYER, traced
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+router = APIRouter()
+
+
+class ProductPage(BaseModel):
+    items: list[Product]
+    # Pass it as after_id to get the next page. None if this is the last page.
+    next_after_id: Optional[str]
+
+
+def product_service_factory(
+    repository_session: Annotated[RepositorySession, Depends(get_repository_session)],
+    catalog_cache: Annotated[ProductCatalogCache, Depends(get_product_catalog_cache)],
+) -> ProductService:
+    return ProductService(product_repository_factory, repository_session, catalog_cache)
+
+
+@router.get("/", response_model=ProductPage)
+@traced(ROUTER_LAYER)
+def get_products(
+    product_service: Annotated[ProductService, Depends(product_service_factory)],
+    category: Optional[str] = None,
+    after_id: Optional[str] = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+):
+    products = product_service.get_page(limit, after_id, category)
+    next_after_id = products[-1].id if len(products) == limit else None
+    return ProductPage(items=products, next_after_id=next_after_id)
+
+
+# Declared before "/{product_id}" so that "search" isn't treated as a product id
+@router.get("/search", response_model=list[Product])
+@traced(ROUTER_LAYER)
+def search_products(
+    product_service: Annotated[ProductService, Depends(product_service_factory)],
+    q: Annotated[Optional[str], Query(description="Words in product name")] = None,
+    category: Optional[str] = None,
+    min_price: Annotated[Optional[float], Query(ge=0)] = None,
+    max_price: Annotated[Optional[float], Query(ge=0)] = None,
+    in_stock: bool = False,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    after_id: Annotated[
+        Optional[str],
+        Query(description="The id of the last product of the previous page"),
+    ] = None,
+):
+    return product_service.search(
+        ProductSearchQuery(
+            text=q,
+            category=category,
+            min_price=min_price,
+            max_price=max_price,
+            in_stock=in_stock,
+            limit=limit,
+            after_id=after_id,
+        )
+    )
+
+
+@router.get("/{product_id}", response_model=Product)
+@traced(ROUTER_LAYER)
+def get_product(
+    product_id: str,
+    product_service: Annotated[ProductService, Depends(product_service_factory)],
+):
+    try:
+        return product_service.get_product(product_id)
+    except EntityNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
@@ -0,0 +1,62 @@
+from datetime import datetime
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.auth import verify_admin_token
+from app.dependencies import get_repository_session
+from app.models.sales import (
+    SalesDimension,
+    SalesMetric,
+    SalesPeriod,
+    SalesRollup,
+    TopSeller,
+)
+from app.repositories.base import RepositorySession
+from app.repositories.sales import sales_repository_factory
+from app.tracing import ROUTER_LAYER, traced
+
+MAX_TOP_SELLERS = 1000
+
+# The reports read the rollups maintained by app/sales_rollups.py, never the orders
+router = APIRouter(dependencies=[Depends(verify_admin_token)])
+
+
+def _validate_range(since: datetime, until: datetime):
+    # The rollups store the hours in the time zone of the database without the offset
+    if since.tzinfo is not None or until.tzinfo is not None:
+        raise HTTPException(
+            status_code=400, detail="since and until must not have a time zone"
+        )
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+
+
+@router.get("/sales", response_model=list[SalesRollup])
+@traced(ROUTER_LAYER)
+def get_sales(
+    repository_session: Annotated[RepositorySession, Depends(get_repository_session)],
+    since: datetime,
+    until: datetime,
+    dimension: SalesDimension = SalesDimension.PRODUCT,
+    period: SalesPeriod = SalesPeriod.DAY,
+):
+    _validate_range(since, until)
+    sales_repository = sales_repository_factory(repository_session.new_operator)
+    with repository_session:
+        return sales_repository.get_sales(dimension, period, since, until)
+
+
+@router.get("/top-sellers", response_model=list[TopSeller])
+@traced(ROUTER_LAYER)
+def get_top_sellers(
+    repository_session: Annotated[RepositorySession, Depends(get_repository_session)],
+    since: datetime,
+    until: datetime,
+    metric: SalesMetric = SalesMetric.UNITS,
+    limit: Annotated[int, Query(ge=1, le=MAX_TOP_SELLERS)] = 10,
+):
+    _validate_range(since, until)
+    sales_repository = sales_repository_factory(repository_session.new_operator)
+    with repository_session:
+        return sales_repository.get_top_sellers(since, until, metric, limit)
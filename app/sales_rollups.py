@@ -0,0 +1,74 @@
+"""
+Aggregation of the items of the new orders into the sales rollups read by the reports under /reports. See
+SalesRepository.
+
+Each run aggregates the orders created since the previous run, except those of the last SALES_ROLLUP_LAG_SECONDS
+(default 60), which are left to the next run. With the postgres backends, the orders are also left while an older
+transaction is running, so a run never skips the orders of the transactions committing after it. With --interval, it
+runs every that many seconds until interrupted, e.g. as a separate process next to the servers. Concurrent runs wait
+for each other.
+
+Usage:
+    python -m app.sales_rollups [--interval 60]
+"""
+
+import argparse
+from dataclasses import dataclass
+import os
+import time
+from typing import Optional
+
+from app.dependencies import get_repository_session
+from app.repositories.base import RepositorySession
+from app.repositories.migration import migrate_up
+from app.repositories.sales import sales_repository_factory
+
+
+@dataclass(frozen=True)
+class SalesRollupConfig:
+    # The orders created more recently are not aggregated yet
+    lag_seconds: float
+
+    @staticmethod
+    def from_env():
+        return SalesRollupConfig(
+            lag_seconds=float(os.getenv("SALES_ROLLUP_LAG_SECONDS", "60"))
+        )
+
+
+def aggregate_sales(session: RepositorySession, lag_seconds: float) -> int:
+    """
+    Returns:
+        The number of order items aggregated.
+    """
+    sales_repository = sales_repository_factory(session.new_operator)
+    with session:
+        item_count = sales_repository.aggregate(lag_seconds)
+        session.commit()
+    return item_count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Aggregate the items of the new orders into the sales rollups"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        help="Run every this many seconds instead of once",
+    )
+    args = parser.parse_args()
+    interval: Optional[float] = args.interval
+
+    session = get_repository_session()
+    migrate_up(session)
+    lag_seconds = SalesRollupConfig.from_env().lag_seconds
+    while True:
+        print(f"Aggregated {aggregate_sales(session, lag_seconds)} order items")
+        if interval is None:
+            return
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    main()
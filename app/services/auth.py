@@ -13,6 +13,7 @@ from app.repositories.auth import AuthRecordRepository, AuthRecordRepositoryFact
 from app.repositories.err import EntityAlreadyExistsError, EntityNotFoundError
 from app.repositories.base import RepositorySession
 from app.repositories.user import UserRepository, UserRepositoryFactory
+from app.tracing import traced
 
 Operator = TypeVar("Operator")
 
@@ -78,16 +79,15 @@ class AuthService(Generic[Operator]):
         )
         self._session = repository_session
 
+    @traced()
     def sign_up(self, auth_input: AuthInput):
+        user = self._new_user()
+        # Hash the password before opening the session so that the slow bcrypt call doesn't hold the database connection.
+        auth_record = self._new_auth_record(user.id, auth_input)
+
         try:
             with self._session:
-                user = self._new_user()
-                self._user_repository.save(user)
-
-                # In the postgres implementation of repository, if other concurrent transaction inserted the same username first without committing, this will wait until the other transaction is committed or rolled back.
-                # If the other transaction is rolled back, this will insert the record. Otherwise, it will raise EntityAlreadyExistsError.
-                self._auth_repository.add(self._new_auth_record(user.id, auth_input))
-
+                self._auth_repository.add_with_user(auth_record, user)
                 self._session.commit()
         except EntityAlreadyExistsError:
             raise RegisterUserError.username_exists_error(auth_input.username)
@@ -109,6 +109,7 @@ class AuthService(Generic[Operator]):
         except EntityNotFoundError:
             return None
 
+    @traced()
     def get_access_token(self, auth_input: AuthInput) -> str:
         with self._session:
             auth_record = self._get_auth_record(auth_input.username)
@@ -135,6 +136,7 @@ class AuthService(Generic[Operator]):
         )
         return encoded_jwt
 
+    @traced()
     def decode_user_id(self, access_token: str) -> str:
         try:
             payload = jwt.decode(
@@ -1,22 +1,40 @@
-from typing import TypeVar, Generic
+from contextlib import nullcontext
+from dataclasses import dataclass
+import logging
+import os
+from typing import Callable, Iterable, Optional, Sequence, TypeVar, Generic
 from uuid import uuid4
+from app.cache import TTLCache
 from app.err import MyValueError
-from app.models.order import Order, PurchaseInfo
+from app.lock_waits import PRODUCT_LOCK, USER_LOCK, LockWaitMonitor
+from app.models.order import (
+    Order,
+    OrderItem,
+    OrderQuote,
+    PurchaseInfo,
+    QuoteLine,
+)
 from app.models.product import Product
 from app.models.user import User
-from app.repositories.err import EntityAlreadyExistsError
+from app.repositories.err import EntityAlreadyExistsError, EntityNotFoundError
 from app.repositories.order import OrderRepository, OrderRepositoryFactory
 from app.repositories.product import ProductRepository, ProductRepositoryFactory
 from app.repositories.base import LockLevel, RepositorySession
 from app.repositories.user import UserRepository, UserRepositoryFactory
+from app.services.product import ProductCatalogCache
+from app.tracing import set_span_attributes, traced
 
 Operator = TypeVar("Operator")
+Entity = TypeVar("Entity")
+
+logger = logging.getLogger(__name__)
 
 
 class PlaceOrderError(MyValueError):
     QUANTITY_NOT_ENOUGH_ERR_MSG = "quantity of product is not enough for your purchase"
     BALANCE_NOT_ENOUGH_ERR_MSG = "not enough balance"
     ORDER_ALREADY_EXISTS_ERR_MSG = "order already exists"
+    CHUNK_FAILED_ERR_MSG = "not placed because the transaction of its chunk failed"
 
     @classmethod
     def quantity_not_enough_error(cls):
@@ -27,6 +45,88 @@ class PlaceOrderError(MyValueError):
         return PlaceOrderError(cls.BALANCE_NOT_ENOUGH_ERR_MSG)
 
 
+@dataclass(frozen=True)
+class InventorySnapshotConfig:
+    max_products: int = 100000
+    ttl_seconds: float = 1
+
+    @staticmethod
+    def from_env():
+        max_products = int(os.getenv("INVENTORY_SNAPSHOT_MAX_PRODUCTS", 100000))
+        ttl_seconds = float(os.getenv("INVENTORY_SNAPSHOT_TTL_SECONDS", 1))
+
+        return InventorySnapshotConfig(
+            max_products=max_products, ttl_seconds=ttl_seconds
+        )
+
+
+class InventorySnapshot:
+    """
+    Short-lived in-process record of the last known quantities of products, read while holding the lock on them.
+
+    Used to reject the orders that clearly cannot be filled without taking any lock. Quantities only go down by placing
+    orders, so a known quantity that is not enough for a purchase will still be not enough unless the product is
+    restocked. Call `invalidate` when products are restocked, otherwise the orders may be wrongly rejected until the
+    entries expire.
+    """
+
+    def __init__(self, config: InventorySnapshotConfig):
+        self._quantities: TTLCache[str, int] = TTLCache(
+            config.max_products, config.ttl_seconds
+        )
+
+    def record(self, product: Product):
+        self._quantities.set(product.id, product.quantity)
+
+    def get_quantity(self, product_id: str) -> Optional[int]:
+        return self._quantities.get(product_id)
+
+    def invalidate(self, product_ids: Iterable[str]):
+        for product_id in product_ids:
+            self._quantities.pop(product_id)
+
+    def clear(self):
+        self._quantities.clear()
+
+
+def price_order_items(
+    order_items: Iterable[OrderItem], products_by_id: dict[str, Product]
+) -> list[QuoteLine]:
+    """
+    The price of each item at the current price of its product, and whether the stock of the product is enough for it,
+    without changing the products.
+    """
+    return [
+        QuoteLine(
+            product_id=item.product_id,
+            quantity=item.quantity,
+            unit_price=products_by_id[item.product_id].price,
+            line_price=item.quantity * products_by_id[item.product_id].price,
+            in_stock=products_by_id[item.product_id].quantity >= item.quantity,
+        )
+        for item in order_items
+    ]
+
+
+@dataclass(frozen=True)
+class OrderBatchConfig:
+    # The orders of a batch are placed in transactions of at most this many orders. All in one transaction if None.
+    chunk_size: Optional[int] = None
+
+    @staticmethod
+    def from_env():
+        chunk_size = os.getenv("ORDER_BATCH_CHUNK_SIZE")
+        return OrderBatchConfig(chunk_size=int(chunk_size) if chunk_size else None)
+
+
+@dataclass(frozen=True)
+class PlaceOrderResult:
+    order_id: str
+
+    # The reason why the order is rejected. None if it is placed.
+    error: Optional[str] = None
+
+
 class OrderService(Generic[Operator]):
     def __init__(
         self,
@@ -34,6 +134,9 @@ class OrderService(Generic[Operator]):
         product_repository_factory: ProductRepositoryFactory[Operator],
         order_repository_factory: OrderRepositoryFactory[Operator],
         repository_session: RepositorySession[Operator],
+        product_catalog_cache: Optional[ProductCatalogCache] = None,
+        inventory_snapshot: Optional[InventorySnapshot] = None,
+        lock_wait_monitor: Optional[LockWaitMonitor] = None,
     ):
         self._user_repository: UserRepository[Operator] = user_repository_factory(
             repository_session.new_operator
@@ -45,12 +148,22 @@ class OrderService(Generic[Operator]):
             repository_session.new_operator
         )
         self._session = repository_session
+        self._product_catalog_cache = product_catalog_cache
+        self._inventory_snapshot = inventory_snapshot
+        self._lock_wait_monitor = lock_wait_monitor
 
+    @traced()
     def place_order(self, user_id: str, purchase_info: PurchaseInfo):
+        set_span_attributes(product_count=len(purchase_info.order_items))
+
+        # Reject before locking anything. The check with locks below is still the final authority.
+        self._check_inventory_snapshot(purchase_info)
+
         with self._session:
-            user = self._user_repository.get_by_id(
-                user_id, lock_level=LockLevel.MODIFY_LOCK
-            )
+            with self._track_lock_wait(USER_LOCK, user_id):
+                user = self._user_repository.get_by_id(
+                    user_id, lock_level=LockLevel.MODIFY_LOCK
+                )
             products_by_id = self._fetch_products_with_modify_lock(
                 [item.product_id for item in purchase_info.order_items]
             )
@@ -58,10 +171,221 @@ class OrderService(Generic[Operator]):
             total_price = self._process_products(purchase_info, products_by_id)
             self._make_payment(user, total_price)
 
-            self._record_order(user.id, purchase_info)
+            self._record_order(user.id, purchase_info, products_by_id)
 
             self._session.commit()
 
+        if self._product_catalog_cache is not None:
+            self._product_catalog_cache.invalidate(products_by_id.keys())
+        if self._inventory_snapshot is not None:
+            for product in products_by_id.values():
+                self._inventory_snapshot.record(product)
+
+    @traced()
+    def quote_order(
+        self, user_id: str, order_items: tuple[OrderItem, ...]
+    ) -> OrderQuote:
+        """
+        Price the items as placing them would, and check the stock and the balance, without changing or locking
+        anything. The user and the products are read from one snapshot, so the quote is consistent even when orders are
+        being placed concurrently.
+
+        Raises:
+            EntityNotFoundError: If the user or a product doesn't exist.
+        """
+        set_span_attributes(product_count=len(order_items))
+        with self._session:
+            self._session.begin_snapshot()
+            user = self._user_repository.get_by_id(user_id)
+            products_by_id = {
+                item.product_id: self._product_repository.get_by_id(item.product_id)
+                for item in order_items
+            }
+
+        lines = price_order_items(order_items, products_by_id)
+        total_price = sum(line.line_price for line in lines)
+        balance_sufficient = total_price <= user.balance
+        return OrderQuote(
+            lines=tuple(lines),
+            total_price=total_price,
+            balance=user.balance,
+            balance_sufficient=balance_sufficient,
+            placeable=balance_sufficient and all(line.in_stock for line in lines),
+        )
+
+    @traced()
+    def place_orders(
+        self,
+        purchases: Sequence[tuple[str, PurchaseInfo]],
+        chunk_size: Optional[int] = None,
+    ) -> list[PlaceOrderResult]:
+        """
+        Place the orders of the pairs of user id and purchase info in their order. Each chunk of `chunk_size` orders (all
+        of them if None) is placed in one transaction, which locks each of its users and then each of its products once,
+        in the order of their ids. An order which can't be placed, e.g. because the orders before it in the batch took
+        the stock it needs, is rejected without affecting the others.
+
+        If the transaction of a chunk fails after the chunks before it are committed, e.g. with a deadlock or a lost
+        connection, the orders of that chunk and the chunks after it are rejected with the name of the error and the
+        results of the committed chunks are returned. If the first chunk fails, nothing is committed and the error is
+        raised.
+
+        Returns:
+            The result of each order, in the same order.
+        """
+        set_span_attributes(order_count=len(purchases))
+        size = chunk_size or max(len(purchases), 1)
+        results: list[PlaceOrderResult] = []
+        for start in range(0, len(purchases), size):
+            try:
+                results.extend(self._place_chunk(purchases[start : start + size]))
+            except Exception as e:
+                if not results:
+                    raise
+                logger.exception(
+                    "Failed to place orders %s to %s of batch", start, len(purchases)
+                )
+                error = f"{PlaceOrderError.CHUNK_FAILED_ERR_MSG}: {type(e).__name__}"
+                results.extend(
+                    PlaceOrderResult(purchase_info.order_id, error)
+                    for _, purchase_info in purchases[start:]
+                )
+                break
+        return results
+
+    def _place_chunk(
+        self, purchases: Sequence[tuple[str, PurchaseInfo]]
+    ) -> list[PlaceOrderResult]:
+        errors: dict[int, str] = {}
+        for index, (_, purchase_info) in enumerate(purchases):
+            try:
+                self._check_inventory_snapshot(purchase_info)
+            except PlaceOrderError as e:
+                errors[index] = str(e)
+        pending = [index for index in range(len(purchases)) if index not in errors]
+
+        with self._session:
+            users_by_id = self._fetch_existing_with_modify_lock(
+                USER_LOCK,
+                {purchases[index][0] for index in pending},
+                self._user_repository.get_by_id,
+            )
+            products_by_id = self._fetch_existing_with_modify_lock(
+                PRODUCT_LOCK,
+                {
+                    item.product_id
+                    for index in pending
+                    for item in purchases[index][1].order_items
+                },
+                self._product_repository.get_by_id,
+            )
+
+            changed_user_ids: set[str] = set()
+            changed_product_ids: set[str] = set()
+            for index in pending:
+                user_id, purchase_info = purchases[index]
+                try:
+                    self._place_locked(
+                        user_id, purchase_info, users_by_id, products_by_id
+                    )
+                except MyValueError as e:
+                    errors[index] = str(e)
+                    continue
+                changed_user_ids.add(user_id)
+                changed_product_ids.update(
+                    item.product_id for item in purchase_info.order_items
+                )
+
+            # Saved once however many orders changed them
+            for product_id in sorted(changed_product_ids):
+                self._product_repository.save(products_by_id[product_id])
+            for user_id in sorted(changed_user_ids):
+                self._user_repository.save(users_by_id[user_id])
+
+            self._session.commit()
+
+        if self._product_catalog_cache is not None:
+            self._product_catalog_cache.invalidate(changed_product_ids)
+        if self._inventory_snapshot is not None:
+            for product in products_by_id.values():
+                self._inventory_snapshot.record(product)
+
+        return [
+            PlaceOrderResult(purchase_info.order_id, errors.get(index))
+            for index, (_, purchase_info) in enumerate(purchases)
+        ]
+
+    def _fetch_existing_with_modify_lock(
+        self, kind: str, keys: set[str], get_by_id: Callable[..., Entity]
+    ) -> dict[str, Entity]:
+        """
+        The entities of the keys which exist, locked in the order of their keys to avoid deadlocks.
+        """
+        entities_by_key: dict[str, Entity] = {}
+        for key in sorted(keys):
+            try:
+                with self._track_lock_wait(kind, key):
+                    entities_by_key[key] = get_by_id(
+                        key, lock_level=LockLevel.MODIFY_LOCK
+                    )
+            except EntityNotFoundError:
+                continue
+        return entities_by_key
+
+    def _place_locked(
+        self,
+        user_id: str,
+        purchase_info: PurchaseInfo,
+        users_by_id: dict[str, User],
+        products_by_id: dict[str, Product],
+    ):
+        """
+        Check the order against the locked user and products of a batch, record it and then update them in place. The
+        user and products are saved by the caller.
+
+        Raises:
+            MyValueError: If the order can't be placed. Nothing is changed.
+        """
+        user = users_by_id.get(user_id)
+        if user is None:
+            raise EntityNotFoundError.create("id", user_id)
+
+        for order_item in purchase_info.order_items:
+            if order_item.product_id not in products_by_id:
+                raise EntityNotFoundError.create("id", order_item.product_id)
+        lines = price_order_items(purchase_info.order_items, products_by_id)
+        if not all(line.in_stock for line in lines):
+            raise PlaceOrderError.quantity_not_enough_error()
+        total_price: float = sum(line.line_price for line in lines)
+        if total_price > user.balance:
+            raise PlaceOrderError.balance_not_enough_error()
+
+        self._record_order(
+            user_id,
+            purchase_info,
+            {
+                item.product_id: products_by_id[item.product_id]
+                for item in purchase_info.order_items
+            },
+        )
+        for order_item in purchase_info.order_items:
+            products_by_id[order_item.product_id].quantity -= order_item.quantity
+        user.balance -= total_price
+
+    def _check_inventory_snapshot(self, purchase_info: PurchaseInfo):
+        if self._inventory_snapshot is None:
+            return
+
+        for order_item in purchase_info.order_items:
+            quantity = self._inventory_snapshot.get_quantity(order_item.product_id)
+            if quantity is not None and quantity < order_item.quantity:
+                raise PlaceOrderError.quantity_not_enough_error()
+
+    def _track_lock_wait(self, kind: str, key: str):
+        if self._lock_wait_monitor is None:
+            return nullcontext()
+        return self._lock_wait_monitor.track(kind, key)
+
     def _fetch_products_with_modify_lock(
         self, product_ids: list[str]
     ) -> dict[str, Product]:
@@ -71,9 +395,10 @@ class OrderService(Generic[Operator]):
 
         products_by_id: dict[str, Product] = {}
         for product_id in product_ids:
-            product = self._product_repository.get_by_id(
-                product_id, lock_level=LockLevel.MODIFY_LOCK
-            )
+            with self._track_lock_wait(PRODUCT_LOCK, product_id):
+                product = self._product_repository.get_by_id(
+                    product_id, lock_level=LockLevel.MODIFY_LOCK
+                )
             products_by_id[product.id] = product
         return products_by_id
 
@@ -85,14 +410,17 @@ class OrderService(Generic[Operator]):
         """
 
         total_price: float = 0
-        for order_item in purchase_info.order_items:
-            product = products_by_id[order_item.product_id]
-            self._update_product_inventory(product, order_item.quantity)
-            total_price += order_item.quantity * product.price
+        for line in price_order_items(purchase_info.order_items, products_by_id):
+            self._update_product_inventory(
+                products_by_id[line.product_id], line.quantity
+            )
+            total_price += line.line_price
         return total_price
 
     def _update_product_inventory(self, product: Product, purchase_quantity: int):
         if product.quantity < purchase_quantity:
+            if self._inventory_snapshot is not None:
+                self._inventory_snapshot.record(product)
             raise PlaceOrderError.quantity_not_enough_error()
 
         product.quantity -= purchase_quantity
@@ -105,13 +433,24 @@ class OrderService(Generic[Operator]):
         user.balance -= total_price
         self._user_repository.save(user)
 
-    def _record_order(self, user_id: str, purchase_info: PurchaseInfo):
+    def _record_order(
+        self,
+        user_id: str,
+        purchase_info: PurchaseInfo,
+        products_by_id: dict[str, Product],
+    ):
         try:
             order = Order(
                 id=str(purchase_info.order_id),
                 user_id=user_id,
                 order_items=purchase_info.order_items,
             )
-            self._order_repository.add(order)
+            self._order_repository.add(
+                order,
+                unit_prices={
+                    product_id: product.price
+                    for product_id, product in products_by_id.items()
+                },
+            )
         except EntityAlreadyExistsError:
             raise PlaceOrderError(PlaceOrderError.ORDER_ALREADY_EXISTS_ERR_MSG)
@@ -0,0 +1,144 @@
+from dataclasses import dataclass
+import os
+from threading import Lock
+from typing import Callable, Generic, Hashable, Iterable, Optional, TypeVar
+
+from app.cache import TTLCache
+from app.models.product import Product
+from app.repositories.base import RepositorySession
+from app.repositories.product import (
+    ProductRepository,
+    ProductRepositoryFactory,
+    ProductSearchQuery,
+)
+from app.tracing import traced
+
+Operator = TypeVar("Operator")
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class ProductCatalogCacheConfig:
+    max_products: int = 10000
+    max_pages: int = 1000
+    ttl_seconds: float = 30
+
+    @staticmethod
+    def from_env():
+        max_products = int(os.getenv("PRODUCT_CACHE_MAX_PRODUCTS", 10000))
+        max_pages = int(os.getenv("PRODUCT_CACHE_MAX_PAGES", 1000))
+        ttl_seconds = float(os.getenv("PRODUCT_CACHE_TTL_SECONDS", 30))
+
+        return ProductCatalogCacheConfig(
+            max_products=max_products, max_pages=max_pages, ttl_seconds=ttl_seconds
+        )
+
+
+class ProductCatalogCache:
+    """
+    In-process cache of products keyed by product id, and of query results keyed by the query.
+
+    Stale entries expire after the TTL. Call `invalidate` after committing changes of products so that
+    the entries containing those products are evicted immediately.
+    """
+
+    def __init__(self, config: ProductCatalogCacheConfig):
+        self._products: TTLCache[str, Product] = TTLCache(
+            config.max_products, config.ttl_seconds
+        )
+        self._queries: TTLCache[Hashable, list[Product]] = TTLCache(
+            config.max_pages, config.ttl_seconds
+        )
+
+        # Incremented on every invalidation. A value loaded while an invalidation happened may be stale,
+        # so it is returned without being cached.
+        self._generation = 0
+        self._generation_lock = Lock()
+
+    def get_product(self, product_id: str, load: Callable[[], Product]) -> Product:
+        return self._get_or_load(self._products, product_id, load)
+
+    def get_query_result(
+        self, key: Hashable, load: Callable[[], list[Product]]
+    ) -> list[Product]:
+        return self._get_or_load(self._queries, key, load)
+
+    def _get_or_load(self, cache: TTLCache, key, load: Callable[[], T]) -> T:
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+        generation = self._generation
+        value = load()
+        with self._generation_lock:
+            if generation == self._generation:
+                cache.set(key, value)
+        return value
+
+    def invalidate(self, product_ids: Iterable[str]):
+        product_ids = set(product_ids)
+        with self._generation_lock:
+            self._generation += 1
+            for product_id in product_ids:
+                self._products.pop(product_id)
+            self._queries.remove_if(
+                lambda _, products: any(
+                    product.id in product_ids for product in products
+                )
+            )
+
+    def clear(self):
+        with self._generation_lock:
+            self._generation += 1
+            self._products.clear()
+            self._queries.clear()
+
+
+class ProductService(Generic[Operator]):
+    def __init__(
+        self,
+        product_repository_factory: ProductRepositoryFactory[Operator],
+        repository_session: RepositorySession[Operator],
+        catalog_cache: ProductCatalogCache,
+    ):
+        self._product_repository: ProductRepository[Operator] = (
+            product_repository_factory(repository_session.new_operator)
+        )
+        self._session = repository_session
+        self._catalog_cache = catalog_cache
+
+    @traced()
+    def get_product(self, product_id: str) -> Product:
+        """
+        Raises:
+            EntityNotFoundError: If no product is found with the provided id.
+        """
+
+        def load():
+            with self._session:
+                return self._product_repository.get_by_id(product_id)
+
+        return self._catalog_cache.get_product(product_id, load)
+
+    @traced()
+    def get_page(
+        self,
+        limit: int,
+        after_id: Optional[str] = None,
+        category: Optional[str] = None,
+    ) -> list[Product]:
+        def load():
+            with self._session:
+                return self._product_repository.get_page(limit, after_id, category)
+
+        return self._catalog_cache.get_query_result(
+            ("page", limit, after_id, category), load
+        )
+
+    @traced()
+    def search(self, query: ProductSearchQuery) -> list[Product]:
+        def load():
+            with self._session:
+                return self._product_repository.search(query)
+
+        return self._catalog_cache.get_query_result(("search", query), load)
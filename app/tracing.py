@@ -0,0 +1,329 @@
+"""
+Lightweight in-process tracing to attribute the latency of a single request to the router, service and repository
+layers.
+
+TracingMiddleware starts the root span of the sampled requests, identified by the request id. The route handlers and
+the service methods decorated with `traced` start child spans, and every SQL statement is recorded as a span of the
+repository method executing it. No request is sampled by default. Outside of a traced request (e.g. in scripts, tests
+and the requests not sampled), `traced` does nothing but a context variable lookup.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+import functools
+import json
+import logging
+import os
+from queue import Empty, Full, Queue
+import random
+from threading import Lock, Thread
+import time
+from typing import Any, Callable, Iterator, Optional, Protocol, Sequence, TypeVar
+from uuid import uuid4
+
+from app.metrics import get_route_path
+from app.repositories.postgres.instrumentation import StatementRecord
+
+HTTP_LAYER = "http"
+ROUTER_LAYER = "router"
+SERVICE_LAYER = "service"
+REPOSITORY_LAYER = "repository"
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TracingConfig:
+    sample_rate: float = 0  # Fraction of the requests traced, from 0 (none) to 1 (all)
+    buffer_size: int = 10000  # Number of the latest spans kept in memory
+    jsonl_path: Optional[str] = None  # Also append the spans to this file if set
+
+    @staticmethod
+    def from_env():
+        sample_rate = float(os.getenv("TRACING_SAMPLE_RATE", 0))
+        buffer_size = int(os.getenv("TRACING_BUFFER_SIZE", 10000))
+        jsonl_path = os.getenv("TRACING_JSONL_PATH") or None
+
+        return TracingConfig(
+            sample_rate=sample_rate, buffer_size=buffer_size, jsonl_path=jsonl_path
+        )
+
+
+@dataclass
+class Span:
+    trace_id: str  # The request id
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    layer: str
+    start_time: float  # Unix time
+    duration_seconds: float = 0
+    attributes: Optional[dict[str, Any]] = None
+
+    def set_attributes(self, **attributes: Any):
+        if self.attributes is None:
+            self.attributes = {}
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "layer": self.layer,
+            "start_time": self.start_time,
+            "duration_seconds": self.duration_seconds,
+            "attributes": self.attributes or {},
+        }
+
+
+class SpanExporter(Protocol):
+    def export(self, span: Span):
+        pass
+
+
+class RingBufferExporter:
+    """
+    Keeps the latest spans in memory.
+    """
+
+    def __init__(self, max_spans: int):
+        self._spans: deque[Span] = deque(maxlen=max_spans)
+        self._lock = Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+
+    def get_trace(self, trace_id: str) -> list[Span]:
+        """
+        Return the spans of the trace ordered by start time. Spans of an old trace may have been dropped.
+        """
+        with self._lock:
+            spans = [span for span in self._spans if span.trace_id == trace_id]
+        return sorted(spans, key=lambda span: span.start_time)
+
+    def recent_root_spans(self, limit: int) -> list[Span]:
+        """
+        Return the root spans of the latest traces, newest first.
+        """
+        with self._lock:
+            root_spans = [span for span in self._spans if span.parent_id is None]
+        return list(reversed(root_spans))[:limit]
+
+
+class JsonlExporter:
+    """
+    Appends each span to a file as a JSON line. The spans are written by a background thread, so that the requests
+    don't wait for the file. The spans exported while `max_pending` spans are waiting to be written are dropped.
+    """
+
+    def __init__(self, path: str, max_pending: int = 10000):
+        self._file = open(path, "a")
+        self._pending: Queue[Optional[Span]] = Queue(max_pending)
+        self.dropped_count = 0
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        try:
+            self._pending.put_nowait(span)
+        except Full:
+            self.dropped_count += 1
+
+    def close(self):
+        """
+        Write the pending spans and close the file.
+        """
+        self._pending.put(None)
+        self._thread.join()
+        self._file.close()
+
+    def _run(self):
+        while True:
+            # Flushed once for all the spans exported meanwhile
+            spans = [self._pending.get()]
+            try:
+                while True:
+                    spans.append(self._pending.get_nowait())
+            except Empty:
+                pass
+
+            closed = None in spans
+            try:
+                self._file.writelines(
+                    json.dumps(span.to_dict()) + "\n" for span in spans if span
+                )
+                self._file.flush()
+            except OSError:
+                logger.exception("Failed to write %s spans", len(spans))
+            if closed:
+                return
+
+
+class Tracer:
+    def __init__(self, exporters: Sequence[SpanExporter], sample_rate: float = 1):
+        """
+        Args:
+            sample_rate: Fraction of the traces started by TracingMiddleware.
+        """
+        self._exporters = list(exporters)
+        self.sample_rate = sample_rate
+
+    def sample(self) -> bool:
+        return random.random() < self.sample_rate
+
+    @contextmanager
+    def start_span(
+        self,
+        name: str,
+        layer: str,
+        trace_id: Optional[str] = None,
+        **attributes: Any,
+    ) -> Iterator[Span]:
+        """
+        Start a child span of the current span, or a root span of a new trace if there is no current span.
+        """
+        parent = _current_span.get()
+        span = Span(
+            trace_id=parent[1].trace_id if parent else (trace_id or uuid4().hex),
+            span_id=uuid4().hex[:16],
+            parent_id=parent[1].span_id if parent else None,
+            name=name,
+            layer=layer,
+            start_time=time.time(),
+            attributes=attributes or None,
+        )
+        token = _current_span.set((self, span))
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.set_attributes(error=type(e).__name__)
+            raise
+        finally:
+            span.duration_seconds = time.perf_counter() - start
+            _current_span.reset(token)
+            self.export(span)
+
+    def export(self, span: Span):
+        for exporter in self._exporters:
+            exporter.export(span)
+
+
+# The tracer is kept with the span so that the code being traced doesn't need a reference to it
+_current_span: ContextVar[Optional[tuple[Tracer, Span]]] = ContextVar(
+    "current_span", default=None
+)
+
+
+def current_span() -> Optional[Span]:
+    current = _current_span.get()
+    return current[1] if current else None
+
+
+def set_span_attributes(**attributes: Any):
+    """
+    Set the attributes of the current span if there is one.
+    """
+    span = current_span()
+    if span is not None:
+        span.set_attributes(**attributes)
+
+
+def traced(layer: str = SERVICE_LAYER) -> Callable[[F], F]:
+    """
+    Decorate a function to run it in a span named after its qualified name when called within a trace.
+    """
+
+    def decorator(func: F) -> F:
+        name = func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            current = _current_span.get()
+            if current is None:
+                return func(*args, **kwargs)
+            with current[0].start_span(name, layer):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def record_statement_span(record: StatementRecord):
+    """
+    Statement observer recording each SQL statement as a finished span of the repository method executing it.
+    """
+    current = _current_span.get()
+    if current is None:
+        return
+
+    tracer, parent = current
+    attributes: dict[str, Any] = {"rows": record.rows}
+    if record.locking_seconds:
+        attributes["locking_seconds"] = record.locking_seconds
+    tracer.export(
+        Span(
+            trace_id=parent.trace_id,
+            span_id=uuid4().hex[:16],
+            parent_id=parent.span_id,
+            name=record.operation,
+            layer=REPOSITORY_LAYER,
+            start_time=time.time() - record.duration_seconds,
+            duration_seconds=record.duration_seconds,
+            attributes=attributes,
+        )
+    )
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware running each HTTP request sampled by the tracer in a root span. The request id is taken from the
+    X-Request-ID header or generated, and returned in the X-Request-ID header of the response. The other requests are
+    passed through untouched.
+    """
+
+    def __init__(self, app, tracer: Tracer):
+        self._app = app
+        self._tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._tracer.sample():
+            await self._app(scope, receive, send)
+            return
+
+        request_id = (
+            dict(scope["headers"]).get(REQUEST_ID_HEADER, b"").decode("latin-1")[:64]
+            or uuid4().hex
+        )
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (REQUEST_ID_HEADER, request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        with self._tracer.start_span(
+            scope["method"], HTTP_LAYER, trace_id=request_id
+        ) as span:
+            try:
+                await self._app(scope, receive, send_wrapper)
+            finally:
+                # The route is known only after routing
+                span.name = f"{scope['method']} {get_route_path(scope)}"
+                span.set_attributes(status=status)
@@ -0,0 +1,346 @@
+"""
+Bulk load of a generated dataset for benchmarks: users with auth records, products, and orders.
+
+The tables of the configured database are dropped and recreated. Rows are streamed with COPY, so millions of rows
+can be loaded in minutes. Every user can log in with username `user<index>` and DEFAULT_PASSWORD.
+
+The products of the orders and the buyers follow Zipf distributions, so a few products and users account for most
+of the orders as they do in production. The same size and seed always generate the same dataset, except that the
+creation times of the orders are relative to the time of generation.
+
+By default, `make generate-dataset` loads into the bench_db database of the docker compose postgres.
+
+Usage:
+    python -m benchmarks.dataset --size medium [--orders 2000000] [--seed 1]
+"""
+
+import argparse
+from array import array
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from math import exp, expm1, gcd, log, log1p
+import random
+import sys
+import time
+from typing import Callable, Iterator
+from uuid import UUID
+
+from app.dependencies import get_repository_session
+from app.repositories.migration import migrate_down, migrate_up
+from app.repositories.order import PostgresOrderRepository
+from app.repositories.postgres.config import OrderPartitionConfig
+from app.repositories.postgres.partitions import create_partitions
+from app.repositories.postgres.session import PostgresSession
+from app.services.auth import get_password_hash
+
+DEFAULT_PASSWORD = "password"
+CATEGORIES = ("Books", "Clothing", "Electronics", "Food", "Home", "Sports", "Toys")
+
+
+def user_id(index: int):
+    return f"u{index}"
+
+
+def username(index: int):
+    return f"user{index}"
+
+
+def product_id(index: int):
+    return f"p{index}"
+
+
+@dataclass(frozen=True)
+class DatasetConfig:
+    users: int = 1000
+    products: int = 10000
+    orders: int = 0
+    max_items_per_order: int = 5
+
+    # Exponents of the Zipf distributions of the products in orders and of the buyers. 0 means uniform.
+    product_skew: float = 1.1
+    user_skew: float = 0.8
+
+    # Orders are created within this number of days before the generation
+    order_days: int = 365
+    user_balance: float = 10**9
+    product_quantity: int = 10**9
+    seed: int = 0
+
+
+DATASET_SIZES = {
+    "small": DatasetConfig(users=1000, products=10000, orders=10000),
+    "medium": DatasetConfig(users=100000, products=1000000, orders=1000000),
+    "large": DatasetConfig(users=1000000, products=5000000, orders=10000000),
+}
+
+
+class ZipfSampler:
+    """
+    Sample indexes in [0, n) where the k-th most popular index is chosen with probability proportional to
+    1 / k^exponent. Which index is the k-th most popular is shuffled, so the popular ones are not adjacent.
+
+    The ranks are sampled by the rejection-inversion method of Hörmann and Derflinger, and shuffled by a random affine
+    permutation, so the memory doesn't grow with n, unlike a table of the cumulative weights and a shuffled list of
+    indexes, which take hundreds of MB for the products of the large dataset.
+    """
+
+    def __init__(self, n: int, exponent: float, rand: random.Random):
+        self._n = n
+        self._exponent = exponent
+        self._h_integral_x1 = self._h_integral(1.5) - 1
+        self._h_integral_n = self._h_integral(n + 0.5)
+        self._s = 2 - self._h_integral_inverse(self._h_integral(2.5) - self._h(2))
+
+        # The rank r is the index (r * multiplier + offset) % n. The multiplier is coprime to n, so it is a permutation.
+        self._multiplier = 1
+        if n > 2:
+            self._multiplier = rand.randrange(1, n)
+            while gcd(self._multiplier, n) != 1:
+                self._multiplier = rand.randrange(1, n)
+        self._offset = rand.randrange(n)
+
+    def sample(self, rand: random.Random) -> int:
+        return (self._sample_rank(rand) * self._multiplier + self._offset) % self._n
+
+    def _sample_rank(self, rand: random.Random) -> int:
+        """
+        Returns:
+            The 0-based rank.
+        """
+        while True:
+            u = self._h_integral_n + rand.random() * (
+                self._h_integral_x1 - self._h_integral_n
+            )
+            x = self._h_integral_inverse(u)
+            k = min(max(int(x + 0.5), 1), self._n)
+            if k - x <= self._s or u >= self._h_integral(k + 0.5) - self._h(k):
+                return k - 1
+
+    def _h(self, x: float) -> float:
+        return exp(-self._exponent * log(x))
+
+    def _h_integral(self, x: float) -> float:
+        # The integral of _h, shifted so that it is continuous at the exponent 1
+        log_x = log(x)
+        return _expm1_over((1 - self._exponent) * log_x) * log_x
+
+    def _h_integral_inverse(self, x: float) -> float:
+        t = max(x * (1 - self._exponent), -1)
+        return exp(_log1p_over(t) * x)
+
+    def sample_distinct(self, rand: random.Random, k: int) -> list[int]:
+        indexes: dict[int, None] = {}  # Keep the order of sampling
+        while len(indexes) < k:
+            indexes[self.sample(rand)] = None
+        return list(indexes)
+
+
+def _log1p_over(x: float) -> float:
+    # log1p(x) / x, which tends to 1 as x tends to 0
+    if abs(x) > 1e-8:
+        return log1p(x) / x
+    return 1 - x * (0.5 - x * (1 / 3 - 0.25 * x))
+
+
+def _expm1_over(x: float) -> float:
+    # expm1(x) / x, which tends to 1 as x tends to 0
+    if abs(x) > 1e-8:
+        return expm1(x) / x
+    return 1 + x * 0.5 * (1 + x * (1 / 3) * (1 + 0.25 * x))
+
+
+def generate_dataset(
+    session: PostgresSession,
+    config: DatasetConfig,
+    on_progress: Callable[[str, int], None] = lambda table, count: None,
+):
+    """
+    Args:
+        on_progress: Called with the table name and the number of rows after loading each table.
+    """
+    migrate_up(session)
+    migrate_down(session)
+    migrate_up(session)
+
+    rand = random.Random(config.seed)
+    with session:
+        _copy_users(session, config)
+        on_progress("users", config.users)
+        price_cents = _copy_products(session, config, rand)
+        on_progress("products", config.products)
+        if config.orders:
+            item_count = _copy_orders(session, config, rand, price_cents)
+            on_progress("orders", config.orders)
+            on_progress("order_items", item_count)
+
+            # The stats are maintained by adding the orders one by one, which COPY bypasses
+            PostgresOrderRepository(session.new_operator).rebuild_stats()
+
+        # Update the statistics so that the query plans are chosen for the generated data
+        with session.new_operator("generate_dataset") as cur:
+            cur.execute("ANALYZE;")
+        session.commit()
+
+
+def _copy_users(session: PostgresSession, config: DatasetConfig):
+    # bcrypt is slow on purpose, so all users share one hash
+    hashed_password = get_password_hash(DEFAULT_PASSWORD)
+    with session.new_operator("_copy_users") as cur:
+        with cur.copy("COPY users (id, balance) FROM STDIN") as copy:
+            for index in range(config.users):
+                copy.write_row((user_id(index), config.user_balance))
+        with cur.copy(
+            "COPY auth_records (user_id, username, hashed_password) FROM STDIN"
+        ) as copy:
+            for index in range(config.users):
+                copy.write_row((user_id(index), username(index), hashed_password))
+
+
+def _copy_products(
+    session: PostgresSession, config: DatasetConfig, rand: random.Random
+) -> array:
+    """
+    Return the price of each product in cents, for the unit prices of the order items. 2 bytes per product.
+    """
+    price_cents = array("H")
+    with session.new_operator("_copy_products") as cur:
+        with cur.copy(
+            "COPY products (id, name, price, quantity, category) FROM STDIN"
+        ) as copy:
+            for index in range(config.products):
+                price_cents.append(rand.randint(100, 10000))
+                copy.write_row(
+                    (
+                        product_id(index),
+                        f"Product {index}",
+                        price_cents[index] / 100,
+                        config.product_quantity,
+                        rand.choice(CATEGORIES),
+                    )
+                )
+    return price_cents
+
+
+@dataclass(frozen=True)
+class _GeneratedOrder:
+    id: str
+    user_index: int
+    created_at: datetime
+    items: list[tuple[int, int]]  # (product index, quantity)
+
+
+def _copy_orders(
+    session: PostgresSession,
+    config: DatasetConfig,
+    rand: random.Random,
+    price_cents: array,
+) -> int:
+    """
+    Return the number of order items. Their unit prices are the current prices of their products.
+    """
+    product_sampler = ZipfSampler(config.products, config.product_skew, rand)
+    user_sampler = ZipfSampler(config.users, config.user_skew, rand)
+    orders_seed = rand.getrandbits(64)
+    now = datetime.now()
+
+    def generate_orders():
+        return _generate_orders(
+            config, random.Random(orders_seed), product_sampler, user_sampler, now
+        )
+
+    # Only one COPY can be in progress on a connection, so the same orders are generated again for the keys and the
+    # items instead of keeping millions of them in memory.
+    item_count = 0
+    with session.new_operator("_copy_orders") as cur:
+        # The rows are copied to their monthly partitions directly instead of being moved from the default ones
+        create_partitions(
+            cur,
+            OrderPartitionConfig.from_env().months_ahead,
+            since=(now - timedelta(days=config.order_days)).date(),
+        )
+        with cur.copy("COPY order_keys (id, created_at) FROM STDIN") as copy:
+            for order in generate_orders():
+                copy.write_row((order.id, order.created_at))
+        with cur.copy("COPY orders (id, user_id, created_at) FROM STDIN") as copy:
+            for order in generate_orders():
+                copy.write_row((order.id, user_id(order.user_index), order.created_at))
+        with cur.copy(
+            "COPY order_items (order_id, product_id, quantity, unit_price, created_at) FROM STDIN"
+        ) as copy:
+            for order in generate_orders():
+                for product_index, quantity in order.items:
+                    copy.write_row(
+                        (
+                            order.id,
+                            product_id(product_index),
+                            quantity,
+                            price_cents[product_index] / 100,
+                            order.created_at,
+                        )
+                    )
+                item_count += len(order.items)
+    return item_count
+
+
+def _generate_orders(
+    config: DatasetConfig,
+    rand: random.Random,
+    product_sampler: ZipfSampler,
+    user_sampler: ZipfSampler,
+    now: datetime,
+) -> Iterator[_GeneratedOrder]:
+    max_items_per_order = min(config.max_items_per_order, config.products)
+    order_seconds = config.order_days * 24 * 60 * 60
+    for _ in range(config.orders):
+        yield _GeneratedOrder(
+            id=str(UUID(int=rand.getrandbits(128), version=4)),
+            user_index=user_sampler.sample(rand),
+            created_at=now - timedelta(seconds=rand.randrange(order_seconds)),
+            items=[
+                (product_index, rand.randint(1, 3))
+                for product_index in product_sampler.sample_distinct(
+                    rand, rand.randint(1, max_items_per_order)
+                )
+            ],
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a dataset for benchmarks")
+    parser.add_argument("--size", choices=list(DATASET_SIZES), default="small")
+    parser.add_argument("--users", type=int, help="Override the number of the size")
+    parser.add_argument("--products", type=int, help="Override the number of the size")
+    parser.add_argument("--orders", type=int, help="Override the number of the size")
+    parser.add_argument("--max-items-per-order", type=int)
+    parser.add_argument("--product-skew", type=float)
+    parser.add_argument("--user-skew", type=float)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    overrides = {
+        name: getattr(args, name)
+        for name in (
+            "users",
+            "products",
+            "orders",
+            "max_items_per_order",
+            "product_skew",
+            "user_skew",
+            "seed",
+        )
+        if getattr(args, name) is not None
+    }
+    config = replace(DATASET_SIZES[args.size], **overrides)
+
+    start = time.monotonic()
+
+    def print_progress(table: str, count: int):
+        print(
+            f"{table}: {count} rows ({time.monotonic() - start:.1f}s)", file=sys.stderr
+        )
+
+    generate_dataset(get_repository_session(), config, print_progress)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""
+Load test of the HTTP API running under uvicorn.
+
+The users and products are seeded first (see benchmarks.dataset), then `app.main:app` is started with the given number
+of uvicorn workers. Requests of the mix are sent at a fixed rate no matter how fast the server responds (open loop),
+and the latency of each request is measured from the time it was scheduled, so a slow server can't hide its queueing
+delay by slowing down the load. The number of database connections is sampled from pg_stat_activity during the run.
+
+By default, `make benchmark-http-load` uses the bench_db database of the docker compose postgres.
+
+Usage:
+    python -m benchmarks.http_load --workers 4 --rate 200 --duration 60 --output result.json
+"""
+
+import argparse
+import asyncio
+from dataclasses import asdict, dataclass, field
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+from threading import Event, Thread
+import time
+from typing import Optional
+from uuid import uuid4
+
+import httpx
+
+from app.dependencies import get_repository_session
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.session import new_postgres_conn
+from benchmarks.dataset import (
+    DEFAULT_PASSWORD,
+    DatasetConfig,
+    generate_dataset,
+    product_id,
+    username,
+)
+from benchmarks.stats import summarize
+
+SIGN_UP = "POST /auth/signup"
+LOGIN = "POST /auth/login"
+PLACE_ORDER = "POST /orders"
+GET_ORDERS = "GET /orders"
+
+
+@dataclass(frozen=True)
+class HttpLoadConfig:
+    workers: int = 4
+    rate: float = 100  # Requests per second
+    duration_seconds: float = 30
+    users: int = 1000
+    products: int = 10000
+    logged_in_users: int = (
+        100  # Users logged in before the run, whose tokens are used for the order requests
+    )
+    items_per_order: int = 3
+    mix: dict[str, float] = field(
+        default_factory=lambda: {
+            SIGN_UP: 1,
+            LOGIN: 1,
+            PLACE_ORDER: 4,
+            GET_ORDERS: 4,
+        }
+    )
+    port: int = 8765
+    seed: int = 0
+    connection_sample_interval_seconds: float = 0.5
+
+
+@dataclass
+class _RouteResult:
+    latencies_ms: list[float] = field(default_factory=list)
+    statuses: dict[str, int] = field(default_factory=dict)
+
+    def add(self, latency_ms: float, status: str):
+        self.latencies_ms.append(latency_ms)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def run_load_test(config: HttpLoadConfig, seed_data: bool = True) -> dict:
+    if seed_data:
+        generate_dataset(
+            get_repository_session(),
+            DatasetConfig(
+                users=config.users, products=config.products, seed=config.seed
+            ),
+        )
+
+    server = _start_server(config)
+    try:
+        base_url = f"http://127.0.0.1:{config.port}"
+        _wait_until_ready(base_url, server)
+
+        connection_sampler = _ConnectionSampler(
+            PostgresConfig.from_env(), config.connection_sample_interval_seconds
+        )
+        connection_sampler.start()
+        try:
+            route_results, duration_seconds = asyncio.run(_drive(config, base_url))
+        finally:
+            connection_sampler.stop()
+    finally:
+        server.terminate()
+        server.wait()
+
+    return _report(config, route_results, duration_seconds, connection_sampler)
+
+
+def _start_server(config: HttpLoadConfig) -> subprocess.Popen:
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(config.port),
+            "--workers",
+            str(config.workers),
+            "--no-access-log",
+        ],
+        env=os.environ.copy(),
+    )
+
+
+def _wait_until_ready(base_url: str, server: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with code {server.returncode}")
+        try:
+            httpx.get(f"{base_url}/metrics").raise_for_status()
+            return
+        except (httpx.TransportError, httpx.HTTPStatusError):
+            time.sleep(0.2)
+    raise RuntimeError(f"server is not ready after {timeout} seconds")
+
+
+async def _drive(
+    config: HttpLoadConfig, base_url: str
+) -> tuple[dict[str, _RouteResult], float]:
+    rand = random.Random(config.seed)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+        access_tokens = await asyncio.gather(
+            *(
+                _login(client, username(index))
+                for index in range(min(config.logged_in_users, config.users))
+            )
+        )
+
+        route_results = {route: _RouteResult() for route in config.mix}
+        routes = list(config.mix)
+        weights = list(config.mix.values())
+        request_count = int(config.rate * config.duration_seconds)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tasks = []
+        for index in range(request_count):
+            scheduled_at = start + index / config.rate
+            delay = scheduled_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            route = rand.choices(routes, weights)[0]
+            request = _new_request(config, client, route, rand, access_tokens)
+            tasks.append(
+                asyncio.create_task(
+                    _send(client, request, scheduled_at, route_results[route])
+                )
+            )
+        await asyncio.gather(*tasks)
+        duration_seconds = loop.time() - start
+
+    return route_results, duration_seconds
+
+
+async def _login(client: httpx.AsyncClient, login_username: str) -> str:
+    response = await client.post(
+        "/auth/login",
+        data={"username": login_username, "password": DEFAULT_PASSWORD},
+    )
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def _new_request(
+    config: HttpLoadConfig,
+    client: httpx.AsyncClient,
+    route: str,
+    rand: random.Random,
+    access_tokens: list[str],
+) -> httpx.Request:
+    def auth_headers():
+        return {"Authorization": f"Bearer {rand.choice(access_tokens)}"}
+
+    if route == SIGN_UP:
+        return client.build_request(
+            "POST",
+            "/auth/signup",
+            json={"username": f"load-{uuid4()}", "password": DEFAULT_PASSWORD},
+        )
+    if route == LOGIN:
+        return client.build_request(
+            "POST",
+            "/auth/login",
+            data={
+                "username": username(rand.randrange(config.users)),
+                "password": DEFAULT_PASSWORD,
+            },
+        )
+    if route == PLACE_ORDER:
+        product_indexes = rand.sample(range(config.products), config.items_per_order)
+        return client.build_request(
+            "POST",
+            "/orders/",
+            headers=auth_headers(),
+            json={
+                "order_id": str(uuid4()),
+                "order_items": [
+                    {"product_id": product_id(index), "quantity": 1}
+                    for index in product_indexes
+                ],
+            },
+        )
+    if route == GET_ORDERS:
+        return client.build_request("GET", "/orders/", headers=auth_headers())
+    raise ValueError(f"unknown route: {route}")
+
+
+async def _send(
+    client: httpx.AsyncClient,
+    request: httpx.Request,
+    scheduled_at: float,
+    result: _RouteResult,
+):
+    try:
+        response = await client.send(request)
+        status = str(response.status_code)
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    latency_ms = (asyncio.get_running_loop().time() - scheduled_at) * 1000
+    result.add(latency_ms, status)
+
+
+class _ConnectionSampler:
+    """
+    Sample the number of connections to the database by state (active, idle, idle in transaction, etc.).
+    """
+
+    def __init__(self, config: PostgresConfig, interval_seconds: float):
+        self._config = config
+        self._interval_seconds = interval_seconds
+        self._stop_event = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+        self.samples: list[dict[str, int]] = []
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        with new_postgres_conn(self._config, autocommit=True) as conn:
+            while not self._stop_event.wait(self._interval_seconds):
+                rows = conn.execute(
+                    """
+                    SELECT COALESCE(state, 'unknown'), COUNT(*) FROM pg_stat_activity
+                    WHERE datname = current_database() AND pid <> pg_backend_pid()
+                    GROUP BY 1;
+                    """
+                ).fetchall()
+                self.samples.append({state: count for state, count in rows})
+
+    def summarize(self) -> dict:
+        totals = [sum(sample.values()) for sample in self.samples]
+        states = sorted({state for sample in self.samples for state in sample})
+        return {
+            "samples": len(self.samples),
+            "total": {
+                "max": max(totals, default=0),
+                "mean": sum(totals) / len(totals) if totals else 0,
+            },
+            "max_by_state": {
+                state: max(sample.get(state, 0) for sample in self.samples)
+                for state in states
+            },
+        }
+
+
+def _is_error(status: str):
+    return not status.isdigit() or int(status) >= 400
+
+
+def _report(
+    config: HttpLoadConfig,
+    route_results: dict[str, _RouteResult],
+    duration_seconds: float,
+    connection_sampler: _ConnectionSampler,
+) -> dict:
+    routes = {}
+    for route, result in route_results.items():
+        error_count = sum(
+            count for status, count in result.statuses.items() if _is_error(status)
+        )
+        request_count = len(result.latencies_ms)
+        routes[route] = {
+            "requests": request_count,
+            "statuses": result.statuses,
+            "error_rate": error_count / request_count if request_count else 0,
+            "latency_ms": summarize(result.latencies_ms),
+        }
+
+    request_count = sum(len(result.latencies_ms) for result in route_results.values())
+    return {
+        "benchmark": "http_load",
+        "config": asdict(config),
+        "duration_seconds": duration_seconds,
+        "requests": request_count,
+        "throughput_per_second": request_count / duration_seconds,
+        "routes": routes,
+        "db_connections": connection_sampler.summarize(),
+    }
+
+
+def _parse_mix(value: str) -> dict[str, float]:
+    """
+    Parse weights in the format of `signup=1,login=1,place_order=4,get_orders=4`.
+    """
+    names = {
+        "signup": SIGN_UP,
+        "login": LOGIN,
+        "place_order": PLACE_ORDER,
+        "get_orders": GET_ORDERS,
+    }
+    mix = {}
+    for pair in value.split(","):
+        name, weight = pair.split("=")
+        if name not in names:
+            raise argparse.ArgumentTypeError(f"unknown route: {name}")
+        mix[names[name]] = float(weight)
+    return mix
+
+
+def _find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    defaults = HttpLoadConfig()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--workers", type=int, default=defaults.workers)
+    parser.add_argument(
+        "--rate", type=float, default=defaults.rate, help="Requests per second"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=defaults.duration_seconds, help="Seconds"
+    )
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--products", type=int, default=defaults.products)
+    parser.add_argument("--logged-in-users", type=int, default=defaults.logged_in_users)
+    parser.add_argument("--items-per-order", type=int, default=defaults.items_per_order)
+    parser.add_argument(
+        "--mix",
+        type=_parse_mix,
+        help="Weights of routes, e.g. signup=1,login=1,place_order=4,get_orders=4",
+    )
+    parser.add_argument("--port", type=int, help="Default to a free port")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument(
+        "--skip-seed-data",
+        action="store_true",
+        help="Reuse the data seeded by a previous run",
+    )
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    args = parser.parse_args()
+
+    mix: Optional[dict[str, float]] = args.mix
+    config = HttpLoadConfig(
+        workers=args.workers,
+        rate=args.rate,
+        duration_seconds=args.duration,
+        users=args.users,
+        products=args.products,
+        logged_in_users=args.logged_in_users,
+        items_per_order=args.items_per_order,
+        mix=mix or defaults.mix,
+        port=args.port or _find_free_port(),
+        seed=args.seed,
+    )
+    result = json.dumps(
+        run_load_test(config, seed_data=not args.skip_seed_data), indent=2
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(result + "\n")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+Benchmark of building the domain objects read by the repositories, comparing the construction with validation
+against the construction without validation for trusted data. Also reports the memory taken by each order read from
+the database.
+
+The orders are built with `construct` by the repository. The products and users are still validated, because the
+validation of pydantic-core is faster than `model_construct` implemented in Python.
+
+No database is needed.
+
+Usage:
+    python -m benchmarks.model_construction --objects 100000 --output result.json
+"""
+
+import argparse
+from dataclasses import asdict, dataclass
+import json
+import sys
+from time import perf_counter
+import tracemalloc
+from typing import Callable
+
+from app.models.order import Order, OrderItem
+from app.models.product import Product
+from app.models.user import User
+from app.repositories.order import OrderItemRow, build_orders
+from benchmarks.dataset import product_id, user_id
+
+USER_ID = "u0"
+
+
+@dataclass(frozen=True)
+class ModelConstructionBenchmarkConfig:
+    objects: int = 100000
+    items_per_order: int = 3
+
+
+def run_benchmark(config: ModelConstructionBenchmarkConfig) -> dict:
+    order_rows = _order_rows(config)
+    product_rows = [
+        (product_id(index), f"Product {index}", "Books", 12.34, 5)
+        for index in range(config.objects)
+    ]
+    user_rows = [(user_id(index), 100.5) for index in range(config.objects)]
+
+    def build_validated_orders():
+        order_items_by_id: dict[str, list[OrderItem]] = {}
+        for order_id, item_product_id, quantity in order_rows:
+            # The rows of the benchmark always have an item
+            order_items_by_id.setdefault(order_id, []).append(
+                OrderItem(item_product_id, quantity)  # type: ignore[arg-type]
+            )
+        return [
+            Order(id=order_id, user_id=USER_ID, order_items=tuple(order_items))
+            for order_id, order_items in order_items_by_id.items()
+        ]
+
+    def build_validated_products():
+        return [
+            Product(
+                id=id,
+                name=name,
+                category=category,
+                price=price,
+                quantity=quantity,
+            )
+            for id, name, category, price, quantity in product_rows
+        ]
+
+    def build_validated_users():
+        return [User(id=id, balance=balance) for id, balance in user_rows]
+
+    return {
+        "benchmark": "model_construction",
+        "config": asdict(config),
+        "objects_per_second": {
+            "order": {
+                "validated": _throughput(config, build_validated_orders),
+                "trusted": _throughput(
+                    config, lambda: build_orders(USER_ID, order_rows)
+                ),
+            },
+            "product": {
+                "validated": _throughput(config, build_validated_products),
+                "model_construct": _throughput(
+                    config,
+                    lambda: [
+                        Product.model_construct(
+                            id=id,
+                            name=name,
+                            category=category,
+                            price=price,
+                            quantity=quantity,
+                        )
+                        for id, name, category, price, quantity in product_rows
+                    ],
+                ),
+            },
+            "user": {
+                "validated": _throughput(config, build_validated_users),
+                "model_construct": _throughput(
+                    config,
+                    lambda: [
+                        User.model_construct(id=id, balance=balance)
+                        for id, balance in user_rows
+                    ],
+                ),
+            },
+        },
+        "bytes_per_order": _bytes_per_order(config, order_rows),
+    }
+
+
+def _order_rows(config: ModelConstructionBenchmarkConfig) -> list[OrderItemRow]:
+    return [
+        OrderItemRow(
+            f"{order_index:08x}-0000-4000-8000-000000000000",
+            product_id(order_index * config.items_per_order + item_index),
+            1,
+        )
+        for order_index in range(config.objects)
+        for item_index in range(config.items_per_order)
+    ]
+
+
+def _throughput(
+    config: ModelConstructionBenchmarkConfig, build: Callable[[], list]
+) -> float:
+    start = perf_counter()
+    build()
+    return config.objects / (perf_counter() - start)
+
+
+def _bytes_per_order(
+    config: ModelConstructionBenchmarkConfig, order_rows: list[OrderItemRow]
+) -> float:
+    """
+    Memory taken by the Order and OrderItem objects, excluding the strings which are shared with the rows.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        orders = build_orders(USER_ID, order_rows)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (after - before) / len(orders)
+
+
+def main():
+    defaults = ModelConstructionBenchmarkConfig()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--objects", type=int, default=defaults.objects)
+    parser.add_argument("--items-per-order", type=int, default=defaults.items_per_order)
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    args = parser.parse_args()
+
+    config = ModelConstructionBenchmarkConfig(
+        objects=args.objects, items_per_order=args.items_per_order
+    )
+    result = json.dumps(run_benchmark(config), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(result + "\n")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Benchmark of the GET /orders response of a user with many orders, comparing the encoding of the repository rows with
+orjson against building the Order and OrderModel objects and letting FastAPI validate and encode them.
+
+No database is needed. The rows are generated in memory and both paths are served by FastAPI, so the time includes
+the whole handling of the request after the repository returns.
+
+Usage:
+    python -m benchmarks.order_serialization --orders 10000 --repeat 20 --output result.json
+"""
+
+import argparse
+from dataclasses import asdict, dataclass
+import json
+import random
+import sys
+from time import perf_counter
+
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+from app.repositories.order import OrderItemRow, build_orders
+from app.routers.orders import OrderModel, encode_orders
+from benchmarks.dataset import product_id
+from benchmarks.stats import summarize
+
+USER_ID = "u0"
+MODELS_PATH = "/models"
+ORJSON_PATH = "/orjson"
+
+
+@dataclass(frozen=True)
+class OrderSerializationBenchmarkConfig:
+    orders: int = 10000
+    items_per_order: int = 3
+    products: int = 10000
+    repeat: int = 20
+    seed: int = 0
+
+
+def run_benchmark(config: OrderSerializationBenchmarkConfig) -> dict:
+    rows = _generate_rows(config)
+    client = TestClient(_create_app(rows))
+
+    latencies_ms: dict[str, list[float]] = {}
+    bodies: dict[str, bytes] = {}
+    for path in (MODELS_PATH, ORJSON_PATH):
+        bodies[path] = client.get(path).content  # Warm up
+        latencies_ms[path] = []
+        for _ in range(config.repeat):
+            start = perf_counter()
+            response = client.get(path)
+            latencies_ms[path].append((perf_counter() - start) * 1000)
+            response.raise_for_status()
+
+    models_ms = summarize(latencies_ms[MODELS_PATH])
+    orjson_ms = summarize(latencies_ms[ORJSON_PATH])
+    return {
+        "benchmark": "order_serialization",
+        "config": asdict(config),
+        "response_bytes": len(bodies[ORJSON_PATH]),
+        "same_body": json.loads(bodies[MODELS_PATH]) == json.loads(bodies[ORJSON_PATH]),
+        "latency_ms": {"models": models_ms, "orjson": orjson_ms},
+        "speedup_p50": models_ms["p50"] / orjson_ms["p50"] if orjson_ms["p50"] else 0,
+    }
+
+
+def _generate_rows(config: OrderSerializationBenchmarkConfig) -> list[OrderItemRow]:
+    rand = random.Random(config.seed)
+    items_per_order = min(config.items_per_order, config.products)
+    rows = []
+    for order_index in range(config.orders):
+        order_id = f"{order_index:08x}-0000-4000-8000-000000000000"
+        for index in sorted(rand.sample(range(config.products), items_per_order)):
+            rows.append(OrderItemRow(order_id, product_id(index), rand.randint(1, 3)))
+    return rows
+
+
+def _create_app(rows: list[OrderItemRow]) -> FastAPI:
+    """
+    Both routes return the same rows as the repository would, as get_orders did before and does now.
+    """
+    app = FastAPI()
+
+    @app.get(MODELS_PATH, response_model=list[OrderModel])
+    def get_orders_with_models():
+        return list(map(OrderModel.from_domain, build_orders(USER_ID, rows)))
+
+    @app.get(ORJSON_PATH, response_model=list[OrderModel])
+    def get_orders_with_orjson():
+        return Response(encode_orders(rows), media_type="application/json")
+
+    return app
+
+
+def main():
+    defaults = OrderSerializationBenchmarkConfig()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--orders", type=int, default=defaults.orders)
+    parser.add_argument("--items-per-order", type=int, default=defaults.items_per_order)
+    parser.add_argument("--products", type=int, default=defaults.products)
+    parser.add_argument("--repeat", type=int, default=defaults.repeat)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    args = parser.parse_args()
+
+    config = OrderSerializationBenchmarkConfig(
+        orders=args.orders,
+        items_per_order=args.items_per_order,
+        products=args.products,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+    result = json.dumps(run_benchmark(config), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(result + "\n")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
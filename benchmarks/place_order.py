@@ -0,0 +1,252 @@
+"""
+Benchmark of OrderService.place_order under contention.
+
+The tables of the configured database are dropped and recreated. By default, `make benchmark-place-order` uses the
+bench_db database of the docker compose postgres.
+
+Usage:
+    python -m benchmarks.place_order --threads 16 --skew hot --items-per-order 3 --output result.json
+"""
+
+import argparse
+from dataclasses import asdict, dataclass
+from enum import Enum
+import json
+import random
+import sys
+from threading import Barrier, Thread
+from time import perf_counter
+
+import psycopg
+
+from app.dependencies import get_repository_session
+from app.err import MyValueError
+from app.models.order import OrderItem, PurchaseInfo
+from app.repositories.order import order_repository_factory
+from app.repositories.postgres.instrumentation import StatementRecord
+from app.repositories.postgres.session import PostgresSession
+from app.repositories.product import product_repository_factory
+from app.repositories.user import user_repository_factory
+from app.services.order import OrderService
+from benchmarks.dataset import DatasetConfig, generate_dataset, product_id, user_id
+from benchmarks.stats import summarize
+
+RETRYABLE_ERRORS = (
+    psycopg.errors.DeadlockDetected,
+    psycopg.errors.SerializationFailure,
+)
+
+
+class ProductSkew(Enum):
+    UNIFORM = "uniform"
+    HOT = "hot"  # Every order contains the same hot product
+
+
+@dataclass(frozen=True)
+class PlaceOrderBenchmarkConfig:
+    threads: int = 8
+    orders_per_thread: int = 100
+    users: int = 100
+    products: int = 1000
+    items_per_order: int = 3
+    skew: ProductSkew = ProductSkew.UNIFORM
+    max_retries: int = 3
+    seed: int = 0
+
+
+@dataclass
+class _ThreadResult:
+    latencies_seconds: list[float]
+    locking_seconds: list[float]  # Of each order, in the statements acquiring row locks
+    errors: dict[str, int]
+    retries: int = 0
+
+
+def run_benchmark(config: PlaceOrderBenchmarkConfig) -> dict:
+    _reset_data(config)
+
+    results = [
+        _ThreadResult(latencies_seconds=[], locking_seconds=[], errors={})
+        for _ in range(config.threads)
+    ]
+    barrier = Barrier(config.threads + 1)
+    threads = [
+        Thread(target=_place_orders, args=(config, index, barrier, results[index]))
+        for index in range(config.threads)
+    ]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()  # Start placing orders in all threads at the same time
+    start = perf_counter()
+    for thread in threads:
+        thread.join()
+    duration_seconds = perf_counter() - start
+
+    return _report(config, duration_seconds, results)
+
+
+def _reset_data(config: PlaceOrderBenchmarkConfig):
+    generate_dataset(
+        get_repository_session(),
+        DatasetConfig(users=config.users, products=config.products, seed=config.seed),
+    )
+
+
+def _place_orders(
+    config: PlaceOrderBenchmarkConfig,
+    thread_index: int,
+    barrier: Barrier,
+    result: _ThreadResult,
+):
+    rand = random.Random(config.seed * 1000 + thread_index)
+    locking_seconds = 0.0
+
+    def record_locking(record: StatementRecord):
+        nonlocal locking_seconds
+        locking_seconds += record.locking_seconds
+
+    session = get_repository_session()  # Same session cannot be shared between threads
+    assert isinstance(session, PostgresSession)
+    session.add_statement_observer(record_locking)
+    order_service = OrderService(
+        user_repository_factory,
+        product_repository_factory,
+        order_repository_factory,
+        session,
+    )
+
+    barrier.wait()
+    for order_index in range(config.orders_per_thread):
+        buyer_id = user_id(rand.randrange(config.users))
+        purchase_info = PurchaseInfo(
+            order_items=tuple(
+                OrderItem(item_product_id, rand.randint(1, 3))
+                for item_product_id in _pick_product_ids(config, rand)
+            ),
+            order_id=f"t{thread_index}-o{order_index}",
+        )
+
+        locking_seconds = 0.0
+        start = perf_counter()
+        for attempt in range(config.max_retries + 1):
+            try:
+                order_service.place_order(buyer_id, purchase_info)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == config.max_retries:
+                    _count_error(result, e)
+                else:
+                    result.retries += 1
+            except MyValueError as e:
+                _count_error(result, e)
+                break
+        result.latencies_seconds.append(perf_counter() - start)
+        result.locking_seconds.append(locking_seconds)
+
+
+def validate_config(config: PlaceOrderBenchmarkConfig):
+    """
+    Raises:
+        ValueError: If the products can't be picked for the orders, which would otherwise fail every thread after the
+            data is reset.
+    """
+    if config.items_per_order < 1:
+        raise ValueError("--items-per-order must be at least 1")
+    # Distinct products, including the hot one with the hot skew
+    if config.items_per_order > config.products:
+        raise ValueError(
+            f"--items-per-order must be at most --products ({config.products})"
+        )
+
+
+def _pick_product_ids(config: PlaceOrderBenchmarkConfig, rand: random.Random):
+    match config.skew:
+        case ProductSkew.UNIFORM:
+            indexes = rand.sample(range(config.products), config.items_per_order)
+        case ProductSkew.HOT:
+            indexes = [0] + rand.sample(
+                range(1, config.products), config.items_per_order - 1
+            )
+    return [product_id(index) for index in indexes]
+
+
+def _count_error(result: _ThreadResult, e: Exception):
+    error = type(e).__name__
+    result.errors[error] = result.errors.get(error, 0) + 1
+
+
+def _report(
+    config: PlaceOrderBenchmarkConfig,
+    duration_seconds: float,
+    results: list[_ThreadResult],
+) -> dict:
+    latencies_ms = [
+        latency * 1000 for result in results for latency in result.latencies_seconds
+    ]
+    locking_ms = [
+        locking * 1000 for result in results for locking in result.locking_seconds
+    ]
+    errors: dict[str, int] = {}
+    for result in results:
+        for error, count in result.errors.items():
+            errors[error] = errors.get(error, 0) + count
+    failed = sum(errors.values())
+    succeeded = len(latencies_ms) - failed
+
+    return {
+        "benchmark": "place_order",
+        "config": {**asdict(config), "skew": config.skew.value},
+        "duration_seconds": duration_seconds,
+        "orders": {"succeeded": succeeded, "failed": failed, "errors": errors},
+        "throughput_per_second": succeeded / duration_seconds,
+        "latency_ms": summarize(latencies_ms),
+        "retries": sum(result.retries for result in results),
+        "locking_ms": {"total": sum(locking_ms), **summarize(locking_ms)},
+    }
+
+
+def main():
+    defaults = PlaceOrderBenchmarkConfig()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--threads", type=int, default=defaults.threads)
+    parser.add_argument(
+        "--orders-per-thread", type=int, default=defaults.orders_per_thread
+    )
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--products", type=int, default=defaults.products)
+    parser.add_argument("--items-per-order", type=int, default=defaults.items_per_order)
+    parser.add_argument(
+        "--skew",
+        choices=[skew.value for skew in ProductSkew],
+        default=defaults.skew.value,
+    )
+    parser.add_argument("--max-retries", type=int, default=defaults.max_retries)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    args = parser.parse_args()
+
+    config = PlaceOrderBenchmarkConfig(
+        threads=args.threads,
+        orders_per_thread=args.orders_per_thread,
+        users=args.users,
+        products=args.products,
+        items_per_order=args.items_per_order,
+        skew=ProductSkew(args.skew),
+        max_retries=args.max_retries,
+        seed=args.seed,
+    )
+    try:
+        validate_config(config)
+    except ValueError as e:
+        parser.error(str(e))
+    result = json.dumps(run_benchmark(config), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(result + "\n")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
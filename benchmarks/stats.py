@@ -0,0 +1,22 @@
+import math
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Nearest-rank percentile. Return 0 if there is no value.
+    """
+    if not values:
+        return 0
+    sorted_values = sorted(values)
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0),
+        "mean": sum(values) / len(values) if values else 0,
+    }
@@ -1 +1,2 @@
-CREATE DATABASE dev_db;
\ No newline at end of file
+CREATE DATABASE dev_db;
+CREATE DATABASE bench_db;
@@ -0,0 +1,105 @@
+from collections import Counter
+import random
+
+import pytest
+
+from app.repositories.auth import PostgresAuthRecordRepository
+from app.repositories.postgres.session import PostgresSession
+from app.repositories.product import PostgresProductRepository
+from app.services.auth import is_password_valid
+from benchmarks.dataset import (
+    DEFAULT_PASSWORD,
+    DatasetConfig,
+    ZipfSampler,
+    generate_dataset,
+    product_id,
+    user_id,
+    username,
+)
+
+
+@pytest.mark.postgres
+def test_should_generate_users_can_log_in_and_products(
+    repository_session: PostgresSession,
+):
+    generate_dataset(repository_session, DatasetConfig(users=3, products=5))
+
+    auth_repository = PostgresAuthRecordRepository(repository_session.new_operator)
+    product_repository = PostgresProductRepository(repository_session.new_operator)
+    with repository_session:
+        auth_record = auth_repository.get_by_username(username(2))
+        assert auth_record.user_id == user_id(2)
+        assert is_password_valid(DEFAULT_PASSWORD, auth_record.hashed_password)
+
+        products = product_repository.get_page(limit=10)
+        assert [product.id for product in products] == sorted(
+            product_id(index) for index in range(5)
+        )
+
+
+@pytest.mark.postgres
+def test_should_generate_orders_with_skewed_products(
+    repository_session: PostgresSession,
+):
+    generate_dataset(
+        repository_session,
+        DatasetConfig(users=10, products=100, orders=200, max_items_per_order=3),
+    )
+
+    with repository_session:
+        with repository_session.new_operator() as cur:
+            cur.execute("SELECT COUNT(*) FROM orders")
+            assert cur.fetchone() == (200,)
+
+            # Copied to the monthly partitions
+            cur.execute("SELECT COUNT(*) FROM orders_default")
+            assert cur.fetchone() == (0,)
+
+            cur.execute(
+                "SELECT COUNT(*) FROM order_items GROUP BY product_id ORDER BY 1 DESC"
+            )
+            item_counts = [count for count, in cur.fetchall()]
+            assert item_counts[0] > 5 * item_counts[len(item_counts) // 2]
+
+            cur.execute(
+                "SELECT SUM(order_count), SUM(item_count) FROM user_order_stats"
+            )
+            order_count, item_count = cur.fetchone()
+            assert order_count == 200
+            cur.execute("SELECT SUM(quantity) FROM order_items")
+            assert cur.fetchone() == (item_count,)
+
+            cur.execute(
+                """
+                SELECT COUNT(*) FROM order_items
+                JOIN products ON products.id = order_items.product_id
+                WHERE unit_price IS DISTINCT FROM price
+                """
+            )
+            assert cur.fetchone() == (0,)
+            cur.execute("SELECT SUM(total_spent) > 0 FROM user_order_stats")
+            assert cur.fetchone() == (True,)
+
+
+def test_should_zipf_sampler_favor_few_indexes():
+    sampler = ZipfSampler(1000, 1.1, random.Random(0))
+    rand = random.Random(1)
+    counts = Counter(sampler.sample(rand) for _ in range(10000))
+
+    top_10_count = sum(count for _, count in counts.most_common(10))
+    assert top_10_count > 10000 * 0.3
+    assert len(set(sampler.sample_distinct(rand, 5))) == 5
+
+
+@pytest.mark.parametrize("exponent", [0, 1, 1.5])
+def test_should_zipf_sampler_follow_weights_of_ranks(exponent: float):
+    n = 5
+    sampler = ZipfSampler(n, exponent, random.Random(0))
+    rand = random.Random(1)
+    counts = Counter(sampler.sample(rand) for _ in range(50000))
+
+    assert set(counts) == set(range(n))
+    weights = [1 / rank**exponent for rank in range(1, n + 1)]
+    expected = sorted((50000 * weight / sum(weights) for weight in weights))
+    for count, expected_count in zip(sorted(counts.values()), expected):
+        assert abs(count - expected_count) < 0.05 * expected_count
@@ -0,0 +1,42 @@
+import argparse
+
+import pytest
+
+from app.repositories.postgres.session import PostgresSession
+from benchmarks.http_load import (
+    GET_ORDERS,
+    PLACE_ORDER,
+    SIGN_UP,
+    HttpLoadConfig,
+    _find_free_port,
+    _parse_mix,
+    run_load_test,
+)
+
+
+def test_should_parse_mix():
+    assert _parse_mix("signup=1,place_order=2.5") == {SIGN_UP: 1, PLACE_ORDER: 2.5}
+
+    with pytest.raises(argparse.ArgumentTypeError):
+        _parse_mix("unknown=1")
+
+
+@pytest.mark.postgres
+def test_should_report_each_route(repository_session: PostgresSession):
+    config = HttpLoadConfig(
+        workers=1,
+        rate=20,
+        duration_seconds=1,
+        users=5,
+        products=10,
+        logged_in_users=2,
+        mix={PLACE_ORDER: 1, GET_ORDERS: 1},
+        port=_find_free_port(),
+    )
+
+    result = run_load_test(config)
+
+    assert result["requests"] == 20
+    for route in (PLACE_ORDER, GET_ORDERS):
+        assert result["routes"][route]["error_rate"] == 0
+    assert result["db_connections"]["total"]["max"] >= 0
@@ -0,0 +1,12 @@
+from benchmarks.model_construction import (
+    ModelConstructionBenchmarkConfig,
+    run_benchmark,
+)
+
+
+def test_should_report_throughput_and_memory():
+    result = run_benchmark(ModelConstructionBenchmarkConfig(objects=100))
+
+    assert result["objects_per_second"]["order"]["trusted"] > 0
+    assert result["objects_per_second"]["product"]["validated"] > 0
+    assert result["bytes_per_order"] > 0
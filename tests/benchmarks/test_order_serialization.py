@@ -0,0 +1,15 @@
+from benchmarks.order_serialization import (
+    OrderSerializationBenchmarkConfig,
+    run_benchmark,
+)
+
+
+def test_should_both_paths_return_the_same_body():
+    config = OrderSerializationBenchmarkConfig(orders=20, products=5, repeat=2)
+
+    result = run_benchmark(config)
+
+    assert result["same_body"]
+    assert result["response_bytes"] > 0
+    assert result["latency_ms"]["models"]["p50"] > 0
+    assert result["latency_ms"]["orjson"]["p50"] > 0
@@ -0,0 +1,54 @@
+import pytest
+from app.repositories.postgres.session import PostgresSession
+from benchmarks.place_order import (
+    PlaceOrderBenchmarkConfig,
+    ProductSkew,
+    run_benchmark,
+    validate_config,
+)
+
+
+@pytest.mark.parametrize(
+    "skew,items_per_order,products",
+    [
+        (ProductSkew.UNIFORM, 0, 10),
+        (ProductSkew.UNIFORM, 11, 10),
+        (ProductSkew.HOT, 0, 10),
+        (ProductSkew.HOT, 2, 1),
+    ],
+)
+def test_should_reject_more_items_per_order_than_products_to_pick(
+    skew: ProductSkew, items_per_order: int, products: int
+):
+    config = PlaceOrderBenchmarkConfig(
+        products=products, items_per_order=items_per_order, skew=skew
+    )
+    with pytest.raises(ValueError):
+        validate_config(config)
+
+
+def test_should_accept_items_per_order_up_to_products():
+    for skew in ProductSkew:
+        validate_config(
+            PlaceOrderBenchmarkConfig(products=3, items_per_order=3, skew=skew)
+        )
+
+
+@pytest.mark.postgres
+def test_should_report_result_of_all_orders(repository_session: PostgresSession):
+    config = PlaceOrderBenchmarkConfig(
+        threads=2,
+        orders_per_thread=5,
+        users=3,
+        products=10,
+        items_per_order=2,
+        skew=ProductSkew.HOT,
+    )
+
+    result = run_benchmark(config)
+
+    assert result["config"]["skew"] == "hot"
+    assert result["orders"] == {"succeeded": 10, "failed": 0, "errors": {}}
+    assert result["throughput_per_second"] > 0
+    assert 0 < result["latency_ms"]["p50"] <= result["latency_ms"]["p99"]
+    assert result["locking_ms"]["total"] > 0
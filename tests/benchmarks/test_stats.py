@@ -0,0 +1,13 @@
+from benchmarks.stats import percentile, summarize
+
+
+def test_should_percentile_use_nearest_rank():
+    values = [float(value) for value in range(100, 0, -1)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([3.0], 50) == 3
+
+
+def test_should_summarize_empty_values_as_zeros():
+    assert summarize([]) == {"p50": 0, "p95": 0, "p99": 0, "max": 0, "mean": 0}
@@ -2,13 +2,46 @@ from typing import Generator
 import pytest
 
 from app.dependencies import get_repository_session
+from app.repositories.base import RepositorySession
+from app.repositories.config import RepositoryBackend
 from app.repositories.migration import migrate_down, migrate_up
-from app.repositories.postgres.session import PostgresSession
+from tests.repositories.postgres.statement_counter import StatementCounter
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "postgres: the test only runs with the postgres backend"
+    )
+    config.addinivalue_line(
+        "markers",
+        "row_locks: the test needs LockLevel.MODIFY_LOCK to lock the rows, not the whole database as sqlite does",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    # The tests run with the backend of REPOSITORY_BACKEND, e.g. `REPOSITORY_BACKEND=memory pytest` runs them without a database
+    backend = RepositoryBackend.from_env()
+    if backend == RepositoryBackend.POSTGRES:
+        return
+    skip = pytest.mark.skip(reason="Only runs with the postgres backend")
+    skip_row_locks = pytest.mark.skip(reason="The backend has no row locks")
+    for item in items:
+        if item.get_closest_marker("postgres"):
+            item.add_marker(skip)
+        elif backend == RepositoryBackend.SQLITE and item.get_closest_marker(
+            "row_locks"
+        ):
+            item.add_marker(skip_row_locks)
 
 
 @pytest.fixture
-def repository_session() -> Generator[PostgresSession, None, None]:
+def repository_session() -> Generator[RepositorySession, None, None]:
     session = get_repository_session()
     migrate_up(session)
     yield session
     migrate_down(session)
+
+
+@pytest.fixture
+def statement_counter(repository_session: RepositorySession) -> StatementCounter:
+    return StatementCounter(repository_session)
@@ -1,7 +1,7 @@
 from uuid import uuid4
 from pydantic import ValidationError
 import pytest
-from app.models.order import OrderItem, PurchaseInfo
+from app.models.order import Order, OrderItem, PurchaseInfo
 
 
 def new_purchase_info(
@@ -23,3 +23,16 @@ def test_should_purchase_info_not_accept_duplicate_product_id():
 
     # won't raise error
     new_purchase_info(order_items=(OrderItem("p1", 3), OrderItem("p2", 4)))
+
+
+def test_should_construct_equal_to_validated_one():
+    order_items = (OrderItem("p1", 2), OrderItem("p2", 3))
+
+    assert OrderItem.construct("p1", 2) == order_items[0]
+    assert Order.construct("o1", "u1", order_items) == Order("o1", "u1", order_items)
+    assert hash(OrderItem.construct("p1", 2)) == hash(order_items[0])
+
+
+def test_should_construct_skip_validation():
+    # Only for trusted data
+    assert OrderItem.construct("p1", 0).quantity == 0
@@ -0,0 +1,183 @@
+from threading import Event, Thread
+import time
+from typing import Iterable
+
+import pytest
+
+from app.repositories.base import LockLevel
+from app.repositories.err import EntityAlreadyExistsError
+from app.repositories.memory.session import (
+    DeadlockDetectedError,
+    MemorySession,
+    MemoryStore,
+)
+from app.repositories.order import MemoryOrderRepository
+from app.repositories.product import MemoryProductRepository
+from tests.models.constructor import new_order, new_product
+
+
+@pytest.fixture
+def store():
+    return MemoryStore()
+
+
+def save_product(session: MemorySession, **kwargs):
+    with session:
+        MemoryProductRepository(session.new_operator).save(new_product(**kwargs))
+        session.commit()
+
+
+def test_should_changes_be_visible_to_other_sessions_only_after_commit(
+    store: MemoryStore,
+):
+    session = MemorySession(store)
+    other_session = MemorySession(store)
+    product_repository = MemoryProductRepository(session.new_operator)
+    other_product_repository = MemoryProductRepository(other_session.new_operator)
+
+    with session, other_session:
+        product_repository.save(new_product(id="p1"))
+        assert product_repository.get_page(limit=10)[0].id == "p1"
+        assert other_product_repository.get_page(limit=10) == []
+
+        session.commit()
+        assert other_product_repository.get_page(limit=10)[0].id == "p1"
+
+
+def test_should_rollback_changes_and_not_leak_mutation(store: MemoryStore):
+    save_product(MemorySession(store), id="p1", quantity=5)
+
+    session = MemorySession(store)
+    product_repository = MemoryProductRepository(session.new_operator)
+    with session:
+        product = product_repository.get_by_id("p1")
+        product.quantity = 1
+        assert product_repository.get_by_id("p1").quantity == 5
+
+        product_repository.save(product)
+    with session:
+        assert product_repository.get_by_id("p1").quantity == 5
+
+
+def test_should_wait_for_row_lock_and_read_latest_committed_value(
+    store: MemoryStore,
+):
+    save_product(MemorySession(store), id="p1", quantity=5)
+
+    session = MemorySession(store)
+    product_repository = MemoryProductRepository(session.new_operator)
+    locked = Event()
+    quantities: list[int] = []
+
+    def decrease_quantity():
+        other_session = MemorySession(store)
+        other_product_repository = MemoryProductRepository(other_session.new_operator)
+        with other_session:
+            locked.wait()
+            product = other_product_repository.get_by_id(
+                "p1", lock_level=LockLevel.MODIFY_LOCK
+            )
+            quantities.append(product.quantity)
+
+    thread = Thread(target=decrease_quantity)
+    thread.start()
+    with session:
+        product = product_repository.get_by_id("p1", lock_level=LockLevel.MODIFY_LOCK)
+        locked.set()
+        time.sleep(0.1)
+        assert quantities == []
+
+        product.quantity = 4
+        product_repository.save(product)
+        session.commit()
+    thread.join(timeout=5)
+
+    assert quantities == [4]
+
+
+def test_should_check_unique_key_against_uncommitted_insert_after_it_commits(
+    store: MemoryStore,
+):
+    session = MemorySession(store)
+    order_repository = MemoryOrderRepository(session.new_operator)
+    errors: list[Exception] = []
+
+    def add_same_order():
+        other_session = MemorySession(store)
+        with other_session:
+            try:
+                MemoryOrderRepository(other_session.new_operator).add(
+                    new_order(id="o1")
+                )
+            except Exception as e:
+                errors.append(e)
+
+    with session:
+        order_repository.add(new_order(id="o1"))
+        thread = Thread(target=add_same_order)
+        thread.start()
+        time.sleep(0.1)
+        assert errors == []
+        session.commit()
+    thread.join(timeout=5)
+
+    assert len(errors) == 1
+    assert isinstance(errors[0], EntityAlreadyExistsError)
+
+
+def test_should_raise_deadlock_detected_if_transactions_wait_for_each_other(
+    store: MemoryStore,
+):
+    save_product(MemorySession(store), id="p1")
+    save_product(MemorySession(store), id="p2")
+
+    session = MemorySession(store)
+    product_repository = MemoryProductRepository(session.new_operator)
+    other_locked = Event()
+
+    def lock_p2_then_p1():
+        other_session = MemorySession(store)
+        other_product_repository = MemoryProductRepository(other_session.new_operator)
+        with other_session:
+            other_product_repository.get_by_id("p2", lock_level=LockLevel.MODIFY_LOCK)
+            other_locked.set()
+            other_product_repository.get_by_id("p1", lock_level=LockLevel.MODIFY_LOCK)
+
+    with session:
+        product_repository.get_by_id("p1", lock_level=LockLevel.MODIFY_LOCK)
+        thread = Thread(target=lock_p2_then_p1)
+        thread.start()
+        other_locked.wait()
+        time.sleep(0.1)  # Let the other transaction wait for p1
+
+        with pytest.raises(DeadlockDetectedError):
+            product_repository.get_by_id("p2", lock_level=LockLevel.MODIFY_LOCK)
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.invalidated: list[str] = []
+
+    def invalidate(self, entity_ids: Iterable[str]):
+        self.invalidated.extend(entity_ids)
+
+    def clear(self):
+        pass
+
+
+def test_should_invalidate_subscribed_handlers_only_on_commit(store: MemoryStore):
+    handler = RecordingHandler()
+    store.subscribe("products", handler)
+
+    session = MemorySession(store)
+    product_repository = MemoryProductRepository(session.new_operator)
+    with session:
+        product_repository.save(new_product(id="p1"))
+        session.rollback()
+        assert handler.invalidated == []
+
+        product_repository.save(new_product(id="p2"))
+        session.commit()
+    assert handler.invalidated == ["p2"]
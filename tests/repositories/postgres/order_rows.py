@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from psycopg import Cursor
+
+
+def insert_order(cur: Cursor, order_id: str, user_id: str, created_at: datetime):
+    """
+    Insert an order with one item created at the time, e.g. in the past, which the repository doesn't allow.
+    """
+    params = {"id": order_id, "user_id": user_id, "created_at": created_at}
+    cur.execute(
+        "INSERT INTO order_keys (id, created_at) VALUES (%(id)s, %(created_at)s);",
+        params,
+    )
+    cur.execute(
+        "INSERT INTO orders (id, user_id, created_at) VALUES (%(id)s, %(user_id)s, %(created_at)s);",
+        params,
+    )
+    cur.execute(
+        "INSERT INTO order_items (order_id, product_id, quantity, created_at) VALUES (%(id)s, 'p1', 1, %(created_at)s);",
+        params,
+    )
@@ -0,0 +1,45 @@
+from collections import Counter
+from contextlib import contextmanager
+
+from app.repositories.base import RepositorySession
+from app.repositories.postgres.instrumentation import StatementRecord
+from app.repositories.postgres.session import PostgresSession
+
+
+class StatementCounter:
+    """
+    Records the statements executed through the session, so that tests can set a budget on the number of statements of
+    an operation. A budget that doesn't depend on the amount of data catches N+1 queries.
+
+    Usage:
+        with statement_counter.assert_max_statements(2):
+            # Call the operation
+
+    Only statements of postgres sessions are counted. The budgets are not checked with the other backends.
+    """
+
+    def __init__(self, session: RepositorySession):
+        self.records: list[StatementRecord] = []
+        self._enabled = isinstance(session, PostgresSession)
+        if isinstance(session, PostgresSession):
+            session.add_statement_observer(self.records.append)
+
+    @contextmanager
+    def assert_max_statements(self, budget: int):
+        start = len(self.records)
+        yield
+        if not self._enabled:
+            return
+        records = self.records[start:]
+        assert len(records) <= budget, self._format_budget_exceeded_msg(budget, records)
+
+    @staticmethod
+    def _format_budget_exceeded_msg(budget: int, records: list[StatementRecord]):
+        counts = Counter(record.operation for record in records)
+        lines = [
+            f"Expected at most {budget} statements but {len(records)} were executed:"
+        ]
+        lines.extend(
+            f"  {count} x {operation}" for operation, count in counts.most_common()
+        )
+        return "\n".join(lines)
@@ -0,0 +1,48 @@
+import pytest
+from app.repositories.base import LockLevel
+from app.repositories.order import PostgresOrderRepository
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.instrumentation import StatementRecord
+from app.repositories.postgres.session import PostgresSession
+from app.repositories.product import PostgresProductRepository
+from tests.models.constructor import new_order, new_product
+from tests.repositories.postgres.statement_counter import StatementCounter
+
+pytestmark = pytest.mark.postgres
+
+
+def test_should_report_statements_attributed_to_repository_method(
+    repository_session: PostgresSession,
+):
+    records: list[StatementRecord] = []
+    session = PostgresSession(
+        PostgresConfig.from_env(), statement_observers=[records.append]
+    )
+    product_repository = PostgresProductRepository(session.new_operator)
+    with session:
+        product_repository.save(new_product(id="p1"))
+        product_repository.get_by_id("p1")
+        product_repository.get_by_id("p1", lock_level=LockLevel.MODIFY_LOCK)
+
+    assert [record.operation for record in records] == [
+        "PostgresProductRepository.save",
+        "PostgresProductRepository.get_by_id",
+        "PostgresProductRepository.get_by_id",
+    ]
+    assert records[1].rows == 1
+    assert records[1].locking_seconds == 0
+    assert records[2].locking_seconds == records[2].duration_seconds > 0
+
+
+def test_should_statement_counter_fail_when_budget_exceeded(
+    repository_session: PostgresSession, statement_counter: StatementCounter
+):
+    order_repository = PostgresOrderRepository(repository_session.new_operator)
+    with repository_session:
+        with pytest.raises(AssertionError) as exc_info:
+            with statement_counter.assert_max_statements(1):
+                order_repository.add(new_order(id="o1"))
+                order_repository.add(new_order(id="o2"))
+
+    assert "2 were executed" in str(exc_info.value)
+    assert "2 x PostgresOrderRepository.add" in str(exc_info.value)
@@ -0,0 +1,155 @@
+from threading import Event
+import time
+from typing import Generator, Iterable
+
+import pytest
+
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.invalidation import PostgresInvalidationListener
+from app.repositories.postgres.notification import (
+    MAX_PAYLOAD_BYTES,
+    invalidation_payload,
+    parse_invalidation_payload,
+)
+from app.repositories.postgres.session import PostgresSession
+from app.repositories.product import PostgresProductRepository
+from tests.models.constructor import new_product
+
+pytestmark = pytest.mark.postgres
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.invalidated_ids: set[str] = set()
+        self.invalidate_count = 0
+        self.clear_count = 0
+        self.changed = Event()
+
+    def invalidate(self, entity_ids: Iterable[str]):
+        self.invalidated_ids.update(entity_ids)
+        self.invalidate_count += 1
+        self.changed.set()
+
+    def clear(self):
+        self.clear_count += 1
+        self.changed.set()
+
+    def wait_for_change(self, timeout: float = 5) -> bool:
+        changed = self.changed.wait(timeout)
+        self.changed.clear()
+        return changed
+
+
+@pytest.fixture
+def product_handler():
+    return RecordingHandler()
+
+
+@pytest.fixture
+def listener(
+    repository_session: PostgresSession,
+    product_handler: RecordingHandler,
+) -> Generator[PostgresInvalidationListener, None, None]:
+    listener = PostgresInvalidationListener(
+        PostgresConfig.from_env(), poll_interval_seconds=0.1
+    )
+    listener.subscribe("products", product_handler)
+    listener.start()
+    assert listener.wait_until_listening(timeout=5)
+    product_handler.wait_for_change()  # Cleared after connected
+    yield listener
+    listener.stop()
+
+
+def test_should_parse_invalidation_payload():
+    assert parse_invalidation_payload("products:p1") == [("products", "p1")]
+    assert parse_invalidation_payload("products:a:b\nproducts:p2") == [
+        ("products", "a:b"),
+        ("products", "p2"),
+    ]
+
+
+def test_should_invalidate_all_entities_of_table_if_payload_is_too_long():
+    assert (
+        invalidation_payload({"products": {"p2", "p1"}}) == "products:p1\nproducts:p2"
+    )
+
+    product_ids = {f"p{index}" for index in range(MAX_PAYLOAD_BYTES)}
+    assert invalidation_payload({"products": product_ids}) == "products:*"
+
+
+def test_should_clear_handlers_when_connected(
+    listener: PostgresInvalidationListener,
+    product_handler: RecordingHandler,
+):
+    assert product_handler.clear_count == 1
+
+
+def test_should_invalidate_products_saved_in_bulk_only_after_commit(
+    repository_session: PostgresSession,
+    listener: PostgresInvalidationListener,
+    product_handler: RecordingHandler,
+):
+    product_repository = PostgresProductRepository(repository_session.new_operator)
+    with repository_session:
+        product_repository.save_many([new_product(id="p1"), new_product(id="p2")])
+
+        time.sleep(0.3)
+        assert product_handler.invalidated_ids == set()
+
+        repository_session.commit()
+
+    assert product_handler.wait_for_change()
+    assert product_handler.invalidated_ids == {"p1", "p2"}
+    assert product_handler.clear_count == 1
+
+
+def test_should_clear_handler_after_saving_too_many_products_to_notify_one_by_one(
+    repository_session: PostgresSession,
+    listener: PostgresInvalidationListener,
+    product_handler: RecordingHandler,
+):
+    product_repository = PostgresProductRepository(repository_session.new_operator)
+    with repository_session:
+        product_repository.save_many(
+            [new_product(id=f"p{index}") for index in range(MAX_PAYLOAD_BYTES)]
+        )
+        repository_session.commit()
+
+    assert product_handler.wait_for_change()
+    assert product_handler.clear_count == 2
+    assert product_handler.invalidated_ids == set()
+
+
+def test_should_not_invalidate_rolled_back_changes(
+    repository_session: PostgresSession,
+    listener: PostgresInvalidationListener,
+    product_handler: RecordingHandler,
+):
+    product_repository = PostgresProductRepository(repository_session.new_operator)
+    with repository_session:
+        product_repository.save_many([new_product(id="p1")])
+
+    assert not product_handler.wait_for_change(timeout=0.5)
+
+
+def test_should_invalidate_products_saved_by_transaction_with_one_notification(
+    repository_session: PostgresSession,
+    listener: PostgresInvalidationListener,
+    product_handler: RecordingHandler,
+):
+    # As when placing orders
+    product_repository = PostgresProductRepository(repository_session.new_operator)
+    with repository_session:
+        product_repository.save(new_product(id="p1"))
+        product_repository.save(new_product(id="p2"))
+        product_repository.save(new_product(id="p1"))
+
+        time.sleep(0.3)
+        assert product_handler.invalidated_ids == set()
+
+        repository_session.commit()
+
+    assert product_handler.wait_for_change()
+    assert product_handler.invalidated_ids == {"p1", "p2"}
+    assert product_handler.invalidate_count == 1
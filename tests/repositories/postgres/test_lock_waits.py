@@ -0,0 +1,52 @@
+from threading import Thread
+import pytest
+
+from app.lock_waits import PRODUCT_LOCK, LockWaitMonitor, LockWaitMonitorConfig
+from app.repositories.base import LockLevel
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.lock_waits import PostgresBlockingSampler
+from app.repositories.postgres.session import PostgresSession
+from app.repositories.product import PostgresProductRepository
+from tests.models.constructor import new_product
+
+pytestmark = pytest.mark.postgres
+
+
+def test_should_sample_blocked_sessions_while_lock_wait_is_pending(
+    repository_session: PostgresSession,
+):
+    product_repository = PostgresProductRepository(repository_session.new_operator)
+    with repository_session:
+        product_repository.save(new_product("p1"))
+        repository_session.commit()
+
+    monitor = LockWaitMonitor(
+        LockWaitMonitorConfig(sample_after_seconds=0.05, sample_interval_seconds=0.05)
+    )
+    sampler = PostgresBlockingSampler(PostgresConfig.from_env(), monitor)
+    sampler.start()
+
+    blocked_session = PostgresSession(PostgresConfig.from_env())
+
+    def wait_for_lock():
+        with blocked_session:
+            with monitor.track(PRODUCT_LOCK, "p1"):
+                PostgresProductRepository(blocked_session.new_operator).get_by_id(
+                    "p1", lock_level=LockLevel.MODIFY_LOCK
+                )
+
+    with repository_session:
+        product_repository.get_by_id("p1", lock_level=LockLevel.MODIFY_LOCK)
+        thread = Thread(target=wait_for_lock)
+        thread.start()
+        thread.join(timeout=0.5)
+    thread.join(timeout=5)
+    sampler.stop()
+
+    samples = monitor.samples()
+    assert samples
+    assert samples[0].pending_waits[0].key == "p1"
+    blocked = samples[0].blocked_sessions[0]
+    assert "FOR UPDATE" in blocked.query
+    assert 0 < blocked.waiting_seconds < 5
+    assert blocked.blocking_state == "idle in transaction"
@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import pytest
+
+from app.repositories.err import EntityAlreadyExistsError
+from app.repositories.migration import migrate_down, migrate_up
+from app.repositories.order import PostgresOrderRepository
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.partitions import (
+    add_months,
+    create_partitions,
+    partition_months,
+    partition_name,
+)
+from app.repositories.postgres.session import PostgresSession
+from tests.models.constructor import new_order
+from tests.repositories.postgres.order_rows import insert_order
+
+# The tables of the first released version
+LEGACY_CREATE_TABLES = """
+    CREATE TABLE orders (
+        id VARCHAR(36) PRIMARY KEY,
+        user_id VARCHAR(36) NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE order_items (
+        order_id VARCHAR(36) NOT NULL,
+        product_id VARCHAR(36) NOT NULL,
+        quantity INT NOT NULL,
+        PRIMARY KEY (order_id, product_id)
+    );
+"""
+
+
+def test_should_add_months_across_years():
+    assert add_months(date(2023, 11, 1), 1) == date(2023, 12, 1)
+    assert add_months(date(2023, 12, 1), 1) == date(2024, 1, 1)
+    assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert add_months(date(2024, 1, 1), 25) == date(2026, 2, 1)
+
+
+def test_should_name_partitions_by_month():
+    assert partition_name("orders", date(2024, 3, 1)) == "orders_2024_03"
+
+
+@pytest.mark.postgres
+def test_should_migrations_create_partitions_up_to_months_ahead(
+    repository_session: PostgresSession,
+):
+    current_month = date.today().replace(day=1)
+    with repository_session:
+        with repository_session.new_operator() as cur:
+            for table in ("orders", "order_items"):
+                assert partition_months(cur, table) == [
+                    add_months(current_month, offset) for offset in range(4)
+                ]
+
+
+@pytest.mark.postgres
+def test_should_migrate_up_concurrently_as_servers_starting_together(
+    repository_session: PostgresSession,
+):
+    migrate_down(repository_session)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(migrate_up, PostgresSession(PostgresConfig.from_env()))
+            for _ in range(4)
+        ]
+        for future in futures:
+            future.result()
+
+    with repository_session:
+        with repository_session.new_operator() as cur:
+            assert len(partition_months(cur, "orders")) == 4
+
+
+@pytest.mark.postgres
+def test_should_create_partitions_of_the_rows_in_default_partitions(
+    repository_session: PostgresSession,
+):
+    old_month = add_months(date.today().replace(day=1), -24)
+    with repository_session:
+        with repository_session.new_operator() as cur:
+            insert_order(cur, "o1", "u1", datetime(old_month.year, old_month.month, 5))
+            assert create_partitions(cur, months_ahead=3) == [
+                partition_name("orders", old_month),
+                partition_name("order_items", old_month),
+            ]
+            assert create_partitions(cur, months_ahead=3) == []
+
+            for table in ("orders", "order_items"):
+                cur.execute(f"SELECT COUNT(*) FROM {table}_default")
+                assert cur.fetchone() == (0,)
+                cur.execute(f"SELECT COUNT(*) FROM {partition_name(table, old_month)}")
+                assert cur.fetchone() == (1,)
+
+        orders = PostgresOrderRepository(
+            repository_session.new_operator
+        ).get_by_user_id("u1")
+        assert [order.id for order in orders] == ["o1"]
+
+
+@pytest.mark.postgres
+def test_should_not_add_order_with_id_of_order_of_another_month(
+    repository_session: PostgresSession,
+):
+    order_repository = PostgresOrderRepository(repository_session.new_operator)
+    with repository_session:
+        with repository_session.new_operator() as cur:
+            insert_order(cur, "o1", "u1", datetime(2020, 1, 1))
+        with pytest.raises(EntityAlreadyExistsError):
+            order_repository.add(new_order(id="o1", user_id="u2"))
+        assert order_repository.get_by_user_id("u2") == []
+
+
+# Added by the versions before the partitions
+LEGACY_CREATE_INDEX = """
+    CREATE INDEX orders_user_id_created_at_idx ON orders (user_id, created_at);
+"""
+
+
+@pytest.mark.postgres
+@pytest.mark.parametrize("with_index", [False, True])
+def test_should_migrations_convert_unpartitioned_tables(
+    repository_session: PostgresSession, with_index: bool
+):
+    migrate_down(repository_session)
+    with repository_session:
+        with repository_session.new_operator() as cur:
+            cur.execute(LEGACY_CREATE_TABLES)
+            if with_index:
+                cur.execute(LEGACY_CREATE_INDEX)
+            cur.execute(
+                """
+                INSERT INTO orders (id, user_id, created_at) VALUES
+                    ('o1', 'u1', '2020-01-05'), ('o2', 'u1', CURRENT_TIMESTAMP);
+                INSERT INTO order_items (order_id, product_id, quantity) VALUES
+                    ('o1', 'p1', 1), ('o2', 'p1', 2), ('o2', 'p2', 3);
+                """
+            )
+        repository_session.commit()
+
+    migrate_up(repository_session)
+
+    with repository_session:
+        with repository_session.new_operator() as cur:
+            cur.execute("SELECT relkind FROM pg_class WHERE relname = 'orders'")
+            assert cur.fetchone() == ("p",)
+            assert date(2020, 1, 1) in partition_months(cur, "orders")
+
+        orders = PostgresOrderRepository(
+            repository_session.new_operator
+        ).get_by_user_id("u1")
+        assert [(order.id, len(order.order_items)) for order in orders] == [
+            ("o2", 2),
+            ("o1", 1),
+        ]
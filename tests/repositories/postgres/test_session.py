@@ -1,7 +1,11 @@
 import pytest
+from app.repositories.postgres.config import PostgresConfig
 from app.repositories.postgres.session import PostgresSession
 from app.repositories.order import PostgresOrderRepository
-from tests.models.constructor import new_order
+from app.repositories.product import PostgresProductRepository
+from tests.models.constructor import new_order, new_product
+
+pytestmark = pytest.mark.postgres
 
 
 def test_should_session_not_commit_work_by_default(repository_session: PostgresSession):
@@ -77,3 +81,25 @@ def test_should_rollback_on_error(repository_session: PostgresSession):
     with repository_session:
         order_repository = PostgresOrderRepository(repository_session.new_operator)
         assert len(order_repository.get_by_user_id("u1")) == 0
+
+
+def test_should_read_snapshot_taken_at_first_read_after_begin_snapshot(
+    repository_session: PostgresSession,
+):
+    product_repository = PostgresProductRepository(repository_session.new_operator)
+    with repository_session:
+        product_repository.save(new_product(id="p1", quantity=5))
+        repository_session.commit()
+
+    other_session = PostgresSession(PostgresConfig.from_env())
+    other_product_repository = PostgresProductRepository(other_session.new_operator)
+    with repository_session, other_session:
+        repository_session.begin_snapshot()
+        assert product_repository.get_by_id("p1").quantity == 5
+
+        other_product_repository.save(new_product(id="p1", quantity=4))
+        other_session.commit()
+        assert product_repository.get_by_id("p1").quantity == 5
+
+        repository_session.rollback()
+        assert product_repository.get_by_id("p1").quantity == 4
@@ -0,0 +1,50 @@
+from dataclasses import replace
+
+from psycopg import sql
+
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.session import new_postgres_conn
+from app.repositories.sharded.config import ShardingConfig
+from app.repositories.sharded.router import ShardRouter
+
+
+def create_shard_databases(shard_count: int) -> ShardingConfig:
+    """
+    Create the databases of the shards in the server of POSTGRES_HOST if they don't exist. The catalog is the database
+    of POSTGRES_DB.
+    """
+    catalog = PostgresConfig.from_env()
+    shards = tuple(
+        replace(catalog, database=f"{catalog.database}_shard{index}")
+        for index in range(shard_count)
+    )
+    with new_postgres_conn(catalog, autocommit=True) as conn:
+        for shard in shards:
+            exists = conn.execute(
+                "SELECT 1 FROM pg_database WHERE datname = %s;", (shard.database,)
+            ).fetchone()
+            if not exists:
+                conn.execute(
+                    sql.SQL("CREATE DATABASE {};").format(
+                        sql.Identifier(shard.database)
+                    )
+                )
+    return ShardingConfig(catalog=catalog, shards=shards)
+
+
+def user_id_of_shard(router: ShardRouter, shard: int, prefix: str = "u") -> str:
+    """
+    Return the first of `<prefix>0`, `<prefix>1`, ... mapped to the shard.
+    """
+    index = 0
+    while router.shard_of(f"{prefix}{index}") != shard:
+        index += 1
+    return f"{prefix}{index}"
+
+
+def count_rows(config: PostgresConfig, table: str) -> int:
+    with new_postgres_conn(config) as conn:
+        row = conn.execute(
+            sql.SQL("SELECT count(*) FROM {};").format(sql.Identifier(table))
+        ).fetchone()
+        return row[0] if row else 0
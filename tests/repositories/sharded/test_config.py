@@ -0,0 +1,30 @@
+from dataclasses import replace
+
+import pytest
+
+from app.err import MyValueError
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.sharded.config import ShardingConfig, parse_shards
+
+CATALOG = PostgresConfig(
+    host="catalog", port=5432, user="admin", password="password", database="db"
+)
+
+
+def test_should_parse_shards_with_credentials_of_catalog():
+    assert parse_shards("shard0:5432/db0, shard1:5433/db1", CATALOG) == (
+        replace(CATALOG, host="shard0", database="db0"),
+        replace(CATALOG, host="shard1", port=5433, database="db1"),
+    )
+
+
+@pytest.mark.parametrize("value", ["shard0/db0", "shard0:port/db0", "shard0:5432"])
+def test_should_reject_invalid_shards(value: str):
+    with pytest.raises(MyValueError):
+        parse_shards(value, CATALOG)
+
+
+def test_should_use_catalog_as_only_shard_if_shards_not_set(monkeypatch):
+    monkeypatch.delenv("POSTGRES_SHARDS", raising=False)
+    config = ShardingConfig.from_env()
+    assert config.shards == (config.catalog,)
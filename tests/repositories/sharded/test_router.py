@@ -0,0 +1,34 @@
+from collections import Counter
+
+from app.repositories.sharded.router import ShardRouter, jump_hash
+
+USER_IDS = [f"user-{index}" for index in range(4000)]
+
+
+def test_should_map_keys_to_buckets_in_range_deterministically():
+    for key in range(100):
+        bucket = jump_hash(key, 7)
+        assert 0 <= bucket < 7
+        assert jump_hash(key, 7) == bucket
+    assert jump_hash(12345, 1) == 0
+
+
+def test_should_spread_users_evenly_across_shards():
+    router = ShardRouter(4)
+    counts = Counter(router.shard_of(user_id) for user_id in USER_IDS)
+
+    assert sorted(counts) == [0, 1, 2, 3]
+    for count in counts.values():
+        assert 0.2 < count / len(USER_IDS) < 0.3
+
+
+def test_should_only_move_users_to_new_shard_when_adding_shard():
+    before, after = ShardRouter(2), ShardRouter(3)
+    moved_to = [
+        after.shard_of(user_id)
+        for user_id in USER_IDS
+        if before.shard_of(user_id) != after.shard_of(user_id)
+    ]
+
+    assert set(moved_to) == {2}
+    assert 0.25 < len(moved_to) / len(USER_IDS) < 0.42
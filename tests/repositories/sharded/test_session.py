@@ -0,0 +1,197 @@
+import time
+from typing import Generator
+from uuid import uuid4
+
+import pytest
+
+from app.repositories.auth import ShardedAuthRecordRepository
+from app.repositories.base import LockLevel
+from app.repositories.err import EntityAlreadyExistsError
+from app.repositories.migration import migrate_down, migrate_up
+from app.repositories.order import ShardedOrderRepository
+from app.repositories.postgres.instrumentation import StatementRecord
+from app.repositories.postgres.session import new_postgres_conn
+from app.repositories.product import ShardedProductRepository
+from app.repositories.sharded.config import RecoveryConfig, ShardingConfig
+from app.repositories.sharded.session import (
+    XID_FORMAT_ID,
+    PreparedTransactionRecoverer,
+    ShardedSession,
+    recover_prepared_transactions,
+)
+from app.repositories.user import ShardedUserRepository
+from tests.models.constructor import (
+    new_auth_record,
+    new_order,
+    new_product,
+    new_user,
+)
+from tests.repositories.sharded.databases import (
+    count_rows,
+    create_shard_databases,
+    user_id_of_shard,
+)
+
+pytestmark = pytest.mark.postgres
+
+
+@pytest.fixture
+def sharding_config() -> Generator[ShardingConfig, None, None]:
+    config = create_shard_databases(2)
+    migrate_up(ShardedSession(config))
+    yield config
+    migrate_down(ShardedSession(config))
+
+
+@pytest.fixture
+def session(sharding_config: ShardingConfig) -> ShardedSession:
+    return ShardedSession(sharding_config)
+
+
+def test_should_attribute_statements_to_sharded_repository_method(
+    sharding_config: ShardingConfig,
+):
+    records: list[StatementRecord] = []
+    session = ShardedSession(sharding_config, statement_observers=[records.append])
+    user_id = user_id_of_shard(session.router, 1)
+    with session:
+        # Executed by the postgres repositories of the nodes
+        ShardedProductRepository(session.new_operator).save(new_product(id="p1"))
+        ShardedUserRepository(session.new_operator).save(new_user(id=user_id))
+        ShardedUserRepository(session.new_operator).get_by_id(user_id)
+
+    assert [record.operation for record in records] == [
+        "ShardedProductRepository.save",
+        "ShardedUserRepository.save",
+        "ShardedUserRepository.get_by_id",
+    ]
+
+
+def test_should_store_users_and_orders_in_shard_of_user(session: ShardedSession):
+    user_ids = [user_id_of_shard(session.router, shard) for shard in (0, 1)]
+    user_repository = ShardedUserRepository(session.new_operator)
+    order_repository = ShardedOrderRepository(session.new_operator)
+
+    with session:
+        for index, user_id in enumerate(user_ids):
+            user_repository.save(new_user(id=user_id))
+            order_repository.add(new_order(id=f"o{index}", user_id=user_id))
+        session.commit()
+
+    for shard in session.config.shards:
+        assert count_rows(shard, "users") == 1
+        assert count_rows(shard, "orders") == 1
+    with session:
+        for index, user_id in enumerate(user_ids):
+            assert user_repository.get_by_id(user_id).id == user_id
+            assert [order.id for order in order_repository.get_by_user_id(user_id)] == [
+                f"o{index}"
+            ]
+
+
+def test_should_commit_transaction_spanning_nodes_atomically(session: ShardedSession):
+    user_id = user_id_of_shard(session.router, 1)
+    user_repository = ShardedUserRepository(session.new_operator)
+    product_repository = ShardedProductRepository(session.new_operator)
+
+    with session:
+        user_repository.save(new_user(id=user_id))
+        product_repository.save(new_product(id="p1"))
+        session.rollback()
+
+        assert product_repository.get_page(limit=10) == []
+        assert count_rows(session.config.shards[1], "users") == 0
+        user_repository.save(new_user(id=user_id))
+        product_repository.save(new_product(id="p1"))
+        session.commit()
+
+    with session:
+        user_repository.get_by_id(user_id, lock_level=LockLevel.MODIFY_LOCK)
+        assert product_repository.get_by_id("p1").id == "p1"
+    assert count_rows(session.config.catalog, "sharded_commits") == 1
+    # No prepared transaction is left behind
+    report = recover_prepared_transactions(session.config, min_age_seconds=0)
+    assert (report.committed, report.rolled_back) == (0, 0)
+
+
+def test_should_check_username_across_shards_and_find_record_by_username(
+    session: ShardedSession,
+):
+    auth_record_repository = ShardedAuthRecordRepository(session.new_operator)
+    user_ids = [user_id_of_shard(session.router, shard) for shard in (0, 1)]
+
+    with session:
+        auth_record_repository.add_with_user(
+            new_auth_record(user_id=user_ids[1], username="uname"),
+            new_user(id=user_ids[1]),
+        )
+        session.commit()
+
+        with pytest.raises(EntityAlreadyExistsError):
+            auth_record_repository.add_with_user(
+                new_auth_record(user_id=user_ids[0], username="uname"),
+                new_user(id=user_ids[0]),
+            )
+        session.rollback()
+
+        assert auth_record_repository.get_by_username("uname").user_id == user_ids[1]
+    assert count_rows(session.config.shards[0], "users") == 0
+
+
+def test_should_recover_prepared_transactions_according_to_decisions(
+    session: ShardedSession,
+):
+    config = session.config
+    user_ids = [user_id_of_shard(session.router, 1, prefix) for prefix in ("a", "b")]
+
+    # Sessions failing after preparing, one of them after committing the decision
+    for user_id, decided in zip(user_ids, (True, False)):
+        leave_prepared_transaction(config, user_id, decided)
+
+    report = recover_prepared_transactions(config, min_age_seconds=0)
+
+    assert (report.committed, report.rolled_back) == (1, 1)
+    with session:
+        user_repository = ShardedUserRepository(session.new_operator)
+        assert user_repository.get_by_id(user_ids[0]).id == user_ids[0]
+    assert count_rows(config.shards[1], "users") == 1
+
+
+def test_should_recover_prepared_transactions_in_background_once_old_enough(
+    session: ShardedSession,
+):
+    config = session.config
+    user_id = user_id_of_shard(session.router, 1)
+    leave_prepared_transaction(config, user_id, decided=True)
+
+    recoverer = PreparedTransactionRecoverer(
+        config, RecoveryConfig(interval_seconds=0.05, min_age_seconds=0.5)
+    )
+    recoverer.start()
+    try:
+        time.sleep(0.2)
+        assert count_rows(config.shards[1], "users") == 0
+
+        deadline = time.monotonic() + 5
+        while count_rows(config.shards[1], "users") == 0:
+            assert time.monotonic() < deadline, "The transaction is not recovered"
+            time.sleep(0.05)
+    finally:
+        recoverer.stop()
+
+
+def leave_prepared_transaction(config: ShardingConfig, user_id: str, decided: bool):
+    """
+    Prepare a transaction adding the user in shard 1 and leave it, as a session failing after preparing does. The
+    decision to commit it is committed if `decided`.
+    """
+    gtrid = uuid4().hex
+    conn = new_postgres_conn(config.shards[1])
+    conn.tpc_begin(conn.xid(XID_FORMAT_ID, gtrid, "2"))
+    conn.execute("INSERT INTO users (id, balance) VALUES (%s, 1);", (user_id,))
+    conn.tpc_prepare()
+    conn.close()  # The prepared transaction outlives the connection
+    if decided:
+        with new_postgres_conn(config.catalog) as conn:
+            conn.execute("INSERT INTO sharded_commits (gtrid) VALUES (%s);", (gtrid,))
+            conn.commit()
@@ -0,0 +1,191 @@
+import sqlite3
+from threading import Event, Thread
+import time
+from typing import Iterable
+
+import pytest
+
+from app.repositories.base import LockLevel
+from app.repositories.migration import migrate_down, migrate_up
+from app.repositories.postgres.instrumentation import StatementRecord
+from app.repositories.product import SqliteProductRepository
+from app.repositories.sqlite.config import SqliteConfig
+from app.repositories.sqlite.session import SqliteDatabase, SqliteSession
+from tests.models.constructor import new_product
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = SqliteDatabase(
+        SqliteConfig(path=str(tmp_path / "test.db"), busy_timeout_seconds=5)
+    )
+    migrate_up(SqliteSession(database))
+    yield database
+    migrate_down(SqliteSession(database))
+
+
+def save_product(session: SqliteSession, **kwargs):
+    with session:
+        SqliteProductRepository(session.new_operator).save(new_product(**kwargs))
+        session.commit()
+
+
+def test_should_enable_wal_mode(database: SqliteDatabase):
+    conn = database.connect()
+    try:
+        assert conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+    finally:
+        conn.close()
+
+
+def test_should_read_changes_committed_by_other_sessions_before_locking(
+    database: SqliteDatabase,
+):
+    save_product(SqliteSession(database), id="p1", quantity=5)
+
+    session = SqliteSession(database)
+    product_repository = SqliteProductRepository(session.new_operator)
+    with session:
+        assert product_repository.get_by_id("p1").quantity == 5
+        save_product(SqliteSession(database), id="p1", quantity=4)
+        assert product_repository.get_by_id("p1").quantity == 4
+
+
+def test_should_read_snapshot_taken_at_first_read_after_begin_snapshot(
+    database: SqliteDatabase,
+):
+    save_product(SqliteSession(database), id="p1", quantity=5)
+
+    session = SqliteSession(database)
+    product_repository = SqliteProductRepository(session.new_operator)
+    with session:
+        session.begin_snapshot()
+        assert product_repository.get_by_id("p1").quantity == 5
+        save_product(SqliteSession(database), id="p1", quantity=4)
+        assert product_repository.get_by_id("p1").quantity == 5
+
+        session.rollback()
+        assert product_repository.get_by_id("p1").quantity == 4
+
+
+def test_should_rollback_changes(database: SqliteDatabase):
+    save_product(SqliteSession(database), id="p1", quantity=5)
+
+    session = SqliteSession(database)
+    product_repository = SqliteProductRepository(session.new_operator)
+    with session:
+        product_repository.save(new_product(id="p1", quantity=1))
+        assert product_repository.get_by_id("p1").quantity == 1
+    with session:
+        assert product_repository.get_by_id("p1").quantity == 5
+
+
+def test_should_wait_for_write_lock_and_read_latest_committed_value(
+    database: SqliteDatabase,
+):
+    save_product(SqliteSession(database), id="p1", quantity=5)
+
+    session = SqliteSession(database)
+    product_repository = SqliteProductRepository(session.new_operator)
+    locked = Event()
+    quantities: list[int] = []
+
+    def decrease_quantity():
+        other_session = SqliteSession(database)
+        other_product_repository = SqliteProductRepository(other_session.new_operator)
+        with other_session:
+            locked.wait()
+            # Other rows are locked too, as the whole database is
+            product = other_product_repository.get_by_id(
+                "p2", lock_level=LockLevel.MODIFY_LOCK
+            )
+            quantities.append(product.quantity)
+
+    thread = Thread(target=decrease_quantity)
+    thread.start()
+    with session:
+        product_repository.get_by_id("p1", lock_level=LockLevel.MODIFY_LOCK)
+        locked.set()
+        time.sleep(0.1)
+        assert quantities == []
+
+        product_repository.save(new_product(id="p2", quantity=4))
+        session.commit()
+    thread.join(timeout=5)
+
+    assert quantities == [4]
+
+
+def test_should_raise_if_write_lock_is_not_released_before_busy_timeout(
+    tmp_path,
+):
+    config = SqliteConfig(path=str(tmp_path / "test.db"), busy_timeout_seconds=0.1)
+    database = SqliteDatabase(config)
+    migrate_up(SqliteSession(database))
+
+    session = SqliteSession(database)
+    other_session = SqliteSession(database)
+    with session, other_session:
+        SqliteProductRepository(session.new_operator).save(new_product(id="p1"))
+        with pytest.raises(sqlite3.OperationalError):
+            SqliteProductRepository(other_session.new_operator).save(
+                new_product(id="p2")
+            )
+
+
+def test_should_report_time_waiting_for_write_lock(database: SqliteDatabase):
+    records: list[StatementRecord] = []
+    session = SqliteSession(database, statement_observers=[records.append])
+    other_session = SqliteSession(database)
+    locked = Event()
+
+    def hold_write_lock():
+        with other_session:
+            SqliteProductRepository(other_session.new_operator).save(
+                new_product(id="p1")
+            )
+            locked.set()
+            time.sleep(0.2)
+            other_session.commit()
+
+    thread = Thread(target=hold_write_lock)
+    thread.start()
+    locked.wait()
+    with session:
+        SqliteProductRepository(session.new_operator).get_by_id(
+            "p1", lock_level=LockLevel.MODIFY_LOCK
+        )
+    thread.join(timeout=5)
+
+    assert records[0].operation == "SqliteProductRepository.get_by_id"
+    assert records[0].locking_seconds >= 0.1
+    assert records[1].locking_seconds == 0
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.invalidated: list[str] = []
+
+    def invalidate(self, entity_ids: Iterable[str]):
+        self.invalidated.extend(entity_ids)
+
+    def clear(self):
+        pass
+
+
+def test_should_invalidate_subscribed_handlers_only_on_commit(
+    database: SqliteDatabase,
+):
+    handler = RecordingHandler()
+    database.subscribe("products", handler)
+
+    session = SqliteSession(database)
+    product_repository = SqliteProductRepository(session.new_operator)
+    with session:
+        product_repository.save(new_product(id="p1"))
+        session.rollback()
+        assert handler.invalidated == []
+
+        product_repository.save(new_product(id="p2"))
+        session.commit()
+    assert handler.invalidated == ["p2"]
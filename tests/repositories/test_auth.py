@@ -1,15 +1,16 @@
 import pytest
-from app.repositories.auth import PostgresAuthRecordRepository
+from app.repositories.auth import auth_record_repository_factory
 from app.repositories.err import EntityAlreadyExistsError, EntityNotFoundError
-from app.repositories.postgres.session import PostgresSession
-from tests.models.constructor import new_auth_record
+from app.repositories.base import RepositorySession
+from app.repositories.user import user_repository_factory
+from tests.models.constructor import new_auth_record, new_user
 
 
 def test_should_add_auth_record_and_get_by_username(
-    repository_session: PostgresSession,
+    repository_session: RepositorySession,
 ):
     auth_record = new_auth_record()
-    auth_record_repository = PostgresAuthRecordRepository(
+    auth_record_repository = auth_record_repository_factory(
         repository_session.new_operator
     )
     with repository_session:
@@ -20,9 +21,9 @@ def test_should_add_auth_record_and_get_by_username(
 
 
 def test_should_raise_entity_not_found_if_username_does_not_exists(
-    repository_session: PostgresSession,
+    repository_session: RepositorySession,
 ):
-    auth_record_repository = PostgresAuthRecordRepository(
+    auth_record_repository = auth_record_repository_factory(
         repository_session.new_operator
     )
     with repository_session:
@@ -36,9 +37,9 @@ def test_should_raise_entity_not_found_if_username_does_not_exists(
 
 
 def test_should_raise_entity_already_exists_if_username_already_exists(
-    repository_session: PostgresSession,
+    repository_session: RepositorySession,
 ):
-    auth_record_repository = PostgresAuthRecordRepository(
+    auth_record_repository = auth_record_repository_factory(
         repository_session.new_operator
     )
 
@@ -50,3 +51,44 @@ def test_should_raise_entity_already_exists_if_username_already_exists(
     assert str(exc_info.value) == EntityAlreadyExistsError.format_err_msg(
         "username", auth_record.username
     )
+
+
+def test_should_add_with_user_add_both_auth_record_and_user(
+    repository_session: RepositorySession,
+):
+    user = new_user(id="u1")
+    auth_record = new_auth_record(user_id="u1")
+    auth_record_repository = auth_record_repository_factory(
+        repository_session.new_operator
+    )
+    user_repository = user_repository_factory(repository_session.new_operator)
+    with repository_session:
+        auth_record_repository.add_with_user(auth_record, user)
+        assert auth_record == auth_record_repository.get_by_username(
+            auth_record.username
+        )
+        assert user == user_repository.get_by_id(user.id)
+
+
+def test_should_add_with_user_not_add_user_if_username_already_exists(
+    repository_session: RepositorySession,
+):
+    auth_record_repository = auth_record_repository_factory(
+        repository_session.new_operator
+    )
+    user_repository = user_repository_factory(repository_session.new_operator)
+
+    with repository_session:
+        auth_record_repository.add_with_user(
+            new_auth_record(user_id="u1", username="uname"), new_user(id="u1")
+        )
+        with pytest.raises(EntityAlreadyExistsError) as exc_info:
+            auth_record_repository.add_with_user(
+                new_auth_record(user_id="u2", username="uname"), new_user(id="u2")
+            )
+        assert str(exc_info.value) == EntityAlreadyExistsError.format_err_msg(
+            "username", "uname"
+        )
+
+        with pytest.raises(EntityNotFoundError):
+            user_repository.get_by_id("u2")
@@ -1,13 +1,16 @@
 import pytest
+from app.models.order import OrderItem, UserOrderStats
 from app.repositories.err import EntityAlreadyExistsError
-from app.repositories.order import PostgresOrderRepository
+from app.repositories.order import OrderItemRow, order_repository_factory
+from app.repositories.base import RepositorySession
 from app.repositories.postgres.session import PostgresSession
 from tests.models.constructor import new_order
+from tests.repositories.postgres.statement_counter import StatementCounter
 
 
-def test_should_save_and_get_by_user_id(repository_session: PostgresSession):
+def test_should_save_and_get_by_user_id(repository_session: RepositorySession):
     order = new_order(user_id="u1")
-    order_repository = PostgresOrderRepository(repository_session.new_operator)
+    order_repository = order_repository_factory(repository_session.new_operator)
     with repository_session:
         order_repository.add(order)
 
@@ -19,12 +22,12 @@ def test_should_save_and_get_by_user_id(repository_session: PostgresSession):
 
 
 def test_should_get_by_user_id_return_the_orders_with_more_recently_created_at_first(
-    repository_session: PostgresSession,
+    repository_session: RepositorySession,
 ):
     order1 = new_order(id="p0", user_id="u1")
     order2 = new_order(id="p1", user_id="u1")
 
-    order_repository = PostgresOrderRepository(repository_session.new_operator)
+    order_repository = order_repository_factory(repository_session.new_operator)
     with repository_session:
         # explicitly commit here after each time of adding order, so there will be difference in the creation time in the record
         order_repository.add(order1)
@@ -38,9 +41,9 @@ def test_should_get_by_user_id_return_the_orders_with_more_recently_created_at_f
 
 
 def test_should_raise_entity_already_exists_if_order_already_exists(
-    repository_session: PostgresSession,
+    repository_session: RepositorySession,
 ):
-    order_repository = PostgresOrderRepository(repository_session.new_operator)
+    order_repository = order_repository_factory(repository_session.new_operator)
 
     order = new_order()
     with repository_session:
@@ -50,3 +53,131 @@ def test_should_raise_entity_already_exists_if_order_already_exists(
     assert str(exc_info.value) == EntityAlreadyExistsError.format_err_msg(
         "id", order.id
     )
+
+
+def test_should_get_by_user_id_in_one_statement_regardless_of_order_count(
+    repository_session: RepositorySession, statement_counter: StatementCounter
+):
+    order_repository = order_repository_factory(repository_session.new_operator)
+    with repository_session:
+        for order_id in ["o1", "o2", "o3"]:
+            order_repository.add(new_order(id=order_id, user_id="u1"))
+
+        with statement_counter.assert_max_statements(1):
+            assert len(order_repository.get_by_user_id("u1")) == 3
+
+
+def test_should_get_item_rows_by_user_id_with_the_rows_of_each_order_adjacent(
+    repository_session: RepositorySession,
+):
+    order_repository = order_repository_factory(repository_session.new_operator)
+    with repository_session:
+        order_repository.add(new_order(id="o1", user_id="u1"))
+        repository_session.commit()
+        order_repository.add(
+            new_order(id="o2", user_id="u1", order_items=(OrderItem("p3", 1),))
+        )
+        repository_session.commit()
+
+        assert order_repository.get_item_rows_by_user_id("u1") == [
+            OrderItemRow("o2", "p3", 1),
+            OrderItemRow("o1", "p1", 2),
+            OrderItemRow("o1", "p2", 3),
+        ]
+
+
+def test_should_get_item_rows_of_page_of_orders(
+    repository_session: RepositorySession,
+):
+    order_repository = order_repository_factory(repository_session.new_operator)
+    with repository_session:
+        for order_id in ["o1", "o2", "o3"]:
+            order_repository.add(new_order(id=order_id, user_id="u1"))
+            repository_session.commit()
+
+        rows = order_repository.get_item_rows_by_user_id("u1", limit=1, offset=1)
+        assert rows == [OrderItemRow("o2", "p1", 2), OrderItemRow("o2", "p2", 3)]
+        assert order_repository.get_item_rows_by_user_id("u1", limit=2, offset=3) == []
+
+
+def test_should_count_added_orders_in_stats_of_user(
+    repository_session: RepositorySession,
+):
+    order_repository = order_repository_factory(repository_session.new_operator)
+    with repository_session:
+        assert order_repository.get_stats_by_user_id("u1") == UserOrderStats()
+
+        order_repository.add(
+            new_order(id="o1", user_id="u1"), unit_prices={"p1": 1.5, "p2": 2}
+        )
+        # Without the price of p2
+        order_repository.add(new_order(id="o2", user_id="u1"), unit_prices={"p1": 1})
+        repository_session.commit()
+
+        stats = order_repository.get_stats_by_user_id("u1")
+        assert (stats.order_count, stats.item_count, stats.total_spent) == (
+            2,
+            10,
+            11,
+        )
+        assert stats.last_order_at is not None
+        assert order_repository.get_stats_by_user_id("u2") == UserOrderStats()
+
+
+def test_should_not_count_order_already_exists_in_stats(
+    repository_session: RepositorySession,
+):
+    order_repository = order_repository_factory(repository_session.new_operator)
+    with repository_session:
+        order_repository.add(new_order(id="o1", user_id="u1"))
+        repository_session.commit()
+        with pytest.raises(EntityAlreadyExistsError):
+            order_repository.add(new_order(id="o1", user_id="u1"))
+        repository_session.rollback()
+
+        assert order_repository.get_stats_by_user_id("u1").order_count == 1
+
+
+def test_should_rebuild_same_stats_as_counted_when_adding_orders(
+    repository_session: RepositorySession,
+):
+    order_repository = order_repository_factory(repository_session.new_operator)
+    with repository_session:
+        order_repository.add(
+            new_order(id="o1", user_id="u1"), unit_prices={"p1": 1.5, "p2": 2}
+        )
+        order_repository.add(
+            new_order(id="o2", user_id="u2"), unit_prices={"p1": 1.5, "p2": 2}
+        )
+        repository_session.commit()
+        counted_stats = [
+            order_repository.get_stats_by_user_id(user_id) for user_id in ["u1", "u2"]
+        ]
+
+        order_repository.rebuild_stats()
+        repository_session.commit()
+
+        assert [
+            order_repository.get_stats_by_user_id(user_id) for user_id in ["u1", "u2"]
+        ] == counted_stats
+
+
+@pytest.mark.postgres
+def test_should_rebuild_stats_changed_without_repository(
+    repository_session: PostgresSession,
+):
+    order_repository = order_repository_factory(repository_session.new_operator)
+    with repository_session:
+        order_repository.add(
+            new_order(id="o1", user_id="u1"), unit_prices={"p1": 1, "p2": 1}
+        )
+        with repository_session.new_operator() as cur:
+            cur.execute("DELETE FROM user_order_stats;")
+            cur.execute("DELETE FROM order_items WHERE product_id = 'p2';")
+        repository_session.commit()
+
+        order_repository.rebuild_stats()
+        repository_session.commit()
+
+        stats = order_repository.get_stats_by_user_id("u1")
+        assert (stats.order_count, stats.item_count, stats.total_spent) == (1, 2, 2)
@@ -1,16 +1,16 @@
 import pytest
-from app.repositories.base import LockLevel
+from app.repositories.base import LockLevel, RepositorySession
 from app.repositories.err import EntityNotFoundError
-from app.repositories.postgres.session import PostgresSession
 from app.repositories.product import (
-    PostgresProductRepository,
+    product_repository_factory,
+    ProductSearchQuery,
 )
 from tests.models.constructor import new_product
 
 
-def test_should_save_and_get_product(repository_session: PostgresSession):
+def test_should_save_and_get_product(repository_session: RepositorySession):
     product = new_product()
-    product_repository = PostgresProductRepository(repository_session.new_operator)
+    product_repository = product_repository_factory(repository_session.new_operator)
     with repository_session:
         product_repository.save(product)
         assert product == product_repository.get_by_id(
@@ -18,10 +18,20 @@ def test_should_save_and_get_product(repository_session: PostgresSession):
         )
 
 
+def test_should_get_price_as_float(repository_session: RepositorySession):
+    product_repository = product_repository_factory(repository_session.new_operator)
+    with repository_session:
+        product_repository.save(new_product(id="p1", price=0.1))
+        product_repository.save(new_product(id="p2", price=12345678.99))
+
+        assert product_repository.get_by_id("p1").price == 0.1
+        assert product_repository.get_page(limit=2)[1].price == 12345678.99
+
+
 def test_should_raise_not_found_if_product_id_not_exist(
-    repository_session: PostgresSession,
+    repository_session: RepositorySession,
 ):
-    product_repository = PostgresProductRepository(repository_session.new_operator)
+    product_repository = product_repository_factory(repository_session.new_operator)
     with repository_session:
         with pytest.raises(EntityNotFoundError) as exc_info:
             product_repository.get_by_id(
@@ -32,9 +42,9 @@ def test_should_raise_not_found_if_product_id_not_exist(
     )
 
 
-def test_should_save_able_to_update_product(repository_session: PostgresSession):
+def test_should_save_able_to_update_product(repository_session: RepositorySession):
     product = new_product(name="old name", category="old category", price=9, quantity=1)
-    product_repository = PostgresProductRepository(repository_session.new_operator)
+    product_repository = product_repository_factory(repository_session.new_operator)
     with repository_session:
         product_repository.save(product)
 
@@ -45,3 +55,127 @@ def test_should_save_able_to_update_product(repository_session: PostgresSession)
         product_repository.save(product)
 
         assert product_repository.get_by_id(product.id) == product
+
+
+def test_should_save_many_insert_and_update_products(
+    repository_session: RepositorySession,
+):
+    product_repository = product_repository_factory(repository_session.new_operator)
+    with repository_session:
+        product_repository.save(new_product(id="p1", quantity=1))
+
+        product_repository.save_many(
+            [
+                new_product(id="p1", quantity=2),
+                new_product(id="p2", quantity=3),
+                new_product(id="p2", quantity=4),  # last one wins
+            ]
+        )
+
+        assert product_repository.get_by_id("p1").quantity == 2
+        assert product_repository.get_by_id("p2").quantity == 4
+
+
+def test_should_get_page_of_products_sorted_by_id(
+    repository_session: RepositorySession,
+):
+    product_repository = product_repository_factory(repository_session.new_operator)
+    with repository_session:
+        product_repository.save_many(
+            [
+                new_product(id="p3", category="c1"),
+                new_product(id="p1", category="c1"),
+                new_product(id="p2", category="c2"),
+                new_product(id="p4", category="c1"),
+            ]
+        )
+
+        first_page = product_repository.get_page(limit=2)
+        assert [p.id for p in first_page] == ["p1", "p2"]
+
+        second_page = product_repository.get_page(limit=2, after_id=first_page[-1].id)
+        assert [p.id for p in second_page] == ["p3", "p4"]
+
+        assert product_repository.get_page(limit=2, after_id="p4") == []
+
+
+def test_should_get_page_filter_by_category(repository_session: RepositorySession):
+    product_repository = product_repository_factory(repository_session.new_operator)
+    with repository_session:
+        product_repository.save_many(
+            [
+                new_product(id="p1", category="c1"),
+                new_product(id="p2", category="c2"),
+                new_product(id="p3", category="c1"),
+            ]
+        )
+
+        products = product_repository.get_page(limit=10, category="c1")
+        assert [p.id for p in products] == ["p1", "p3"]
+
+        products = product_repository.get_page(limit=10, after_id="p1", category="c1")
+        assert [p.id for p in products] == ["p3"]
+
+
+def test_should_search_products_by_category_price_range_and_stock(
+    repository_session: RepositorySession,
+):
+    product_repository = product_repository_factory(repository_session.new_operator)
+    with repository_session:
+        product_repository.save_many(
+            [
+                new_product(id="p1", category="c1", price=5, quantity=1),
+                new_product(id="p2", category="c1", price=1, quantity=1),
+                new_product(id="p3", category="c1", price=10, quantity=1),
+                new_product(id="p4", category="c1", price=3, quantity=0),
+                new_product(id="p5", category="c2", price=2, quantity=1),
+            ]
+        )
+
+        products = product_repository.search(ProductSearchQuery(category="c1"))
+        assert [p.id for p in products] == ["p2", "p4", "p1", "p3"]
+
+        products = product_repository.search(
+            ProductSearchQuery(category="c1", min_price=2, max_price=5, in_stock=True)
+        )
+        assert [p.id for p in products] == ["p1"]
+
+        products = product_repository.search(ProductSearchQuery(limit=2))
+        assert [p.id for p in products] == ["p2", "p5"]
+        products = product_repository.search(ProductSearchQuery(limit=2, after_id="p5"))
+        assert [p.id for p in products] == ["p4", "p1"]
+
+        products = product_repository.search(
+            ProductSearchQuery(in_stock=True, limit=2, after_id="p2")
+        )
+        assert [p.id for p in products] == ["p5", "p1"]
+
+
+def test_should_search_products_by_name_sorted_by_relevance(
+    repository_session: RepositorySession,
+):
+    product_repository = product_repository_factory(repository_session.new_operator)
+    with repository_session:
+        product_repository.save_many(
+            [
+                new_product(id="p1", name="Red Shirt"),
+                new_product(id="p2", name="Blue Jeans"),
+                new_product(id="p3", name="Red Shirt Red Collar"),
+            ]
+        )
+
+        products = product_repository.search(ProductSearchQuery(text="red"))
+        assert [p.id for p in products] == ["p3", "p1"]
+        products = product_repository.search(
+            ProductSearchQuery(text="red", limit=1, after_id="p3")
+        )
+        assert [p.id for p in products] == ["p1"]
+        assert (
+            product_repository.search(ProductSearchQuery(text="red", after_id="p1"))
+            == []
+        )
+
+        products = product_repository.search(ProductSearchQuery(text="blue jeans"))
+        assert [p.id for p in products] == ["p2"]
+
+        assert product_repository.search(ProductSearchQuery(text="green")) == []
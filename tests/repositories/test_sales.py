@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+import time
+
+import pytest
+
+from app.models.order import OrderItem
+from app.models.sales import SalesDimension, SalesMetric, SalesPeriod, TopSeller
+from app.repositories.base import RepositorySession
+from app.repositories.order import order_repository_factory
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.session import PostgresSession
+from app.repositories.product import product_repository_factory
+from app.repositories.sales import sales_repository_factory
+from tests.models.constructor import new_order, new_product
+
+# Wider than any difference between the local time and the time zone of the database
+SINCE = datetime.now() - timedelta(days=2)
+UNTIL = datetime.now() + timedelta(days=2)
+
+
+def add_orders(repository_session: RepositorySession):
+    product_repository = product_repository_factory(repository_session.new_operator)
+    order_repository = order_repository_factory(repository_session.new_operator)
+    with repository_session:
+        product_repository.save(new_product(id="p1", category="c1"))
+        product_repository.save(new_product(id="p2", category="c1"))
+        product_repository.save(new_product(id="p3", category="c2"))
+        order_repository.add(
+            new_order(id="o1", user_id="u1"), unit_prices={"p1": 1.5, "p2": 2}
+        )
+        order_repository.add(
+            new_order(
+                id="o2",
+                user_id="u2",
+                order_items=(OrderItem("p1", 1), OrderItem("p3", 10)),
+            ),
+            unit_prices={"p1": 1.5, "p3": 0.5},
+        )
+        repository_session.commit()
+    # The orders are created before the aggregation starts, even with the millisecond precision of sqlite
+    time.sleep(0.01)
+
+
+def test_should_aggregate_sales_of_products_and_categories(
+    repository_session: RepositorySession,
+):
+    add_orders(repository_session)
+    sales_repository = sales_repository_factory(repository_session.new_operator)
+    with repository_session:
+        assert sales_repository.aggregate(lag_seconds=0) == 4
+        repository_session.commit()
+
+        product_sales = sales_repository.get_sales(
+            SalesDimension.PRODUCT, SalesPeriod.HOUR, SINCE, UNTIL
+        )
+        assert [(sales.key, sales.units, sales.revenue) for sales in product_sales] == [
+            ("p1", 3, 4.5),
+            ("p2", 3, 6),
+            ("p3", 10, 5),
+        ]
+        assert product_sales[0].period_start.minute == 0
+
+        category_sales = sales_repository.get_sales(
+            SalesDimension.CATEGORY, SalesPeriod.DAY, SINCE, UNTIL
+        )
+        assert [
+            (sales.key, sales.units, sales.revenue) for sales in category_sales
+        ] == [("c1", 6, 10.5), ("c2", 10, 5)]
+        assert category_sales[0].period_start.hour == 0
+
+        assert (
+            sales_repository.get_sales(
+                SalesDimension.PRODUCT, SalesPeriod.DAY, UNTIL, UNTIL + timedelta(1)
+            )
+            == []
+        )
+
+
+def test_should_aggregate_only_orders_added_since_last_aggregation(
+    repository_session: RepositorySession,
+):
+    add_orders(repository_session)
+    sales_repository = sales_repository_factory(repository_session.new_operator)
+    order_repository = order_repository_factory(repository_session.new_operator)
+    with repository_session:
+        sales_repository.aggregate(lag_seconds=0)
+        repository_session.commit()
+        assert sales_repository.aggregate(lag_seconds=0) == 0
+        repository_session.commit()
+
+        order_repository.add(
+            new_order(id="o3", user_id="u1", order_items=(OrderItem("p2", 1),)),
+            unit_prices={"p2": 2},
+        )
+        repository_session.commit()
+        time.sleep(0.01)
+        assert sales_repository.aggregate(lag_seconds=0) == 1
+        repository_session.commit()
+
+        assert sales_repository.get_top_sellers(
+            SINCE, UNTIL, SalesMetric.REVENUE, limit=2
+        ) == [TopSeller("p2", 4, 8), TopSeller("p3", 10, 5)]
+        assert sales_repository.get_top_sellers(
+            SINCE, UNTIL, SalesMetric.UNITS, limit=3
+        ) == [TopSeller("p3", 10, 5), TopSeller("p2", 4, 8), TopSeller("p1", 3, 4.5)]
+
+
+def test_should_leave_orders_within_lag_to_next_aggregation(
+    repository_session: RepositorySession,
+):
+    add_orders(repository_session)
+    sales_repository = sales_repository_factory(repository_session.new_operator)
+    with repository_session:
+        assert sales_repository.aggregate(lag_seconds=3600) == 0
+        repository_session.commit()
+        assert sales_repository.aggregate(lag_seconds=0) == 4
+
+
+@pytest.mark.postgres
+def test_should_not_skip_orders_of_transaction_started_before_aggregation(
+    repository_session: PostgresSession,
+):
+    other_session = PostgresSession(PostgresConfig.from_env())
+    order_repository = order_repository_factory(other_session.new_operator)
+    sales_repository = sales_repository_factory(repository_session.new_operator)
+    with other_session:
+        order_repository.add(new_order(id="o1", user_id="u1"))
+        time.sleep(0.01)
+        with repository_session:
+            # The order is created before the aggregation starts but not committed yet
+            assert sales_repository.aggregate(lag_seconds=0) == 0
+            repository_session.commit()
+
+            other_session.commit()
+            assert sales_repository.aggregate(lag_seconds=0) == 2
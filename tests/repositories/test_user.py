@@ -1,25 +1,24 @@
 import pytest
-from app.repositories.base import LockLevel
+from app.repositories.base import LockLevel, RepositorySession
 from app.repositories.err import EntityNotFoundError
-from app.repositories.postgres.session import PostgresSession
 from app.repositories.user import (
-    PostgresUserRepository,
+    user_repository_factory,
 )
 from tests.models.constructor import new_user
 
 
-def test_should_save_and_get_user(repository_session: PostgresSession):
+def test_should_save_and_get_user(repository_session: RepositorySession):
     user = new_user()
-    user_repository = PostgresUserRepository(repository_session.new_operator)
+    user_repository = user_repository_factory(repository_session.new_operator)
     with repository_session:
         user_repository.save(user)
         assert user == user_repository.get_by_id(user.id)
 
 
 def test_should_raise_not_found_if_user_id_not_exist(
-    repository_session: PostgresSession,
+    repository_session: RepositorySession,
 ):
-    user_repository = PostgresUserRepository(repository_session.new_operator)
+    user_repository = user_repository_factory(repository_session.new_operator)
 
     with repository_session:
         with pytest.raises(EntityNotFoundError) as exc_info:
@@ -29,9 +28,9 @@ def test_should_raise_not_found_if_user_id_not_exist(
     )
 
 
-def test_should_save_able_to_update_user(repository_session: PostgresSession):
+def test_should_save_able_to_update_user(repository_session: RepositorySession):
     user = new_user(balance=99)
-    user_repository = PostgresUserRepository(repository_session.new_operator)
+    user_repository = user_repository_factory(repository_session.new_operator)
     with repository_session:
         user_repository.save(user)
 
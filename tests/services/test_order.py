@@ -1,21 +1,34 @@
 from dataclasses import dataclass
 from threading import Thread
+import time
 from typing import Generic, Optional, TypeVar
 from uuid import UUID, uuid4
 import pytest
 
 from app.dependencies import get_repository_session
-from app.models.order import Order, OrderItem, PurchaseInfo
+from app.lock_waits import (
+    PRODUCT_LOCK,
+    USER_LOCK,
+    LockWaitMonitor,
+    LockWaitMonitorConfig,
+)
+from app.models.order import Order, OrderItem, OrderQuote, PurchaseInfo, QuoteLine
 from app.models.product import Product
 from app.models.user import User
+from app.repositories.err import EntityNotFoundError
 from app.repositories.order import OrderRepository, order_repository_factory
 from app.repositories.product import (
     ProductRepository,
     product_repository_factory,
 )
-from app.repositories.base import RepositorySession
+from app.repositories.base import LockLevel, RepositorySession
 from app.repositories.user import UserRepository, user_repository_factory
-from app.services.order import OrderService, PlaceOrderError
+from app.services.order import (
+    InventorySnapshot,
+    InventorySnapshotConfig,
+    OrderService,
+    PlaceOrderError,
+)
 from tests.models.constructor import new_product, new_user
 
 Operator = TypeVar("Operator")
@@ -96,12 +109,28 @@ class OrderServiceFixture(Generic[Operator]):
 
 
 @pytest.fixture
-def order_service_fixture(repository_session: RepositorySession):
+def inventory_snapshot():
+    return InventorySnapshot(InventorySnapshotConfig())
+
+
+@pytest.fixture
+def lock_wait_monitor():
+    return LockWaitMonitor(LockWaitMonitorConfig(min_wait_seconds=0))
+
+
+@pytest.fixture
+def order_service_fixture(
+    repository_session: RepositorySession,
+    inventory_snapshot: InventorySnapshot,
+    lock_wait_monitor: LockWaitMonitor,
+):
     order_service = OrderService(
         user_repository_factory,
         product_repository_factory,
         order_repository_factory,
         repository_session,
+        inventory_snapshot=inventory_snapshot,
+        lock_wait_monitor=lock_wait_monitor,
     )
     return OrderServiceFixture(
         order_service,
@@ -179,6 +208,11 @@ def test_should_make_order_successfully_if_input_valid(
     assert order.user_id == user.id
     assert order.order_items == (OrderItem("p1", 2), OrderItem("p2", 5))
 
+    # Check order is counted in the stats of user with the prices paid
+    with order_service_fixture.session:
+        stats = order_service_fixture.order_repository.get_stats_by_user_id(user.id)
+    assert (stats.order_count, stats.item_count, stats.total_spent) == (1, 7, 19)
+
 
 def test_should_prevent_placing_same_order_twice(
     order_service_fixture: OrderServiceFixture,
@@ -199,6 +233,96 @@ def test_should_prevent_placing_same_order_twice(
     )
 
 
+def test_should_reject_order_of_sold_out_product_without_waiting_for_lock(
+    order_service_fixture: OrderServiceFixture,
+):
+    product = new_product("p1", quantity=2, price=1)
+    user = new_user(balance=100)
+    order_service_fixture.save_user(user)
+    order_service_fixture.save_products([product])
+
+    order_service_fixture.place_order(user.id, {"p1": 2}, "o1")
+
+    # Another transaction holds the lock of the product. Without the inventory snapshot, placing order would wait for it.
+    other_session = get_repository_session()
+    with other_session:
+        product_repository_factory(other_session.new_operator).get_by_id(
+            "p1", lock_level=LockLevel.MODIFY_LOCK
+        )
+
+        errors: list[Exception] = []
+
+        def place_order():
+            try:
+                order_service_fixture.place_order(user.id, {"p1": 1}, "o2")
+            except Exception as e:
+                errors.append(e)
+
+        thread = Thread(target=place_order)
+        thread.start()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+
+    assert len(errors) == 1
+    assert str(errors[0]) == PlaceOrderError.QUANTITY_NOT_ENOUGH_ERR_MSG
+
+
+def test_should_accept_order_again_after_restocked_product_is_invalidated(
+    order_service_fixture: OrderServiceFixture,
+    inventory_snapshot: InventorySnapshot,
+):
+    product = new_product("p1", quantity=1, price=1)
+    user = new_user(balance=100)
+    order_service_fixture.save_user(user)
+    order_service_fixture.save_products([product])
+
+    order_service_fixture.assert_place_order_error(
+        user.id, {"p1": 2}, expected_err_msg=PlaceOrderError.QUANTITY_NOT_ENOUGH_ERR_MSG
+    )
+
+    product.quantity = 10
+    order_service_fixture.save_products([product])
+    inventory_snapshot.invalidate([product.id])
+
+    order_service_fixture.place_order(user.id, {"p1": 2}, "o1")
+    assert order_service_fixture.get_products(["p1"])[0].quantity == 8
+
+
+@pytest.mark.row_locks
+def test_should_record_time_waiting_for_locks_of_user_and_products(
+    order_service_fixture: OrderServiceFixture, lock_wait_monitor: LockWaitMonitor
+):
+    user = new_user(balance=100)
+    order_service_fixture.save_user(user)
+    order_service_fixture.save_products(
+        [new_product("p1", price=1), new_product("p2", price=1)]
+    )
+
+    other_session = get_repository_session()
+    with other_session:
+        product_repository_factory(other_session.new_operator).get_by_id(
+            "p2", lock_level=LockLevel.MODIFY_LOCK
+        )
+
+        thread = Thread(
+            target=order_service_fixture.place_order, args=(user.id, {"p1": 1, "p2": 1})
+        )
+        thread.start()
+        time.sleep(0.3)
+    thread.join(timeout=5)
+
+    top = lock_wait_monitor.top(limit=10)
+    assert top[0].kind == PRODUCT_LOCK
+    assert top[0].key == "p2"
+    # The order is placed some time after the thread starts
+    assert top[0].max_wait_seconds >= 0.2
+    assert {(stats.kind, stats.key) for stats in top} == {
+        (USER_LOCK, user.id),
+        (PRODUCT_LOCK, "p1"),
+        (PRODUCT_LOCK, "p2"),
+    }
+
+
 def test_should_prevent_race_condition_when_placing_orders(
     repository_session: RepositorySession,
 ):
@@ -292,3 +416,202 @@ def test_should_prevent_race_condition_when_placing_orders(
         assert user2.balance == 66  # 120 - (2*4 + 2*5)*3
         assert product1.quantity == 0
         assert product2.quantity == 0
+
+
+def new_purchase(order_id: str, product_id_to_quantity: dict[str, int]):
+    return PurchaseInfo(
+        tuple(
+            OrderItem(product_id, quantity)
+            for product_id, quantity in product_id_to_quantity.items()
+        ),
+        order_id,
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [None, 2])
+def test_should_place_orders_of_batch_and_reject_those_cannot_be_placed(
+    order_service_fixture: OrderServiceFixture, chunk_size: Optional[int]
+):
+    order_service_fixture.save_user(new_user("u1", balance=10))
+    order_service_fixture.save_products(
+        [new_product("p1", quantity=3, price=1), new_product("p2", price=20)]
+    )
+
+    results = order_service_fixture.order_service.place_orders(
+        [
+            ("u1", new_purchase("o1", {"p1": 2})),
+            # The order before took the stock
+            ("u1", new_purchase("o2", {"p1": 2})),
+            ("u1", new_purchase("o3", {"p2": 1})),
+            ("u1", new_purchase("o4", {"unknown": 1})),
+            ("u1", new_purchase("o1", {"p1": 1})),
+            ("u1", new_purchase("o5", {"p1": 1})),
+        ],
+        chunk_size,
+    )
+
+    assert [result.error for result in results] == [
+        None,
+        PlaceOrderError.QUANTITY_NOT_ENOUGH_ERR_MSG,
+        PlaceOrderError.BALANCE_NOT_ENOUGH_ERR_MSG,
+        EntityNotFoundError.format_err_msg("id", "unknown"),
+        PlaceOrderError.ORDER_ALREADY_EXISTS_ERR_MSG,
+        None,
+    ]
+    assert [result.order_id for result in results] == [
+        "o1",
+        "o2",
+        "o3",
+        "o4",
+        "o1",
+        "o5",
+    ]
+    assert order_service_fixture.get_user("u1").balance == 7
+    assert order_service_fixture.get_products(["p1"])[0].quantity == 0
+    with order_service_fixture.session:
+        orders = order_service_fixture.order_repository.get_by_user_id("u1")
+    assert {order.id for order in orders} == {"o1", "o5"}
+
+
+def fail_adding_order(
+    order_service_fixture: OrderServiceFixture,
+    monkeypatch: pytest.MonkeyPatch,
+    order_id: str,
+):
+    order_repository = order_service_fixture.order_service._order_repository
+    add = order_repository.add
+
+    def add_or_fail(order: Order, *args, **kwargs):
+        if order.id == order_id:
+            raise ConnectionError("lost connection")
+        return add(order, *args, **kwargs)
+
+    monkeypatch.setattr(order_repository, "add", add_or_fail)
+
+
+def test_should_keep_committed_chunks_of_batch_when_later_chunk_fails(
+    order_service_fixture: OrderServiceFixture, monkeypatch: pytest.MonkeyPatch
+):
+    order_service_fixture.save_user(new_user("u1", balance=10))
+    order_service_fixture.save_products([new_product("p1", quantity=10, price=1)])
+    fail_adding_order(order_service_fixture, monkeypatch, "o3")
+
+    results = order_service_fixture.order_service.place_orders(
+        [
+            ("u1", new_purchase("o1", {"p1": 1})),
+            ("u1", new_purchase("o2", {"p1": 1})),
+            ("u1", new_purchase("o3", {"p1": 1})),
+            ("u1", new_purchase("o4", {"p1": 1})),
+            ("u1", new_purchase("o5", {"p1": 1})),
+        ],
+        chunk_size=2,
+    )
+
+    error = f"{PlaceOrderError.CHUNK_FAILED_ERR_MSG}: ConnectionError"
+    assert [(result.order_id, result.error) for result in results] == [
+        ("o1", None),
+        ("o2", None),
+        ("o3", error),
+        ("o4", error),
+        ("o5", error),
+    ]
+    assert order_service_fixture.get_user("u1").balance == 8
+    assert order_service_fixture.get_products(["p1"])[0].quantity == 8
+    with order_service_fixture.session:
+        orders = order_service_fixture.order_repository.get_by_user_id("u1")
+    assert {order.id for order in orders} == {"o1", "o2"}
+
+
+def test_should_raise_error_of_first_chunk_of_batch(
+    order_service_fixture: OrderServiceFixture, monkeypatch: pytest.MonkeyPatch
+):
+    order_service_fixture.save_user(new_user("u1", balance=10))
+    order_service_fixture.save_products([new_product("p1", quantity=10, price=1)])
+    fail_adding_order(order_service_fixture, monkeypatch, "o2")
+
+    with pytest.raises(ConnectionError):
+        order_service_fixture.order_service.place_orders(
+            [
+                ("u1", new_purchase("o1", {"p1": 1})),
+                ("u1", new_purchase("o2", {"p1": 1})),
+                ("u1", new_purchase("o3", {"p1": 1})),
+            ],
+            chunk_size=2,
+        )
+
+    assert order_service_fixture.get_user("u1").balance == 10
+    with order_service_fixture.session:
+        orders = order_service_fixture.order_repository.get_by_user_id("u1")
+    assert orders == []
+
+
+def test_should_lock_each_user_and_product_of_batch_once(
+    order_service_fixture: OrderServiceFixture, lock_wait_monitor: LockWaitMonitor
+):
+    order_service_fixture.save_user(new_user("u1", balance=100))
+    order_service_fixture.save_user(new_user("u2", balance=100))
+    order_service_fixture.save_products(
+        [new_product("p1", quantity=10, price=1), new_product("p2", price=1)]
+    )
+
+    results = order_service_fixture.order_service.place_orders(
+        [
+            ("u2", new_purchase("o1", {"p1": 1, "p2": 1})),
+            ("u1", new_purchase("o2", {"p1": 1})),
+            ("u2", new_purchase("o3", {"p1": 1})),
+        ]
+    )
+
+    assert [result.error for result in results] == [None, None, None]
+    assert {
+        (stats.kind, stats.key, stats.waits)
+        for stats in lock_wait_monitor.top(limit=10)
+    } == {
+        (USER_LOCK, "u1", 1),
+        (USER_LOCK, "u2", 1),
+        (PRODUCT_LOCK, "p1", 1),
+        (PRODUCT_LOCK, "p2", 1),
+    }
+    assert order_service_fixture.get_user("u2").balance == 97
+    assert order_service_fixture.get_products(["p1"])[0].quantity == 7
+
+
+def test_should_quote_order_without_changing_anything(
+    order_service_fixture: OrderServiceFixture,
+):
+    order_service_fixture.save_user(new_user("u1", balance=10))
+    order_service_fixture.save_products(
+        [new_product("p1", quantity=3, price=2), new_product("p2", quantity=1, price=3)]
+    )
+
+    quote = order_service_fixture.order_service.quote_order(
+        "u1", (OrderItem("p1", 2), OrderItem("p2", 2))
+    )
+    assert quote == OrderQuote(
+        lines=(
+            QuoteLine("p1", 2, unit_price=2, line_price=4, in_stock=True),
+            QuoteLine("p2", 2, unit_price=3, line_price=6, in_stock=False),
+        ),
+        total_price=10,
+        balance=10,
+        balance_sufficient=True,
+        placeable=False,
+    )
+
+    quote = order_service_fixture.order_service.quote_order(
+        "u1", (OrderItem("p1", 3), OrderItem("p2", 1))
+    )
+    assert (quote.total_price, quote.balance_sufficient, quote.placeable) == (
+        9,
+        True,
+        True,
+    )
+
+    assert order_service_fixture.get_user("u1").balance == 10
+    assert [
+        product.quantity for product in order_service_fixture.get_products(["p1", "p2"])
+    ] == [3, 1]
+    with pytest.raises(EntityNotFoundError):
+        order_service_fixture.order_service.quote_order(
+            "u1", (OrderItem("unknown", 1),)
+        )
@@ -0,0 +1,67 @@
+import pytest
+
+from app.repositories.base import RepositorySession
+from app.repositories.err import EntityNotFoundError
+from app.repositories.product import product_repository_factory
+from app.services.product import (
+    ProductCatalogCache,
+    ProductCatalogCacheConfig,
+    ProductService,
+)
+from tests.models.constructor import new_product
+
+
+@pytest.fixture
+def catalog_cache():
+    return ProductCatalogCache(ProductCatalogCacheConfig())
+
+
+@pytest.fixture
+def product_service(
+    repository_session: RepositorySession, catalog_cache: ProductCatalogCache
+):
+    return ProductService(product_repository_factory, repository_session, catalog_cache)
+
+
+def save_product(repository_session: RepositorySession, product):
+    with repository_session:
+        product_repository_factory(repository_session.new_operator).save(product)
+        repository_session.commit()
+
+
+def test_should_serve_product_from_cache_until_invalidated(
+    repository_session: RepositorySession,
+    catalog_cache: ProductCatalogCache,
+    product_service: ProductService,
+):
+    save_product(repository_session, new_product(id="p1", quantity=5))
+    assert product_service.get_product("p1").quantity == 5
+
+    save_product(repository_session, new_product(id="p1", quantity=4))
+    assert product_service.get_product("p1").quantity == 5
+
+    catalog_cache.invalidate(["p1"])
+    assert product_service.get_product("p1").quantity == 4
+
+
+def test_should_invalidate_cached_pages_containing_the_product(
+    repository_session: RepositorySession,
+    catalog_cache: ProductCatalogCache,
+    product_service: ProductService,
+):
+    save_product(repository_session, new_product(id="p1", quantity=5))
+    save_product(repository_session, new_product(id="p2", quantity=5))
+    assert [p.quantity for p in product_service.get_page(limit=10)] == [5, 5]
+
+    save_product(repository_session, new_product(id="p2", quantity=1))
+    assert [p.quantity for p in product_service.get_page(limit=10)] == [5, 5]
+
+    catalog_cache.invalidate(["p2"])
+    assert [p.quantity for p in product_service.get_page(limit=10)] == [5, 1]
+
+
+def test_should_raise_entity_not_found_if_product_does_not_exist(
+    product_service: ProductService,
+):
+    with pytest.raises(EntityNotFoundError):
+        product_service.get_product("unknown")
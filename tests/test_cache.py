@@ -0,0 +1,55 @@
+from app.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_should_get_value_that_was_set():
+    cache: TTLCache[str, int] = TTLCache(max_size=2, ttl_seconds=10)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+
+
+def test_should_expire_entry_after_ttl():
+    clock = FakeClock()
+    cache: TTLCache[str, int] = TTLCache(max_size=2, ttl_seconds=10, clock=clock)
+    cache.set("a", 1)
+
+    clock.now = 9.9
+    assert cache.get("a") == 1
+
+    clock.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_should_evict_least_recently_used_entry_when_full():
+    cache: TTLCache[str, int] = TTLCache(max_size=2, ttl_seconds=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # b becomes the least recently used
+
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_should_remove_entries_matching_predicate():
+    cache: TTLCache[str, int] = TTLCache(max_size=3, ttl_seconds=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+
+    cache.remove_if(lambda _, value: value % 2 == 1)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.get("c") is None
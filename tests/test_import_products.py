@@ -0,0 +1,51 @@
+from io import StringIO
+
+import pytest
+
+from app.err import MyValueError
+from app.import_products import ProductImportReport, import_products
+from app.repositories.base import RepositorySession
+from app.repositories.err import EntityNotFoundError
+from app.repositories.product import product_repository_factory
+from tests.models.constructor import new_product
+
+
+def test_should_import_valid_rows_and_report_rejected_rows(
+    repository_session: RepositorySession,
+):
+    product_repository = product_repository_factory(repository_session.new_operator)
+    with repository_session:
+        product_repository.save(new_product(id="p1", name="old name"))
+        repository_session.commit()
+
+    csv_file = StringIO(
+        "id,name,price,quantity,category\n"
+        "p1,new name,10.18,26,Gadgets\n"
+        "p2,Product 2,-1,21,Gadgets\n"
+        "p3,Product 3,6.92,not a number,Home\n"
+        "p4,Product 4,21.16,10,Clothing\n"
+    )
+    progress_reports: list[ProductImportReport] = []
+    report = import_products(
+        repository_session,
+        csv_file,
+        chunk_size=1,
+        on_progress=lambda report: progress_reports.append(report),
+    )
+
+    assert report.imported_count == 2
+    assert [row.line_number for row in report.rejected_rows] == [3, 4]
+    assert len(progress_reports) == 2
+
+    with repository_session:
+        assert product_repository.get_by_id("p1").name == "new name"
+        assert product_repository.get_by_id("p4").quantity == 10
+        with pytest.raises(EntityNotFoundError):
+            product_repository.get_by_id("p2")
+
+
+def test_should_raise_error_if_csv_header_missing_columns(
+    repository_session: RepositorySession,
+):
+    with pytest.raises(MyValueError):
+        import_products(repository_session, StringIO("id,name\np1,Product 1\n"))
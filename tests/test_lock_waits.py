@@ -0,0 +1,86 @@
+from app.lock_waits import (
+    PRODUCT_LOCK,
+    USER_LOCK,
+    BlockingSample,
+    LockWaitMonitor,
+    LockWaitMonitorConfig,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_should_rank_rows_by_total_wait():
+    monitor = LockWaitMonitor(LockWaitMonitorConfig(min_wait_seconds=0))
+    monitor.record(PRODUCT_LOCK, "p1", 0.1)
+    monitor.record(PRODUCT_LOCK, "p2", 0.3)
+    monitor.record(PRODUCT_LOCK, "p1", 0.4)
+    monitor.record(USER_LOCK, "u1", 0.2)
+
+    top = monitor.top(limit=2)
+    assert [(stats.key, stats.waits) for stats in top] == [("p1", 2), ("p2", 1)]
+    assert top[0].total_wait_seconds == 0.5
+    assert top[0].max_wait_seconds == 0.4
+
+    assert [stats.key for stats in monitor.top(limit=10, kind=USER_LOCK)] == ["u1"]
+
+
+def test_should_not_record_wait_shorter_than_min_wait():
+    monitor = LockWaitMonitor(LockWaitMonitorConfig(min_wait_seconds=0.01))
+    monitor.record(PRODUCT_LOCK, "p1", 0.009)
+    assert monitor.top(limit=10) == []
+
+
+def test_should_forget_waits_out_of_window():
+    clock = FakeClock()
+    monitor = LockWaitMonitor(
+        LockWaitMonitorConfig(min_wait_seconds=0, bucket_seconds=10, buckets=3),
+        clock=clock,
+    )
+    monitor.record(PRODUCT_LOCK, "p1", 1)
+    clock.now = 15
+    monitor.record(PRODUCT_LOCK, "p1", 2)
+
+    clock.now = 29.9
+    assert monitor.top(limit=10)[0].total_wait_seconds == 3
+
+    clock.now = 30
+    assert monitor.top(limit=10)[0].total_wait_seconds == 2
+
+    clock.now = 40
+    assert monitor.top(limit=10) == []
+
+
+def test_should_track_pending_waits():
+    clock = FakeClock()
+    monitor = LockWaitMonitor(LockWaitMonitorConfig(min_wait_seconds=0), clock=clock)
+
+    with monitor.track(PRODUCT_LOCK, "p1"):
+        clock.now = 0.5
+        with monitor.track(PRODUCT_LOCK, "p2"):
+            clock.now = 1
+            assert [
+                (wait.key, wait.waiting_seconds)
+                for wait in monitor.pending_waits(min_waiting_seconds=0.6)
+            ] == [("p1", 1)]
+
+    assert monitor.pending_waits() == []
+    assert {stats.key: stats.total_wait_seconds for stats in monitor.top(10)} == {
+        "p1": 1,
+        "p2": 0.5,
+    }
+
+
+def test_should_keep_latest_samples():
+    monitor = LockWaitMonitor(LockWaitMonitorConfig(max_samples=2))
+    for taken_at in range(3):
+        monitor.add_sample(
+            BlockingSample(taken_at=taken_at, pending_waits=[], blocked_sessions=[])
+        )
+
+    assert [sample.taken_at for sample in monitor.samples()] == [2, 1]
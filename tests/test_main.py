@@ -1,20 +1,37 @@
+from datetime import datetime, timedelta
+import time
 from uuid import uuid4
 from fastapi.testclient import TestClient
 import pytest
 
 from app.auth import auth_service_factory
 from app.dependencies import (
+    get_inventory_snapshot,
+    get_lock_wait_monitor,
+    get_product_catalog_cache,
     get_repository_session,
+    get_tracer,
 )
+from app.lock_waits import PRODUCT_LOCK, LockWaitMonitor, LockWaitMonitorConfig
 from app.main import app
 from app.models.product import Product
 from app.repositories.err import EntityNotFoundError
 from app.repositories.order import order_repository_factory
 from app.repositories.product import product_repository_factory
 from app.repositories.base import RepositorySession
+from app.repositories.migration import migrate_up
+from app.repositories.sharded.session import ShardedSession
+from app.sales_rollups import aggregate_sales
 from app.services.auth import GetAccessTokenError, RegisterUserError
-from app.services.order import PlaceOrderError
+from app.services.order import (
+    InventorySnapshot,
+    InventorySnapshotConfig,
+    PlaceOrderError,
+)
+from app.services.product import ProductCatalogCache, ProductCatalogCacheConfig
 from tests.models.constructor import new_product
+from tests.repositories.postgres.statement_counter import StatementCounter
+from tests.repositories.sharded.databases import create_shard_databases
 
 client = TestClient(app)
 
@@ -27,6 +44,19 @@ def override_repository_session_dependency(repository_session):
     app.dependency_overrides[get_repository_session] = my_get_repository_session
 
 
+@pytest.fixture(autouse=True)
+def override_product_catalog_cache_dependency():
+    # The database is reset in every test, so the cache shouldn't be shared between tests
+    product_catalog_cache = ProductCatalogCache(ProductCatalogCacheConfig())
+    app.dependency_overrides[get_product_catalog_cache] = lambda: product_catalog_cache
+
+
+@pytest.fixture(autouse=True)
+def override_inventory_snapshot_dependency():
+    inventory_snapshot = InventorySnapshot(InventorySnapshotConfig())
+    app.dependency_overrides[get_inventory_snapshot] = lambda: inventory_snapshot
+
+
 def test_should_login_respond_400_when_input_invalid():
     response = call_login_api(
         username="1", password="1234567"
@@ -34,11 +64,15 @@ def test_should_login_respond_400_when_input_invalid():
     assert response.status_code == 400
 
 
-def test_should_sign_up_and_login_respond_properly():
-    response = call_sign_up_api("myname", "mypassword")
+def test_should_sign_up_and_login_respond_properly(
+    statement_counter: StatementCounter,
+):
+    with statement_counter.assert_max_statements(1):
+        response = call_sign_up_api("myname", "mypassword")
     assert response.status_code == 201
 
-    response = call_login_api("myname", "mypassword")
+    with statement_counter.assert_max_statements(2):
+        response = call_login_api("myname", "mypassword")
     assert response.status_code == 200
     assert response.json()["access_token"]
     assert response.json()["token_type"] == "bearer"
@@ -62,7 +96,9 @@ def test_should_reject_login_with_wrong_password():
     }
 
 
-def test_should_place_order_and_get_placed_order(repository_session: RepositorySession):
+def test_should_place_order_and_get_placed_order(
+    repository_session: RepositorySession, statement_counter: StatementCounter
+):
     product = new_product(quantity=10, price=1)
     persist_product(product, repository_session)
 
@@ -70,13 +106,16 @@ def test_should_place_order_and_get_placed_order(repository_session: RepositoryS
 
     order_id = str(uuid4())
     # Place order
-    response = call_place_order_api(
-        access_token, [{"product_id": product.id, "quantity": 5}], order_id=order_id
-    )
+    # Lock user, lock product, save product, save user and add order with its items and the stats of the user
+    with statement_counter.assert_max_statements(5):
+        response = call_place_order_api(
+            access_token, [{"product_id": product.id, "quantity": 5}], order_id=order_id
+        )
     assert response.status_code == 201
 
     # Get orders
-    response = call_get_orders_api(access_token)
+    with statement_counter.assert_max_statements(1):
+        response = call_get_orders_api(access_token)
     assert response.status_code == 200
 
     assert len(response.json()) == 1
@@ -92,6 +131,141 @@ def test_should_place_order_and_get_placed_order(repository_session: RepositoryS
         assert order_response["id"] == order_in_repo.id
 
 
+def test_should_quote_order_without_placing_it(
+    repository_session: RepositorySession, statement_counter: StatementCounter
+):
+    product1 = new_product(id="p1", quantity=5, price=1.5)
+    product2 = new_product(id="p2", quantity=1, price=2)
+    persist_product(product1, repository_session)
+    persist_product(product2, repository_session)
+    access_token = fetch_valid_access_token()
+
+    # Read the user and each product
+    with statement_counter.assert_max_statements(3):
+        response = call_quote_order_api(
+            access_token,
+            [
+                {"product_id": product1.id, "quantity": 2},
+                {"product_id": product2.id, "quantity": 2},
+            ],
+        )
+    assert response.status_code == 200
+    quote = response.json()
+    assert [
+        (line["product_id"], line["line_price"], line["in_stock"])
+        for line in quote["lines"]
+    ] == [(product1.id, 3, True), (product2.id, 4, False)]
+    assert quote["total_price"] == 7
+    assert quote["placeable"] is False
+    assert call_get_orders_api(access_token).json() == []
+
+    response = call_quote_order_api(
+        access_token, [{"product_id": "unknown", "quantity": 1}]
+    )
+    assert response.status_code == 400
+    assert call_quote_order_api(access_token, []).status_code == 422
+
+
+def test_should_place_batch_of_orders_and_respond_result_of_each(
+    repository_session: RepositorySession, statement_counter: StatementCounter
+):
+    product = new_product(quantity=5, price=1)
+    persist_product(product, repository_session)
+    access_token = fetch_valid_access_token()
+
+    order_ids = [str(uuid4()) for _ in range(3)]
+    # Lock the user and the product once, add each order, then save the product and the user once
+    with statement_counter.assert_max_statements(7):
+        response = call_place_orders_api(
+            access_token,
+            [
+                {
+                    "order_items": [{"product_id": product.id, "quantity": quantity}],
+                    "order_id": order_id,
+                }
+                for order_id, quantity in zip(order_ids, [2, 4, 3])
+            ],
+        )
+    assert response.status_code == 200
+    assert response.json() == [
+        {"order_id": order_ids[0], "placed": True, "error": None},
+        {
+            "order_id": order_ids[1],
+            "placed": False,
+            "error": PlaceOrderError.QUANTITY_NOT_ENOUGH_ERR_MSG,
+        },
+        {"order_id": order_ids[2], "placed": True, "error": None},
+    ]
+    assert [order["id"] for order in call_get_orders_api(access_token).json()] == [
+        order_ids[2],
+        order_ids[0],
+    ]
+
+    # All orders are validated before placing any of them
+    response = call_place_orders_api(
+        access_token,
+        [
+            {
+                "order_items": [{"product_id": product.id, "quantity": 1}],
+                "order_id": str(uuid4()),
+            },
+            {"order_items": [], "order_id": str(uuid4())},
+        ],
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("orders[1]: ")
+    assert call_place_orders_api(access_token, []).status_code == 422
+
+
+def test_should_get_orders_cost_same_number_of_statements_regardless_of_order_count(
+    repository_session: RepositorySession, statement_counter: StatementCounter
+):
+    persist_product(new_product(quantity=10, price=1), repository_session)
+    access_token = fetch_valid_access_token()
+
+    for _ in range(3):
+        call_place_order_api(
+            access_token, [{"product_id": "p1", "quantity": 1}], order_id=str(uuid4())
+        )
+
+    with statement_counter.assert_max_statements(1):
+        response = call_get_orders_api(access_token)
+    assert len(response.json()) == 3
+
+
+def test_should_get_page_of_orders_with_total_count_and_order_stats(
+    repository_session: RepositorySession, statement_counter: StatementCounter
+):
+    persist_product(new_product(quantity=10, price=2), repository_session)
+    access_token = fetch_valid_access_token()
+
+    order_ids = [str(uuid4()) for _ in range(3)]
+    for order_id in order_ids:
+        call_place_order_api(
+            access_token, [{"product_id": "p1", "quantity": 2}], order_id=order_id
+        )
+
+    # The page, and the stats for the total count
+    with statement_counter.assert_max_statements(2):
+        response = call_get_orders_api(access_token, limit=2, offset=1)
+    assert response.status_code == 200
+    assert response.headers["X-Total-Count"] == "3"
+    assert [order["id"] for order in response.json()] == [order_ids[1], order_ids[0]]
+
+    with statement_counter.assert_max_statements(1):
+        response = client.get(
+            "/orders/stats", headers={"Authorization": f"Bearer {access_token}"}
+        )
+    assert response.status_code == 200
+    stats = response.json()
+    assert (stats["order_count"], stats["item_count"], stats["total_spent"]) == (
+        3,
+        6,
+        12,
+    )
+    assert stats["last_order_at"] is not None
+
+
 def test_should_response_400_if_my_value_error_throw_from_service_layer(
     repository_session: RepositorySession,
 ):
@@ -138,6 +312,259 @@ def test_should_response_400_if_cannot_form_valid_purchase_info_from_request(
     assert response.status_code == 400
 
 
+def test_should_get_products_page_by_page(
+    repository_session: RepositorySession, statement_counter: StatementCounter
+):
+    for product_id in ["p1", "p2", "p3"]:
+        persist_product(new_product(id=product_id), repository_session)
+
+    with statement_counter.assert_max_statements(1):
+        response = call_get_products_api(limit=2)
+    assert response.status_code == 200
+
+    # Served from cache
+    with statement_counter.assert_max_statements(0):
+        call_get_products_api(limit=2)
+    assert [item["id"] for item in response.json()["items"]] == ["p1", "p2"]
+    assert response.json()["next_after_id"] == "p2"
+
+    response = call_get_products_api(limit=2, after_id="p2")
+    assert [item["id"] for item in response.json()["items"]] == ["p3"]
+    assert response.json()["next_after_id"] is None
+
+
+def test_should_get_products_filter_by_category(repository_session: RepositorySession):
+    persist_product(new_product(id="p1", category="c1"), repository_session)
+    persist_product(new_product(id="p2", category="c2"), repository_session)
+
+    response = call_get_products_api(category="c2")
+    assert [item["id"] for item in response.json()["items"]] == ["p2"]
+
+
+def test_should_search_products(repository_session: RepositorySession):
+    persist_product(
+        new_product(id="p1", name="Red Shirt", category="c1", price=3),
+        repository_session,
+    )
+    persist_product(
+        new_product(id="p2", name="Red Hat", category="c1", price=10),
+        repository_session,
+    )
+    persist_product(
+        new_product(id="p3", name="Blue Shirt", category="c2", price=1),
+        repository_session,
+    )
+
+    response = client.get("/products/search", params={"q": "shirt"})
+    assert response.status_code == 200
+    assert {item["id"] for item in response.json()} == {"p1", "p3"}
+
+    response = client.get(
+        "/products/search", params={"q": "red", "category": "c1", "max_price": 5}
+    )
+    assert [item["id"] for item in response.json()] == ["p1"]
+
+
+def test_should_get_product(repository_session: RepositorySession):
+    product = new_product(id="p1")
+    persist_product(product, repository_session)
+
+    response = client.get(f"/products/{product.id}")
+    assert response.status_code == 200
+    assert Product(**response.json()) == product
+
+    response = client.get("/products/unknown")
+    assert response.status_code == 404
+
+
+def test_should_get_product_reflect_stock_change_after_placing_order(
+    repository_session: RepositorySession,
+):
+    product = new_product(quantity=10, price=1)
+    persist_product(product, repository_session)
+    assert client.get(f"/products/{product.id}").json()["quantity"] == 10
+    assert call_get_products_api().json()["items"][0]["quantity"] == 10
+
+    access_token = fetch_valid_access_token()
+    call_place_order_api(access_token, [{"product_id": product.id, "quantity": 3}])
+
+    assert client.get(f"/products/{product.id}").json()["quantity"] == 7
+    assert call_get_products_api().json()["items"][0]["quantity"] == 7
+
+
+@pytest.mark.postgres
+def test_should_expose_metrics_of_requests():
+    call_get_products_api()
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/products/",status="200"}'
+        in response.text
+    )
+    assert (
+        'db_statement_duration_seconds_count{operation="PostgresProductRepository.get_page"}'
+        in response.text
+    )
+
+
+def test_should_reject_admin_request_without_valid_token(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    assert client.get("/admin/lock-waits").status_code == 403  # ADMIN_TOKEN not set
+
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    assert client.get("/admin/lock-waits").status_code == 403
+    response = client.get("/admin/lock-waits", headers={"X-Admin-Token": "wrong"})
+    assert response.status_code == 403
+
+
+def test_should_get_lock_waits_of_placed_orders(
+    repository_session: RepositorySession, monkeypatch: pytest.MonkeyPatch
+):
+    lock_wait_monitor = LockWaitMonitor(LockWaitMonitorConfig(min_wait_seconds=0))
+    app.dependency_overrides[get_lock_wait_monitor] = lambda: lock_wait_monitor
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+    product = new_product(quantity=10, price=1)
+    persist_product(product, repository_session)
+    call_place_order_api(
+        fetch_valid_access_token(), [{"product_id": product.id, "quantity": 1}]
+    )
+
+    response = client.get(
+        "/admin/lock-waits",
+        params={"kind": PRODUCT_LOCK},
+        headers={"X-Admin-Token": "secret"},
+    )
+    assert response.status_code == 200
+    assert [row["key"] for row in response.json()["top"]] == [product.id]
+    assert response.json()["top"][0]["waits"] == 1
+
+
+def test_should_report_top_sellers_of_aggregated_orders(
+    repository_session: RepositorySession, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    product = new_product(quantity=10, price=2.5)
+    persist_product(product, repository_session)
+    call_place_order_api(
+        fetch_valid_access_token(), [{"product_id": product.id, "quantity": 2}]
+    )
+    time.sleep(0.01)
+    aggregate_sales(repository_session, lag_seconds=0)
+
+    params = {
+        "since": (datetime.now() - timedelta(days=2)).isoformat(),
+        "until": (datetime.now() + timedelta(days=2)).isoformat(),
+    }
+    response = client.get(
+        "/reports/top-sellers", params=params, headers={"X-Admin-Token": "secret"}
+    )
+    assert response.status_code == 200
+    assert response.json() == [{"product_id": product.id, "units": 2, "revenue": 5}]
+
+    response = client.get(
+        "/reports/sales",
+        params={**params, "dimension": "category"},
+        headers={"X-Admin-Token": "secret"},
+    )
+    assert [(row["key"], row["units"]) for row in response.json()] == [
+        (product.category, 2)
+    ]
+
+    response = client.get(
+        "/reports/sales",
+        params={"since": params["until"], "until": params["since"]},
+        headers={"X-Admin-Token": "secret"},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.postgres
+def test_should_get_trace_of_request_by_request_id(
+    repository_session: RepositorySession, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(get_tracer(), "sample_rate", 1)
+    product = new_product(quantity=10, price=1)
+    persist_product(product, repository_session)
+    access_token = fetch_valid_access_token()
+
+    response = client.post(
+        "/orders/",
+        json={
+            "order_items": [{"product_id": product.id, "quantity": 1}],
+            "order_id": str(uuid4()),
+        },
+        headers={"Authorization": f"Bearer {access_token}", "X-Request-ID": "r1"},
+    )
+    assert response.headers["X-Request-ID"] == "r1"
+
+    response = client.get("/admin/traces/r1", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    spans_by_name = {span["name"]: span for span in response.json()}
+    assert spans_by_name["POST /orders/"]["parent_id"] is None
+    assert spans_by_name["OrderService.place_order"]["attributes"] == {
+        "product_count": 1
+    }
+    assert "PostgresProductRepository.get_by_id" in spans_by_name
+
+    response = client.get("/admin/traces/unknown", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 404
+
+
+def test_should_invalidate_cached_product_changed_by_other_session_after_startup(
+    repository_session: RepositorySession,
+):
+    assert_lifespan_invalidates_cached_product(repository_session)
+
+
+@pytest.mark.postgres
+def test_should_invalidate_cached_product_changed_by_other_session_after_startup_when_sharded(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    sharding_config = create_shard_databases(2)
+    monkeypatch.setenv("REPOSITORY_BACKEND", "sharded_postgres")
+    monkeypatch.setenv(
+        "POSTGRES_SHARDS",
+        ",".join(
+            f"{shard.host}:{shard.port}/{shard.database}"
+            for shard in sharding_config.shards
+        ),
+    )
+    # The shards are empty after the test, and the catalog is migrated down by the repository_session fixture
+    session = ShardedSession(sharding_config)
+    migrate_up(session)
+    assert_lifespan_invalidates_cached_product(session)
+
+
+def assert_lifespan_invalidates_cached_product(repository_session: RepositorySession):
+    product = new_product(price=1)
+    persist_product(product, repository_session)
+    product_repository = product_repository_factory(repository_session.new_operator)
+
+    def load_product():
+        with repository_session:
+            return product_repository.get_by_id(product.id)
+
+    with TestClient(app):
+        # The caches of the lifespan are the ones shared by the process, not the ones overridden for the requests
+        cache = get_product_catalog_cache()
+        assert cache.get_product(product.id, load_product).price == 1
+
+        # Saved one by one as by placing orders, in another session than the ones of the cache
+        with repository_session:
+            product_repository.save(product.model_copy(update={"price": 2}))
+            repository_session.commit()
+
+        deadline = time.monotonic() + 5
+        while cache.get_product(product.id, load_product).price != 2:
+            assert time.monotonic() < deadline, "The cached product is not invalidated"
+            time.sleep(0.05)
+    cache.clear()
+
+
 def persist_product(product: Product, repository_session: RepositorySession):
     product_repository = product_repository_factory(repository_session.new_operator)
     with repository_session:
@@ -173,9 +600,33 @@ def call_place_order_api(token: str, order_items: list, order_id: str = str(uuid
     return response
 
 
-def call_get_orders_api(token: str):
+def call_quote_order_api(token: str, order_items: list):
+    response = client.post(
+        "/orders/quote",
+        json={"order_items": order_items},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    return response
+
+
+def call_place_orders_api(token: str, purchase_requests: list):
+    response = client.post(
+        "/orders/batch",
+        json=purchase_requests,
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    return response
+
+
+def call_get_orders_api(token: str, **params):
     response = client.get(
         "/orders",
+        params=params,
         headers={"Authorization": f"Bearer {token}"},
     )
     return response
+
+
+def call_get_products_api(**params):
+    response = client.get("/products", params=params)
+    return response
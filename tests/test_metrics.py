@@ -0,0 +1,100 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.metrics import (
+    AppMetrics,
+    Counter,
+    Histogram,
+    MetricsMiddleware,
+    RequestSqlStats,
+    current_request_sql_stats,
+)
+from app.repositories.postgres.instrumentation import StatementRecord
+
+
+def new_statement_record(
+    operation="Repo.method", duration_seconds=0.01, rows=1, locking_seconds=0.0
+):
+    return StatementRecord(
+        operation=operation,
+        duration_seconds=duration_seconds,
+        rows=rows,
+        locking_seconds=locking_seconds,
+    )
+
+
+def test_should_render_counter():
+    counter = Counter("my_total", "My counter", ("a",))
+    counter.inc(("x",))
+    counter.inc(("x",), 2)
+    counter.inc(('y"',))
+
+    assert list(counter.render()) == [
+        "# HELP my_total My counter",
+        "# TYPE my_total counter",
+        'my_total{a="x"} 3',
+        'my_total{a="y\\""} 1',
+    ]
+
+
+def test_should_render_histogram_with_cumulative_buckets():
+    histogram = Histogram("my_seconds", "My histogram", ("a",), buckets=(1, 2))
+    histogram.observe(("x",), 0.5)
+    histogram.observe(("x",), 2)
+    histogram.observe(("x",), 3)
+
+    assert list(histogram.render()) == [
+        "# HELP my_seconds My histogram",
+        "# TYPE my_seconds histogram",
+        'my_seconds_bucket{a="x",le="1"} 1',
+        'my_seconds_bucket{a="x",le="2"} 2',
+        'my_seconds_bucket{a="x",le="+Inf"} 3',
+        'my_seconds_sum{a="x"} 5.5',
+        'my_seconds_count{a="x"} 3',
+    ]
+
+
+def test_should_add_statement_to_current_request_sql_stats():
+    metrics = AppMetrics()
+    sql_stats = RequestSqlStats()
+    token = current_request_sql_stats.set(sql_stats)
+    try:
+        metrics.record_statement(new_statement_record(rows=2))
+        metrics.record_statement(
+            new_statement_record(duration_seconds=0.5, locking_seconds=0.5)
+        )
+    finally:
+        current_request_sql_stats.reset(token)
+
+    assert sql_stats.statement_count == 2
+    assert sql_stats.rows == 3
+    assert sql_stats.locking_seconds == 0.5
+    assert metrics.db_statement_duration.get_count(("Repo.method",)) == 2
+    assert metrics.db_locking.get(("Repo.method",)) == 0.5
+
+
+def test_should_middleware_record_request_by_route_template():
+    metrics = AppMetrics()
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: str):
+        # Run in another thread like the endpoints of this project
+        metrics.record_statement(new_statement_record())
+        return {}
+
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/unknown")
+
+    assert (
+        metrics.http_request_duration.get_count(("GET", "/items/{item_id}", "200")) == 2
+    )
+    assert metrics.http_request_duration.get_count(("GET", "unmatched", "404")) == 1
+    assert "http_request_db_statements_sum" in metrics.render()
+    assert (
+        'http_request_db_statements_bucket{method="GET",route="/items/{item_id}",le="1"} 2'
+        in metrics.render()
+    )
@@ -0,0 +1,123 @@
+from datetime import date, datetime
+import gzip
+from pathlib import Path
+
+import pytest
+
+from app.err import MyValueError
+from app.models.order import UserOrderStats
+from app.order_partitions import archive_order_partitions, order_nodes
+from app.repositories.order import PostgresOrderRepository
+from app.repositories.postgres.config import PostgresConfig
+from app.repositories.postgres.partitions import (
+    add_months,
+    partition_months,
+    partition_name,
+)
+from app.repositories.postgres.session import PostgresSession
+from tests.models.constructor import new_order
+from tests.repositories.postgres.order_rows import insert_order
+
+
+def test_should_not_find_order_nodes_of_backends_without_postgres(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setenv("REPOSITORY_BACKEND", "memory")
+    with pytest.raises(MyValueError):
+        order_nodes()
+
+
+def test_should_find_order_nodes_of_each_shard_once(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("REPOSITORY_BACKEND", "sharded_postgres")
+    monkeypatch.setenv("POSTGRES_SHARDS", "s0:5432/db,s1:5432/db,s0:5432/db")
+    assert [(node.host, node.database) for node in order_nodes()] == [
+        ("s0", "db"),
+        ("s1", "db"),
+    ]
+
+
+def test_should_not_archive_current_month(tmp_path: Path):
+    with pytest.raises(MyValueError):
+        archive_order_partitions(
+            PostgresConfig.from_env(),
+            add_months(date.today().replace(day=1), 1),
+            tmp_path,
+            months_ahead=3,
+        )
+
+
+@pytest.mark.postgres
+def test_should_archive_export_and_drop_partitions_of_old_months(
+    repository_session: PostgresSession, tmp_path: Path
+):
+    current_month = date.today().replace(day=1)
+    old_month = add_months(current_month, -13)
+    order_repository = PostgresOrderRepository(repository_session.new_operator)
+    with repository_session:
+        with repository_session.new_operator() as cur:
+            insert_order(cur, "o1", "u1", datetime(old_month.year, old_month.month, 5))
+        order_repository.add(new_order(id="o2", user_id="u1"))
+        repository_session.commit()
+
+    config = PostgresConfig.from_env()
+    paths = archive_order_partitions(
+        config, add_months(current_month, -1), tmp_path, months_ahead=3
+    )
+
+    node_directory = tmp_path / f"{config.host}_{config.port}_{config.database}"
+    assert paths == [
+        node_directory / f"{partition_name(table, old_month)}.csv.gz"
+        for table in ("orders", "order_items")
+    ]
+    with gzip.open(paths[0], "rt") as file:
+        lines = file.read().splitlines()
+    assert lines[0] == "id,user_id,created_at"
+    assert lines[1].startswith("o1,u1,")
+
+    with repository_session:
+        with repository_session.new_operator() as cur:
+            assert old_month not in partition_months(cur, "orders")
+            cur.execute("SELECT id FROM order_keys")
+            assert cur.fetchall() == [("o2",)]
+        assert [order.id for order in order_repository.get_by_user_id("u1")] == ["o2"]
+
+
+@pytest.mark.postgres
+def test_should_subtract_archived_orders_from_stats_as_rebuilding_them_does(
+    repository_session: PostgresSession, tmp_path: Path
+):
+    current_month = date.today().replace(day=1)
+    old_month = add_months(current_month, -13)
+    order_repository = PostgresOrderRepository(repository_session.new_operator)
+    with repository_session:
+        with repository_session.new_operator() as cur:
+            for order_id, user_id in (("o1", "u1"), ("o2", "u1"), ("o3", "u2")):
+                insert_order(
+                    cur, order_id, user_id, datetime(old_month.year, old_month.month, 5)
+                )
+        order_repository.rebuild_stats()
+        order_repository.add(new_order(id="o4", user_id="u1"), unit_prices={"p1": 2})
+        repository_session.commit()
+        stats = order_repository.get_stats_by_user_id("u1")
+
+    archive_order_partitions(
+        PostgresConfig.from_env(),
+        add_months(current_month, -1),
+        tmp_path,
+        months_ahead=3,
+    )
+
+    with repository_session:
+        archived_stats = order_repository.get_stats_by_user_id("u1")
+        assert (
+            archived_stats.order_count,
+            archived_stats.item_count,
+            archived_stats.total_spent,
+            archived_stats.last_order_at,
+        ) == (1, stats.item_count - 2, stats.total_spent, stats.last_order_at)
+        assert order_repository.get_stats_by_user_id("u2") == UserOrderStats()
+
+        order_repository.rebuild_stats()
+        repository_session.commit()
+        assert order_repository.get_stats_by_user_id("u1") == archived_stats
+        assert order_repository.get_stats_by_user_id("u2") == UserOrderStats()
@@ -0,0 +1,72 @@
+import json
+from pathlib import Path
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+
+from app.metrics import AppMetrics, MetricsMiddleware
+from app.profiling import ProfilingConfig, ProfilingMiddleware
+
+
+def busy_wait(seconds: float):
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        pass
+
+
+def new_client(config: ProfilingConfig) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        busy_wait(0.05)
+        return {"id": item_id}
+
+    app.add_middleware(ProfilingMiddleware, config=config)
+    app.add_middleware(MetricsMiddleware, metrics=AppMetrics())
+    return TestClient(app)
+
+
+def list_profiles(directory: Path) -> list[str]:
+    return sorted(path.stem for path in directory.glob("*.json"))
+
+
+def test_should_profile_request_with_profile_header_and_admin_token(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    client = new_client(ProfilingConfig(directory=str(tmp_path)))
+
+    client.get("/items/1")
+    client.get("/items/1", headers={"X-Profile": "1", "X-Admin-Token": "wrong"})
+    assert list_profiles(tmp_path) == []
+
+    response = client.get(
+        "/items/1", headers={"X-Profile": "1", "X-Admin-Token": "secret"}
+    )
+    assert response.json() == {"id": 1}
+
+    [name] = list_profiles(tmp_path)
+    profile = json.loads((tmp_path / f"{name}.json").read_text())
+    assert profile["method"] == "GET"
+    assert profile["route"] == "/items/{item_id}"
+    assert profile["status"] == 200
+    assert profile["latency_seconds"] >= 0.05
+    assert profile["samples"] > 0
+
+    stacks = (tmp_path / f"{name}.collapsed").read_text().splitlines()
+    assert any("get_item" in stack and "busy_wait" in stack for stack in stacks)
+
+
+def test_should_profile_sampled_requests_and_keep_latest_profiles(tmp_path: Path):
+    client = new_client(
+        ProfilingConfig(sample_rate=1, directory=str(tmp_path), max_profiles=2)
+    )
+
+    for _ in range(3):
+        client.get("/items/1")
+
+    assert len(list_profiles(tmp_path)) == 2
+    assert len(list(tmp_path.glob("*.collapsed"))) == 2
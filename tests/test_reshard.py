@@ -0,0 +1,107 @@
+from dataclasses import replace
+from typing import Generator
+
+import pytest
+
+from app.repositories.auth import ShardedAuthRecordRepository
+from app.repositories.migration import migrate_down, migrate_up
+from app.repositories.order import ShardedOrderRepository
+from app.repositories.sharded.config import ShardingConfig, node_name
+from app.repositories.sharded.router import ShardRouter
+from app.repositories.sharded.session import ShardedSession
+from app.repositories.user import ShardedUserRepository
+from app.reshard import reshard
+from tests.models.constructor import new_auth_record, new_order, new_user
+from tests.repositories.sharded.databases import count_rows, create_shard_databases
+
+pytestmark = pytest.mark.postgres
+
+USER_IDS = [f"u{index}" for index in range(10)]
+
+
+@pytest.fixture
+def target() -> Generator[ShardingConfig, None, None]:
+    config = create_shard_databases(2)
+    migrate_up(ShardedSession(config))
+    yield config
+    migrate_down(ShardedSession(config))
+
+
+@pytest.fixture
+def source(target: ShardingConfig) -> ShardingConfig:
+    """
+    The layout before adding the second shard of the target, with the users of USER_IDS.
+    """
+    config = ShardingConfig(catalog=target.catalog, shards=target.shards[:1])
+    session = ShardedSession(config)
+    with session:
+        for user_id in USER_IDS:
+            ShardedAuthRecordRepository(session.new_operator).add_with_user(
+                new_auth_record(user_id=user_id, username=f"name-{user_id}"),
+                new_user(id=user_id),
+            )
+            ShardedOrderRepository(session.new_operator).add(
+                new_order(id=f"o-{user_id}", user_id=user_id)
+            )
+        session.commit()
+    return config
+
+
+def test_should_only_count_users_to_move_in_dry_run(
+    source: ShardingConfig, target: ShardingConfig
+):
+    router = ShardRouter(len(target.shards))
+    expected_count = sum(router.shard_of(user_id) == 1 for user_id in USER_IDS)
+
+    report = reshard(source, target, dry_run=True)
+
+    assert report.moved_users == {
+        (node_name(target.shards[0]), node_name(target.shards[1])): expected_count
+    }
+    assert count_rows(target.shards[1], "users") == 0
+
+
+def test_should_count_users_by_nodes_of_shards_with_same_database_name(
+    source: ShardingConfig, target: ShardingConfig
+):
+    # Another host name of the same server stands for another host with a database of the same name. Only counted, so
+    # nothing is written to it.
+    other_host_shard = replace(source.shards[0], host="127.0.0.1")
+    assert other_host_shard.host != source.shards[0].host
+    target = replace(target, shards=(source.shards[0], other_host_shard))
+    router = ShardRouter(len(target.shards))
+    expected_count = sum(router.shard_of(user_id) == 1 for user_id in USER_IDS)
+
+    report = reshard(source, target, dry_run=True)
+
+    assert report.moved_users == {
+        (node_name(source.shards[0]), node_name(other_host_shard)): expected_count
+    }
+
+
+def test_should_move_rows_of_users_to_their_new_shards(
+    source: ShardingConfig, target: ShardingConfig
+):
+    reshard(source, target, batch_size=3)
+
+    router = ShardRouter(len(target.shards))
+    moved_count = sum(router.shard_of(user_id) == 1 for user_id in USER_IDS)
+    for table in ("users", "auth_records", "orders"):
+        assert count_rows(target.shards[1], table) == moved_count
+        assert count_rows(target.shards[0], table) == len(USER_IDS) - moved_count
+    assert count_rows(target.shards[1], "order_items") == 2 * moved_count
+
+    session = ShardedSession(target)
+    with session:
+        for user_id in USER_IDS:
+            assert ShardedUserRepository(session.new_operator).get_by_id(user_id)
+            assert ShardedAuthRecordRepository(session.new_operator).get_by_username(
+                f"name-{user_id}"
+            )
+            orders = ShardedOrderRepository(session.new_operator).get_by_user_id(
+                user_id
+            )
+            assert [order.id for order in orders] == [f"o-{user_id}"]
+
+    # Nothing is left to move
+    assert sum(reshard(source, target).moved_users.values()) == 0
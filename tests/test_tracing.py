@@ -0,0 +1,147 @@
+import json
+from pathlib import Path
+from typing import Annotated
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+import pytest
+
+from app.repositories.postgres.instrumentation import StatementRecord
+from app.tracing import (
+    HTTP_LAYER,
+    REPOSITORY_LAYER,
+    ROUTER_LAYER,
+    SERVICE_LAYER,
+    JsonlExporter,
+    RingBufferExporter,
+    Tracer,
+    TracingMiddleware,
+    record_statement_span,
+    set_span_attributes,
+    traced,
+)
+
+
+class ItemService:
+    @traced()
+    def get_item(self, item_id: int):
+        set_span_attributes(item_id=item_id)
+        record_statement_span_for_test()
+        return {"id": item_id}
+
+    @traced()
+    def fail(self):
+        raise ValueError()
+
+
+def record_statement_span_for_test():
+    record_statement_span(
+        StatementRecord(
+            operation="ItemRepository.get_by_id",
+            duration_seconds=0.01,
+            rows=1,
+            locking_seconds=0,
+        )
+    )
+
+
+@pytest.fixture
+def trace_buffer():
+    return RingBufferExporter(max_spans=100)
+
+
+@pytest.fixture
+def client(trace_buffer: RingBufferExporter):
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    @traced(ROUTER_LAYER)
+    def get_item(item_id: int, service: Annotated[ItemService, Depends(ItemService)]):
+        return service.get_item(item_id)
+
+    app.add_middleware(TracingMiddleware, tracer=Tracer([trace_buffer]))
+    return TestClient(app)
+
+
+def test_should_trace_request_across_layers(
+    client: TestClient, trace_buffer: RingBufferExporter
+):
+    response = client.get("/items/1", headers={"X-Request-ID": "request-1"})
+    assert response.json() == {"id": 1}
+    assert response.headers["X-Request-ID"] == "request-1"
+
+    spans_by_layer = {span.layer: span for span in trace_buffer.get_trace("request-1")}
+    assert {layer: span.name for layer, span in spans_by_layer.items()} == {
+        HTTP_LAYER: "GET /items/{item_id}",
+        ROUTER_LAYER: "client.<locals>.get_item",
+        SERVICE_LAYER: "ItemService.get_item",
+        REPOSITORY_LAYER: "ItemRepository.get_by_id",
+    }
+    root = spans_by_layer[HTTP_LAYER]
+    handler = spans_by_layer[ROUTER_LAYER]
+    service = spans_by_layer[SERVICE_LAYER]
+    repository = spans_by_layer[REPOSITORY_LAYER]
+    assert root.parent_id is None
+    assert handler.parent_id == root.span_id
+    assert service.parent_id == handler.span_id
+    assert repository.parent_id == service.span_id
+
+    assert root.attributes == {"status": 200}
+    assert service.attributes == {"item_id": 1}
+    assert repository.attributes == {"rows": 1}
+    assert repository.duration_seconds == 0.01
+    assert root.duration_seconds >= service.duration_seconds
+
+
+def test_should_generate_request_id(
+    client: TestClient, trace_buffer: RingBufferExporter
+):
+    request_id = client.get("/items/1").headers["X-Request-ID"]
+    assert trace_buffer.recent_root_spans(limit=1)[0].trace_id == request_id
+
+
+def test_should_pass_through_requests_not_sampled(trace_buffer: RingBufferExporter):
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int, service: Annotated[ItemService, Depends(ItemService)]):
+        return service.get_item(item_id)
+
+    app.add_middleware(TracingMiddleware, tracer=Tracer([trace_buffer], sample_rate=0))
+    response = TestClient(app).get("/items/1", headers={"X-Request-ID": "request-1"})
+
+    assert response.json() == {"id": 1}
+    assert "X-Request-ID" not in response.headers
+    assert trace_buffer.recent_root_spans(limit=10) == []
+
+
+def test_should_not_trace_outside_of_request(trace_buffer: RingBufferExporter):
+    assert ItemService().get_item(1) == {"id": 1}
+    assert trace_buffer.recent_root_spans(limit=10) == []
+
+
+def test_should_record_error_of_span(trace_buffer: RingBufferExporter):
+    tracer = Tracer([trace_buffer])
+    with pytest.raises(ValueError):
+        with tracer.start_span("job", SERVICE_LAYER, trace_id="t1"):
+            ItemService().fail()
+
+    spans = trace_buffer.get_trace("t1")
+    assert [span.attributes for span in spans] == [
+        {"error": "ValueError"},
+        {"error": "ValueError"},
+    ]
+
+
+def test_should_export_spans_to_jsonl(tmp_path: Path):
+    path = tmp_path / "spans.jsonl"
+    exporter = JsonlExporter(str(path))
+    tracer = Tracer([exporter])
+    for trace_id in ("t1", "t2"):
+        with tracer.start_span("job", SERVICE_LAYER, trace_id=trace_id, size=3):
+            pass
+    exporter.close()
+
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [span["trace_id"] for span in spans] == ["t1", "t2"]
+    assert spans[0]["attributes"] == {"size": 3}